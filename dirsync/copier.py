@@ -0,0 +1,725 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, stat, shutil, threading, errno, io, mmap, re
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl of Linux: the target shares the data blocks of the source (btrfs, xfs)
+FICLONE = 0x40049409
+# the temporary files: .<node>.redirsync.<pid>.<suffix>
+_tempPattern = re.compile(r'^\.(.+)\.redirsync\.(\d+)\.(tmp|part)$', re.DOTALL)
+
+def tempName(path, suffix = 'tmp'):
+    '''Returns the name of a temporary file receiving the data of a target.
+    The file is hidden and contains the process id: concurrent processes do
+    not share it and leftovers of aborted runs can be recognized.
+    @param path: the full path of the target file
+    @param suffix: 'tmp' or 'part' (resumable copies)
+    @return: the full path of the temporary file (same directory)
+    '''
+    head, node = os.path.split(path)
+    return os.path.join(head, '.{}.redirsync.{}.{}'.format(node, os.getpid(),
+        suffix))
+
+def parseTempName(node):
+    '''Tests whether a node is the name of a temporary file (see tempName()).
+    @param node: the filename without path
+    @return: None: no temporary file<br>
+            otherwise: a tuple (target node, process id, suffix)
+    '''
+    matcher = _tempPattern.match(node)
+    return (None if matcher == None else (matcher.group(1), 
+        int(matcher.group(2)), matcher.group(3)))
+
+def pageCacheSize():
+    '''Returns the size of the page cache of the system.
+    @return: the size in bytes. None: unknown (not Linux)
+    '''
+    rc = None
+    try:
+        with open('/proc/meminfo', 'r') as fp:
+            for line in fp:
+                if line.startswith('Cached:'):
+                    rc = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    return rc
+
+class Copier:
+    '''Copies the content and the metadata of files.
+    The content is copied by the cheapest method the kernel offers:
+    reflink (FICLONE), copy_file_range(), sendfile() and at last
+    read()/write() with a large buffer. A method which is not supported
+    for a pair of devices is not tried again for that pair.
+    Large files which already exist on the target can be updated in place:
+    only the blocks which differ are written (delta copy).
+    Sparse files are copied extent by extent: the holes found by
+    SEEK_DATA/SEEK_HOLE are not written but recreated on the target.
+    Without hole information (or in mode 'zeros') blocks of zeros are skipped.
+    Targets are preallocated (posix_fallocate()) against fragmentation.
+    In page cache mode 'drop' the copied parts are released from the cache
+    window by window (posix_fadvise()): a large run does not evict the cache
+    of other programs. Very large files can bypass the cache (O_DIRECT).
+    In atomic mode new content is written to a temporary file which is
+    renamed into place: the target is never seen half written.
+    '''
+    _unsupported = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+        errno.ENOTTY, errno.EBADF, errno.ETXTBSY)
+    # the bytes handed to the kernel with one call
+    _chunkSize = 64 * 1024 * 1024
+    # the unit of the zero block detection
+    _zeroBlockSize = 64 * 1024
+    # positional I/O is needed for writing around holes (not on Windows)
+    _sparseSupported = hasattr(os, 'pread') and hasattr(os, 'pwrite')
+    # in page cache mode 'drop': the bytes copied between two releases
+    _cacheWindow = 16 * 1024 * 1024
+    _adviceSupported = hasattr(os, 'posix_fadvise')
+    _directSupported = (hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv')
+        and hasattr(os, 'pwritev'))
+    # O_DIRECT needs aligned buffers, positions and lengths
+    _directAlignment = 4096
+    _directBufferSize = 8 * 1024 * 1024
+
+    def __init__(self, deltaMinSize = 0, blockSize = 1024 * 1024, 
+            bufferSize = 1024 * 1024, sparse = 'auto', pageCache = 'keep',
+            directMinSize = 0, preallocateMinSize = 1024 * 1024,
+            atomic = False, replace = None):
+        '''Constructor.
+        @param deltaMinSize: files with at least this size are copied with
+                delta copy if the target exists. 0: no delta copy
+        @param blockSize: the unit of comparison for delta copy
+        @param bufferSize: the buffer size of the read()/write() copy
+        @param sparse: 'auto': files with fewer allocated blocks than their
+                size are copied without their holes<br>
+                'zeros': additionally blocks of zeros are not written<br>
+                'off': all files are copied completely
+        @param pageCache: 'keep': the page cache is used as usual<br>
+                'drop': the copied data is released from the page cache
+        @param directMinSize: files with at least this size are copied with
+                O_DIRECT (bypassing the page cache). 0: never
+        @param preallocateMinSize: targets with at least this size are
+                allocated before copying. 0: never
+        @param atomic: True: regular files are copied into a temporary file
+                which replaces the target (see copySafe())
+        @param replace: None or a function(temp, target) moving the
+                temporary file into place. None: os.replace()
+        '''
+        self._deltaMinSize = deltaMinSize
+        self._blockSize = blockSize
+        self._bufferSize = bufferSize
+        self._sparse = sparse if self._sparseSupported else 'off'
+        self._dropCache = pageCache == 'drop' and self._adviceSupported
+        if self._dropCache:
+            # the kernel copies window by window
+            self._chunkSize = self._cacheWindow
+        self._directMinSize = directMinSize if self._directSupported else 0
+        self._preallocateMinSize = (preallocateMinSize 
+            if hasattr(os, 'posix_fallocate') else 0)
+        self._atomic = atomic
+        self._replace = os.replace if replace == None else replace
+        self._lock = threading.Lock()
+        self._countDelta = 0
+        self._deltaWritten = 0
+        self._deltaSkipped = 0
+        self._countFallbacks = 0
+        self._countSparse = 0
+        self._sparseSkipped = 0
+        self._countPreallocated = 0
+        self._countDirect = 0
+        self._directBytes = 0
+        # the bytes of the copied files released from the page cache
+        self._releasedBytes = 0
+        self._zeros = None
+        self._methods = []
+        if fcntl != None and hasattr(fcntl, 'ioctl') and os.sep == '/':
+            self._methods.append(('reflink', self.copyByReflink))
+        if self._sparse != 'off':
+            # after reflink: sharing the extents keeps the holes too
+            self._methods.append(('sparse', self.copySparse))
+        if hasattr(os, 'copy_file_range'):
+            self._methods.append(('copy_file_range', self.copyByCopyFileRange))
+        if hasattr(os, 'sendfile'):
+            self._methods.append(('sendfile', self.copyBySendfile))
+        self._methods.append(('read/write', self.copyByBuffer))
+        # (srcDevice, trgDevice, method) of failed methods
+        self._failed = set()
+        # method -> [files, bytes]
+        self._methodStatistics = {}
+
+    def copy(self, src, trg, srcStat, trgStat = None):
+        '''Copies a file like shutil.copy2().
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source (without following links)
+        @param trgStat: None or the status of the existing target
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        if self.isDeltaCopy(srcStat, trgStat):
+            try:
+                self.copyDelta(src, trg)
+            except OSError:
+                # the target may be partially updated: replace it completely
+                with self._lock:
+                    self._countFallbacks += 1
+                rc = self.copySafe(src, trg)
+        elif not stat.S_ISREG(srcStat.st_mode):
+            shutil.copy2(src, trg)
+            self.count('copy2', srcStat.st_size)
+        elif self._atomic:
+            rc = self.copySafe(src, trg, srcStat)
+        else:
+            rc = self.copyRegular(src, trg, srcStat)
+        return rc
+
+    def copyRegular(self, src, trg, srcStat):
+        '''Copies the content and the metadata of a regular file.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        if not self.isDirect(srcStat) or not self.copyDirect(src, trg):
+            rc = self.copyContent(src, trg, srcStat)
+        shutil.copystat(src, trg)
+        return rc
+
+    def isDeltaCopy(self, srcStat, trgStat):
+        '''Tests whether a file will be copied by delta copy.
+        @param srcStat: the status of the source (without following links)
+        @param trgStat: None or the status of the existing target
+        @return: True: only the changed blocks will be written
+        '''
+        return (self._deltaMinSize > 0 and trgStat != None
+                and srcStat.st_size >= self._deltaMinSize
+                and stat.S_ISREG(srcStat.st_mode)
+                and stat.S_ISREG(trgStat.st_mode))
+
+    def isSparse(self, srcStat):
+        '''Tests whether a file will be copied without its holes.
+        @param srcStat: the status of the source
+        @return: True: only the data extents will be written
+        '''
+        rc = False
+        if (self._sparse != 'off' and stat.S_ISREG(srcStat.st_mode) 
+                and srcStat.st_size > 0):
+            if self._sparse == 'zeros':
+                rc = True
+            else:
+                blocks = getattr(srcStat, 'st_blocks', None)
+                rc = blocks != None and blocks * 512 < srcStat.st_size
+        return rc
+
+    def count(self, method, size):
+        '''Counts a copy in the statistics of the copy methods.
+        @param method: the name of the method
+        @param size: the number of copied bytes
+        '''
+        with self._lock:
+            if method not in self._methodStatistics:
+                self._methodStatistics[method] = [0, 0]
+            item = self._methodStatistics[method]
+            item[0] += 1
+            item[1] += size
+
+    def isDirect(self, srcStat):
+        '''Tests whether a file should be copied with O_DIRECT.
+        @param srcStat: the status of the source
+        @return: True: the page cache should be bypassed
+        '''
+        return (self._directMinSize > 0 and stat.S_ISREG(srcStat.st_mode)
+            and srcStat.st_size >= self._directMinSize
+            and not self.isSparse(srcStat))
+
+    def adviseSequential(self, fdSrc):
+        '''Announces that the source will be read once from start to end.
+        @param fdSrc: the file descriptor of the source
+        '''
+        if self._dropCache:
+            os.posix_fadvise(fdSrc, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def releaseCache(self, fdSrc, fdTrg, start, end):
+        '''Releases a copied part of the files from the page cache.
+        The target pages are dirty at first: the advice starts their write
+        back, they are released by the advice for the next part.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param start: the first position of the copied part
+        @param end: the position behind the copied part
+        '''
+        if self._dropCache:
+            if end > start:
+                os.posix_fadvise(fdSrc, start, end - start, os.POSIX_FADV_DONTNEED)
+                os.posix_fadvise(fdTrg, start, end - start, os.POSIX_FADV_DONTNEED)
+            if start > 0:
+                previous = max(0, start - self._chunkSize)
+                os.posix_fadvise(fdTrg, previous, start - previous, 
+                    os.POSIX_FADV_DONTNEED)
+
+    def releaseFile(self, fdSrc, fdTrg, size):
+        '''Releases a copied file from the page cache and counts it.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param size: the number of copied bytes
+        '''
+        if self._dropCache:
+            self.releaseCache(fdSrc, fdTrg, 0, size)
+            with self._lock:
+                self._releasedBytes += size
+
+    def preallocate(self, fdTrg, offset, size):
+        '''Allocates the blocks of a target before copying: less fragmentation.
+        @param fdTrg: the file descriptor of the target
+        @param offset: the first position to allocate
+        @param size: the final size of the target
+        @return: True: the target has been extended to size
+        '''
+        rc = False
+        if self._preallocateMinSize > 0 and size >= self._preallocateMinSize:
+            try:
+                os.posix_fallocate(fdTrg, offset, size - offset)
+                rc = True
+            except OSError as exc:
+                if exc.errno not in self._unsupported:
+                    raise
+            if rc:
+                with self._lock:
+                    self._countPreallocated += 1
+        return rc
+
+    def countSparse(self, skipped):
+        '''Counts a file copied without its holes.
+        @param skipped: the number of bytes not written
+        '''
+        with self._lock:
+            self._countSparse += 1
+            self._sparseSkipped += skipped
+
+    def copyContent(self, src, trg, srcStat):
+        '''Copies the content of a regular file with the cheapest method.
+        If a method fails before copying anything the next one is used.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        sparse = self.isSparse(srcStat)
+        preallocated = False
+        with open(src, 'rb') as fpSrc, open(trg, 'wb') as fpTrg:
+            fdSrc = fpSrc.fileno()
+            fdTrg = fpTrg.fileno()
+            devices = (srcStat.st_dev, os.fstat(fdTrg).st_dev)
+            self.adviseSequential(fdSrc)
+            for name, method in self._methods:
+                if (devices + (name,) in self._failed 
+                        or name == 'sparse' and not sparse):
+                    continue
+                if name not in ('reflink', 'sparse') and not preallocated:
+                    # the size only: the content is written sequentially
+                    preallocated = self.preallocate(fdTrg, 0, srcStat.st_size)
+                start = os.lseek(fdTrg, 0, os.SEEK_CUR)
+                try:
+                    size = method(fdSrc, fdTrg)
+                except OSError as exc:
+                    if (exc.errno not in self._unsupported 
+                            or os.lseek(fdTrg, 0, os.SEEK_CUR) != start):
+                        raise
+                    with self._lock:
+                        self._failed.add(devices + (name,))
+                    continue
+                self.count(name, size)
+                if name == 'sparse':
+                    rc = srcStat.st_size - size
+                    self.countSparse(rc)
+                elif preallocated and size != srcStat.st_size:
+                    # the source has changed in the meantime
+                    os.ftruncate(fdTrg, size)
+                if name != 'reflink':
+                    self.releaseFile(fdSrc, fdTrg, size)
+                break
+        return rc
+
+    def copyByReflink(self, fdSrc, fdTrg):
+        '''Lets the target share the data blocks of the source.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        fcntl.ioctl(fdTrg, FICLONE, fdSrc)
+        size = os.fstat(fdSrc).st_size
+        os.lseek(fdTrg, size, os.SEEK_SET)
+        return size
+
+    def copyByCopyFileRange(self, fdSrc, fdTrg):
+        '''Copies inside the kernel with copy_file_range().
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        while True:
+            length = os.copy_file_range(fdSrc, fdTrg, self._chunkSize)
+            if length == 0:
+                break
+            rc += length
+            self.releaseCache(fdSrc, fdTrg, rc - length, rc)
+        return rc
+
+    def copyBySendfile(self, fdSrc, fdTrg):
+        '''Copies inside the kernel with sendfile().
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        while True:
+            length = os.sendfile(fdTrg, fdSrc, None, self._chunkSize)
+            if length == 0:
+                break
+            rc += length
+            self.releaseCache(fdSrc, fdTrg, rc - length, rc)
+        return rc
+
+    def copyByBuffer(self, fdSrc, fdTrg):
+        '''Copies with read() and write() through a buffer.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        released = 0
+        buffer = bytearray(self._bufferSize)
+        view = memoryview(buffer)
+        reader = io.FileIO(fdSrc, 'rb', closefd=False)
+        while True:
+            length = reader.readinto(buffer)
+            if not length:
+                break
+            written = 0
+            while written < length:
+                written += os.write(fdTrg, view[written:length])
+            rc += length
+            if rc - released >= self._chunkSize:
+                self.releaseCache(fdSrc, fdTrg, released, rc)
+                released = rc
+        return rc
+
+    def copySparse(self, fdSrc, fdTrg):
+        '''Copies the data extents of a file: the holes are not written.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of written bytes
+        '''
+        size, rc = self.copyExtents(fdSrc, fdTrg, 0)
+        os.lseek(fdTrg, size, os.SEEK_SET)
+        return rc
+
+    def dataExtents(self, fd, offset, size):
+        '''Returns the parts of a file which contain data.
+        @param fd: the file descriptor
+        @param offset: the first position to inspect
+        @param size: the file size
+        @return: an iterator of tuples (start, end, exact). exact is False if
+                the filesystem does not know the holes: the part may contain some
+        '''
+        position = offset
+        while position < size:
+            if not hasattr(os, 'SEEK_DATA'):
+                yield (position, size, False)
+                break
+            try:
+                start = os.lseek(fd, position, os.SEEK_DATA)
+                end = min(size, os.lseek(fd, start, os.SEEK_HOLE))
+            except OSError as exc:
+                if exc.errno == errno.ENXIO:
+                    # only a hole up to the end of the file
+                    break
+                if exc.errno not in self._unsupported:
+                    raise
+                yield (position, size, False)
+                break
+            if start >= end:
+                break
+            yield (start, end, True)
+            position = end
+
+    def copyExtents(self, fdSrc, fdTrg, offset, progress = None):
+        '''Copies the data extents of a file starting at a given position.
+        The holes are recreated by setting the file size.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target (empty behind offset)
+        @param offset: the first position to copy
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk (64 MByte)
+        @return: a tuple (size, written): the file size and the number of
+                written bytes
+        '''
+        size = os.fstat(fdSrc).st_size
+        written = 0
+        reported = offset
+        for start, end, exact in self.dataExtents(fdSrc, offset, size):
+            detectZeros = self._sparse == 'zeros' or not exact
+            position = start
+            while position < end:
+                last = min(end, position + self._chunkSize)
+                written += self.copyExtent(fdSrc, fdTrg, position, last, 
+                    detectZeros)
+                self.releaseCache(fdSrc, fdTrg, position, last)
+                position = last
+                if progress != None and position - reported >= self._chunkSize:
+                    os.ftruncate(fdTrg, position)
+                    progress(position)
+                    reported = position
+        os.ftruncate(fdTrg, size)
+        return size, written
+
+    def copyExtent(self, fdSrc, fdTrg, start, end, detectZeros):
+        '''Copies a part of a file to the same position of the target.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param start: the first position to copy
+        @param end: the position behind the last byte to copy
+        @param detectZeros: True: blocks containing only zeros are not written
+        @return: the number of written bytes
+        '''
+        position = start
+        if not detectZeros and hasattr(os, 'copy_file_range'):
+            try:
+                while position < end:
+                    length = os.copy_file_range(fdSrc, fdTrg, 
+                        min(self._chunkSize, end - position), position, position)
+                    if length == 0:
+                        break
+                    position += length
+                return position - start
+            except OSError as exc:
+                if exc.errno not in self._unsupported:
+                    raise
+        # the part copied by the kernel before it failed
+        rc = position - start
+        unit = self._zeroBlockSize
+        bufferSize = self._bufferSize
+        if detectZeros:
+            if self._zeros == None:
+                self._zeros = bytes(unit)
+            # whole blocks: the zero blocks are found at the same positions
+            bufferSize = max(unit, bufferSize - bufferSize % unit)
+        while position < end:
+            data = os.pread(fdSrc, min(bufferSize, end - position), position)
+            if not data:
+                break
+            length = len(data)
+            view = memoryview(data)
+            first = 0
+            if detectZeros:
+                # writes the runs of blocks which are not zero
+                for ix in range(0, length, unit):
+                    if data[ix:ix + unit] == self._zeros[0:min(unit, length - ix)]:
+                        if first < ix:
+                            rc += self.writeAt(fdTrg, view[first:ix], position + first)
+                        first = ix + unit
+            if first < length:
+                rc += self.writeAt(fdTrg, view[first:length], position + first)
+            position += length
+        return rc
+
+    def writeAt(self, fd, view, position):
+        '''Writes a buffer completely at a given position.
+        @param fd: the file descriptor
+        @param view: the data to write (a memoryview)
+        @param position: the file position of the first byte
+        @return: the number of written bytes
+        '''
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], position + written)
+        return written
+
+    def copyDirect(self, src, trg, offset = 0, progress = None):
+        '''Copies a file with O_DIRECT: the data does not pass the page cache.
+        @param src: the source file
+        @param trg: the target file. Data behind offset is discarded
+        @param offset: the first position to copy (aligned)
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk
+        @return: True: the file has been copied<br>
+                False: the filesystems do not support O_DIRECT
+        '''
+        align = self._directAlignment
+        size = self._directBufferSize
+        # mmap: the buffer is aligned to a page
+        buffer = mmap.mmap(-1, size)
+        view = memoryview(buffer)
+        fdSrc = fdTrg = None
+        position = offset
+        try:
+            fdSrc = os.open(src, os.O_RDONLY | os.O_DIRECT)
+            fdTrg = os.open(trg, os.O_WRONLY | os.O_CREAT | os.O_DIRECT
+                | (os.O_TRUNC if offset == 0 else 0), 0o666)
+            os.ftruncate(fdTrg, offset)
+            total = os.fstat(fdSrc).st_size
+            self.preallocate(fdTrg, offset, total)
+            reported = offset
+            while True:
+                length = os.preadv(fdSrc, [buffer], position)
+                if length == 0:
+                    break
+                # the last block is filled up and cut off by the truncation
+                todo = (length + align - 1) // align * align
+                written = 0
+                while written < todo:
+                    written += os.pwritev(fdTrg, [view[written:todo]], 
+                        position + written)
+                position += length
+                if progress != None and position - reported >= self._chunkSize:
+                    progress(position)
+                    reported = position
+                if length % align != 0:
+                    # the end of the file
+                    break
+            os.ftruncate(fdTrg, position)
+        except OSError as exc:
+            if exc.errno != errno.EINVAL or position != offset:
+                raise
+            return False
+        finally:
+            view.release()
+            buffer.close()
+            if fdSrc != None:
+                os.close(fdSrc)
+            if fdTrg != None:
+                os.close(fdTrg)
+        self.count('direct', position - offset)
+        with self._lock:
+            self._countDirect += 1
+            self._directBytes += position - offset
+        return True
+
+    def copyRange(self, src, trg, offset, progress = None):
+        '''Copies the content of a file starting at a given position.
+        Used to continue an interrupted copy.
+        @param src: the source file
+        @param trg: the target file. Data behind offset is discarded
+        @param offset: the first position to copy
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk (64 MByte)
+        @return: the number of bytes not written because they are holes
+        '''
+        info = os.stat(src)
+        if (self.isDirect(info) and offset % self._directAlignment == 0
+                and self.copyDirect(src, trg, offset, progress)):
+            return 0
+        useKernel = hasattr(os, 'copy_file_range')
+        buffer = None
+        rc = 0
+        with open(src, 'rb') as fpSrc, open(trg, 
+                'r+b' if offset > 0 else 'wb') as fpTrg:
+            fpTrg.truncate(offset)
+            fpSrc.seek(offset)
+            fpTrg.seek(offset)
+            fdSrc = fpSrc.fileno()
+            fdTrg = fpTrg.fileno()
+            position = offset
+            reported = offset
+            self.adviseSequential(fdSrc)
+            preallocated = False
+            if self.isSparse(os.fstat(fdSrc)):
+                position, written = self.copyExtents(fdSrc, fdTrg, offset, 
+                    progress)
+                rc = max(0, position - offset - written)
+                self.countSparse(rc)
+            else:
+                preallocated = self.preallocate(fdTrg, offset, info.st_size)
+                while True:
+                    length = None
+                    if useKernel:
+                        try:
+                            length = os.copy_file_range(fdSrc, fdTrg, 
+                                self._chunkSize, position, position)
+                        except OSError as exc:
+                            if exc.errno not in self._unsupported:
+                                raise
+                            useKernel = False
+                    if length == None:
+                        if buffer == None:
+                            buffer = bytearray(self._bufferSize)
+                        os.lseek(fdSrc, position, os.SEEK_SET)
+                        os.lseek(fdTrg, position, os.SEEK_SET)
+                        length = fpSrc.raw.readinto(buffer)
+                        view = memoryview(buffer)
+                        written = 0
+                        while written < length:
+                            written += os.write(fdTrg, view[written:length])
+                    if not length:
+                        break
+                    position += length
+                    self.releaseCache(fdSrc, fdTrg, position - length, position)
+                    if progress != None and position - reported >= self._chunkSize:
+                        progress(position)
+                        reported = position
+                if preallocated and position != info.st_size:
+                    os.ftruncate(fdTrg, position)
+            self.releaseFile(fdSrc, fdTrg, position)
+        self.count('resumed' if offset > 0 else 'resumable', position - offset - rc)
+        return rc
+
+    def copyDelta(self, src, trg):
+        '''Updates an existing target file: only differing blocks are written.
+        @param src: the source file
+        @param trg: the target file
+        '''
+        written = 0
+        skipped = 0
+        blockSize = self._blockSize
+        with open(src, 'rb') as fpSrc, open(trg, 'r+b') as fpTrg:
+            self.adviseSequential(fpSrc.fileno())
+            position = 0
+            released = 0
+            while True:
+                block = fpSrc.read(blockSize)
+                if not block:
+                    break
+                if fpTrg.read(len(block)) == block:
+                    skipped += len(block)
+                else:
+                    fpTrg.seek(position)
+                    fpTrg.write(block)
+                    written += len(block)
+                position += len(block)
+                if self._dropCache and position - released >= self._chunkSize:
+                    fpTrg.flush()
+                    self.releaseCache(fpSrc.fileno(), fpTrg.fileno(), released, 
+                        position)
+                    released = position
+            fpTrg.truncate(position)
+            fpTrg.flush()
+            self.releaseFile(fpSrc.fileno(), fpTrg.fileno(), position)
+        shutil.copystat(src, trg)
+        self.count('delta', written)
+        with self._lock:
+            self._countDelta += 1
+            self._deltaWritten += written
+            self._deltaSkipped += skipped
+
+    def copySafe(self, src, trg, srcStat = None):
+        '''Copies a file into a temporary file which replaces the target.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: None or the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        temp = tempName(trg)
+        try:
+            rc = self.copyRegular(src, temp, 
+                os.stat(src) if srcStat == None else srcStat)
+            self._replace(temp, trg)
+        except OSError:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+        return rc
@@ -0,0 +1,288 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import errno, os, os.path, stat, threading, time
+from dirsync.pool import WorkerPool
+
+class DirNode:
+    '''A directory being removed. It is deleted itself when its listing and
+    the removal of all its subdirectories are done.
+    '''
+    __slots__ = ('_parent', '_name', '_path', '_fd', '_pending', '_done')
+
+    def __init__(self, parent, name, path, fd):
+        '''Constructor.
+        @param parent: None (the root of the tree) or the parent DirNode
+        @param name: the node of the directory (without path)
+        @param path: the full name of the directory (with trailing separator)
+        @param fd: None or the open descriptor of the directory
+        '''
+        self._parent = parent
+        self._name = name
+        self._path = path
+        self._fd = fd
+        # the listing and the subdirectories still to remove
+        self._pending = 1
+        self._done = threading.Event() if parent == None else None
+
+class TreeDeleter:
+    '''Removes directory trees fast.
+    The directories are read with os.scandir() and the entries are removed
+    relative to the descriptor of the open directory (unlinkat(), no path
+    lookups). Subdirectories are opened with O_NOFOLLOW: an entry replaced by
+    a symbolic link in the meantime is never followed, only the link is removed.
+    The permissions are changed only if a removal fails (read-only directories).
+    With more than one worker the subtrees are removed in parallel.
+    No recursion: the subdirectories not taken by a worker are stored in an
+    explicit stack, only the directories of the current path are open.
+    '''
+    # the descriptor based functions are available (not on Windows)
+    _useFd = (os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd
+        and os.open in os.supports_dir_fd and os.scandir in os.supports_fd
+        and os.chmod in os.supports_fd and hasattr(os, 'O_NOFOLLOW')
+        and hasattr(os, 'O_DIRECTORY'))
+
+    def __init__(self, countWorkers = 1, onError = None, onRemove = None):
+        '''Constructor.
+        @param countWorkers: the number of threads removing subtrees
+                (including the calling thread)
+        @param onError: None or a function(msg, exception, path) handling errors
+        @param onRemove: None or a function(path) called for each removed entry
+        '''
+        self._pool = None
+        if countWorkers > 1:
+            self._pool = WorkerPool(countWorkers - 1, name='deleter')
+        self._onError = onError
+        self._onRemove = onRemove
+        self._lock = threading.Lock()
+        # per thread: the explicit stack of the directories to process
+        self._local = threading.local()
+        self._countFiles = 0
+        self._countDirs = 0
+        self._countErrors = 0
+        self._seconds = 0.0
+
+    def close(self):
+        '''Stops the worker threads.
+        '''
+        if self._pool != None:
+            self._pool.close()
+            self._pool = None
+
+    def throughput(self):
+        '''Returns the removal speed.
+        @return: the removed entries (files and directories) per second
+        '''
+        return (self._countFiles + self._countDirs) / max(self._seconds, 1E-6)
+
+    def error(self, msg, exception, path):
+        '''Handles an error.
+        @param msg: the error message
+        @param exception: the exception describing the error
+        @param path: the file concerned
+        '''
+        with self._lock:
+            self._countErrors += 1
+        if self._onError != None:
+            self._onError(msg, exception, path)
+
+    def removeTree(self, path):
+        '''Removes a directory with all files and subdirectories.
+        Errors are reported (see onError), the rest of the tree is removed.
+        @param path: the full name of the directory. If it is a symbolic link
+                only the link is removed
+        @return: True: the tree has been removed completely
+        '''
+        start = time.time()
+        errors = self._countErrors
+        root = path.rstrip(os.sep)
+        fd = None
+        try:
+            if self._useFd:
+                fd = self.openDir(None, root)
+            elif os.path.islink(root):
+                raise OSError(errno.ELOOP, 'symbolic link', root)
+        except OSError as exc:
+            if exc.errno in (errno.ELOOP, errno.ENOTDIR):
+                self.removeEntry(None, root, False)
+            else:
+                self.error('cannot remove: ', exc, root + os.sep)
+        else:
+            node = DirNode(None, None, root + os.sep, fd)
+            # the calling thread works too: the subtrees go to the workers
+            self.drain(node)
+            node._done.wait()
+        with self._lock:
+            self._seconds += time.time() - start
+        return self._countErrors == errors
+
+    def schedule(self, node):
+        '''Removes a directory: by a worker if the queue has room, otherwise
+        by the current thread.
+        @param node: the DirNode of the directory
+        '''
+        if self._pool != None and self._pool.trySubmit(self.removeContent, node):
+            return
+        todo = getattr(self._local, 'todo', None)
+        if todo != None:
+            todo.append(node)
+        else:
+            self.drain(node)
+
+    def drain(self, node):
+        '''Removes a directory and the subdirectories not taken by a worker.
+        @param node: the DirNode of the directory
+        '''
+        todo = self._local.todo = [node]
+        try:
+            while todo:
+                self.removeContent(todo.pop())
+        finally:
+            self._local.todo = None
+
+    def removeContent(self, node):
+        '''Removes the files of a directory and schedules its subdirectories.
+        @param node: the DirNode of the directory
+        '''
+        parent = node._parent
+        if parent != None and parent._fd != None:
+            try:
+                node._fd = self.openDir(parent, node._name)
+            except OSError as exc:
+                if exc.errno in (errno.ELOOP, errno.ENOTDIR):
+                    # replaced by a symbolic link or a file in the meantime
+                    self.removeEntry(parent, node._name, False)
+                    self.release(parent)
+                    return
+                if exc.errno not in (errno.EMFILE, errno.ENFILE):
+                    self.error('cannot remove: ', exc, node._path)
+                    self.release(parent)
+                    return
+                # too many open directories: this subtree uses path names
+        try:
+            with os.scandir(node._path if node._fd == None else node._fd) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.removeSubdir(node, entry.name)
+                    else:
+                        self.removeEntry(node, entry.name, False)
+        except OSError as exc:
+            self.error('cannot list: ', exc, node._path)
+        finally:
+            self.release(node)
+
+    def removeSubdir(self, node, name):
+        '''Schedules the removal of a subdirectory.
+        @param node: the DirNode of the parent
+        @param name: the node of the subdirectory
+        '''
+        with self._lock:
+            node._pending += 1
+        # opened when processed: waiting directories need no descriptor
+        self.schedule(DirNode(node, name, node._path + name + os.sep, None))
+
+    def openDir(self, node, name):
+        '''Opens a directory without following symbolic links.
+        A directory without access rights is made accessible.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the directory
+        @return: the descriptor of the directory
+        '''
+        flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+        if hasattr(os, 'O_CLOEXEC'):
+            flags |= os.O_CLOEXEC
+        dirFd = None if node == None else node._fd
+        try:
+            rc = os.open(name, flags, dir_fd=dirFd)
+        except PermissionError:
+            if not hasattr(os, 'O_PATH'):
+                raise
+            # O_PATH needs no rights and does not follow a link either
+            fd = os.open(name, os.O_PATH | os.O_DIRECTORY | os.O_NOFOLLOW,
+                dir_fd=dirFd)
+            try:
+                info = os.fstat(fd)
+                os.chmod('/proc/self/fd/%d' % fd,
+                    stat.S_IMODE(info.st_mode) | stat.S_IRWXU)
+            finally:
+                os.close(fd)
+            rc = os.open(name, flags, dir_fd=dirFd)
+        return rc
+
+    def remove(self, node, name, isDir):
+        '''Removes a file or an empty directory.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the entry
+        @param isDir: True: the entry is a directory
+        '''
+        function = os.rmdir if isDir else os.unlink
+        if node == None:
+            function(name)
+        elif node._fd != None:
+            function(name, dir_fd=node._fd)
+        else:
+            function(node._path + name)
+
+    def removeEntry(self, node, name, isDir):
+        '''Removes a file or an empty directory and counts it.
+        If the removal is not permitted the parent directory (and on
+        systems without descriptor functions the entry) is made writable.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the entry
+        @param isDir: True: the entry is a directory
+        '''
+        path = name if node == None else node._path + name
+        try:
+            try:
+                self.remove(node, name, isDir)
+            except PermissionError:
+                self.makeWritable(node, path)
+                self.remove(node, name, isDir)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error('cannot remove: ', exc, path)
+            return
+        with self._lock:
+            if isDir:
+                self._countDirs += 1
+            else:
+                self._countFiles += 1
+        if self._onRemove != None:
+            self._onRemove(path + os.sep if isDir else path)
+
+    def makeWritable(self, node, path):
+        '''Allows the removal of the entries of a directory.
+        @param node: None or the DirNode of the parent
+        @param path: the full name of the entry to remove
+        '''
+        if node != None and node._fd != None:
+            info = os.fstat(node._fd)
+            os.chmod(node._fd, stat.S_IMODE(info.st_mode) | stat.S_IRWXU)
+        else:
+            # e.g. Windows: the read-only attribute of the entry itself
+            parent = os.path.dirname(path.rstrip(os.sep))
+            os.chmod(parent, stat.S_IMODE(os.lstat(parent).st_mode) | stat.S_IRWXU)
+            if not os.path.islink(path):
+                os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IWUSR)
+
+    def release(self, node):
+        '''Marks a part of the work of a directory as done.
+        If nothing remains the directory itself is removed (and maybe its
+        parents: iteratively).
+        @param node: the DirNode of the directory
+        '''
+        while node != None:
+            with self._lock:
+                node._pending -= 1
+                done = node._pending == 0
+            if not done:
+                break
+            if node._fd != None:
+                os.close(node._fd)
+            parent = node._parent
+            if parent == None:
+                self.removeEntry(None, node._path[0:-1], True)
+                node._done.set()
+            else:
+                self.removeEntry(parent, node._name, True)
+            node = parent
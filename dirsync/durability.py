@@ -0,0 +1,244 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, threading, time
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+class DurabilityTracker:
+    '''Makes the written targets durable. Except for 'none' the files are
+    written under a temporary name and renamed into place (atomically): an
+    aborted process never leaves a half written target. The policies differ
+    in what survives a crash of the system (power loss):<br>
+    'none': nothing is synced, the targets are written in place<br>
+    'file': each file is synced before its rename, its directory when the
+    directory is done: a renamed target is never empty or incomplete<br>
+    'dir': the written files and the entries of a directory are synced as one
+    batch when the directory is done. The files are renamed before: a crash
+    before the batch may leave targets of that directory empty or incomplete,
+    after the batch the directory is durable<br>
+    'fs': one syncfs() per target filesystem at the end of the run: a crash
+    during the run may leave any renamed target empty or incomplete, after
+    the run everything is durable<br>
+    Files written after their directory is done (by worker threads) are
+    synced at the end of the run.
+    '''
+    MODES = ('none', 'file', 'dir', 'fs')
+    # directories can be opened and synced (not on Windows)
+    _dirSyncSupported = os.name == 'posix'
+    # the files of a batch open at the same time
+    _batchSize = 256
+
+    def __init__(self, mode = 'none', onError = None):
+        '''Constructor.
+        @param mode: the policy: 'none', 'file', 'dir' or 'fs'
+        @param onError: None or a function(msg, exception, path) handling errors
+        '''
+        self._mode = mode
+        self._onError = onError
+        self._lock = threading.Lock()
+        # directory -> list of the written files not synced yet ('dir')
+        self._files = {}
+        # the directories with changed entries not synced yet
+        self._dirs = set()
+        self._countFiles = 0
+        self._countDirs = 0
+        self._countFilesystems = 0
+        self._seconds = 0.0
+
+    def isAtomic(self):
+        '''Tests whether the files are written under a temporary name.
+        @return: True: the targets are renamed into place by replace()
+        '''
+        return self._mode != 'none'
+
+    def error(self, msg, exception, path):
+        '''Handles an error.
+        @param msg: the error message
+        @param exception: the exception describing the error
+        @param path: the file concerned
+        '''
+        if self._onError != None:
+            self._onError(msg, exception, path)
+
+    def replace(self, temp, trg):
+        '''Moves a completely written temporary file to its final name.
+        Only in mode 'file' the content is synced before the rename.
+        @param temp: the temporary file
+        @param trg: the target file
+        '''
+        if self._mode == 'file':
+            self.syncFile(temp)
+        os.replace(temp, trg)
+        if self._mode == 'dir':
+            self.fileWritten(trg)
+        self.entryChanged(trg)
+
+    def fileWritten(self, full):
+        '''Registers a file written in place.
+        @param full: the full name of the file
+        '''
+        if self._mode == 'file':
+            self.syncFile(full)
+        elif self._mode == 'dir':
+            parent = os.path.dirname(full)
+            with self._lock:
+                files = self._files.get(parent)
+                if files == None:
+                    files = self._files[parent] = []
+                files.append(full)
+
+    def entryChanged(self, full):
+        '''Registers a created, replaced or removed directory entry.
+        @param full: the full name of the entry
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            parent = os.path.dirname(full.rstrip(os.sep))
+            with self._lock:
+                self._dirs.add(parent)
+
+    def dirDone(self, path):
+        '''Syncs the registered files and the entries of a directory.
+        @param path: the directory (with or without trailing separator)
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            path = path.rstrip(os.sep) or os.sep
+            with self._lock:
+                files = self._files.pop(path, None)
+                changed = path in self._dirs
+                if changed:
+                    self._dirs.remove(path)
+            if files != None or changed:
+                start = time.time()
+                for ix in range(0, len(files or ()), self._batchSize):
+                    self.syncFiles(files[ix:ix + self._batchSize])
+                if changed:
+                    self.syncDir(path)
+                with self._lock:
+                    self._seconds += time.time() - start
+
+    def flush(self, roots):
+        '''Syncs everything not synced yet: called at the end of the run.
+        @param roots: the target directories of the run
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            with self._lock:
+                dirs = set(self._files.keys()) | self._dirs
+            for path in sorted(dirs):
+                self.dirDone(path)
+        elif self._mode == 'fs':
+            start = time.time()
+            devices = set()
+            for root in roots:
+                try:
+                    device = os.stat(root).st_dev
+                    if device not in devices:
+                        devices.add(device)
+                        self.syncFilesystem(root)
+                except OSError as exc:
+                    self.error('cannot sync: ', exc, root)
+            with self._lock:
+                self._seconds += time.time() - start
+
+    def syncFile(self, full):
+        '''Writes the content of a file to the storage.
+        @param full: the full name of the file
+        '''
+        try:
+            fd = os.open(full, os.O_RDONLY)
+            try:
+                if hasattr(os, 'fdatasync'):
+                    os.fdatasync(fd)
+                else:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error('cannot sync: ', exc, full)
+            return
+        with self._lock:
+            self._countFiles += 1
+
+    def syncFiles(self, files):
+        '''Writes the content of some files to the storage.
+        The write back of all files is started before the first is waited
+        for: the storage works on the whole batch at once.
+        @param files: the full names of the files
+        '''
+        if len(files) == 1 or not hasattr(os, 'posix_fadvise'):
+            for full in files:
+                self.syncFile(full)
+        else:
+            fds = []
+            try:
+                for full in files:
+                    try:
+                        fd = os.open(full, os.O_RDONLY)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as exc:
+                        self.error('cannot sync: ', exc, full)
+                        continue
+                    fds.append((fd, full))
+                    # Linux: starts the write back without waiting
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                for fd, full in fds:
+                    try:
+                        os.fdatasync(fd)
+                    except OSError as exc:
+                        self.error('cannot sync: ', exc, full)
+                        continue
+                    with self._lock:
+                        self._countFiles += 1
+            finally:
+                for fd, full in fds:
+                    os.close(fd)
+
+    def syncDir(self, path):
+        '''Writes the entries of a directory to the storage.
+        @param path: the directory
+        '''
+        if self._dirSyncSupported:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                return
+            except OSError as exc:
+                self.error('cannot sync: ', exc, path)
+                return
+            with self._lock:
+                self._countDirs += 1
+
+    def syncFilesystem(self, path):
+        '''Writes all changes of a filesystem to the storage.
+        Without syncfs() (not Linux) all filesystems are synced.
+        @param path: a directory of the filesystem
+        '''
+        libc = None
+        if ctypes != None and os.name == 'posix':
+            try:
+                libc = ctypes.CDLL(None, use_errno=True)
+                if not hasattr(libc, 'syncfs'):
+                    libc = None
+            except OSError:
+                libc = None
+        if libc == None:
+            if hasattr(os, 'sync'):
+                os.sync()
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if libc.syncfs(fd) != 0:
+                    error = ctypes.get_errno()
+                    raise OSError(error, os.strerror(error), path)
+            finally:
+                os.close(fd)
+        with self._lock:
+            self._countFilesystems += 1
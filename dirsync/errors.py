@@ -0,0 +1,143 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import collections, errno, json, os.path, sys, time
+
+class ErrorLog:
+    '''Collects the errors of a run with bounded memory and cost.
+    The first and the last errors are kept for the report (the last ones in
+    a ring buffer). All errors are counted by kind and by directory.
+    Up to a limit the messages are written (buffered) to the error file,
+    a JSON lines file and stderr; beyond it the errors are only counted.
+    '''
+    # the number of distinct directories counted separately
+    _maxDirs = 10000
+
+    def __init__(self, maxFirst = 20, maxLast = 20, maxLogged = 10000,
+            filename = None, jsonFilename = None, echo = sys.stderr,
+            interval = 2.0):
+        '''Constructor.
+        @param maxFirst: the number of first errors kept for the report
+        @param maxLast: the number of last errors kept for the report
+        @param maxLogged: the number of errors written to the log media
+        @param filename: None or the error file (text)
+        @param jsonFilename: None or the error file (JSON lines)
+        @param echo: None or the stream showing the errors
+        @param interval: the log files are flushed after this many seconds
+        '''
+        self._maxFirst = maxFirst
+        self._maxLogged = maxLogged
+        self._filename = filename
+        self._jsonFilename = jsonFilename
+        self._echo = echo
+        self._interval = interval
+        self._fp = None
+        self._fpJson = None
+        self._lastFlush = time.time()
+        self._count = 0
+        self._first = []
+        self._last = collections.deque(maxlen=maxLast)
+        self._kinds = {}
+        self._dirs = {}
+        self._countOtherDirs = 0
+
+    @staticmethod
+    def kindOf(exception):
+        '''Returns the kind of an error.
+        @param exception: None or the exception describing the error
+        @return: e.g. 'EACCES', 'ValueError' or 'message'
+        '''
+        if exception == None:
+            rc = 'message'
+        elif isinstance(exception, OSError) and exception.errno in errno.errorcode:
+            rc = errno.errorcode[exception.errno]
+        else:
+            rc = type(exception).__name__
+        return rc
+
+    def add(self, msg, exception = None, path = None):
+        '''Handles one error. The caller must serialize the calls.
+        @param msg: the complete message (with newline)
+        @param exception: None or the exception describing the error
+        @param path: None or the file concerned
+        '''
+        self._count += 1
+        kind = self.kindOf(exception)
+        self._kinds[kind] = self._kinds.get(kind, 0) + 1
+        if path != None:
+            path = getattr(exception, 'filename', None) or path
+            directory = os.path.dirname(path.rstrip(os.sep)) + os.sep
+            if directory in self._dirs or len(self._dirs) < self._maxDirs:
+                self._dirs[directory] = self._dirs.get(directory, 0) + 1
+            else:
+                self._countOtherDirs += 1
+        if self._count <= self._maxFirst:
+            self._first.append(msg)
+        else:
+            self._last.append(msg)
+        if self._count <= self._maxLogged:
+            self.write(msg, kind, exception, path)
+            if self._count == self._maxLogged:
+                self.write('further errors are only counted\n', 'limit', None, None)
+
+    def write(self, msg, kind, exception, path):
+        '''Writes an error to the log media.
+        @param msg: the complete message (with newline)
+        @param kind: the kind of the error
+        @param exception: None or the exception describing the error
+        @param path: None or the file concerned
+        '''
+        if self._echo != None:
+            self._echo.write(msg)
+        if self._fp == None and self._filename != None:
+            self._fp = open(self._filename, 'w', buffering=64 * 1024)
+        if self._fp != None:
+            self._fp.write(msg)
+        if self._fpJson == None and self._jsonFilename != None:
+            self._fpJson = open(self._jsonFilename, 'w', buffering=64 * 1024)
+        if self._fpJson != None:
+            record = {'time': round(time.time(), 3), 'kind': kind,
+                'msg': msg.rstrip()}
+            if path != None:
+                record['path'] = path
+            if isinstance(exception, OSError) and exception.errno != None:
+                record['errno'] = exception.errno
+            self._fpJson.write(json.dumps(record, ensure_ascii=False) + '\n')
+        now = time.time()
+        if now - self._lastFlush >= self._interval:
+            self.flush()
+            self._lastFlush = now
+
+    def flush(self):
+        '''Writes the buffered messages.
+        '''
+        for fp in (self._fp, self._fpJson):
+            if fp != None:
+                fp.flush()
+
+    def topKinds(self, count = 10):
+        '''Returns the most frequent kinds of errors.
+        @param count: the maximal number of items
+        @return: a list of (kind, number), the most frequent first
+        '''
+        return sorted(self._kinds.items(), key=lambda item: (-item[1], item[0]))[0:count]
+
+    def topDirs(self, count = 10):
+        '''Returns the directories with the most errors.
+        @param count: the maximal number of items
+        @return: a list of (directory, number), the most errors first
+        '''
+        return sorted(self._dirs.items(), key=lambda item: (-item[1], item[0]))[0:count]
+
+    def omitted(self):
+        '''Returns the number of errors not kept for the report.
+        @return: the number of errors neither in the first nor in the last ones
+        '''
+        return self._count - len(self._first) - len(self._last)
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        for fp in (self._fp, self._fpJson):
+            if fp != None:
+                fp.close()
+        self._fp = self._fpJson = None
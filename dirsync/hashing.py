@@ -0,0 +1,126 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, hashlib, sqlite3, threading, time
+
+class FileHasher:
+    '''Calculates content digests (BLAKE2b) of files with streaming reads.
+    The digests are stored in a SQLite database in the home directory,
+    keyed by device and inode and validated by size, modification time and
+    change time: a repeated run does not read unchanged files again. The
+    change time detects content rewritten in place with a restored mtime.
+    '''
+    def __init__(self, home, blockSize = 1024 * 1024):
+        '''Constructor.
+        @param home: None or the directory containing the digest cache.<br>
+                None: the digests are not cached
+        @param blockSize: the size of one read
+        '''
+        self._blockSize = blockSize
+        self._lock = threading.Lock()
+        self._db = None
+        if home != None:
+            self._db = sqlite3.connect(home + os.sep + '.redirsync.digests.db',
+                check_same_thread=False)
+            columns = [row[1] for row in 
+                self._db.execute('PRAGMA table_info(digests)')]
+            if columns and 'ctime_ns' not in columns:
+                # a cache of a former version: cannot be validated
+                self._db.execute('DROP TABLE digests')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, 
+    ctime_ns INTEGER, digest BLOB, PRIMARY KEY (dev, inode))''')
+        self._countFiles = 0
+        self._countCached = 0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def close(self):
+        '''Stores the cache and frees the resources.
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def hashFile(self, path):
+        '''Calculates the digest of a file without using the cache.
+        @param path: the filename
+        @return: a tuple (digest, status): the digest (bytes) and the status
+                of the file after reading
+        '''
+        start = time.time()
+        size = 0
+        digest = hashlib.blake2b(digest_size=32)
+        buffer = bytearray(self._blockSize)
+        view = memoryview(buffer)
+        with open(path, 'rb', buffering=0) as fp:
+            while True:
+                length = fp.readinto(buffer)
+                if not length:
+                    break
+                digest.update(view[0:length])
+                size += length
+            statInfo = os.fstat(fp.fileno())
+        with self._lock:
+            self._countFiles += 1
+            self._bytes += size
+            self._seconds += time.time() - start
+        return digest.digest(), statInfo
+
+    def digest(self, path, statInfo):
+        '''Returns the digest of a file, from the cache if possible.
+        @param path: the filename
+        @param statInfo: the status of the file (without following links)
+        @return: the digest (bytes)
+        '''
+        if (statInfo.st_dev == None 
+                or getattr(statInfo, 'st_ctime_ns', None) == None):
+            # e.g. taken from the index
+            statInfo = os.lstat(path)
+        key = (statInfo.st_dev, statInfo.st_ino)
+        row = None
+        if self._db != None:
+            with self._lock:
+                row = self._db.execute('SELECT size, mtime_ns, ctime_ns, digest'
+                    + ' FROM digests WHERE dev=? AND inode=?', key).fetchone()
+        if (row != None and row[0] == statInfo.st_size
+                and row[1] == statInfo.st_mtime_ns 
+                and row[2] == statInfo.st_ctime_ns):
+            rc = row[3]
+            with self._lock:
+                self._countCached += 1
+        else:
+            rc, after = self.hashFile(path)
+            if (after.st_size == statInfo.st_size
+                    and after.st_mtime_ns == statInfo.st_mtime_ns
+                    and after.st_ctime_ns == statInfo.st_ctime_ns):
+                self.store(after, rc)
+        return rc
+
+    def store(self, statInfo, digest):
+        '''Stores the digest of a file in the cache.
+        @param statInfo: the status of the file
+        @param digest: the digest of the content
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO digests '
+                    + 'VALUES (?, ?, ?, ?, ?, ?)', (statInfo.st_dev, 
+                        statInfo.st_ino, statInfo.st_size, 
+                        statInfo.st_mtime_ns, statInfo.st_ctime_ns, digest))
+
+    def forget(self, statInfo):
+        '''Removes the digest of a file from the cache.
+        @param statInfo: the status of the file
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.execute('DELETE FROM digests WHERE dev=? AND inode=?',
+                    (statInfo.st_dev, statInfo.st_ino))
+
+    def throughput(self):
+        '''Returns the hashing speed.
+        @return: the hashed bytes per second
+        '''
+        return self._bytes / max(self._seconds, 1E-6)
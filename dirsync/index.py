@@ -0,0 +1,228 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, stat, sqlite3, hashlib, threading, time
+
+class IndexedStat:
+    '''The part of a file status stored in the index.
+    '''
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns', 'st_ino')
+
+    def __init__(self, mode, size, mtimeNs, inode):
+        '''Constructor.
+        @param mode: the file mode (type and permissions)
+        @param size: the file size in bytes
+        @param mtimeNs: the modification time in nanoseconds
+        @param inode: the inode number
+        '''
+        self.st_mode = mode
+        self.st_size = size
+        self.st_mtime_ns = mtimeNs
+        self.st_ino = inode
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1E9
+
+    @property
+    def st_dev(self):
+        '''The device is not stored: None.'''
+        return None
+
+class IndexedEntry:
+    '''A directory entry taken from the index instead of from the file system.
+    Offers the part of the os.DirEntry interface used by the walker.
+    '''
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, name, path, statInfo):
+        '''Constructor.
+        @param name: the node (name without path)
+        @param path: the full name
+        @param statInfo: the stored status (IndexedStat)
+        '''
+        self.name = name
+        self.path = path
+        self._stat = statInfo
+
+    def is_dir(self, follow_symlinks = True):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def stat(self, follow_symlinks = True):
+        return self._stat
+
+class StateIndex:
+    '''Stores the state of a target tree after a successful run in a SQLite
+    database, one database per (source, target) pair.
+    If the modification time of a target directory has not moved since
+    the last run its entries are taken from the index: the directory is
+    neither read nor its entries stat'ed.
+    '''
+    # a directory modified this recently may change again within the
+    # time stamp granularity of the file system: it will not be trusted
+    _racyNs = 2 * 1000 * 1000 * 1000
+
+    def __init__(self, home, source, target):
+        '''Constructor.
+        @param home: the directory containing the index files
+        @param source: the source directory
+        @param target: the target directory
+        '''
+        self._target = target
+        key = os.path.abspath(source) + '\0' + os.path.abspath(target)
+        path = home + os.sep + '.redirsync.index'
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._filename = (path + os.sep
+            + hashlib.sha1(key.encode('utf-8')).hexdigest()[0:16] + '.db')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._filename, check_same_thread=False)
+        self._db.executescript('''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS files (dir TEXT, node TEXT, mode INTEGER,
+    size INTEGER, mtime_ns INTEGER, inode INTEGER, PRIMARY KEY (dir, node));
+''')
+        self._db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+            (('source', source), ('target', target)))
+        self._db.commit()
+        self._countHits = 0
+        self._countMisses = 0
+
+    def close(self, success):
+        '''Frees the resources.
+        @param success: True: the changes are stored.<br>
+                False: the changes are discarded
+        '''
+        with self._lock:
+            if success:
+                self._db.commit()
+            else:
+                self._db.rollback()
+            self._db.close()
+
+    def relative(self, trg):
+        '''Returns the path relative to the target root.
+        @param trg: a target directory inside the target root
+        @return: the relative path (with trailing separator)
+        '''
+        return trg[len(self._target):]
+
+    def targets(self, trg):
+        '''Returns the indexed entries of a target directory if they are
+        still valid.
+        @param trg: the target directory (with trailing separator)
+        @return: None: the directory is unknown or has been modified<br>
+                otherwise: a dictionary node -> IndexedEntry
+        '''
+        rc = None
+        relPath = self.relative(trg)
+        with self._lock:
+            row = self._db.execute('SELECT mtime_ns FROM dirs WHERE path=?',
+                (relPath,)).fetchone()
+        if row != None:
+            try:
+                mtimeNs = os.stat(trg).st_mtime_ns
+            except OSError:
+                mtimeNs = None
+            if mtimeNs == row[0]:
+                rc = {}
+                with self._lock:
+                    rows = self._db.execute('SELECT node, mode, size, mtime_ns, '
+                        + 'inode FROM files WHERE dir=?', (relPath,)).fetchall()
+                for node, mode, size, nodeMtime, inode in rows:
+                    rc[node] = IndexedEntry(node, trg + node,
+                        IndexedStat(mode, size, nodeMtime, inode))
+        if rc == None:
+            self._countMisses += 1
+        else:
+            self._countHits += 1
+        return rc
+
+    def record(self, trg, entries):
+        '''Stores the state of a target directory.
+        @param trg: the target directory (with trailing separator)
+        @param entries: a dictionary node -> status info of all entries
+        '''
+        self.begin(trg)
+        self.add(trg, entries)
+        self.finish(trg)
+
+    def begin(self, trg):
+        '''Starts recording a target directory in chunks (see add()):
+        the directory is unknown until finish().
+        @param trg: the target directory (with trailing separator)
+        '''
+        relPath = self.relative(trg)
+        with self._lock:
+            self._db.execute('DELETE FROM dirs WHERE path=?', (relPath,))
+            self._db.execute('DELETE FROM files WHERE dir=?', (relPath,))
+
+    def add(self, trg, entries):
+        '''Stores a chunk of the entries of a target directory.
+        @param trg: the target directory (with trailing separator)
+        @param entries: a dictionary node -> status info
+        '''
+        relPath = self.relative(trg)
+        with self._lock:
+            self._db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                [(relPath, node, info.st_mode, info.st_size,
+                    info.st_mtime_ns, info.st_ino)
+                 for node, info in entries.items()])
+
+    def finish(self, trg):
+        '''Marks a target directory as known: all its entries are stored.
+        @param trg: the target directory (with trailing separator)
+        '''
+        relPath = self.relative(trg)
+        mtimeNs = os.stat(trg).st_mtime_ns
+        with self._lock:
+            if time.time() * 1E9 - mtimeNs < self._racyNs:
+                self._db.execute('DELETE FROM files WHERE dir=?', (relPath,))
+            else:
+                self._db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)',
+                    (relPath, mtimeNs))
+
+    def forget(self, trg):
+        '''Marks a target directory as unknown: it will be read the next time.
+        @param trg: the target directory (with trailing separator)
+        '''
+        with self._lock:
+            self._db.execute('DELETE FROM dirs WHERE path=?',
+                (self.relative(trg),))
+
+    def verify(self):
+        '''Compares the index with the real target tree.
+        @return: a list of messages describing the differences.
+                Empty: the index matches the tree
+        '''
+        rc = []
+        with self._lock:
+            dirs = self._db.execute('SELECT path, mtime_ns FROM dirs').fetchall()
+        for relPath, mtimeNs in dirs:
+            trg = self._target + relPath
+            try:
+                if os.stat(trg).st_mtime_ns != mtimeNs:
+                    # will be read again by the next run: no problem
+                    continue
+                real = {}
+                with os.scandir(trg) as iterator:
+                    for entry in iterator:
+                        real[entry.name] = entry.stat(follow_symlinks=False)
+            except OSError as exc:
+                rc.append(trg + ': ' + str(exc))
+                continue
+            with self._lock:
+                rows = self._db.execute('SELECT node, mode, size, mtime_ns, '
+                    + 'inode FROM files WHERE dir=?', (relPath,)).fetchall()
+            for node, mode, size, nodeMtime, inode in rows:
+                info = real.pop(node, None)
+                if info == None:
+                    rc.append(trg + node + ': missing')
+                elif stat.S_IFMT(info.st_mode) != stat.S_IFMT(mode):
+                    rc.append(trg + node + ': file type differs')
+                elif not stat.S_ISDIR(mode) and (info.st_size != size
+                        or info.st_mtime_ns != nodeMtime or info.st_ino != inode):
+                    rc.append(trg + node + ': modified')
+            for node in real:
+                rc.append(trg + node + ': not indexed')
+        return rc
@@ -0,0 +1,135 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import json, os, os.path, threading, time
+
+class PartialCopy:
+    '''The state of an interrupted copy found in the journal.
+    '''
+    __slots__ = ('_temp', '_bytes', '_size', '_mtimeNs')
+
+    def __init__(self, temp, bytesWritten, size, mtimeNs):
+        '''Constructor.
+        @param temp: the temporary file receiving the data
+        @param bytesWritten: the number of bytes stored in the temporary file
+        @param size: the size of the source file
+        @param mtimeNs: the modification time of the source file
+        '''
+        self._temp = temp
+        self._bytes = bytesWritten
+        self._size = size
+        self._mtimeNs = mtimeNs
+
+class Journal:
+    '''An append-only checkpoint journal of a synchronization run.
+    It records the completed target directories and the progress of large
+    copies. The records are JSON arrays, one per line, and are written in
+    batches. After a successful run the journal is removed.
+    Records:<br>
+    ["D", dir]: all entries of the directory (not its subdirectories) are done<br>
+    ["C", target, temp, bytes, size, mtimeNs]: progress of a copy<br>
+    ["F", target]: a copy is finished
+    '''
+    def __init__(self, filename, resume, batchSize = 1000, interval = 2.0):
+        '''Constructor.
+        @param filename: the journal file
+        @param resume: True: the records of the journal are read and kept.<br>
+                False: the journal is started from scratch
+        @param batchSize: the records are written after this number of records
+        @param interval: ... or after this number of seconds
+        '''
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._done = set()
+        self._copies = {}
+        if resume and os.path.exists(filename):
+            self.load()
+        self._fp = open(filename, 'a' if resume else 'w')
+        self._batchSize = batchSize
+        self._interval = interval
+        self._waiting = []
+        self._lastFlush = time.time()
+
+    def load(self):
+        '''Reads the records of a former run.
+        '''
+        with open(self._filename, 'r') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete
+                    continue
+                kind = record[0]
+                if kind == 'D':
+                    self._done.add(record[1])
+                elif kind == 'C':
+                    self._copies[record[1]] = PartialCopy(record[2], record[3],
+                        record[4], record[5])
+                elif kind == 'F':
+                    self._copies.pop(record[1], None)
+
+    def isDone(self, trg):
+        '''Tests whether a target directory has been completed by a former run.
+        @param trg: the target directory
+        @return: True: the entries of the directory are synchronized
+        '''
+        return trg in self._done
+
+    def partialCopy(self, trg):
+        '''Returns the state of an interrupted copy.
+        @param trg: the target file
+        @return: None: no interrupted copy<br>
+                otherwise: the PartialCopy instance
+        '''
+        return self._copies.get(trg)
+
+    def add(self, record):
+        '''Appends a record. The records are written in batches.
+        @param record: the record (a list)
+        '''
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._waiting.append(line)
+            if (len(self._waiting) >= self._batchSize
+                    or time.time() - self._lastFlush >= self._interval):
+                self.flush()
+
+    def flush(self):
+        '''Writes the waiting records. The caller must hold the lock.
+        '''
+        self._fp.write(''.join(self._waiting))
+        self._fp.flush()
+        self._waiting = []
+        self._lastFlush = time.time()
+
+    def dirDone(self, trg):
+        '''Records that the entries of a target directory are synchronized.
+        @param trg: the target directory
+        '''
+        self.add(['D', trg])
+
+    def copyProgress(self, trg, temp, bytesWritten, srcStat):
+        '''Records the progress of a copy.
+        @param trg: the target file
+        @param temp: the temporary file receiving the data
+        @param bytesWritten: the number of bytes stored in temp
+        @param srcStat: the status of the source
+        '''
+        self.add(['C', trg, temp, bytesWritten, srcStat.st_size,
+            srcStat.st_mtime_ns])
+
+    def copyDone(self, trg):
+        '''Records that a copy is finished.
+        @param trg: the target file
+        '''
+        self.add(['F', trg])
+
+    def close(self, success):
+        '''Frees the resources.
+        @param success: True: the run is complete: the journal is removed
+        '''
+        with self._lock:
+            self.flush()
+            self._fp.close()
+        if success:
+            os.unlink(self._filename)
@@ -0,0 +1,125 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, stat, threading
+
+class LinkTracker:
+    '''Recreates hardlinks on the target instead of copying the data again.
+    Source files with more than one link are identified by (device, inode).
+    Optionally files with identical content (and metadata: the links share
+    one inode) are linked too (deduplication).
+    A target is registered after its copy: a later source path with the same
+    key becomes a hardlink to it.
+    The memory is bounded: at most maxTargets targets are registered, the
+    least recently used are forgotten. A forgotten target is not linked
+    again: a later source with its key is copied.
+    '''
+    def __init__(self, hardLinks = True, hasher = None, dedupMinSize = 4096,
+            maxTargets = 100000):
+        '''Constructor.
+        @param hardLinks: True: hardlinks of the source are recreated
+        @param hasher: None or the FileHasher used for deduplication.<br>
+                None: no deduplication
+        @param dedupMinSize: smaller files are not deduplicated
+        @param maxTargets: the maximal number of registered targets
+        '''
+        self._hardLinks = hardLinks
+        self._hasher = hasher
+        self._dedupMinSize = dedupMinSize
+        self._maxTargets = maxTargets
+        self._lock = threading.Lock()
+        # key -> (target, size, mtimeNs) of the registered target.
+        # Ordered by the last use: the oldest first
+        self._targets = {}
+        self._countForgotten = 0
+        self._countLinked = 0
+        self._countDeduplicated = 0
+        self._bytesSaved = 0
+
+    def keys(self, src, srcStat):
+        '''Returns the keys identifying a source file.
+        @param src: the source file
+        @param srcStat: the status of the source
+        @return: a list of keys (may be empty)
+        '''
+        rc = []
+        if stat.S_ISREG(srcStat.st_mode):
+            if self._hardLinks and srcStat.st_nlink > 1:
+                rc.append(('inode', srcStat.st_dev, srcStat.st_ino))
+            if self._hasher != None and srcStat.st_size >= self._dedupMinSize:
+                rc.append(('content', srcStat.st_size, srcStat.st_mtime_ns,
+                    stat.S_IMODE(srcStat.st_mode), self._hasher.digest(src, srcStat)))
+        return rc
+
+    def link(self, keys, trg, srcStat):
+        '''Creates the target as hardlink to an already registered target.
+        @param keys: the keys of the source (see keys())
+        @param trg: the target file. If it exists it will be replaced
+        @param srcStat: the status of the source
+        @return: True: the link has been created<br>
+                False: the file must be copied
+        '''
+        for key in keys:
+            with self._lock:
+                item = self._targets.pop(key, None)
+                if item != None:
+                    # the most recently used: the last
+                    self._targets[key] = item
+            if item == None:
+                continue
+            other, size, mtimeNs = item
+            try:
+                info = os.lstat(other)
+                if info.st_size != size or info.st_mtime_ns != mtimeNs:
+                    # changed since the registration
+                    continue
+                if os.path.lexists(trg):
+                    os.unlink(trg)
+                os.link(other, trg)
+            except OSError:
+                # e.g. EXDEV or EMLINK: the caller copies
+                continue
+            with self._lock:
+                if key[0] == 'inode':
+                    self._countLinked += 1
+                else:
+                    self._countDeduplicated += 1
+                self._bytesSaved += srcStat.st_size
+            return True
+        return False
+
+    def register(self, keys, trg):
+        '''Stores a copied (or unchanged) target as link destination.
+        @param keys: the keys of the source
+        @param trg: the target file
+        '''
+        if keys:
+            info = os.lstat(trg)
+            with self._lock:
+                for key in keys:
+                    if key not in self._targets:
+                        self.add(key, (trg, info.st_size, info.st_mtime_ns))
+
+    def registerUnchanged(self, srcStat, trg, trgStat):
+        '''Stores an unchanged target of a source file with several links.
+        No content digest is calculated: only the inode key is registered.
+        @param srcStat: the status of the source
+        @param trg: the target file
+        @param trgStat: the status of the target
+        '''
+        if (self._hardLinks and srcStat.st_nlink > 1 
+                and stat.S_ISREG(srcStat.st_mode) and stat.S_ISREG(trgStat.st_mode)):
+            key = ('inode', srcStat.st_dev, srcStat.st_ino)
+            with self._lock:
+                if key not in self._targets:
+                    self.add(key, (trg, trgStat.st_size, trgStat.st_mtime_ns))
+
+    def add(self, key, item):
+        '''Registers a target. If the limit is reached the least recently
+        used target is forgotten. The caller must hold the lock.
+        @param key: the key of the source
+        @param item: the tuple (target, size, mtimeNs)
+        '''
+        self._targets[key] = item
+        while len(self._targets) > self._maxTargets:
+            del self._targets[next(iter(self._targets))]
+            self._countForgotten += 1
@@ -0,0 +1,127 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import heapq, threading
+
+class PhaseStatistics:
+    '''Counters and timers of the phases of a run: listdir, stat, match,
+    compare, copy, delete and rmtree. Each thread accumulates into its own
+    counters (no lock in the hot path), they are summed on demand.
+    The slowest directories and the largest copies are tracked too.
+    '''
+    PHASES = ('listdir', 'stat', 'match', 'compare', 'copy', 'delete', 'rmtree')
+    # the phases not transferring file content
+    METADATA = ('listdir', 'stat', 'match', 'compare', 'delete', 'rmtree')
+
+    def __init__(self, maxItems = 10):
+        '''Constructor.
+        @param maxItems: the number of the slowest directories and the
+                largest copies to keep
+        '''
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # the counters of all threads: phase -> [count, seconds]
+        self._counters = []
+        self._maxItems = maxItems
+        # heaps of (seconds, dir) and (bytes, seconds, file)
+        self._slowestDirs = []
+        self._largestCopies = []
+
+    def counters(self):
+        '''Returns the counters of the current thread.
+        @return: a dictionary phase -> [count, seconds]
+        '''
+        rc = getattr(self._local, 'counters', None)
+        if rc == None:
+            rc = dict((phase, [0, 0.0]) for phase in self.PHASES)
+            self._local.counters = rc
+            with self._lock:
+                self._counters.append(rc)
+        return rc
+
+    def add(self, phase, seconds, count = 1):
+        '''Counts the execution of a phase.
+        @param phase: the name of the phase, e.g. 'stat'
+        @param seconds: the duration of the execution
+        @param count: the number of executed operations
+        '''
+        item = self.counters()[phase]
+        item[0] += count
+        item[1] += seconds
+
+    def keep(self, heap, item):
+        '''Stores an item in a heap holding the largest items only.
+        @param heap: the heap
+        @param item: the item to store
+        '''
+        with self._lock:
+            if len(heap) < self._maxItems:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def dirDone(self, path, seconds):
+        '''Tracks the processing time of a directory (without subdirectories).
+        @param path: the directory
+        @param seconds: the processing time
+        '''
+        if len(self._slowestDirs) < self._maxItems or seconds > self._slowestDirs[0][0]:
+            self.keep(self._slowestDirs, (seconds, path))
+
+    def copyDone(self, path, size, seconds):
+        '''Tracks a copy.
+        @param path: the target file
+        @param size: the number of copied bytes
+        @param seconds: the duration of the copy
+        '''
+        self.add('copy', seconds)
+        if len(self._largestCopies) < self._maxItems or size > self._largestCopies[0][0]:
+            self.keep(self._largestCopies, (size, seconds, path))
+
+    def totals(self):
+        '''Returns the sum of the counters of all threads.
+        @return: a dictionary phase -> (count, seconds)
+        '''
+        rc = dict((phase, [0, 0.0]) for phase in self.PHASES)
+        with self._lock:
+            for counters in self._counters:
+                for phase, (count, seconds) in counters.items():
+                    item = rc[phase]
+                    item[0] += count
+                    item[1] += seconds
+        return dict((phase, tuple(item)) for phase, item in rc.items())
+
+    def metadataSeconds(self):
+        '''Returns the time spent with metadata operations.
+        @return: the sum of the durations of all phases except copy
+        '''
+        totals = self.totals()
+        return sum(totals[phase][1] for phase in self.METADATA)
+
+    def slowestDirs(self):
+        '''Returns the slowest directories.
+        @return: a list of (seconds, dir), the slowest first
+        '''
+        with self._lock:
+            return sorted(self._slowestDirs, reverse=True)
+
+    def largestCopies(self):
+        '''Returns the largest copies.
+        @return: a list of (bytes, seconds, file), the largest first
+        '''
+        with self._lock:
+            return sorted(self._largestCopies, reverse=True)
+
+    def toDict(self):
+        '''Returns the statistics as dictionary (for the JSON representation).
+        @return: a dictionary with the keys phases, slowestDirs and largestCopies
+        '''
+        return {
+            'phases': dict((phase, {'count': count, 'seconds': round(seconds, 6)})
+                for phase, (count, seconds) in self.totals().items()),
+            'slowestDirs': [{'path': path, 'seconds': round(seconds, 6)}
+                for seconds, path in self.slowestDirs()],
+            'largestCopies': [{'path': path, 'bytes': size,
+                'seconds': round(seconds, 6),
+                'mbPerSec': round(size / max(seconds, 1E-9) / 1E6, 3)}
+                for size, seconds, path in self.largestCopies()]
+        }
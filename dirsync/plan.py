@@ -0,0 +1,106 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import json, sys, threading
+
+class Action:
+    '''One step of a change plan: copy, link, delete, mkdir or rmtree.
+    '''
+    __slots__ = ('_op', '_reason', '_src', '_trg', '_size', '_mtime',
+        '_srcStat', '_trgStat', '_statsKnown')
+
+    def __init__(self, op, reason, src, trg, srcStat = None, trgStat = None):
+        '''Constructor.
+        @param op: 'copy', 'link', 'delete', 'mkdir' or 'rmtree'.<br>
+                'link': the target becomes a hardlink to src
+        @param reason: the reason of the action, e.g. '+' for a new file
+        @param src: None or the source file
+        @param trg: the target file or directory
+        @param srcStat: None or the status of the source
+        @param trgStat: None or the status of the target.<br>
+                For 'copy': None means the target does not exist
+        '''
+        self._op = op
+        self._reason = reason
+        self._src = src
+        self._trg = trg
+        info = srcStat if srcStat != None else trgStat
+        self._size = None if info == None else info.st_size
+        self._mtime = None if info == None else info.st_mtime
+        self._srcStat = srcStat
+        self._trgStat = trgStat
+        self._statsKnown = True
+
+    def toDict(self):
+        '''Returns the action as dictionary (for the JSON representation).
+        @return: a dictionary with the keys op, reason, trg and (if known)
+                src, size and mtime
+        '''
+        rc = {'op': self._op, 'reason': self._reason, 'trg': self._trg}
+        if self._src != None:
+            rc['src'] = self._src
+        if self._size != None:
+            rc['size'] = self._size
+            rc['mtime'] = self._mtime
+        return rc
+
+    @staticmethod
+    def fromDict(values):
+        '''Builds an action from its JSON representation.
+        The status infos are unknown: they must be fetched while executing.
+        @param values: a dictionary created by toDict()
+        @return: the action
+        '''
+        rc = Action(values['op'], values.get('reason'), values.get('src'),
+            values['trg'])
+        rc._size = values.get('size')
+        rc._mtime = values.get('mtime')
+        rc._statsKnown = False
+        return rc
+
+class PlanWriter:
+    '''Writes a change plan as JSON lines: one action per line.
+    '''
+    def __init__(self, filename):
+        '''Constructor.
+        @param filename: the file to write. '-': standard output
+        '''
+        self._lock = threading.Lock()
+        if filename == '-':
+            self._fp = sys.stdout
+            self._ownFile = False
+        else:
+            self._fp = open(filename, 'w', buffering=1024 * 1024)
+            self._ownFile = True
+        self._countActions = 0
+
+    def write(self, action):
+        '''Writes one action.
+        @param action: the action to write
+        '''
+        line = json.dumps(action.toDict(), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._fp.write(line)
+            self._countActions += 1
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        if self._ownFile:
+            self._fp.close()
+        else:
+            self._fp.flush()
+
+def readPlan(filename):
+    '''Reads a change plan written by PlanWriter.
+    @param filename: the file to read. '-': standard input
+    @return: an iterator of the actions
+    '''
+    fp = sys.stdin if filename == '-' else open(filename, 'r')
+    try:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield Action.fromDict(json.loads(line))
+    finally:
+        if fp != sys.stdin:
+            fp.close()
@@ -0,0 +1,123 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import threading, queue, sys, time
+
+class WorkerPool:
+    '''Executes tasks in a fixed number of threads.
+    The tasks are stored in a bounded queue. If the queue is full the
+    submitting thread executes the task itself: this slows down the producer
+    and avoids a deadlock when tasks submit further tasks.
+    A blocking pool lets the submitting thread wait instead (backpressure):
+    its tasks must not submit further tasks to the same pool.
+    '''
+    def __init__(self, countWorkers, maxQueued = None, blocking = False,
+            name = 'worker'):
+        '''Constructor.
+        @param countWorkers: the number of worker threads
+        @param maxQueued: None or the maximal number of waiting tasks.<br>
+                None: 4 tasks per worker
+        @param blocking: True: submit() waits while the queue is full<br>
+                False: submit() executes the task itself if the queue is full
+        @param name: the name of the threads (without number)
+        '''
+        if maxQueued == None:
+            maxQueued = 4 * countWorkers
+        self._queue = queue.Queue(maxQueued)
+        self._blocking = blocking
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._excInfo = None
+        self._countWaits = 0
+        self._waitSeconds = 0.0
+        self._threads = []
+        for no in range(countWorkers):
+            thread = threading.Thread(target=self.work,
+                name='redirsync-%s-%d' % (name, no))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, *args):
+        '''Executes a function asynchronously.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            if not self._blocking:
+                self.execute(function, args)
+            else:
+                start = time.time()
+                self._queue.put((function, args))
+                with self._condition:
+                    self._countWaits += 1
+                    self._waitSeconds += time.time() - start
+
+    def trySubmit(self, function, *args):
+        '''Queues a function if the queue has room.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        @return: True: the function will be executed by a worker<br>
+                False: the queue is full, nothing is done
+        '''
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            with self._condition:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._condition.notify_all()
+            return False
+        return True
+
+    def execute(self, function, args):
+        '''Executes a task and marks it as done.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        try:
+            function(*args)
+        except Exception:
+            with self._condition:
+                if self._excInfo == None:
+                    self._excInfo = sys.exc_info()
+        finally:
+            with self._condition:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._condition.notify_all()
+
+    def work(self):
+        '''The main loop of a worker thread.
+        '''
+        while True:
+            task = self._queue.get()
+            if task == None:
+                break
+            self.execute(task[0], task[1])
+
+    def join(self):
+        '''Waits until all submitted tasks (and their subtasks) are done.
+        The first exception raised by a task is raised again.
+        '''
+        with self._condition:
+            while self._pending > 0:
+                self._condition.wait()
+            excInfo = self._excInfo
+            self._excInfo = None
+        if excInfo != None:
+            raise excInfo[1].with_traceback(excInfo[2])
+
+    def close(self):
+        '''Stops the worker threads.
+        '''
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -21,12 +21,27 @@ will be copied from the source to the destination.
 '''
 
 import os.path, shutil, stat, re, fnmatch, logging, time, math, subprocess
+import threading, hashlib, json, glob, copy
 
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 from argparse import ArgumentTypeError
+from argparse import Namespace
 from reutil.util import *
-from reutil.config import Config
+from reutil.config import Config, ConfigCache, ParsedConfigCache
+from dirsync.walker import DirWalker, SpilledList
+from dirsync.pool import WorkerPool
+from dirsync.index import StateIndex, IndexedStat
+from dirsync.hashing import FileHasher
+from dirsync.copier import Copier, pageCacheSize, tempName, parseTempName
+from dirsync.plan import Action, PlanWriter, readPlan
+from dirsync.journal import Journal
+from dirsync.watcher import Watcher
+from dirsync.phases import PhaseStatistics
+from dirsync.errors import ErrorLog
+from dirsync.deleter import TreeDeleter
+from dirsync.links import LinkTracker
+from dirsync.durability import DurabilityTracker
 
 
 __all__ = []
@@ -40,7 +55,11 @@ PROFILE = 0
 
 class SearchCriteria:
     '''Administrates the search criteria for a filename pattern matching.
+    The patterns are compiled into a suffix tuple and one regular expression
+    for the includes and for the excludes. The results are cached per name.
     '''
+    _maxCached = 8192
+
     def __init__(self):
         '''Constructor.
         '''
@@ -50,6 +69,28 @@ class SearchCriteria:
         self._excludeEndsWith = []
         self._excludePatterns = []
         self._wildcardMatcher = re.compile(r'[*?\[\]]')
+        self.compile()
+
+    def compile(self):
+        '''Builds the matchers from the pattern lists and resets the cache.
+        '''
+        self._includeSuffixes = tuple(self._includeEndsWith)
+        self._includeMatcher = self.combine(self._includePatterns)
+        self._excludeSuffixes = tuple(self._excludeEndsWith)
+        self._excludeMatcher = self.combine(self._excludePatterns)
+        self._cache = {}
+
+    def combine(self, patterns):
+        '''Compiles a list of shell patterns into one regular expression.
+        @param patterns: the list of patterns (syntax of fnmatch)
+        @return: None: the list is empty<br>
+                otherwise: the compiled regular expression
+        '''
+        rc = None
+        if len(patterns) > 0:
+            rc = re.compile('|'.join(fnmatch.translate(os.path.normcase(item)) 
+                for item in patterns))
+        return rc
    
     def getSettings(self):
         '''Returns a string containing the current search criteria.
@@ -94,6 +135,7 @@ class SearchCriteria:
                     self._includeEndsWith.append(entry[1:])
                 else:
                     self._includePatterns.append(entry)
+        self.compile()
 
     def matches(self, name):
         '''Tests whether a name matches the search criteria.
@@ -101,32 +143,27 @@ class SearchCriteria:
         @return: True: the name matches the criteria.<br>
                False: otherwise
         '''
-        rc = self._includeAll
-        if not rc:
-            for pattern in self._includeEndsWith:
-                if name.endswith(pattern):
-                    rc = True
-                    break
-            if not rc:
-                for pattern in self._includePatterns:
-                    if fnmatch.fnmatch(name, pattern):
-                        rc = True
-                        break
-        if rc:
-            for pattern in self._excludeEndsWith:
-                if name.endswith(pattern):
-                    rc = False
-                    break
+        rc = self._cache.get(name)
+        if rc == None:
+            rc = (self._includeAll or name.endswith(self._includeSuffixes)
+                or (self._includeMatcher != None 
+                    and self._includeMatcher.match(os.path.normcase(name)) != None))
             if rc:
-                for pattern in self._excludePatterns:
-                    if fnmatch.fnmatch(name, pattern):
-                        rc = False
-                        break
+                rc = not (name.endswith(self._excludeSuffixes)
+                    or (self._excludeMatcher != None 
+                        and self._excludeMatcher.match(os.path.normcase(name)) != None))
+            if len(self._cache) >= self._maxCached:
+                self._cache.clear()
+            self._cache[name] = rc
         return rc
 
 class Settings:
     '''Stores the search criteria for files and subdirs.
     '''
+    # the keys a per directory configuration file may change (see derive())
+    _localKeys = ('copy.mode', 'copy.mode.removed', 'maxDepth', 'verboseLevel')
+    _localPrefixes = ('patterns.',)
+
     def __init__(self):
         self._node = SearchCriteria()
         self._dir = SearchCriteria()
@@ -134,60 +171,256 @@ class Settings:
         self._maxDepth = 99
         self._addNonExisting = False
         self._copyNewer = False
+        # --update: a source is newer only if its mtime is later by more
+        # than this. 0: exact. FAT targets need 2 (SMB and NFS may round too)
+        self._mtimeGranularity = 0.0
         self._copyDifferentSize = False
         self._speed = 'quick'
         self._verboseLevel = 1
         self._showHtml = False
         self._maxFirstErrors = 20
         self._maxLastErrors = 20
+        self._maxLoggedErrors = 10000
+        self._browser = None
+        self._jobs = 1
+        self._minParallelCopySize = 16 * 1024 * 1024
+        self._copyJobs = 0
+        self._copyQueueSize = 256
+        self._deleteJobs = 4
+        self._scanChunkSize = 100000
+        self._useIndex = False
+        self._deltaMinSize = 0
+        self._bufferSize = 1024 * 1024
+        self._sparse = 'auto'
+        self._pageCache = 'keep'
+        self._directMinSize = 0
+        self._preallocateMinSize = 1024 * 1024
+        self._durability = 'none'
+        self._resume = False
+        self._resumableMinSize = 64 * 1024 * 1024
+        self._watchDelay = 2.0
+        self._hardLinks = False
+        self._dedup = False
+        self._dedupMinSize = 4096
+        self._linkDest = None
+        self._parallelSources = 1
+        self._perDevice = 1
              
     def readConfig(self, filename):
         '''Reads the configuration file.
         @param filename: the name of the configuration file
         '''
-        config = Config(filename)
+        self.applyConfig(Config(filename))
+
+    def derive(self, config):
+        '''Returns a copy changed by a per directory configuration file.
+        Only the keys of applyLocalConfig() are taken: the others concern
+        the whole run (jobs, durability, link.dest ...), see ignoredKeys().
+        The settings itself are not changed.
+        @param config: the Config instance to apply
+        @return: the new Settings instance
+        @raise ValueError: an invalid value
+        '''
+        rc = copy.copy(self)
+        rc.applyLocalConfig(config)
+        return rc
+
+    def ignoredKeys(self, config):
+        '''Returns the keys of a configuration not taken by derive().
+        @param config: the Config instance to inspect
+        @return: the list of the keys which concern the whole run only
+        '''
+        return [key for key in config.keys() if key not in self._localKeys
+            and not key.startswith(self._localPrefixes)]
+
+    def applyConfig(self, config):
+        '''Takes the values defined in a configuration.
+        @param config: the Config instance
+        '''
+        self.applyLocalConfig(config)
+        jobs = config.get('jobs')
+        if jobs != None:
+            self._jobs = max(1, int(jobs))
+        count = config.get('log.error.max')
+        if count != None:
+            self._maxLoggedErrors = int(count)
+        jobs = config.get('jobs.copy')
+        if jobs != None:
+            self._copyJobs = max(0, int(jobs))
+        jobs = config.get('jobs.delete')
+        if jobs != None:
+            self._deleteJobs = max(1, int(jobs))
+        size = config.get('scan.chunk.size')
+        if size != None:
+            self._scanChunkSize = max(1, int(size))
+        size = config.get('jobs.copy.queue')
+        if size != None:
+            self._copyQueueSize = max(1, int(size))
+        size = config.get('jobs.copy.min.size')
+        if size != None:
+            self._minParallelCopySize = int(size)
+        size = config.get('copy.delta.min.size')
+        if size != None:
+            self._deltaMinSize = int(size)
+        size = config.get('copy.buffer.size')
+        if size != None:
+            self._bufferSize = int(size)
+        value = config.get('copy.sparse')
+        if value != None:
+            if value not in ('auto', 'zeros', 'off'):
+                raise ValueError('unknown copy.sparse: {} (auto, zeros or off expected)'.format(value))
+            self._sparse = value
+        value = config.get('copy.page.cache')
+        if value != None:
+            if value not in ('keep', 'drop'):
+                raise ValueError('unknown copy.page.cache: {} (keep or drop expected)'.format(value))
+            self._pageCache = value
+        size = config.get('copy.direct.min.size')
+        if size != None:
+            self._directMinSize = int(size)
+        size = config.get('copy.preallocate.min.size')
+        if size != None:
+            self._preallocateMinSize = int(size)
+        value = config.get('durability')
+        if value != None:
+            if value not in DurabilityTracker.MODES:
+                raise ValueError('unknown durability: {} (none, file, dir or fs expected)'.format(value))
+            self._durability = value
+        size = config.get('journal.copy.min.size')
+        if size != None:
+            self._resumableMinSize = int(size)
+        delay = config.get('watch.delay')
+        if delay != None:
+            self._watchDelay = float(delay)
+        granularity = config.get('copy.mtime.granularity')
+        if granularity != None:
+            self._mtimeGranularity = max(0.0, float(granularity))
+        value = config.get('hardlinks')
+        if value != None:
+            self._hardLinks = value == 'true'
+        value = config.get('dedup')
+        if value != None:
+            self._dedup = value == 'true'
+        size = config.get('dedup.min.size')
+        if size != None:
+            self._dedupMinSize = int(size)
+        count = config.get('sources.parallel')
+        if count != None:
+            self._parallelSources = max(1, int(count))
+        count = config.get('sources.per.device')
+        if count != None:
+            self._perDevice = max(1, int(count))
+        value = config.get('link.dest')
+        if value != None:
+            self._linkDest = value
+        useIndex = config.get('index')
+        if useIndex != None:
+            self._useIndex = useIndex == 'true'
+        
+    def applyLocalConfig(self, config):
+        '''Takes the values which may be defined per directory.
+        @param config: the Config instance
+        '''
         mode = config.get('copy.mode')
         if mode:
-            if mode.find('add'):
+            if 'add' in mode:
                 self._addNonExisting = True
-            if mode.find('size'):
+            if 'size' in mode:
                 self._copyDifferentSize = True
-            if mode.find('update'):
+            if 'update' in mode:
                 self._copyNewer = True
-            if mode.find('delete'):
+            if 'delete' in mode:
                 self._deleteFilesWithoutSource = True
         mode = config.get('copy.mode.removed')
         if mode:
-            if mode.find('add'):
+            if 'add' in mode:
                 self._addNonExisting = False
-            if mode.find('size'):
+            if 'size' in mode:
                 self._copyDifferentSize = False
-            if mode.find('update'):
+            if 'update' in mode:
                 self._copyNewer = False
-            if mode.find('delete'):
+            if 'delete' in mode:
                 self._deleteFilesWithoutSource = False
+        patterns = config.get('patterns.node')
+        if patterns:
+            # copy on write: the criteria may be shared with other settings
+            self._node = copy.deepcopy(self._node)
+            self._node.addPatterns(re.split(r',', patterns))
+        patterns = config.get('patterns.dir')
+        if patterns:
+            self._dir = copy.deepcopy(self._dir)
+            self._dir.addPatterns(re.split(r',', patterns))
         maxDepth = config.get('maxDepth')
         if maxDepth != None:
             self._maxDepth = int(maxDepth)
         verbose = config.get('verboseLevel')
         if verbose != None:
             self._verboseLevel = int(verbose)
-        
-        
+
     def getFromOpts(self, opts):
         '''Get the settings from the command line options.
-        @param opts: the command line options
-        '''
-        self._addNonExisting = opts.add
-        self._copyNewer = opts.update
-        self._copyDifferentSize = opts.size
-        self._maxDepth = opts.maxDepth
-        self._deleteFilesWithoutSource = opts.delete
-        self._node.addPatterns(re.split(r',', opts.nodePatterns))
-        self._dir.addPatterns(re.split(r',', opts.dirPatterns))
-        self._speed = opts.speed
-        self._verboseLevel = opts.verbose
-        self._showHtml = opts.report
+        @param opts: the command line options. A missing option (not given
+                on the command line, see main()) does not change the setting
+        '''
+        if 'add' in opts:
+            self._addNonExisting = opts.add
+        if 'update' in opts:
+            self._copyNewer = opts.update
+        if 'mtimeGranularity' in opts:
+            self._mtimeGranularity = max(0.0, opts.mtimeGranularity)
+        if 'size' in opts:
+            self._copyDifferentSize = opts.size
+        if 'maxDepth' in opts:
+            self._maxDepth = opts.maxDepth
+        if 'delete' in opts:
+            self._deleteFilesWithoutSource = opts.delete
+        if 'nodePatterns' in opts:
+            self._node = SearchCriteria()
+            self._node.addPatterns(re.split(r',', opts.nodePatterns))
+        if 'dirPatterns' in opts:
+            self._dir = SearchCriteria()
+            self._dir.addPatterns(re.split(r',', opts.dirPatterns))
+        if 'speed' in opts:
+            self._speed = opts.speed
+        if 'verbose' in opts:
+            self._verboseLevel = opts.verbose
+        if 'report' in opts:
+            self._showHtml = opts.report
+        if 'jobs' in opts:
+            self._jobs = max(1, opts.jobs)
+        if 'copyJobs' in opts:
+            self._copyJobs = max(0, opts.copyJobs)
+        if 'deleteJobs' in opts:
+            self._deleteJobs = max(1, opts.deleteJobs)
+        if 'index' in opts or 'verifyIndex' in opts:
+            self._useIndex = (getattr(opts, 'index', False) 
+                or getattr(opts, 'verifyIndex', False))
+        if 'deltaMinSize' in opts:
+            self._deltaMinSize = opts.deltaMinSize
+        if 'bufferSize' in opts:
+            self._bufferSize = opts.bufferSize
+        if 'sparse' in opts:
+            self._sparse = opts.sparse
+        if 'pageCache' in opts:
+            self._pageCache = opts.pageCache
+        if 'directMinSize' in opts:
+            self._directMinSize = opts.directMinSize
+        if 'durability' in opts:
+            self._durability = opts.durability
+        if 'resume' in opts:
+            self._resume = opts.resume
+        if 'watchDelay' in opts:
+            self._watchDelay = opts.watchDelay
+        if 'hardLinks' in opts:
+            self._hardLinks = opts.hardLinks
+        if 'dedup' in opts:
+            self._dedup = opts.dedup
+        if getattr(opts, 'linkDest', None) != None:
+            self._linkDest = opts.linkDest
+        if 'parallelSources' in opts:
+            self._parallelSources = max(1, opts.parallelSources)
+        if 'perDevice' in opts:
+            self._perDevice = max(1, opts.perDevice)
         
     def getSettings(self):
         opts = ''
@@ -197,7 +430,36 @@ class Settings:
             opts += "--delete"
         if self._copyNewer:
             opts += " --update"
+            if self._mtimeGranularity > 0:
+                opts += " --mtime-granularity=" + str(self._mtimeGranularity)
         opts += "--max-depth=" + str(self._maxDepth)
+        if self._jobs > 1:
+            opts += " --jobs=" + str(self._jobs)
+        if self._copyJobs > 0:
+            opts += " --copy-jobs=" + str(self._copyJobs)
+        if self._deleteJobs != 4:
+            opts += " --delete-jobs=" + str(self._deleteJobs)
+        if self._useIndex:
+            opts += " --index"
+        if self._hardLinks:
+            opts += " --hard-links"
+        if self._dedup:
+            opts += " --dedup"
+        if self._linkDest != None:
+            opts += " --link-dest=" + self._linkDest
+        if self._parallelSources > 1:
+            opts += " --parallel-sources={} --per-device={}".format(
+                self._parallelSources, self._perDevice)
+        if self._deltaMinSize > 0:
+            opts += " --delta-min-size=" + str(self._deltaMinSize)
+        if self._sparse != 'auto':
+            opts += " --sparse=" + self._sparse
+        if self._pageCache != 'keep':
+            opts += " --page-cache=" + self._pageCache
+        if self._directMinSize > 0:
+            opts += " --direct-min-size=" + str(self._directMinSize)
+        if self._durability != 'none':
+            opts += " --durability=" + self._durability
         opts += " --node-patterns=" + self._node.getSettings()
         opts += " --dir-patterns=" + self._dir.getSettings()
         return opts
@@ -211,6 +473,58 @@ class Statistics:
         self._countDirs = 0
         self._countFiles = 0
         self._sizeFiles = 0
+        # the bytes of the files not written because they are holes
+        self._sizeHoles = 0
+
+class SyncPair:
+    '''A source directory with its target directory and the state belonging
+    to the pair: the pairs of a run may be synchronized concurrently.
+    '''
+    def __init__(self, src, trg, linkDest = None):
+        '''Constructor.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param linkDest: None or the counterpart of trg in the previous snapshot
+        '''
+        self._src = src
+        self._trg = trg
+        self._linkDest = linkDest
+        self._index = None
+        self._devices = []
+
+    def overlaps(self, other):
+        '''Tests whether two pairs may touch the same files.
+        @param other: the other pair
+        @return: True: a target lies inside the other target or source
+        '''
+        src, trg = SyncPair.realPath(self._src), SyncPair.realPath(self._trg)
+        otherSrc = SyncPair.realPath(other._src)
+        otherTrg = SyncPair.realPath(other._trg)
+        return (trg.startswith(otherTrg) or otherTrg.startswith(trg)
+            or trg.startswith(otherSrc) or otherTrg.startswith(src))
+
+    @staticmethod
+    def realPath(path):
+        '''Returns the canonical form of a directory for prefix comparisons.
+        @param path: the directory (relative or absolute, may not exist)
+        @return: the absolute path without symbolic links, with a trailing
+                separator: /data/x/ is no prefix of /data/xy/
+        '''
+        rc = os.path.realpath(path)
+        return rc if rc.endswith(os.sep) else rc + os.sep
+
+    def devices(self):
+        '''Returns the devices used by the pair.
+        @return: a sorted list of the st_dev of source and target
+        '''
+        rc = set()
+        for path in (self._src, self._trg):
+            path = os.path.abspath(path)
+            # the target may not exist yet: its nearest existing parent counts
+            while not os.path.exists(path):
+                path = os.path.dirname(path)
+            rc.add(os.stat(path).st_dev)
+        return sorted(rc)
         
 class Sync:
     '''Synchronizes two directory trees in an efficient way.
@@ -221,22 +535,48 @@ class Sync:
         @param opts: options and arguments from the command line
         '''
         self._startTime = time.time()
+        # per thread: the explicit stack of schedule() and the settings of
+        # the current directory
+        self._local = threading.local()
         self._settings = Settings()
-        self._settingStack = []
         self._countTotals = True
         self._localConfig = '.redirsync.conf'
+        self._countLocalConfigs = 0
+        # filename -> the state of a local configuration already reported
+        self._reportedConfigs = {}
         self._total = Statistics()
         self._completed = Statistics()
         self._modified = Statistics()
-        self._writableFile = None
-        self._fpError = None
+        self._linked = Statistics()
+        self._phases = PhaseStatistics()
+        self._walker = DirWalker()
+        self._walker._phases = self._phases
+        self._fnStatsJson = None
+        self._pool = None
+        self._copyPool = None
+        self._lock = threading.Lock()
+        self._hasher = None
+        self._links = None
+        # the previous snapshot of the whole target
+        self._linkDestRoot = None
+        self._pairs = []
+        self._copier = Copier()
+        self._durability = DurabilityTracker()
+        # the size of the page cache at the start and at the end of the run
+        self._cacheBefore = None
+        self._cacheAfter = None
+        self._planWriter = None
+        self._dryRun = False
+        self._journal = None
+        self._countResumedDirs = 0
+        self._dirStat = IndexedStat(stat.S_IFDIR, 0, 0, 0)
+        self._deleter = None
+        self._errorLog = None
         self._fnError = None
+        self._fnErrorJson = None
         self._countErrors = 0
-        self._firstErrors = []
-        self._lastErrors = []
         self._home = None
         self._waitingErrors = []
-        self._browser = None
         if 'REDIRSYNC_HOME' in os.environ:
             self._home = os.environ.get('REDIRSYNC_HOME')
         elif 'HOME' in os.environ:
@@ -249,6 +589,88 @@ class Sync:
         if not os.path.exists(self._home) or not os.path.isdir(self._home):
             self._waitingErrors.append('home directory does not exist: ' 
                 + self._home)
+        # the parsed configuration files, see configCache()
+        self._configCache = ConfigCache()
+        # None or the parsed configuration files surviving the process:
+        # created on demand from the final home directory (parsedConfigs())
+        self._parsedConfigs = None
+
+    @property
+    def _settings(self):
+        '''The settings of the directory processed by the current thread:
+        those of the run or, below a local configuration file, a changed copy.
+        '''
+        rc = getattr(self._local, 'settings', None)
+        return self._runSettings if rc == None else rc
+
+    @_settings.setter
+    def _settings(self, settings):
+        self._runSettings = settings
+
+    def localSettings(self, src, inherited):
+        '''Returns the settings of a directory: the inherited ones, changed
+        by the local configuration file of the directory if it exists.
+        The settings are copied only if such a file exists (copy on write).
+        A file which cannot be read or contains invalid values is reported
+        and ignored.
+        @param src: the source directory (with trailing separator)
+        @param inherited: None (the settings of the run) or the settings of
+                the parent directory
+        @return: None (the settings of the run) or the settings to use
+        '''
+        filename = src + self._localConfig
+        try:
+            config = self.configCache().get(filename)
+        except (OSError, ValueError) as exc:
+            if self.firstReport(filename, str(exc)):
+                self.error('local configuration ignored: ', exc, filename)
+            return inherited
+        if config == None:
+            return inherited
+        settings = self._runSettings if inherited == None else inherited
+        try:
+            rc = settings.derive(config)
+        except ValueError as exc:
+            if self.firstReport(filename, config):
+                self.error('local configuration ignored: ', exc, filename)
+            return inherited
+        if self.firstReport(filename, config):
+            for key in settings.ignoredKeys(config):
+                self.error('{}: {} is valid only in the master configuration'
+                    .format(filename, key))
+        with self._lock:
+            self._countLocalConfigs += 1
+        return rc
+
+    def firstReport(self, filename, reason):
+        '''Tests whether a problem of a local configuration file has not
+        been reported yet: each directory visit would repeat the message.
+        @param filename: the configuration file
+        @param reason: identifies the state of the file, e.g. the Config
+                instance (a changed file gets a new one)
+        @return: True: the problem should be reported
+        '''
+        with self._lock:
+            rc = self._reportedConfigs.get(filename) != reason
+            self._reportedConfigs[filename] = reason
+        return rc
+
+    def inheritedSettings(self, src, trg):
+        '''Returns the settings a directory inherits from the local
+        configuration files of its parents.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @return: None (the settings of the run) or the inherited settings
+        '''
+        rc = None
+        pair = self.pairOf(trg)
+        if pair != None and src.startswith(pair._src) and src != pair._src:
+            path = pair._src
+            rc = self.localSettings(path, rc)
+            for node in src[len(path):].split(os.sep)[0:-2]:
+                path += node + os.sep
+                rc = self.localSettings(path, rc)
+        return rc
 
     def replaceVariables(self, phrase, timepoint = None):
         '''Replaces variables in a string with its values.
@@ -275,6 +697,28 @@ class Sync:
             rc = rc.replace('{time}', "%d" % (timepoint))
         return rc
 
+    def parsedConfigs(self):
+        '''Returns the cache of the parsed configuration files which survives
+        the process. It is created on the first call: the home directory
+        may be changed before.
+        @return: None: the home directory does not exist<br>
+                otherwise: the ParsedConfigCache
+        '''
+        with self._lock:
+            if self._parsedConfigs == None and os.path.isdir(self._home):
+                self._parsedConfigs = ParsedConfigCache(self._home + os.sep 
+                    + '.redirsync.configs.json')
+            return self._parsedConfigs
+
+    def configCache(self):
+        '''Returns the cache of the parsed configuration files (master and
+        per directory), backed by parsedConfigs().
+        @return: the ConfigCache
+        '''
+        if self._configCache._parsed == None:
+            self._configCache._parsed = self.parsedConfigs()
+        return self._configCache
+
     def readMasterConfig(self, config):
         '''Reads the master configuration file.
         @param config: None or the name of the configuration file (with path)
@@ -284,10 +728,15 @@ class Sync:
         if not os.path.exists(config):
             self._waitingErrors.append('Configuration file not found: ' + config)
         else:
-            self._settings.readConfig(config)
-            self._browser = config.get('browser')
-            self._fnError = self.replaceVariables(config.get('log.file.error'))
-            self._fnLog = self.replaceVariables(config.get('log.file'))
+            values = self.configCache().get(config)
+            self._settings.applyConfig(values)
+            self._settings._browser = values.get('browser')
+            self._fnError = values.get('log.file.error')
+            if self._fnError != None:
+                self._fnError = self.replaceVariables(self._fnError)
+            if values.get('log.file.error.json') != None:
+                self._fnErrorJson = self.replaceVariables(
+                    values.get('log.file.error.json'))
 
             if self._fnError == None:
                 self._fnError = Util.getTempFile('redirsync.error.log')
@@ -297,10 +746,15 @@ class Sync:
     def close(self):
         '''Frees the resources.
         '''
-        if self._writableFile != None:
-            os.remove(self._writableFile)
-        if self._fpError != None:
-            self._fpError.close()
+        if self._planWriter != None:
+            self._planWriter.close()
+            self._planWriter = None
+        if self._deleter != None:
+            self._deleter.close()
+        if self._parsedConfigs != None:
+            self._parsedConfigs.save()
+        if self._errorLog != None:
+            self._errorLog.close()
     
     def log(self, msg):
         '''Prints a message to the log media.
@@ -315,25 +769,22 @@ class Sync:
         @param additional:    if the exception message does not contain this
                                 string, it will be issued
         '''
-        msg += "\n"
-        self._countErrors += 1
-        if self._countErrors <= self._settings._maxFirstErrors:
-            self._firstErrors.append(msg)
-        self._lastErrors.append(msg)
-        if len(self._lastErrors) > self._settings._maxLastErrors:
-            self._lastErrors = self._lastErrors [1:]
         if exception != None:
-            if not  msg.endswith(" "):
+            if not msg.endswith(" "):
                 msg += " "
             error = repr(exception)
             msg += error
             if additional != None and error.find(additional) < 0:
                 msg += " [" + additional + ']'
-        sys.stderr.write(msg )
-        if self._fpError == None and self._fnError != None:
-            self._fpError = open(self._fnError, "w")
-        if self._fpError != None:
-            self._fpError.write(msg)
+        msg += "\n"
+        with self._lock:
+            self._countErrors += 1
+            if self._errorLog == None:
+                settings = self._settings
+                self._errorLog = ErrorLog(settings._maxFirstErrors, 
+                    settings._maxLastErrors, settings._maxLoggedErrors, 
+                    self._fnError, self._fnErrorJson)
+            self._errorLog.add(msg, exception, additional)
         
     def addNodePatterns(self, patterns):
         '''Adds a each entry of a list to the include/exclude criteria of the node
@@ -367,41 +818,24 @@ class Sync:
         '''
         self.error('cannot remove: ' + exceptionString(exceptionInfo, path))
     
-    def getWritableFile(self):
-        '''Returns a file which is writable.
-        This file can be used as source for a file attribute copy.
-        @return: the name of a file which is writable
-        '''
-        if self._writableFile == None:
-            self._writableFile = os.tempnam()
-            fp = open(self._writableFile, "w")
-            fp.close()
-        return self._writableFile
-            
+    def deleter(self):
+        '''Returns the engine removing directory trees (created on demand).
+        @return: the TreeDeleter
+        '''
+        with self._lock:
+            if self._deleter == None:
+                onRemove = None
+                if self._settings._verboseLevel > 1:
+                    onRemove = lambda path: self.log('-' + path)
+                self._deleter = TreeDeleter(self._settings._deleteJobs,
+                    self.error, onRemove)
+        return self._deleter
+
     def rmTree(self, path):
         '''Removes a directory with all files and subdirectories.
         @param path: the full name of the directory to delete
         '''
-        if not path.endswith(os.sep):
-            path += os.sep
-        try:  
-            fullName = path      
-            for node in os.listdir(path):
-                fullName = path + node
-                statInfo = os.lstat(fullName)
-                try:
-                    self.makeWritable(fullName, statInfo)
-                    if self._settings._verboseLevel > 1:
-                        self.log('-' + fullName)
-                    if stat.S_ISDIR(statInfo.st_mode):
-                        self.rmTree(fullName + os.sep)
-                    else:
-                        os.unlink(fullName)
-                except Exception as exc:
-                    self.error('cannot remove: ', exc, fullName)
-            os.rmdir(path)
-        except Exception as exc:
-            self.error('cannot remove: ', exc, fullName)
+        self.deleter().removeTree(path)
        
     def makeWritable(self, path, statInfo = None):
         '''Ensures that a file (or subdirectory) is writable.
@@ -412,9 +846,9 @@ class Sync:
         if statInfo == None:
             statInfo = os.lstat(path)
         mode = statInfo.st_mode & (stat.S_IWUSR + stat.S_IWGRP + stat.S_IWOTH)
-        if mode == 0:
+        if mode == 0 and not stat.S_ISLNK(statInfo.st_mode):
             try:
-                shutil.copymode(self.getWritableFile(), path)
+                os.chmod(path, stat.S_IMODE(statInfo.st_mode) | stat.S_IWUSR)
             except Exception as exc:
                 self.error('cannot make writable: ', exc, path)    
     
@@ -431,101 +865,687 @@ class Sync:
         @param fullTrg: the full path of the target file
         @param srcStat: None or the status of the source
         @param srcStat: None or the status of the target
+        @return: True: the file will be copied
         '''
-        copyReason = None
         if srcStat == None:
             srcStat = os.lstat(fullSrc)
             if os.path.exists(fullTrg):
                 trgStat = os.lstat(fullTrg)
+        action = self.fileAction(fullSrc, fullTrg, srcStat, trgStat)
+        if action != None:
+            self.execute(action)
+        return action != None
+
+    def fileAction(self, fullSrc, fullTrg, srcStat, trgStat):
+        '''Decides whether a file must be copied.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @param trgStat: None or the status of the target
+        @return: None: nothing to do<br>
+                otherwise: the copy action
+        '''
+        copyReason = None
         if self._countTotals:
-            self._total._sizeFiles += srcStat.st_size
-            self._total._countFiles += 1
+            with self._lock:
+                self._total._sizeFiles += srcStat.st_size
+                self._total._countFiles += 1
             
         if trgStat == None:
             if self._settings._addNonExisting:
                 copyReason = "+"
+        elif stat.S_ISDIR(trgStat.st_mode):
+            copyReason = '~'
         else:
-            if stat.S_ISDIR(trgStat.st_mode):
-                self.makeWritable(fullTrg, trgStat)
-                self.rmTree(fullTrg)
-                copyReason = '~'
             if not self._settings._copyNewer:
                 copyReason = '*'
-            elif self._settings._copyNewer and srcStat.st_mtime > trgStat.st_mtime:
-                aType = type(srcStat.st_mtime)
-                if (aType == type(float) 
-                      and srcStat.st_mtime - trgStat.st_mtime < 1/(24*3600)):
-                    copyReason = '>'
-            elif self._settings._copyDifferentSize and srcStat.st_size != trgStat.st_size:
+            elif self.isNewer(srcStat, trgStat):
+                copyReason = '>'
+            if (copyReason == None and self._settings._copyDifferentSize 
+                    and srcStat.st_size != trgStat.st_size):
                 copyReason = '!'
-            if copyReason != None:
-                self.makeWritable(fullTrg, trgStat)
-        if copyReason != None:
+            if (copyReason == None and self._settings._speed == 'save'
+                    and srcStat.st_size == trgStat.st_size
+                    and stat.S_ISREG(srcStat.st_mode) 
+                    and stat.S_ISREG(trgStat.st_mode)
+                    and self._hasher.digest(fullSrc, srcStat) 
+                        != self._hasher.digest(fullTrg, trgStat)):
+                copyReason = '#'
+        rc = None
+        if copyReason == '+' and self._linkDestRoot != None:
+            rc = self.linkDestAction(fullSrc, fullTrg, srcStat)
+        if rc == None and copyReason != None:
+            rc = Action('copy', copyReason, fullSrc, fullTrg, srcStat, trgStat)
+        return rc
+
+    def isNewer(self, srcStat, trgStat):
+        '''Tests whether the source is newer than the target (--update).
+        Differences within the time granularity of the target filesystem
+        (--mtime-granularity) do not count: otherwise a target with rounded
+        times would be copied again in each run.
+        @param srcStat: the status of the source
+        @param trgStat: the status of the target
+        @return: True: the source is newer
+        '''
+        granularity = int(self._settings._mtimeGranularity * 1E9)
+        return srcStat.st_mtime_ns - trgStat.st_mtime_ns > granularity
+
+    def linkDestAction(self, fullSrc, fullTrg, srcStat):
+        '''Tests whether a new target can be a hardlink into the previous
+        snapshot (--link-dest): the file must be unchanged there.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the (not existing) target file
+        @param srcStat: the status of the source
+        @return: None: the file must be copied<br>
+                otherwise: the link action
+        '''
+        rc = None
+        pair = self.pairOf(fullTrg)
+        if (stat.S_ISREG(srcStat.st_mode) and pair != None 
+                and pair._linkDest != None):
+            previous = pair._linkDest + fullTrg[len(pair._trg):]
+            try:
+                prevStat = os.lstat(previous)
+            except OSError:
+                prevStat = None
+            if (prevStat != None and stat.S_ISREG(prevStat.st_mode)
+                    and prevStat.st_size == srcStat.st_size
+                    and prevStat.st_mtime_ns == srcStat.st_mtime_ns
+                    and stat.S_IMODE(prevStat.st_mode) == stat.S_IMODE(srcStat.st_mode)
+                    and (self._settings._speed != 'save' 
+                        or self._hasher.digest(fullSrc, srcStat) 
+                            == self._hasher.digest(previous, prevStat))):
+                rc = Action('link', '=', previous, fullTrg, prevStat)
+        return rc
+
+    def execute(self, action):
+        '''Executes an action of the change plan.
+        In dry run mode the action is only written to the plan.
+        @param action: the action to execute
+        '''
+        if self._planWriter != None:
+            self._planWriter.write(action)
+        if self._dryRun:
+            return
+        op = action._op
+        if op == 'copy':
+            self.executeCopy(action)
+        elif op == 'delete' or op == 'rmtree':
+            if self.isParallelDelete(action):
+                self._copyPool.submit(self.executeDelete, action)
+            else:
+                self.executeDelete(action)
+        elif op == 'mkdir':
             if self._settings._verboseLevel > 1:
-                self.log(copyReason + fullTrg)
-            shutil.copy2(fullSrc, fullTrg)
+                self.log('&' + action._trg)
+            # the parents are missing only for the root of a target.
+            # The directory exists if the plan is applied again:
+            created = not os.path.isdir(action._trg)
+            os.makedirs(action._trg, exist_ok=True)
+            if created:
+                self._durability.entryChanged(action._trg)
+        elif op == 'link':
+            self.executeLink(action)
+        else:
+            self.error('unknown action: ' + op)
+
+    def executeLink(self, action):
+        '''Executes a link action: the target becomes a hardlink to the file
+        of the previous snapshot. If that fails the file is copied.
+        @param action: the action to execute
+        '''
+        if self._settings._verboseLevel > 1:
+            self.log('=' + action._trg)
+        prevStat = action._srcStat
+        if not action._statsKnown:
+            prevStat = os.lstat(action._src)
+        try:
+            os.link(action._src, action._trg)
+        except OSError:
+            # e.g. another file system or too many links: copy
+            self.copyFile('+', action._src, action._trg, prevStat)
+        else:
+            self._durability.entryChanged(action._trg)
+            with self._lock:
+                self._linked._countFiles += 1
+                self._linked._sizeFiles += prevStat.st_size
+
+    def executeDelete(self, action):
+        '''Executes a delete or rmtree action.
+        @param action: the action to execute
+        '''
+        start = time.perf_counter()
+        if action._op == 'delete':
+            self.deleteFile(action._trg)
+        else:
+            self.rmTree(action._trg)
+        self._durability.entryChanged(action._trg)
+        self._phases.add(action._op, time.perf_counter() - start)
+
+    def isParallelDelete(self, action):
+        '''Tests whether a delete action is done by a copy worker.
+        Only orphans are deleted asynchronously: a target blocking a new
+        subdirectory must be removed before the subdirectory is created.
+        @param action: the delete or rmtree action
+        @return: True: the action is done asynchronously
+        '''
+        return self._copyPool != None and action._reason == '-'
+
+    def executeCopy(self, action):
+        '''Executes a copy action: prepares the target and copies the file.
+        @param action: the action to execute
+        '''
+        fullSrc = action._src
+        fullTrg = action._trg
+        srcStat = action._srcStat
+        trgStat = action._trgStat
+        if not action._statsKnown:
+            srcStat = os.lstat(fullSrc)
+            trgStat = os.lstat(fullTrg) if os.path.lexists(fullTrg) else None
+        if self.isShared(fullTrg, trgStat):
+            # writing in place (or chmod) would change the other links too,
+            # e.g. the previous snapshot of --link-dest
+            os.unlink(fullTrg)
+            self._durability.entryChanged(fullTrg)
+            trgStat = None
+        if trgStat != None:
+            self.makeWritable(fullTrg, trgStat)
+            if stat.S_ISDIR(trgStat.st_mode):
+                self.rmTree(fullTrg)
+        if self._copyPool != None:
+            self._copyPool.submit(self.copyFile, action._reason, fullSrc, 
+                fullTrg, srcStat, trgStat)
+        elif self.isParallelCopy(srcStat):
+            self._pool.submit(self.copyFile, action._reason, fullSrc, fullTrg, 
+                srcStat, trgStat)
+        else:
+            self.copyFile(action._reason, fullSrc, fullTrg, srcStat, trgStat)
+        
+    def isShared(self, fullTrg, trgStat):
+        '''Tests whether a target file shares its inode with other links.
+        @param fullTrg: the full path of the target file
+        @param trgStat: None or the status of the target
+        @return: True: the target must not be changed in place
+        '''
+        rc = False
+        if trgStat != None and stat.S_ISREG(trgStat.st_mode):
+            # the index does not store the link count
+            links = getattr(trgStat, 'st_nlink', None)
+            if links == None:
+                links = os.lstat(fullTrg).st_nlink
+            rc = links > 1
+        return rc
+
+    def isParallelCopy(self, srcStat):
+        '''Tests whether a file is copied by a worker thread.
+        @param srcStat: the status of the source
+        @return: True: the copy is done asynchronously
+        '''
+        return self._copyPool != None or (self._pool != None 
+            and srcStat.st_size >= self._settings._minParallelCopySize)
+
+    def copyFile(self, copyReason, fullSrc, fullTrg, srcStat, trgStat = None):
+        '''Copies a file and counts it as modified.
+        @param copyReason: the reason of the copy: '+', '*', '>', '!', '#' or '~'
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @param trgStat: None or the status of the target before copying
+        '''
+        if self._settings._verboseLevel > 1:
+            self.log(copyReason + fullTrg)
+        start = time.perf_counter()
+        links = self._links
+        keys = None
+        if links != None and stat.S_ISREG(srcStat.st_mode):
+            keys = links.keys(fullSrc, srcStat)
+        holes = 0
+        if keys and links.link(keys, fullTrg, srcStat):
+            if self._settings._verboseLevel > 1:
+                self.log('=' + fullTrg)
+            self._durability.entryChanged(fullTrg)
+        else:
+            if (self._journal != None and stat.S_ISREG(srcStat.st_mode)
+                    and srcStat.st_size >= self._settings._resumableMinSize
+                    and not self._copier.isDeltaCopy(srcStat, trgStat)):
+                holes = self.copyResumable(fullSrc, fullTrg, srcStat)
+            else:
+                holes = self._copier.copy(fullSrc, fullTrg, srcStat, trgStat)
+                if not stat.S_ISREG(srcStat.st_mode):
+                    self._durability.entryChanged(fullTrg)
+                elif self._copier.isDeltaCopy(srcStat, trgStat):
+                    # written in place
+                    self._durability.fileWritten(fullTrg)
+            self._phases.copyDone(fullTrg, srcStat.st_size, 
+                time.perf_counter() - start)
+            if self._hasher != None and stat.S_ISREG(srcStat.st_mode):
+                self.updateDigest(copyReason, fullSrc, fullTrg, srcStat)
+            if keys:
+                links.register(keys, fullTrg)
+        with self._lock:
             self._modified._sizeFiles += srcStat.st_size
+            self._modified._sizeHoles += holes
             self._modified._countFiles += 1
         
-    def oneDir(self, src, trg, depth):
+    def updateDigest(self, copyReason, fullSrc, fullTrg, srcStat):
+        '''Updates the cached digest of a copied target.
+        After a copy because of different content ('#') the target gets
+        the known digest of the source: the next run does not hash it again.
+        @param copyReason: the reason of the copy
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source before copying
+        '''
+        trgStat = os.lstat(fullTrg)
+        after = os.lstat(fullSrc)
+        if (copyReason == '#' and after.st_size == srcStat.st_size
+                and after.st_mtime_ns == srcStat.st_mtime_ns):
+            self._hasher.store(trgStat, self._hasher.digest(fullSrc, srcStat))
+        else:
+            self._hasher.forget(trgStat)
+
+    def copyResumable(self, fullSrc, fullTrg, srcStat):
+        '''Copies a large file via a temporary file, recording the progress
+        in the journal. An interrupted copy of a former run is continued.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        journal = self._journal
+        temp = tempName(fullTrg, 'part')
+        offset = 0
+        partial = journal.partialCopy(fullTrg)
+        if partial != None and self.isPartOf(partial._temp, fullTrg):
+            # the former run had another process id
+            if (partial._size == srcStat.st_size
+                    and partial._mtimeNs == srcStat.st_mtime_ns
+                    and os.path.exists(partial._temp) 
+                    and os.path.getsize(partial._temp) >= partial._bytes):
+                temp = partial._temp
+                offset = partial._bytes
+                if self._settings._verboseLevel > 1:
+                    self.log('resuming at {}: {}'.format(offset, fullTrg))
+            elif os.path.exists(partial._temp):
+                os.unlink(partial._temp)
+        rc = self._copier.copyRange(fullSrc, temp, offset, 
+            lambda position: journal.copyProgress(fullTrg, temp, position, srcStat))
+        shutil.copystat(fullSrc, temp)
+        self._durability.replace(temp, fullTrg)
+        journal.copyDone(fullTrg)
+        return rc
+
+    def isPartOf(self, temp, fullTrg):
+        '''Tests whether a file is the temporary file of a resumable copy.
+        @param temp: the full path of the file to test
+        @param fullTrg: the full path of the target file
+        @return: True: temp belongs to a (former) resumable copy of fullTrg
+        '''
+        head, node = os.path.split(temp)
+        info = parseTempName(node)
+        return (info != None and info[2] == 'part' 
+            and os.path.join(head, info[0]) == fullTrg)
+
+    def isStaleTemp(self, trg, node):
+        '''Tests whether a target entry is a temporary file left over by an
+        aborted run. The file of an interrupted resumable copy is kept.
+        @param trg: the target directory (with trailing separator)
+        @param node: the name of a temporary file (see tempName())
+        @return: True: the file can be removed
+        '''
+        target, pid, suffix = parseTempName(node)
+        rc = pid != os.getpid()
+        if rc and suffix == 'part' and self._journal != None:
+            partial = self._journal.partialCopy(trg + target)
+            rc = partial == None or partial._temp != trg + node
+        return rc
+
+    def schedule(self, function, *args):
+        '''Executes a function: in a worker thread if --jobs is active and
+        the queue has room, otherwise by the current thread.
+        The current thread uses an explicit stack instead of recursion:
+        deep trees do not reach the recursion limit. The order is the same
+        as with recursion (depth first, the subtasks in scheduling order).
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        if self._pool != None and self._pool.trySubmit(function, *args):
+            return
+        todo = getattr(self._local, 'todo', None)
+        if todo != None:
+            todo.append((function, args))
+            return
+        todo = self._local.todo = [(function, args)]
+        try:
+            while todo:
+                function, args = todo.pop()
+                mark = len(todo)
+                function(*args)
+                todo[mark:] = reversed(todo[mark:])
+        finally:
+            self._local.todo = None
+
+    def oneDir(self, src, trg, depth, recursive = True, settings = None):
         '''Syncronizes one directory.
         @param src: the source directory, e.g. /home/
         @param trg: the target directory e.g. /opt/backup/
         @param depth: the current depth of the source tree
+        @param recursive: False: the subdirectories are not synchronized
+        @param settings: None: the settings of the run<br>
+                otherwise: the settings inherited from the parent directory
         '''
-        if not os.path.exists(trg):
-            if self._settings._verboseLevel > 1:
-                self.log('&' + trg)
-            os.mkdir(trg)
-            
-        files = os.listdir(src)
-        if self._localConfig in files:
-            self.readConfig(src + self._localConfig) 
-        validFiles = []
-        dirs = []
-        if self._countTotals:
-            self._total._countDirs += 1
-        self._modified._countDirs += 1
-        modified = self._modified._countFiles
-        for filename in files:
-            fullSrc = src + filename
-            srcStat = os.lstat(fullSrc)
-            if stat.S_ISDIR(srcStat.st_mode):
-                if self._settings._dir.matches(filename):
-                    dirs.append(filename)
+        pair = self.pairOf(trg)
+        index = None if pair == None else pair._index
+        journal = self._journal
+        if journal != None and journal.isDone(trg):
+            self.resumeDir(src, trg, depth, settings)
+            return
+        countErrors = self._countErrors
+        start = time.perf_counter()
+        listing = self._walker.listing(src, trg, 
+            None if index == None else index.targets(trg))
+        if listing.hasSource(self._localConfig):
+            settings = self.localSettings(src, settings)
+        self._local.settings = settings
+        chunkSize = self._settings._scanChunkSize
+        dirs = SpilledList(chunkSize)
+        try:
+            if index != None and self._dryRun:
+                index = None
+            # target states for the index: node -> status info. Stored in
+            # chunks: the memory does not depend on the size of the directory
+            known = None if index == None else {}
+            copied = []
+            pending = False
+            if index != None:
+                index.begin(trg)
+            try:
+                for action in self.planDir(listing, src, trg, depth, dirs, known):
+                    self.execute(action)
+                    if action._op == 'copy':
+                        if self.isParallelCopy(action._srcStat):
+                            pending = True
+                        else:
+                            copied.append(action._trg)
+                    elif action._op == 'link':
+                        copied.append(action._trg)
+                    elif action._op != 'mkdir' and self.isParallelDelete(action):
+                        pending = True
+                    if (index != None and not pending 
+                            and len(known) + len(copied) >= chunkSize):
+                        self.recordChunk(index, trg, known, copied)
+            finally:
+                listing.close()
+            self._durability.dirDone(trg)
+            if index != None:
+                if pending or countErrors != self._countErrors:
+                    index.forget(trg)
+                else:
+                    self.recordChunk(index, trg, known, copied)
+                    index.finish(trg)
+            if (journal != None and not pending and not self._dryRun
+                    and countErrors == self._countErrors):
+                journal.dirDone(trg)
+            self._phases.dirDone(src, time.perf_counter() - start)
+        finally:
+            self._local.settings = None
+        if recursive:
+            self.scheduleDirs(dirs, src, trg, depth, settings)
+        else:
+            dirs.close()
+
+    def scheduleDirs(self, dirs, src, trg, depth, settings):
+        '''Schedules the synchronization of the subdirectories of a directory.
+        @param dirs: the SpilledList of (node, isDir) of the subdirectories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory (not the subdirectories)
+        @param settings: None or the settings of the directory. The
+                subdirectories share them (no copy)
+        '''
+        if dirs.isSpilled():
+            # one by one: millions of subdirectories do not fill the stack
+            self.schedule(self.scheduleSubdirs, iter(dirs), dirs, src, trg, 
+                depth, settings)
+        else:
+            for subdir, isDir in dirs:
+                self.schedule(self.oneDir, src + subdir + os.sep, 
+                    trg + subdir + os.sep, depth + 1, True, settings)
+
+    def scheduleSubdirs(self, subdirs, dirs, src, trg, depth, settings):
+        '''Schedules the next subdirectory of a huge directory and then
+        itself for the rest: the pending subdirectories stay in the
+        temporary file of the SpilledList instead of the stack or the queue.
+        @param subdirs: the iterator over dirs
+        @param dirs: the SpilledList of (node, isDir) of the subdirectories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory (not the subdirectories)
+        @param settings: None or the settings of the directory
+        '''
+        item = next(subdirs, None)
+        if item == None:
+            dirs.close()
+        else:
+            self.schedule(self.oneDir, src + item[0] + os.sep, 
+                trg + item[0] + os.sep, depth + 1, True, settings)
+            self.schedule(self.scheduleSubdirs, subdirs, dirs, src, trg, 
+                depth, settings)
+
+    def recordChunk(self, index, trg, known, copied):
+        '''Stores the collected target states of a directory in the index.
+        The containers are emptied.
+        @param index: the StateIndex of the target tree
+        @param trg: the target directory (with trailing separator)
+        @param known: IN/OUT: node -> status of the unchanged entries
+        @param copied: IN/OUT: the list of the copied targets (full path)
+        '''
+        for fullTrg in copied:
+            known[fullTrg[len(trg):]] = os.lstat(fullTrg)
+        index.add(trg, known)
+        known.clear()
+        del copied[:]
+
+    def resumeDir(self, src, trg, depth, settings = None):
+        '''Handles a directory completed by an interrupted former run:
+        only the subdirectories are processed.
+        @param src: the source directory
+        @param trg: the target directory
+        @param depth: the current depth of the source tree
+        @param settings: None or the settings inherited from the parent directory
+        '''
+        with self._lock:
+            self._countResumedDirs += 1
+        settings = self.localSettings(src, settings)
+        current = self._runSettings if settings == None else settings
+        if depth <= current._maxDepth:
+            walker = self._walker
+            dirs = SpilledList(current._scanChunkSize)
+            for entry in walker.entries(src):
+                if walker.isDir(entry) and current._dir.matches(entry.name):
+                    dirs.append((entry.name, True))
+            self.scheduleDirs(dirs, src, trg, depth, settings)
+
+    def planDir(self, listing, src, trg, depth, dirs, known = None):
+        '''Decides what has to be done to synchronize one directory.
+        Subdirectories are not processed but returned in dirs.
+        Both sides are processed in one pass: huge directories are merged
+        as sorted streams (see StreamedListing).
+        The memory does not grow with the size of the directory, except for
+        the delayed copies of changed files with several links (--hard-links)
+        and for known: the caller must empty it (see recordChunk()).
+        @param listing: the entries of the source and the target directory
+        @param src: the source directory, e.g. /home/
+        @param trg: the target directory e.g. /opt/backup/
+        @param depth: the current depth of the source tree
+        @param dirs: OUT: the subdirectories to process, a SpilledList of
+                (node, isDir): isDir is None if the target does not exist
+        @param known: None or OUT: node -> status of the target entries
+                which are not changed by the actions
+        @return: an iterator of the actions
+        '''
+        walker = self._walker
+        phases = self._phases
+        settings = self._settings
+        clock = time.perf_counter
+        # the targets of subdirectories are created by their parents
+        if not listing.targetExists() and depth == 0:
+            yield Action('mkdir', '&', None, trg)
+        countFiles = 0
+        sizeFiles = 0
+        modified = False
+        # copies of files with several links: done after the unchanged
+        # links of the directory are registered
+        delayed = []
+        for filename, srcEntry, trgEntry in listing.merged():
+            if parseTempName(filename) != None:
+                # temporary files are never copied or deleted as orphans.
+                # Leftovers of aborted runs are removed:
+                if (trgEntry != None and not walker.isDir(trgEntry)
+                        and self.isStaleTemp(trg, filename)):
+                    yield Action('delete', '-', None, trgEntry.path)
+                continue
+            # True: a target without a (matching) source
+            orphan = False
+            if srcEntry == None:
+                orphan = True
+            elif walker.isDir(srcEntry):
+                start = clock()
+                matches = settings._dir.matches(filename)
+                phases.add('match', clock() - start)
+                if not matches:
+                    orphan = True
+                elif depth <= settings._maxDepth:
+                    dirs.append((filename, 
+                        None if trgEntry == None else walker.isDir(trgEntry)))
+                elif trgEntry != None and known != None:
+                    # too deep: the target stays as it is
+                    known[filename] = (self._dirStat if walker.isDir(trgEntry)
+                        else walker.stat(trgEntry))
             else:
-                self._completed._countFiles += 1
-                self._completed._sizeFiles += srcStat.st_size
-                fullTrg = trg + filename
-                if self._settings._node.matches(filename):
-                    if self._settings._deleteFilesWithoutSource:
-                        validFiles.append(filename) 
-                    trgStat = os.lstat(fullTrg) if os.path.exists(fullTrg) else None
-                    if not stat.S_ISDIR(srcStat.st_mode):
-                        self.oneFile(fullSrc, fullTrg, srcStat, trgStat)
-        self._completed._countDirs += 1               
-        if modified != self._modified._countFiles:
+                srcStat = walker.stat(srcEntry)
+                countFiles += 1
+                sizeFiles += srcStat.st_size
+                start = clock()
+                matches = settings._node.matches(filename)
+                phases.add('match', clock() - start)
+                if not matches:
+                    orphan = True
+                else:
+                    trgStat = None if trgEntry == None else walker.stat(trgEntry)
+                    start = clock()
+                    action = self.fileAction(src + filename, trg + filename, 
+                        srcStat, trgStat)
+                    phases.add('compare', clock() - start)
+                    if action != None:
+                        modified = True
+                        if self._links != None and srcStat.st_nlink > 1:
+                            delayed.append(action)
+                        else:
+                            yield action
+                    elif trgStat != None:
+                        if known != None:
+                            known[filename] = trgStat
+                        if self._links != None:
+                            self._links.registerUnchanged(srcStat, 
+                                trg + filename, trgStat)
+            if orphan and trgEntry != None:
+                if not settings._deleteFilesWithoutSource:
+                    if known != None:
+                        known[filename] = walker.stat(trgEntry)
+                elif walker.isDir(trgEntry):
+                    yield Action('rmtree', '-', None, trgEntry.path)
+                else:
+                    yield Action('delete', '-', None, trgEntry.path)
+        for action in delayed:
+            yield action
+        with self._lock:
+            if self._countTotals:
+                self._total._countDirs += 1
             self._modified._countDirs += 1
-            
-        if self._settings._deleteFilesWithoutSource:
-            trgFiles = os.listdir(trg)
-            for filename in trgFiles:
-                if filename not in validFiles and filename not in dirs:
-                    full = trg + filename
-                    if os.path.isdir(full):
-                        self.rmTree(full)
-                    else:
-                        self.deleteFile(full) 
+            self._completed._countFiles += countFiles
+            self._completed._sizeFiles += sizeFiles
+            self._completed._countDirs += 1               
+            if modified:
+                self._modified._countDirs += 1
                         
-        if depth <= self._settings._maxDepth:
-            for subdir in dirs:
-                fullTrg = fullTrg + subdir
-                if os.path.exists(fullTrg) and not os.path.isdir(fullTrg):
-                    self.deleteFile(fullTrg)
-                self.oneDir(src + subdir + os.sep, trg + subdir + os.sep, 
-                    depth + 1)
-         
+        for subdir, isDir in dirs:
+            if not isDir:
+                if isDir != None:
+                    yield Action('delete', '~', None, trg + subdir)
+                yield Action('mkdir', '&', None, trg + subdir + os.sep)
+            if known != None:
+                known[subdir] = self._dirStat
+
+    def planTree(self, src, trg, depth = 0):
+        '''Decides what has to be done to synchronize a directory tree.
+        Nothing is executed: the target tree is only read.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the current depth of the source tree
+        @return: an iterator of the actions
+        '''
+        # an explicit stack instead of recursion: per directory (src, trg,
+        # depth, settings, dirs, iterator over the subdirectories not done)
+        todo = []
+        current = (src, trg, depth, None)
+        while current != None:
+            src, trg, depth, settings = current
+            dirs = SpilledList(self._settings._scanChunkSize)
+            listing = self._walker.listing(src, trg)
+            if listing.hasSource(self._localConfig):
+                settings = self.localSettings(src, settings)
+            self._local.settings = settings
+            try:
+                for action in self.planDir(listing, src, trg, depth, dirs):
+                    yield action
+            finally:
+                listing.close()
+                self._local.settings = None
+            todo.append((src, trg, depth, settings, dirs, iter(dirs)))
+            current = None
+            while todo and current == None:
+                src, trg, depth, settings, dirs, subdirs = todo[-1]
+                item = next(subdirs, None)
+                if item == None:
+                    todo.pop()
+                    dirs.close()
+                else:
+                    current = (src + item[0] + os.sep, trg + item[0] + os.sep,
+                        depth + 1, settings)
             
+    def startPools(self):
+        '''Starts the worker threads configured by --jobs and --copy-jobs.
+        With copy workers the run is a pipeline: the scanner feeds the copy
+        and delete jobs into a bounded queue and waits if it is full.
+        '''
+        if self._settings._jobs > 1:
+            self._pool = WorkerPool(self._settings._jobs)
+        if self._settings._copyJobs > 0:
+            self._copyPool = WorkerPool(self._settings._copyJobs, 
+                self._settings._copyQueueSize, True, 'copier')
+
+    def joinPools(self):
+        '''Waits until the scanner and then the copy workers are done.
+        '''
+        if self._pool != None:
+            self._pool.join()
+        if self._copyPool != None:
+            self._copyPool.join()
+
+    def stopPools(self):
+        '''Stops the worker threads.
+        '''
+        if self._pool != None:
+            self._pool.close()
+            self._pool = None
+        if self._copyPool != None:
+            self._copyPool.close()
+            if self._settings._verboseLevel > 0:
+                self.log("pipeline: the scanner waited {} times ({:.1f} sec) for the copy workers"
+                    .format(self._copyPool._countWaits, self._copyPool._waitSeconds))
+            self._copyPool = None
+
     def synchronize(self, sources, target, useLastNode):
         '''Synchronizes the directory trees given by the command line opts.
         @param sources: a list of source directories
@@ -533,7 +1553,173 @@ class Sync:
         @param useLastNode: True: the last node of the source will be appended
                         to the target. source=/x/y target=/z copy target: /z/y
         '''
+        pattern = target
         target = self.replaceVariables(target, self._startTime)
+        self._linkDestRoot = self._settings._linkDest
+        if self._linkDestRoot == 'auto':
+            self._linkDestRoot = self.findPreviousSnapshot(pattern, target)
+            if self._settings._verboseLevel > 0:
+                self.log("link-dest: {}".format(self._linkDestRoot or 
+                    'no previous snapshot found'))
+        if self._linkDestRoot != None and not self._linkDestRoot.endswith(os.sep):
+            self._linkDestRoot += os.sep
+        self._cacheBefore = pageCacheSize()
+        self.startPools()
+        if self._settings._speed == 'save' or self._settings._dedup:
+            self._hasher = FileHasher(self._home)
+        if self._settings._hardLinks or self._settings._dedup:
+            self._links = LinkTracker(self._settings._hardLinks, 
+                self._hasher if self._settings._dedup else None, 
+                self._settings._dedupMinSize)
+        self._durability = DurabilityTracker(self._settings._durability, 
+            self.error)
+        self._copier = self.createCopier()
+        self._walker._chunkSize = self._settings._scanChunkSize
+        if not self._dryRun:
+            self._journal = Journal(self.journalName(sources, target), 
+                self._settings._resume)
+        success = False
+        try:
+            self.synchronizeSources(sources, target, useLastNode)
+            # before the journal is closed: the run is complete only if durable
+            self._durability.flush([pair._trg for pair in self._pairs])
+            success = True
+        finally:
+            self.stopPools()
+            self._cacheAfter = pageCacheSize()
+            if self._journal != None:
+                self._journal.close(success)
+                self._journal = None
+                if self._countResumedDirs > 0 and self._settings._verboseLevel > 0:
+                    self.log("resumed: {} directories completed by the former run"
+                        .format(self._countResumedDirs))
+            if self._hasher != None:
+                self._hasher.close()
+                if self._settings._verboseLevel > 0:
+                    self.log("hashed: {} files {} in {:.1f} sec: {:.1f} MB/s ({} from cache)"
+                        .format(self._hasher._countFiles, 
+                            self.formatSize(self._hasher._bytes), 
+                            self._hasher._seconds, 
+                            self._hasher.throughput() / 1E6, 
+                            self._hasher._countCached))
+            if self._settings._verboseLevel > 0:
+                if self._countLocalConfigs > 0:
+                    self.log("local configurations: {} directories ({} files parsed, {} from the cache)"
+                        .format(self._countLocalConfigs, 
+                            self._configCache._countParsed,
+                            self._configCache._countHits))
+                if self._links != None:
+                    self.log("hardlinks: {} recreated, {} deduplicated, {} saved, {} forgotten"
+                        .format(self._links._countLinked, 
+                            self._links._countDeduplicated,
+                            self.formatSize(self._links._bytesSaved),
+                            self._links._countForgotten))
+                if self._linkDestRoot != None:
+                    self.log("link-dest: {} files {} linked to the previous snapshot"
+                        .format(self._linked._countFiles, 
+                            self.formatSize(self._linked._sizeFiles)))
+                if self._deleter != None:
+                    self.log("removed trees: {} files, {} dirs in {:.1f} sec: {:.0f} entries/s"
+                        .format(self._deleter._countFiles, self._deleter._countDirs,
+                            self._deleter._seconds, self._deleter.throughput()))
+                if self._copier._countDelta > 0:
+                    self.log("delta copy: {} files, {} written, {} unchanged"
+                        .format(self._copier._countDelta, 
+                            self.formatSize(self._copier._deltaWritten),
+                            self.formatSize(self._copier._deltaSkipped)))
+                if self._copier._countSparse > 0:
+                    self.log("sparse copy: {} files, {} holes not written"
+                        .format(self._copier._countSparse, 
+                            self.formatSize(self._modified._sizeHoles)))
+                for method, (count, size) in sorted(
+                        self._copier._methodStatistics.items()):
+                    self.log("copied by {}: {} files {}".format(method, count,
+                        self.formatSize(size)))
+                if self._durability._mode != 'none':
+                    self.log("durability {}: {} files, {} directories, {} filesystems synced in {:.1f} sec"
+                        .format(self._durability._mode, 
+                            self._durability._countFiles,
+                            self._durability._countDirs, 
+                            self._durability._countFilesystems,
+                            self._durability._seconds))
+                if self._copier._dropCache or self._copier._countDirect > 0:
+                    self.log("page cache: {} released, {} bypassed (O_DIRECT), {} preallocated files, cached {} -> {}"
+                        .format(self.formatSize(self._copier._releasedBytes),
+                            self.formatSize(self._copier._directBytes),
+                            self._copier._countPreallocated,
+                            self.formatCacheSize(self._cacheBefore),
+                            self.formatCacheSize(self._cacheAfter)))
+                self.log("phases: " + ", ".join("{} {}x {:.3f} sec".format(
+                    phase, count, seconds) for phase, (count, seconds) 
+                    in sorted(self._phases.totals().items()) if count > 0))
+            if self._fnStatsJson != None:
+                self.writeStatsJson(self._fnStatsJson)
+        if self._settings._showHtml:
+            report = self.makeReport()
+            self.showInBrowser(report)
+
+    def createCopier(self):
+        '''Returns the copy engine configured by the settings.
+        @return: the Copier instance
+        '''
+        settings = self._settings
+        return Copier(settings._deltaMinSize, bufferSize=settings._bufferSize, 
+            sparse=settings._sparse, pageCache=settings._pageCache,
+            directMinSize=settings._directMinSize,
+            preallocateMinSize=settings._preallocateMinSize,
+            atomic=self._durability.isAtomic(), 
+            replace=self._durability.replace)
+
+    def journalName(self, sources, target):
+        '''Returns the name of the checkpoint journal of a run.
+        The journal lies next to the error log.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @return: the filename of the journal
+        '''
+        key = '\0'.join([os.path.abspath(target)] 
+            + [os.path.abspath(src) for src in sources])
+        node = 'redirsync.{}.journal'.format(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[0:12])
+        if self._fnError != None:
+            rc = os.path.join(os.path.dirname(os.path.abspath(self._fnError)), node)
+        else:
+            rc = Util.getTempFile(node)
+        return rc
+
+    def findPreviousSnapshot(self, pattern, current):
+        '''Finds the newest snapshot matching a target containing time
+        variables, e.g. /backup/{year}.{month}.{dayOfMonth}.
+        @param pattern: the target with variables
+        @param current: the target of this run (variables replaced)
+        @return: None: no snapshot found<br>
+                otherwise: the most recently modified snapshot except current
+        '''
+        rc = None
+        pattern = pattern.replace('{home}', self._home).rstrip(os.sep)
+        wildcards = re.sub(r'\{(year|month|dayOfMonth|hour|minute|second|dayOfWeek|week|time)\}',
+            '*', glob.escape(pattern))
+        if wildcards != glob.escape(pattern):
+            current = os.path.normpath(os.path.abspath(current))
+            newest = None
+            for candidate in glob.glob(wildcards):
+                if (os.path.normpath(os.path.abspath(candidate)) != current 
+                        and os.path.isdir(candidate)):
+                    mtime = os.stat(candidate).st_mtime
+                    if newest == None or mtime > newest:
+                        newest = mtime
+                        rc = candidate
+        return rc
+
+    def targetPairs(self, sources, target, useLastNode):
+        '''Returns the source directories with their target directories.
+        @param sources: a list of source directories
+        @param target: the name of the target directory (variables replaced)
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @return: a list of tuples (source, target), both with trailing separator
+        '''
+        rc = []
         for src in sources:
             if not src.endswith(os.sep):
                 src += os.sep
@@ -545,12 +1731,280 @@ class Sync:
                 if len(lastNode) == 0:
                     self.error("--use-last-node needs at least one node in source " + src)
                 trg += os.path.basename(lastNode) + os.sep
-            if self._settings._verboseLevel > 0:
-                self.log("=== " + src + " -> " + trg)
-            self.oneDir(src, trg, 0)
-        if self._settings._showHtml:
-            report = self.makeReport()
-            self.showInBrowser(report)
+            rc.append((src, trg))
+        return rc
+
+    def pairOf(self, trg):
+        '''Returns the source/target pair a target belongs to.
+        @param trg: a target file or directory
+        @return: None: not inside a target of the run<br>
+                otherwise: the SyncPair
+        '''
+        for pair in self._pairs:
+            if trg.startswith(pair._trg):
+                return pair
+        return None
+
+    def synchronizeSources(self, sources, target, useLastNode):
+        '''Synchronizes the source directories: one after another or, with
+        --parallel-sources, concurrently if the pairs do not overlap.
+        @param sources: a list of source directories
+        @param target: the name of the target directory (variables replaced)
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        '''
+        root = target if target.endswith(os.sep) else target + os.sep
+        pairs = []
+        for src, trg in self.targetPairs(sources, target, useLastNode):
+            pairs.append(SyncPair(src, trg, None if self._linkDestRoot == None
+                else self._linkDestRoot + trg[len(root):]))
+        # the most specific target first: see pairOf()
+        self._pairs = sorted(pairs, key=lambda pair: -len(pair._trg))
+        if self.isConcurrent(pairs):
+            self.synchronizeConcurrently(pairs)
+        else:
+            for pair in pairs:
+                self.synchronizePair(pair, True)
+
+    def isConcurrent(self, pairs):
+        '''Tests whether the pairs can be synchronized concurrently.
+        @param pairs: the list of SyncPair instances
+        @return: True: concurrency is wanted and the pairs do not overlap
+        '''
+        rc = self._settings._parallelSources > 1 and len(pairs) > 1
+        for ix, pair in enumerate(pairs):
+            for other in pairs[ix + 1:]:
+                if rc and pair.overlaps(other):
+                    rc = False
+                    if self._settings._verboseLevel > 0:
+                        self.log("overlapping targets: {} {}: sequential run"
+                            .format(pair._trg, other._trg))
+        return rc
+
+    def synchronizePair(self, pair, join):
+        '''Synchronizes one source directory with its target.
+        @param pair: the SyncPair to process
+        @param join: True: waits until the worker threads are done
+        '''
+        if self._settings._verboseLevel > 0:
+            self.log("=== " + pair._src + " -> " + pair._trg)
+        if self._dryRun:
+            for action in self.planTree(pair._src, pair._trg):
+                self.execute(action)
+            return
+        if self._settings._useIndex:
+            pair._index = StateIndex(self._home, pair._src, pair._trg)
+        success = False
+        try:
+            self.oneDir(pair._src, pair._trg, 0)
+            if join:
+                self.joinPools()
+            success = True
+        finally:
+            index = pair._index
+            if index != None:
+                if self._settings._verboseLevel > 0:
+                    self.log("index: {} directories from the index, {} read"
+                        .format(index._countHits, index._countMisses))
+                pair._index = None
+                index.close(success)
+
+    def synchronizeConcurrently(self, pairs):
+        '''Synchronizes the pairs in parallel threads. At most 
+        --parallel-sources pairs run at once and at most --per-device pairs
+        use the same device (source or target).
+        Each pair is scanned by its own thread: the --jobs pool is not used
+        for scanning, but the copy workers (--copy-jobs) are shared.
+        A pair takes all its slots at once: a waiting pair holds none, so it
+        cannot block a pair of another device.
+        @param pairs: the list of SyncPair instances (not overlapping)
+        '''
+        for pair in pairs:
+            pair._devices = pair.devices()
+        condition = threading.Condition()
+        # device -> the number of running pairs using it
+        busy = {}
+        running = 0
+        errors = []
+        def startable(pair):
+            return (running < self._settings._parallelSources 
+                and all(busy.get(device, 0) < self._settings._perDevice
+                    for device in pair._devices))
+        def run(pair):
+            nonlocal running
+            with condition:
+                condition.wait_for(lambda: startable(pair))
+                running += 1
+                for device in pair._devices:
+                    busy[device] = busy.get(device, 0) + 1
+            try:
+                self.synchronizePair(pair, False)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                with condition:
+                    running -= 1
+                    for device in pair._devices:
+                        busy[device] -= 1
+                    condition.notify_all()
+        pool = self._pool
+        self._pool = None
+        try:
+            threads = []
+            for pair in pairs:
+                thread = threading.Thread(target=run, args=(pair,),
+                    name='redirsync-source-%d' % len(threads))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            self._pool = pool
+        self.joinPools()
+        if errors:
+            raise errors[0][1].with_traceback(errors[0][2])
+
+    def watch(self, sources, target, useLastNode, rounds = None, timeout = None):
+        '''Synchronizes the trees and then waits for changes of the sources
+        (inotify): only the directories touched by events are synchronized.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @param rounds: None or the number of batches to process (for tests)
+        @param timeout: None or the maximal waiting time for the next event
+        '''
+        watcher = Watcher(self._settings._dir.matches, self._settings._maxDepth)
+        try:
+            # watching starts before the first run: no change gets lost
+            for src, trg in self.targetPairs(sources, 
+                    self.replaceVariables(target, self._startTime), useLastNode):
+                watcher.addTree(src, trg)
+            lastSync = time.time()
+            self.synchronize(sources, target, useLastNode)
+            count = 0
+            while rounds == None or count < rounds:
+                batch = watcher.collect(self._settings._watchDelay, timeout)
+                if batch.isEmpty():
+                    if timeout != None:
+                        break
+                    continue
+                start = time.time()
+                if batch._overflow:
+                    self.error('inotify queue overflow: rescanning changed directories')
+                    for src, item in watcher.changedSince(lastSync)._dirs.items():
+                        batch.add(src, item[0], item[1], item[2])
+                if self._settings._verboseLevel > 0:
+                    self.log("watch: {} events, {} directories".format(
+                        batch._countEvents, len(batch._dirs)))
+                self.syncBatch(batch)
+                lastSync = start
+                count += 1
+        finally:
+            watcher.close()
+
+    def syncBatch(self, batch):
+        '''Synchronizes the directories collected by the watcher.
+        The changes of the batch are durable when the method returns.
+        @param batch: the Batch instance to process
+        '''
+        # parents first: they create the targets of new subdirectories
+        roots = set()
+        for src in sorted(batch._dirs):
+            trg, depth, recursive = batch._dirs[src]
+            if os.path.isdir(src):
+                try:
+                    self.oneDir(src, trg, depth, recursive, 
+                        self.inheritedSettings(src, trg))
+                except OSError as exc:
+                    self.error('synchronization failed: ', exc, src)
+            roots.update(pair._trg for pair in self._pairs 
+                if trg.startswith(pair._trg))
+        self._durability.flush(sorted(roots))
+
+    def applyPlan(self, filename):
+        '''Executes the actions of a change plan written by --dry-run.
+        @param filename: the file containing the plan. '-': standard input
+        '''
+        self._durability = DurabilityTracker(self._settings._durability, 
+            self.error)
+        self.startPools()
+        self._copier = self.createCopier()
+        roots = set()
+        try:
+            for action in readPlan(filename):
+                self.execute(action)
+                roots.add(os.path.dirname(action._trg.rstrip(os.sep)))
+            self.joinPools()
+            self._durability.flush(sorted(roots))
+        finally:
+            self.stopPools()
+
+    def verifyIndexes(self, sources, target, useLastNode):
+        '''Compares the state indexes with the real target trees.
+        Each difference is reported as error.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @return: the number of differences
+        '''
+        rc = 0
+        target = self.replaceVariables(target, self._startTime)
+        for src, trg in self.targetPairs(sources, target, useLastNode):
+            index = StateIndex(self._home, src, trg)
+            for msg in index.verify():
+                self.error('index differs: ' + msg)
+                rc += 1
+            index.close(True)
+        return rc
+
+    def writeStatsJson(self, filename):
+        '''Writes the statistics of the run as JSON.
+        @param filename: the file to write
+        '''
+        def counts(statistics):
+            return {'dirs': statistics._countDirs, 'files': statistics._countFiles,
+                'bytes': statistics._sizeFiles}
+        document = self._phases.toDict()
+        document.update({
+            'start': self._startTime,
+            'seconds': round(time.time() - self._startTime, 3),
+            'total': counts(self._total),
+            'modified': counts(self._modified),
+            'holeBytes': self._modified._sizeHoles,
+            'metadataSeconds': round(self._phases.metadataSeconds(), 6),
+            'copyMethods': dict((method, {'files': count, 'bytes': size})
+                for method, (count, size) in self._copier._methodStatistics.items()),
+            'errors': self._countErrors
+        })
+        if self._linkDestRoot != None:
+            document['linkDest'] = {'previous': self._linkDestRoot,
+                'files': self._linked._countFiles, 'bytes': self._linked._sizeFiles}
+        if self._deleter != None:
+            document['removedTrees'] = {'files': self._deleter._countFiles,
+                'dirs': self._deleter._countDirs, 
+                'seconds': round(self._deleter._seconds, 6),
+                'entriesPerSec': round(self._deleter.throughput(), 1)}
+        if self._copier._dropCache or self._copier._countDirect > 0:
+            document['pageCache'] = {'releasedBytes': self._copier._releasedBytes,
+                'directFiles': self._copier._countDirect,
+                'directBytes': self._copier._directBytes,
+                'preallocatedFiles': self._copier._countPreallocated,
+                'cachedBefore': self._cacheBefore, 'cachedAfter': self._cacheAfter}
+        if self._durability._mode != 'none':
+            document['durability'] = {'mode': self._durability._mode,
+                'files': self._durability._countFiles,
+                'dirs': self._durability._countDirs,
+                'filesystems': self._durability._countFilesystems,
+                'seconds': round(self._durability._seconds, 6)}
+        if self._links != None:
+            document['links'] = {'linked': self._links._countLinked,
+                'deduplicated': self._links._countDeduplicated,
+                'bytesSaved': self._links._bytesSaved}
+        with open(filename, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+            fp.write('\n')
 
     def formatSize(self, bytes):
         '''Formats a size value in a human readable form.
@@ -566,6 +2020,13 @@ class Sync:
         else:
             rc = "%.3f GByte" % (bytes / 1000.0 / 1000.0 / 1000.0)
         return rc
+
+    def formatCacheSize(self, bytes):
+        '''Formats a size of the page cache.
+        @param bytes: None (unknown) or the size in bytes
+        @return: the formated string
+        '''
+        return '?' if bytes == None else self.formatSize(bytes)
     
     def makeReport(self):
         '''Builds a report in HTML and write it to a file.
@@ -584,19 +2045,102 @@ class Sync:
                 int (durationInt / 3600), int(durationInt / 3600) % 60, durationInt % 60)
             
         errors = ''
-        if self._countErrors > 0:
+        errorLog = self._errorLog
+        if errorLog != None:
+            errorLog.flush()
             errors = """
 <h2>Es sind leider Fehler aufgetreten</h2>
 <p>Anzahl Fehler: {}
 <p><a href="file://{}">Vollst&auml;ndiges Fehlerprotokoll</a></p>
-<pre>
-""".format(self._countErrors, self._fnError) + "".join(self._firstErrors)
-                
-            omitted = self._countErrors - (self._settings._maxFirstErrors 
-                + self._settings._maxLastErrors)
+<table border="0">
+<tr><td>Fehlerart</td><td>Anzahl</td></tr>
+""".format(self._countErrors, self._fnError)
+            for kind, count in errorLog.topKinds():
+                errors += '<tr><td>{}</td><td>{}</td></tr>\n'.format(kind, count)
+            errors += '</table>\n'
+            if len(errorLog._dirs) > 0:
+                errors += '<table border="0">\n<tr><td>Verzeichnis</td><td>Fehler</td></tr>\n'
+                for path, count in errorLog.topDirs():
+                    errors += '<tr><td>{}</td><td>{}</td></tr>\n'.format(path, count)
+                errors += '</table>\n'
+            errors += '<pre>\n' + "".join(errorLog._first)
+            omitted = errorLog.omitted()
             if omitted > 0:
                 errors += "... ({} Fehler ausgelassen)\n".format(omitted)
-            errors += "".join(self._lastErrors) + "</pre>\n"
+            errors += "".join(errorLog._last) + "</pre>\n"
+        details = ''
+        if self._copier._countDelta > 0:
+            details = '''<p>Delta-Kopie: {} Dateien, {} geschrieben, {} unver&auml;ndert</p>
+'''.format(self._copier._countDelta, self.formatSize(self._copier._deltaWritten),
+                self.formatSize(self._copier._deltaSkipped))
+        if self._copier._countSparse > 0:
+            details += '''<p>Sparse-Dateien: {} Dateien, {} L&ouml;cher nicht geschrieben</p>
+'''.format(self._copier._countSparse, self.formatSize(self._modified._sizeHoles))
+        if len(self._copier._methodStatistics) > 0:
+            details += '<table border="0">\n<tr><td>Kopiermethode</td><td>Dateien</td><td>MByte</td></tr>\n'
+            for method, (count, size) in sorted(
+                    self._copier._methodStatistics.items()):
+                details += '<tr><td>{}</td><td>{}</td><td>{}</td></tr>\n'.format(
+                    method, count, self.formatSize(size))
+            details += '</table>\n'
+        if self._durability._mode != 'none':
+            details += '''<p>Dauerhaftigkeit ({}): {} Dateien, {} Verzeichnisse,
+{} Dateisysteme synchronisiert in {:.1f} sec</p>
+'''.format(self._durability._mode, self._durability._countFiles,
+                self._durability._countDirs, self._durability._countFilesystems,
+                self._durability._seconds)
+        if self._copier._dropCache or self._copier._countDirect > 0:
+            details += '''<p>Page-Cache: {} freigegeben, {} direkt geschrieben (O_DIRECT),
+{} Dateien vorab belegt<br/>
+Cache vorher: {}, nachher: {}</p>
+'''.format(self.formatSize(self._copier._releasedBytes), 
+                self.formatSize(self._copier._directBytes),
+                self._copier._countPreallocated,
+                self.formatCacheSize(self._cacheBefore),
+                self.formatCacheSize(self._cacheAfter))
+        if self._linkDestRoot != None:
+            details += '''<p>Vorheriger Snapshot: {}<br/>
+Verlinkt: {} Dateien, {}</p>
+'''.format(self._linkDestRoot, self._linked._countFiles, 
+                self.formatSize(self._linked._sizeFiles))
+        if self._links != None:
+            details += '''<p>Hardlinks: {} wiederhergestellt, {} dedupliziert, {} gespart</p>
+'''.format(self._links._countLinked, self._links._countDeduplicated,
+                self.formatSize(self._links._bytesSaved))
+        if self._deleter != None:
+            details += '''<p>Gel&ouml;schte Verzeichnisb&auml;ume: {} Dateien, {} Verzeichnisse
+in {:.1f} sec: {:.0f} Eintr&auml;ge/s</p>
+'''.format(self._deleter._countFiles, self._deleter._countDirs,
+                self._deleter._seconds, self._deleter.throughput())
+        if self._hasher != None:
+            details += '''<p>Pr&uuml;fsummen: {} Dateien, {} in {:.1f} sec: {:.1f} MByte/s
+({} aus dem Cache)</p>
+'''.format(self._hasher._countFiles, self.formatSize(self._hasher._bytes),
+                self._hasher._seconds, self._hasher.throughput() / 1E6,
+                self._hasher._countCached)
+        totals = self._phases.totals()
+        details += '''<p>Metadaten: {:.3f} sec, Kopieren: {:.3f} sec</p>
+<table border="0">
+<tr><td>Phase</td><td>Anzahl</td><td>Sekunden</td></tr>
+'''.format(self._phases.metadataSeconds(), totals['copy'][1])
+        for phase in PhaseStatistics.PHASES:
+            details += '<tr><td>{}</td><td>{}</td><td>{:.3f}</td></tr>\n'.format(
+                phase, totals[phase][0], totals[phase][1])
+        details += '</table>\n'
+        slowest = self._phases.slowestDirs()
+        if len(slowest) > 0:
+            details += '<h2>Langsamste Verzeichnisse</h2>\n<table border="0">\n'
+            for seconds, path in slowest:
+                details += '<tr><td>{:.3f} sec</td><td>{}</td></tr>\n'.format(
+                    seconds, path)
+            details += '</table>\n'
+        largest = self._phases.largestCopies()
+        if len(largest) > 0:
+            details += '<h2>Gr&ouml;&szlig;te Kopien</h2>\n<table border="0">\n'
+            for size, seconds, path in largest:
+                details += '<tr><td>{}</td><td>{:.3f} sec</td><td>{}</td></tr>\n'.format(
+                    self.formatSize(size), seconds, path)
+            details += '</table>\n'
         msg = '''<html>
 <head>
 <title>Datensicherung Report</title>
@@ -626,7 +2170,7 @@ Dauer: {duration}</p>
     <td>{r_size}:1</td>
 </tr>
 </table>
-{errors}
+{details}{errors}
 </body>
 </html>
         '''.format(
@@ -642,6 +2186,7 @@ Dauer: {duration}</p>
             r_files=self._total._countFiles / max(1, self._modified._countFiles),
             r_size=self._total._sizeFiles / max(1, self._modified._sizeFiles),
             rate=self._modified._sizeFiles / max(1,durationInt),
+            details=details,
             errors=errors)
         fp.write(msg)
         fp.close()
@@ -711,30 +2256,82 @@ USAGE
         parser.add_argument("-a", "--add", dest="add", action="store_true", help="add new files (only exist on the source")
         parser.add_argument("-c", "--config", dest="config", type=isFile, help="configuration file. [default: {}]".format(defaultConfig) )
         parser.add_argument("--delete", dest="delete", action="store_true", help="files on the target which are not exist on the source will be deleted")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, help="number of worker threads for subdirectories and large files. [default: %(default)s]")
+        parser.add_argument("--buffer-size", dest="bufferSize", type=int, default=1024*1024, help="buffer size (in bytes) if the kernel cannot copy itself. [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--apply-plan", dest="applyPlan", help="executes the change plan written by --dry-run. '-': standard input. Source and target are not needed", metavar="FILE")
+        parser.add_argument("--sparse", dest="sparse", default="auto", choices=['auto', 'zeros', 'off'], help="'auto': the holes of sparse files are not copied but recreated. 'zeros': blocks of zeros are not written either (filesystems without hole information). 'off': all bytes are copied [default: %(default)s]")
+        parser.add_argument("--page-cache", dest="pageCache", default="keep", choices=['keep', 'drop'], help="'drop': the copied data is released from the page cache while copying: the cache of other programs survives the run [default: %(default)s]")
+        parser.add_argument("--direct-min-size", dest="directMinSize", type=int, default=0, help="files with at least this size (in bytes) are copied with O_DIRECT, bypassing the page cache. 0: never [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--durability", dest="durability", default="none", choices=['none', 'file', 'dir', 'fs'], help="'none': nothing is synced. Otherwise the files are copied via temporary files renamed into place (an aborted run leaves no half written target) and synced: 'file': each file before its rename (a renamed target survives a power loss). 'dir': the files and entries of a directory as one batch when the directory is done (a power loss before may leave files of that directory incomplete). 'fs': one syncfs() per target filesystem at the end (durable only after the run) [default: %(default)s]")
+        parser.add_argument("--delta-min-size", dest="deltaMinSize", type=int, default=0, help="existing target files with at least this size (in bytes) are updated in place: only changed blocks are written. 0: never [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--error-json", dest="errorJson", help="the errors are written to this file as JSON lines", metavar="FILE")
+        parser.add_argument("--stats-json", dest="statsJson", help="the statistics of the run (phase timings, slowest directories, largest copies) are written to this file as JSON", metavar="FILE")
+        parser.add_argument("-n", "--dry-run", dest="dryRun", action="store_true", help="writes the change plan (JSON lines) but changes nothing")
+        parser.add_argument("--copy-jobs", dest="copyJobs", type=int, default=0, help="copies and deletions are done by this many threads fed by the scanner through a bounded queue. 0: the scanner copies itself [default: %(default)s]", metavar="N")
+        parser.add_argument("--delete-jobs", dest="deleteJobs", type=int, default=4, help="directory trees are removed by this many threads (subtrees in parallel) [default: %(default)s]", metavar="N")
+        parser.add_argument("-H", "--hard-links", dest="hardLinks", action="store_true", help="files with several links in the source are linked in the target too instead of being copied again")
+        parser.add_argument("--dedup", dest="dedup", action="store_true", help="new files with the same content and metadata as an already copied file become hardlinks to it. The last 100000 copied files are remembered")
+        parser.add_argument("--link-dest", dest="linkDest", help="snapshot mode: new files unchanged in this previous snapshot are hardlinked to it. 'auto': the newest existing directory matching the target pattern (e.g. /backup/{year}.{month}.{dayOfMonth})", metavar="PREVIOUS")
+        parser.add_argument("--parallel-sources", dest="parallelSources", type=int, default=1, help="at most N sources (with their own targets) are synchronized concurrently if the targets do not overlap [default: %(default)s]", metavar="N")
+        parser.add_argument("--per-device", dest="perDevice", type=int, default=1, help="at most N concurrent sources use the same device (source or target) [default: %(default)s]", metavar="N")
+        parser.add_argument("--index", dest="index", action="store_true", help="stores the state of the target in REDIRSYNC_HOME: unchanged target directories will not be read again")
+        parser.add_argument("--verify-index", dest="verifyIndex", action="store_true", help="compares the state index with the target tree instead of synchronizing")
         parser.add_argument("-l", "--log-file", dest="logfile", default=defaultLog, help="log file. [default: %(default)s]")
         parser.add_argument("-m", "--max-depth", dest="maxDepth", type=int, default=100, help="maximal depth of the directory tree.  [default: %(default)s]" )
+        parser.add_argument("--plan-file", dest="planFile", help="the change plan is written to this file. '-': standard output. [default: standard output with --dry-run]", metavar="FILE")
         parser.add_argument("-p", "--node-patterns", dest="nodePatterns", default="*,-*.bak,-*~", help="only files matching this patterns will be copied. Separator: ',' [default: %(default)s]", metavar="RE")
         parser.add_argument("-P", "--dir-patterns", dest="dirPatterns", default="*,cache,-temp,-tmp", help="only files matching this patterns will be copied. Separator: ',' [default: %(default)s]", metavar="RE")
         parser.add_argument("-r", "--report", dest="report", action="store_true", help="displays a report in a browser. [default: %(default)s]")
+        parser.add_argument("--resume", dest="resume", action="store_true", help="continues an interrupted run: completed directories and partial copies of large files are taken from the checkpoint journal")
         parser.add_argument("-s", "--size", dest="size", action="store_true", help="copy if the size of source and target is different. [default: %(default)s]")
-        parser.add_argument("-S", "--speed", dest="speed", default="quick", help="'quick' or 'save'. [default: %(default)s]")
-        parser.add_argument("-u", "--update", dest="update", action="store_true", help="if a file exists on the destination and it is newer it will be copied")
+        parser.add_argument("-S", "--speed", dest="speed", default="quick", choices=['quick', 'save'], help="'quick': compare size and time. 'save': compare the content of equal sized files by a hash. [default: %(default)s]")
+        parser.add_argument("-u", "--update", dest="update", action="store_true", help="if a file exists on the destination and the source is newer it will be copied (see --mtime-granularity)")
+        parser.add_argument("--mtime-granularity", dest="mtimeGranularity", type=float, default=0.0, help="--update: the source is newer only if its modification time is later by more than this. 0: exact (nanoseconds). 2: targets on FAT, whose times are rounded [default: %(default)s]", metavar="SECONDS")
         parser.add_argument("--use-last-node", dest="useLastNode", action="store_true", help="the last node of the source will added to the target.  [default: %(default)s]")
-        parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="set verbosity level [default: %(default)s]")
+        parser.add_argument("-w", "--watch", dest="watch", action="store_true", help="after the synchronization the sources are watched (inotify): changes are synchronized within seconds")
+        parser.add_argument("--watch-delay", dest="watchDelay", type=float, default=2.0, help="the changes are synchronized when the sources are quiet for this many seconds. [default: %(default)s]", metavar="SECONDS")
+        parser.add_argument("-v", "--verbose", dest="verbose", action="count", default=0, help="set verbosity level [default: %(default)s]")
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
-        parser.add_argument(dest="source", type=isDirectory, help="source directory", metavar="source", nargs='+')
-        parser.add_argument(dest="target", type=isDirectory, help="target directory", metavar="target")
+        parser.add_argument(dest="source", type=isDirectory, help="source directory", metavar="source", nargs='*')
+        parser.add_argument(dest="target", type=isDirectory, help="target directory", metavar="target", nargs='?')
         
         # Process arguments
         args = parser.parse_args(argv)
-        
-        if ("config" not in args and os.path.isfile(defaultConfig) ):
-            args.append["config"] = defaultConfig
+        if args.target == None and len(args.source) > 1:
+            args.target = args.source.pop()
+        if args.applyPlan == None and (len(args.source) == 0 or args.target == None):
+            parser.error("source and target are required")
         
         sync = Sync()
         sync._settings.getFromOpts(args)
-        if sync._settings._showHtml and (not hasattr(sync._browser, '_browser')
-                or sync._browser == None):
+        config = args.config
+        if config == None:
+            for name in (sync._home + os.sep + '.redirsync.conf', 
+                    os.path.expanduser(defaultConfig)):
+                if os.path.isfile(name):
+                    config = name
+                    break
+        if config != None:
+            # the configuration replaces the defaults of the options...
+            sync.readMasterConfig(config)
+            # ...but not the options given on the command line (an option
+            # with its default value counts as not given)
+            sync._settings.getFromOpts(Namespace(**dict((dest, value) 
+                for dest, value in vars(args).items() 
+                if value != parser.get_default(dest))))
+        sync._dryRun = args.dryRun
+        sync._fnStatsJson = args.statsJson
+        if args.errorJson != None:
+            sync._fnErrorJson = args.errorJson
+        if args.planFile == None and args.dryRun:
+            args.planFile = '-'
+        if args.planFile == '-':
+            # the standard output belongs to the plan
+            sync._settings._verboseLevel = 0
+            args.verbose = 0
+        if args.planFile != None:
+            sync._planWriter = PlanWriter(args.planFile)
+        if sync._settings._showHtml and sync._settings._browser == None:
             sync.error('No browser defined. I cannot execute --report')
             exit(2)
         
@@ -751,7 +2348,18 @@ USAGE
                 opts += " --use-last-node"
             say("opts: " + opts + ' ' + sync._settings.getSettings())
         
-        sync.synchronize(args.source, args.target, args.useLastNode)
+        if args.applyPlan != None:
+            sync.applyPlan(args.applyPlan)
+            sync.close()
+            return 0
+        if args.verifyIndex:
+            rc = sync.verifyIndexes(args.source, args.target, args.useLastNode)
+            sync.close()
+            return 0 if rc == 0 else 1
+        if args.watch:
+            sync.watch(args.source, args.target, args.useLastNode)
+        else:
+            sync.synchronize(args.source, args.target, args.useLastNode)
         sync.close()
 
            
@@ -0,0 +1,474 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import heapq, marshal, os, tempfile, time
+
+class EntryStat:
+    '''The part of a file status used by the synchronization.
+    Much smaller than os.stat_result: huge directories stay affordable.
+    '''
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns', 'st_ctime_ns', 'st_ino',
+        'st_dev', 'st_nlink', 'st_blocks')
+
+    def __init__(self, info):
+        '''Constructor.
+        @param info: the status info (os.stat_result)
+        '''
+        self.st_mode = info.st_mode
+        self.st_size = info.st_size
+        self.st_mtime_ns = info.st_mtime_ns
+        # validates the digest cache (see FileHasher)
+        self.st_ctime_ns = info.st_ctime_ns
+        self.st_ino = info.st_ino
+        self.st_dev = info.st_dev
+        self.st_nlink = info.st_nlink
+        # None on Windows: sparse files are not recognized
+        self.st_blocks = getattr(info, 'st_blocks', None)
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1E9
+
+class FileEntry:
+    '''A compact directory entry: the name, the file type from the directory
+    read and the status fetched on demand (without following links).
+    Offers the part of the os.DirEntry interface used by the walker.
+    '''
+    __slots__ = ('name', '_parent', '_isDir', '_stat')
+
+    def __init__(self, name, parent, isDir):
+        '''Constructor.
+        @param name: the node (name without path)
+        @param parent: the directory (with trailing separator)
+        @param isDir: True: the entry is a directory (not a link to it)
+        '''
+        self.name = name
+        self._parent = parent
+        self._isDir = isDir
+        self._stat = None
+
+    @property
+    def path(self):
+        return self._parent + self.name
+
+    def is_dir(self, follow_symlinks = True):
+        return self._isDir
+
+    def stat(self, follow_symlinks = True):
+        if self._stat == None:
+            self._stat = EntryStat(os.lstat(self._parent + self.name))
+        return self._stat
+
+class DirListing:
+    '''The entries of a source directory and of its target counterpart.
+    Both sides are read exactly once. The status of an entry is fetched
+    lazily and only once (FileEntry caches it).
+    '''
+    def __init__(self, walker, sources, targets):
+        '''Constructor.
+        @param walker: the walker which has read the directories
+        @param sources: a dictionary node -> FileEntry of the source
+        @param targets: None: the target does not exist<br>
+                otherwise: a dictionary node -> FileEntry of the target
+        '''
+        self._walker = walker
+        self._sources = sources
+        self._targetExists = targets != None
+        self._targets = targets if targets != None else {}
+
+    def targetExists(self):
+        '''Tests whether the target directory existed while reading.
+        @return: True: the target directory exists
+        '''
+        return self._targetExists
+
+    def hasSource(self, node):
+        '''Tests whether the source directory contains a given node.
+        @param node: the name of the entry (without path)
+        @return: True: the node exists in the source
+        '''
+        return node in self._sources
+
+    def pairs(self):
+        '''Returns the source entries with their target counterparts.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                trgEntry is None if the target does not exist
+        '''
+        targets = self._targets
+        for node, entry in self._sources.items():
+            yield node, entry, targets.get(node)
+
+    def orphans(self, keep):
+        '''Returns the target entries which should not be kept.
+        @param keep: a container of nodes which must not be returned
+        @return: an iterator of target entries (FileEntry)
+        '''
+        for node, entry in self._targets.items():
+            if node not in keep:
+                yield entry
+
+    def merged(self):
+        '''Returns all entries of both sides in one pass.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                srcEntry or trgEntry is None if the node exists on one side only
+        '''
+        for node, entry, trgEntry in self.pairs():
+            yield node, entry, trgEntry
+        sources = self._sources
+        for node, entry in self._targets.items():
+            if node not in sources:
+                yield node, None, entry
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        pass
+
+class SortedRuns:
+    '''The names of a huge directory as sorted runs in temporary files.
+    The directory is read in chunks: each chunk is sorted and written as one
+    run. Iterating merges the runs: the memory depends on the chunk size and
+    the number of runs, not on the number of entries.
+    '''
+    def __init__(self, first, iterator, chunkSize):
+        '''Constructor.
+        @param first: the list of (name, isDir) already read
+        @param iterator: the os.scandir() iterator delivering the rest
+        @param chunkSize: the number of entries of a run
+        '''
+        self._runs = []
+        self._count = 0
+        self.spill(first)
+        chunk = []
+        for entry in iterator:
+            chunk.append((entry.name, entry.is_dir(follow_symlinks=False)))
+            if len(chunk) >= chunkSize:
+                self.spill(chunk)
+                chunk = []
+        if chunk:
+            self.spill(chunk)
+
+    def spill(self, chunk):
+        '''Writes a chunk as sorted run into a temporary file.
+        @param chunk: a list of (name, isDir). Will be sorted
+        '''
+        chunk.sort()
+        fp = tempfile.TemporaryFile(prefix='redirsync.')
+        for item in chunk:
+            marshal.dump(item, fp)
+        self._runs.append((fp, len(chunk)))
+        self._count += len(chunk)
+
+    def readRun(self, fp, count):
+        '''Returns the entries of one run.
+        @param fp: the file containing the run
+        @param count: the number of entries of the run
+        @return: an iterator of (name, isDir)
+        '''
+        fp.seek(0)
+        for no in range(count):
+            yield marshal.load(fp)
+
+    def __iter__(self):
+        return heapq.merge(*[self.readRun(fp, count) for fp, count in self._runs])
+
+    def close(self):
+        '''Removes the temporary files.
+        '''
+        for fp, count in self._runs:
+            fp.close()
+        self._runs = []
+
+class SpilledList:
+    '''A list keeping at most chunkSize items in memory: full chunks are
+    appended to a temporary file. The items must be marshallable.
+    Iterating returns the items in the order of append().
+    '''
+    def __init__(self, chunkSize):
+        '''Constructor.
+        @param chunkSize: the maximal number of items kept in memory
+        '''
+        self._chunkSize = chunkSize
+        self._items = []
+        self._fp = None
+        self._countSpilled = 0
+
+    def append(self, item):
+        '''Adds an item at the end.
+        @param item: the item to add
+        '''
+        self._items.append(item)
+        if len(self._items) >= self._chunkSize:
+            if self._fp == None:
+                self._fp = tempfile.TemporaryFile(prefix='redirsync.')
+            for entry in self._items:
+                marshal.dump(entry, self._fp)
+            self._countSpilled += len(self._items)
+            self._items = []
+
+    def isSpilled(self):
+        '''Tests whether items have been written to the temporary file.
+        @return: True: the list is larger than one chunk
+        '''
+        return self._fp != None
+
+    def __len__(self):
+        return self._countSpilled + len(self._items)
+
+    def __iter__(self):
+        if self._fp != None:
+            self._fp.seek(0)
+            for no in range(self._countSpilled):
+                yield marshal.load(self._fp)
+        for item in self._items:
+            yield item
+
+    def close(self):
+        '''Removes the temporary file.
+        '''
+        if self._fp != None:
+            self._fp.close()
+            self._fp = None
+
+class StreamedListing:
+    '''The entries of a source directory and of its target counterpart
+    when one of them is too large to be kept in memory: both sides are
+    merged as sorted streams of names.
+    '''
+    def __init__(self, walker, src, trg, sources, targets):
+        '''Constructor.
+        @param walker: the walker which has read the directories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param sources: a SortedRuns instance or a dictionary node -> FileEntry
+        @param targets: None: the target does not exist<br>
+                otherwise: a SortedRuns instance or a dictionary node -> FileEntry
+        '''
+        self._walker = walker
+        self._src = src
+        self._trg = trg
+        self._sources = sources
+        self._targets = targets
+
+    def targetExists(self):
+        '''Tests whether the target directory existed while reading.
+        @return: True: the target directory exists
+        '''
+        return self._targets != None
+
+    def hasSource(self, node):
+        '''Tests whether the source directory contains a given node.
+        @param node: the name of the entry (without path)
+        @return: True: the node exists in the source
+        '''
+        if isinstance(self._sources, dict):
+            return node in self._sources
+        return os.path.lexists(self._src + node)
+
+    def sortedNames(self, entries):
+        '''Returns the names of one side in sorted order.
+        @param entries: None, a SortedRuns instance or a dictionary 
+                node -> FileEntry (or IndexedEntry)
+        @return: an iterator of (name, isDir)
+        '''
+        if entries == None:
+            rc = iter(())
+        elif isinstance(entries, dict):
+            rc = iter(sorted((node, entry.is_dir(follow_symlinks=False)) 
+                for node, entry in entries.items()))
+        else:
+            rc = iter(entries)
+        return rc
+
+    def entry(self, entries, path, item):
+        '''Returns the entry of a name delivered by sortedNames().
+        @param entries: a SortedRuns instance or a dictionary node -> entry
+        @param path: the directory of the entries (with trailing separator)
+        @param item: the tuple (name, isDir)
+        @return: the entry of the dictionary (e.g. with the status taken 
+                from the index) or a new FileEntry
+        '''
+        if isinstance(entries, dict):
+            return entries[item[0]]
+        return FileEntry(item[0], path, item[1])
+
+    def merged(self):
+        '''Returns all entries of both sides in one pass, sorted by name.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                srcEntry or trgEntry is None if the node exists on one side only
+        '''
+        sources = self.sortedNames(self._sources)
+        targets = self.sortedNames(self._targets)
+        src = next(sources, None)
+        trg = next(targets, None)
+        while src != None or trg != None:
+            if trg == None or src != None and src[0] < trg[0]:
+                yield src[0], self.entry(self._sources, self._src, src), None
+                src = next(sources, None)
+            elif src == None or trg[0] < src[0]:
+                yield trg[0], None, self.entry(self._targets, self._trg, trg)
+                trg = next(targets, None)
+            else:
+                yield (src[0], self.entry(self._sources, self._src, src),
+                    self.entry(self._targets, self._trg, trg))
+                src = next(sources, None)
+                trg = next(targets, None)
+
+    def pairs(self):
+        '''Returns the source entries with their target counterparts.
+        @return: an iterator of tuples (node, srcEntry, trgEntry)
+        '''
+        for node, srcEntry, trgEntry in self.merged():
+            if srcEntry != None:
+                yield node, srcEntry, trgEntry
+
+    def orphans(self, keep):
+        '''Returns the target entries which should not be kept.
+        @param keep: a container of nodes which must not be returned
+        @return: an iterator of target entries (FileEntry)
+        '''
+        for node, srcEntry, trgEntry in self.merged():
+            if trgEntry != None and node not in keep:
+                yield trgEntry
+
+    def close(self):
+        '''Removes the temporary files.
+        '''
+        for entries in (self._sources, self._targets):
+            if isinstance(entries, SortedRuns):
+                entries.close()
+
+class DirWalker:
+    '''Reads directories with os.scandir() and pairs source and target entries.
+    Each side costs one directory read plus at most one stat() per entry.
+    The file type comes from the directory read itself (d_type) if the
+    file system delivers it.
+    Directories with more than chunkSize entries are not kept in memory:
+    they are spilled as sorted runs and both sides are merged.
+    '''
+    def __init__(self, chunkSize = 100000):
+        '''Constructor.
+        @param chunkSize: the maximal number of entries of one directory
+                kept in memory
+        '''
+        self._chunkSize = chunkSize
+        self._countSpilled = 0
+        self._countReads = 0
+        self._countStats = 0
+        # None or the PhaseStatistics receiving the timings
+        self._phases = None
+
+    def scan(self, path):
+        '''Reads a directory.
+        @param path: the directory to read
+        @return: None: the directory does not exist<br>
+                otherwise: a dictionary node -> FileEntry
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return None
+        if not path.endswith(os.sep):
+            path += os.sep
+        rc = {}
+        with iterator:
+            for entry in iterator:
+                # the os.DirEntry (with a full os.stat_result) is not kept
+                rc[entry.name] = FileEntry(entry.name, path,
+                    entry.is_dir(follow_symlinks=False))
+        return rc
+
+    def entries(self, path):
+        '''Reads a directory without keeping the entries.
+        @param path: the directory to read
+        @return: an iterator of FileEntry. Empty if the directory does not exist
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return
+        if not path.endswith(os.sep):
+            path += os.sep
+        with iterator:
+            for entry in iterator:
+                yield FileEntry(entry.name, path, entry.is_dir(follow_symlinks=False))
+
+    def read(self, path):
+        '''Reads a directory: small ones into memory, huge ones into sorted runs.
+        @param path: the directory to read (with trailing separator)
+        @return: None: the directory does not exist<br>
+                a dictionary node -> FileEntry: at most chunkSize entries<br>
+                otherwise: a SortedRuns instance
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return None
+        rc = {}
+        with iterator:
+            for entry in iterator:
+                if len(rc) >= self._chunkSize:
+                    first = [(node, item._isDir) for node, item in rc.items()]
+                    first.append((entry.name, entry.is_dir(follow_symlinks=False)))
+                    rc = SortedRuns(first, iterator, self._chunkSize)
+                    self._countSpilled += 1
+                    break
+                rc[entry.name] = FileEntry(entry.name, path,
+                    entry.is_dir(follow_symlinks=False))
+        return rc
+
+    def listing(self, src, trg, targets = None):
+        '''Reads a source directory and its target counterpart.
+        @param src: the source directory
+        @param trg: the target directory
+        @param targets: None or the already known target entries
+                (e.g. from the state index): the target is not read
+        @return: a DirListing or (huge directories) a StreamedListing instance
+        '''
+        phases = self._phases
+        if phases != None:
+            start = time.perf_counter()
+        if not src.endswith(os.sep):
+            src += os.sep
+        if not trg.endswith(os.sep):
+            trg += os.sep
+        sources = self.read(src)
+        if sources == None:
+            sources = {}
+        count = 1
+        if targets == None:
+            targets = self.read(trg)
+            count = 2
+        if phases != None:
+            phases.add('listdir', time.perf_counter() - start, count)
+        if isinstance(sources, SortedRuns) or isinstance(targets, SortedRuns):
+            return StreamedListing(self, src, trg, sources, targets)
+        return DirListing(self, sources, targets)
+
+    def isDir(self, entry):
+        '''Tests whether an entry is a directory (symbolic links are not).
+        @param entry: the entry to test (FileEntry)
+        @return: True: the entry is a directory
+        '''
+        return entry.is_dir(follow_symlinks=False)
+
+    def stat(self, entry):
+        '''Returns the status of an entry without following symbolic links.
+        @param entry: the entry to inspect (FileEntry)
+        @return: the status info like os.lstat()
+        '''
+        self._countStats += 1
+        if self._phases == None:
+            return entry.stat(follow_symlinks=False)
+        start = time.perf_counter()
+        rc = entry.stat(follow_symlinks=False)
+        self._phases.add('stat', time.perf_counter() - start)
+        return rc
+
+    def countSyscalls(self):
+        '''Returns the number of directory reads and stat() calls.
+        @return: the sum of the calls done by the walker
+        '''
+        return self._countReads + self._countStats
@@ -0,0 +1,231 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, ctypes, ctypes.util, struct, select, time, errno
+
+# constants of <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+class Batch:
+    '''The directories to synchronize after a burst of events.
+    '''
+    def __init__(self):
+        '''Constructor.
+        '''
+        # source directory -> (target directory, depth, recursive)
+        self._dirs = {}
+        self._overflow = False
+        self._countEvents = 0
+
+    def add(self, src, trg, depth, recursive):
+        '''Marks a directory as dirty.
+        @param src: the source directory
+        @param trg: the target directory
+        @param depth: the depth of the directory in the source tree
+        @param recursive: True: the subdirectories must be synchronized too
+        '''
+        item = self._dirs.get(src)
+        if item == None or (recursive and not item[2]):
+            self._dirs[src] = (trg, depth, recursive)
+
+    def isEmpty(self):
+        '''Tests whether there is nothing to do.
+        @return: True: no dirty directory and no overflow
+        '''
+        return len(self._dirs) == 0 and not self._overflow
+
+class Watcher:
+    '''Watches source trees with inotify (via ctypes, Linux only) and
+    collects the directories touched by events.
+    '''
+    _mask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+    _eventHeader = struct.Struct('iIII')
+
+    def __init__(self, dirFilter = None, maxDepth = 99):
+        '''Constructor.
+        @param dirFilter: None or a function testing whether a subdirectory
+                (node) is synchronized
+        @param maxDepth: subdirectories deeper than that are not watched
+        '''
+        name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(name if name != None else 'libc.so.6',
+            use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirFilter = dirFilter
+        self._maxDepth = maxDepth
+        # watch descriptor -> (source, target, depth)
+        self._watches = {}
+        self._descriptors = {}
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        os.close(self._fd)
+
+    def addDir(self, src, trg, depth):
+        '''Watches one directory.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory in the source tree
+        '''
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(src), self._mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'cannot watch ' + src)
+        self._watches[wd] = (src, trg, depth)
+        self._descriptors[src] = wd
+
+    def addTree(self, src, trg, depth = 0):
+        '''Watches a directory and its (matching) subdirectories.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory in the source tree
+        '''
+        self.addDir(src, trg, depth)
+        if depth <= self._maxDepth:
+            with os.scandir(src) as iterator:
+                for entry in iterator:
+                    if (entry.is_dir(follow_symlinks=False) and (self._dirFilter == None
+                            or self._dirFilter(entry.name))):
+                        self.addTree(src + entry.name + os.sep,
+                            trg + entry.name + os.sep, depth + 1)
+
+    def removeTree(self, src):
+        '''Stops watching a directory and its subdirectories.
+        @param src: the source directory (with trailing separator)
+        '''
+        for path in [path for path in self._descriptors if path.startswith(src)]:
+            wd = self._descriptors.pop(path)
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self, timeout):
+        '''Reads the waiting events.
+        @param timeout: the maximal waiting time in seconds. None: forever
+        @return: a list of tuples (wd, mask, name). Empty: timeout
+        '''
+        rc = []
+        ready = select.select([self._fd], [], [], timeout)[0]
+        if ready:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as exc:
+                if exc.errno != errno.EAGAIN:
+                    raise
+                data = b''
+            offset = 0
+            header = self._eventHeader
+            while offset < len(data):
+                wd, mask, cookie, length = header.unpack_from(data, offset)
+                offset += header.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                rc.append((wd, mask, name))
+        return rc
+
+    def handle(self, batch, wd, mask, name):
+        '''Stores the consequences of one event in a batch.
+        @param batch: the batch to fill
+        @param wd: the watch descriptor
+        @param mask: the kind of the event
+        @param name: the node concerned (inside the watched directory)
+        '''
+        if mask & IN_Q_OVERFLOW:
+            batch._overflow = True
+            return
+        info = self._watches.get(wd)
+        if info == None:
+            return
+        src, trg, depth = info
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            self._descriptors.pop(src, None)
+            return
+        if mask & IN_DELETE_SELF:
+            return
+        batch.add(src, trg, depth, False)
+        if (mask & IN_ISDIR and depth < self._maxDepth
+                and (self._dirFilter == None or self._dirFilter(name))):
+            subSrc = src + name + os.sep
+            subTrg = trg + name + os.sep
+            if mask & IN_MOVED_FROM:
+                self.removeTree(subSrc)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.addTree(subSrc, subTrg, depth + 1)
+                except OSError:
+                    # already removed again: the parent will be synchronized
+                    return
+                batch.add(subSrc, subTrg, depth + 1, True)
+
+    def collect(self, delay, timeout = None):
+        '''Waits for events and collects them until nothing happens for a while.
+        @param delay: the batch is complete after this many quiet seconds
+        @param timeout: None or the maximal waiting time for the first event
+        @return: a Batch instance (empty if the timeout has been reached)
+        '''
+        batch = Batch()
+        events = self.read(timeout)
+        start = time.time()
+        while events:
+            for wd, mask, name in events:
+                batch._countEvents += 1
+                self.handle(batch, wd, mask, name)
+            # a steady stream of events must not delay the batch forever:
+            if time.time() - start > 10 * delay:
+                break
+            events = self.read(delay)
+        return batch
+
+    def changedSince(self, timepoint):
+        '''Finds the watched directories with entries changed after a time.
+        Used after an overflow of the event queue: only the source side is
+        inspected. The events of created subdirectories may be lost too:
+        unwatched subdirectories are watched now and synchronized recursively.
+        @param timepoint: the time of the last synchronization
+        @return: a Batch containing the changed directories
+        '''
+        batch = Batch()
+        for wd, (src, trg, depth) in list(self._watches.items()):
+            newDirs = []
+            try:
+                info = os.stat(src)
+                changed = max(info.st_mtime, info.st_ctime) >= timepoint
+                with os.scandir(src) as iterator:
+                    for entry in iterator:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (depth < self._maxDepth
+                                    and src + entry.name + os.sep not in self._descriptors
+                                    and (self._dirFilter == None
+                                        or self._dirFilter(entry.name))):
+                                newDirs.append(entry.name)
+                        elif not changed:
+                            info = entry.stat(follow_symlinks=False)
+                            changed = max(info.st_mtime, info.st_ctime) >= timepoint
+            except OSError:
+                changed = False
+            if changed or newDirs:
+                batch.add(src, trg, depth, False)
+            for name in newDirs:
+                subSrc = src + name + os.sep
+                subTrg = trg + name + os.sep
+                try:
+                    self.addTree(subSrc, subTrg, depth + 1)
+                except OSError:
+                    # already removed again: the parent will be synchronized
+                    continue
+                batch.add(subSrc, subTrg, depth + 1, True)
+        return batch
@@ -0,0 +1,253 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+'''
+Measures Sync.synchronize() on a synthetic tree in typical scenarios:
+first copy, no-op resync, a small change and a mass delete.
+The results are written as JSON. With --baseline the results are compared
+with a former run: a regression is reported by the exit code 1.
+
+usage: python -m pybench.syncbench [--depth=3] [--fan-out=4] ... [--output=<file>]
+
+A huge flat directory (no subdirectories: the files are deleted instead):
+python -m pybench.syncbench --depth=0 --files=500000 --median-size=0 --sigma=0
+
+The cost of the durability policies (each on a fresh tree):
+python -m pybench.syncbench --durability=none,file,dir,fs
+'''
+import os, os.path, sys, time, json, shutil, platform
+from argparse import ArgumentParser
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from dirsync.redirsync import Sync
+from pybench.treegen import TreeGenerator
+from pybench.walkerbench import SyscallCounter
+from reutil.util import Util, say, sayError
+
+# the os functions counted while synchronizing. The counter replaces the
+# attributes of the module os: calls like os.fsync() are counted, syncfs()
+# (via ctypes) is not: see the durability values of the result
+SYSCALLS = ('scandir', 'listdir', 'stat', 'lstat', 'fstat', 'open', 'read',
+    'write', 'lseek', 'copy_file_range', 'sendfile', 'mkdir', 'unlink',
+    'rmdir', 'chmod', 'utime', 'replace', 'fsync', 'fdatasync', 
+    'posix_fadvise', 'sync')
+
+def peakRss():
+    '''Returns the peak resident set size of the process.
+    @return: the size in KiB. None: not available
+    '''
+    rc = None
+    if resource != None:
+        rc = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            rc //= 1024
+    return rc
+
+def dropCaches():
+    '''Tries to empty the page cache (needs root on Linux).
+    @return: True: the cache has been dropped
+    '''
+    rc = False
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as fp:
+            fp.write('3\n')
+        rc = True
+    except (OSError, AttributeError):
+        pass
+    return rc
+
+class SyncBenchmark:
+    '''Runs the scenarios and collects the results.
+    '''
+    def __init__(self, base, generator, jobs = 1, useIndex = False, cold = False,
+            durability = 'none'):
+        '''Constructor.
+        @param base: the working directory (with trailing separator)
+        @param generator: the TreeGenerator building the source tree
+        @param jobs: the number of worker threads of the synchronization
+        @param useIndex: True: the state index is used
+        @param cold: True: the page cache is dropped before each scenario
+        @param durability: the durability policy: 'none', 'file', 'dir' or 'fs'
+        '''
+        self._base = base
+        self._src = base + 'src' + os.sep
+        self._trg = base + 'trg' + os.sep
+        self._generator = generator
+        self._jobs = jobs
+        self._useIndex = useIndex
+        self._cold = cold
+        self._durability = durability
+        self._results = []
+
+    def createSync(self):
+        '''Returns a Sync instance configured like a typical backup run.
+        @return: the Sync instance
+        '''
+        sync = Sync()
+        sync._home = self._base
+        sync._fnError = self._base + 'error.log'
+        settings = sync._settings
+        settings._addNonExisting = True
+        settings._copyNewer = True
+        settings._copyDifferentSize = True
+        settings._deleteFilesWithoutSource = True
+        settings._verboseLevel = 0
+        settings._jobs = self._jobs
+        settings._useIndex = self._useIndex
+        settings._durability = self._durability
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        return sync
+
+    def measure(self, scenario):
+        '''Synchronizes the trees and stores the measured values.
+        @param scenario: the name of the scenario
+        @return: the result (a dictionary)
+        '''
+        cold = self._cold and dropCaches()
+        if not cold and hasattr(os, 'sync'):
+            # the dirty data of the preparation does not count
+            os.sync()
+        sync = self.createSync()
+        counter = SyscallCounter(SYSCALLS)
+        counter.start()
+        start = time.perf_counter()
+        try:
+            sync.synchronize([self._src], self._trg, False)
+        finally:
+            duration = time.perf_counter() - start
+            counter.stop()
+            sync.close()
+        duration = max(duration, 1E-9)
+        syscalls = dict((name, count)
+            for name, count in counter._counts.items() if count > 0)
+        durability = sync._durability
+        rc = {
+            'scenario': scenario,
+            'durability': self._durability,
+            'cold': cold,
+            'seconds': round(duration, 6),
+            'files': sync._total._countFiles,
+            'dirs': sync._total._countDirs,
+            'copiedFiles': sync._modified._countFiles,
+            'copiedBytes': sync._modified._sizeFiles,
+            'filesPerSec': round(sync._total._countFiles / duration, 1),
+            'mbPerSec': round(sync._modified._sizeFiles / duration / 1E6, 3),
+            'syscalls': syscalls,
+            'syscallsTotal': sum(syscalls.values()),
+            'syncedFiles': durability._countFiles,
+            'syncedDirs': durability._countDirs,
+            'syncedFilesystems': durability._countFilesystems,
+            'syncSeconds': round(durability._seconds, 6),
+            'errors': sync._countErrors,
+            'peakRssKiB': peakRss()
+        }
+        self._results.append(rc)
+        return rc
+
+    def run(self, changeRatio, deleteRatio):
+        '''Runs all scenarios.
+        @param changeRatio: the part of the files changed before the 3rd run
+        @param deleteRatio: the part of the top level directories (or of the
+                files of a flat tree) removed before the last run
+        @return: the list of results
+        '''
+        files, size = self._generator.generate(self._src)
+        Util.mkDir(self._trg)
+        self.measure('first-copy')
+        self.measure('no-op')
+        self._generator.change(files, changeRatio)
+        self.measure('change')
+        if self._generator._depth == 0:
+            self._generator.removeFiles(files, deleteRatio)
+        else:
+            self._generator.removeTrees(self._src, deleteRatio)
+        self.measure('mass-delete')
+        return self._results
+
+def compare(results, baseline, tolerance):
+    '''Compares the results with a former run.
+    @param results: the current results
+    @param baseline: the results of the former run
+    @param tolerance: the allowed deterioration, e.g. 0.2 for 20%
+    @return: a list of messages describing the regressions. Empty: no regression
+    '''
+    rc = []
+    # older result files have no durability: 'none'
+    former = dict(((item['scenario'], item.get('durability', 'none')), item) 
+        for item in baseline)
+    for item in results:
+        old = former.get((item['scenario'], item['durability']))
+        if old == None:
+            continue
+        name = item['scenario']
+        if item['durability'] != 'none':
+            name += '/' + item['durability']
+        if item['filesPerSec'] < old['filesPerSec'] * (1 - tolerance):
+            rc.append('{}: files/s {} -> {}'.format(name,
+                old['filesPerSec'], item['filesPerSec']))
+        if item['syscallsTotal'] > old['syscallsTotal'] * (1 + tolerance):
+            rc.append('{}: syscalls {} -> {}'.format(name,
+                old['syscallsTotal'], item['syscallsTotal']))
+    return rc
+
+def main(argv):
+    parser = ArgumentParser(description='benchmark of the directory synchronization')
+    parser.add_argument('--depth', type=int, default=3, help='the directory levels [default: %(default)s]')
+    parser.add_argument('--fan-out', dest='fanOut', type=int, default=4, help='the subdirectories per directory [default: %(default)s]')
+    parser.add_argument('--files', type=int, default=20, help='the files per directory [default: %(default)s]')
+    parser.add_argument('--median-size', dest='medianSize', type=int, default=4096, help='the median of the file sizes [default: %(default)s]')
+    parser.add_argument('--sigma', type=float, default=2.0, help='the spread of the (log-normal) size distribution [default: %(default)s]')
+    parser.add_argument('--max-size', dest='maxSize', type=int, default=16 * 1024 * 1024, help='the maximal file size [default: %(default)s]')
+    parser.add_argument('--change-ratio', dest='changeRatio', type=float, default=0.01, help='the part of the changed files [default: %(default)s]')
+    parser.add_argument('--delete-ratio', dest='deleteRatio', type=float, default=0.5, help='the part of the deleted top level directories [default: %(default)s]')
+    parser.add_argument('--seed', type=int, default=4711, help='the start value of the random generator [default: %(default)s]')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='the worker threads of the synchronization [default: %(default)s]')
+    parser.add_argument('--index', action='store_true', help='the state index is used')
+    parser.add_argument('--durability', default='none', help="the durability policies to measure, comma separated: none, file, dir, fs [default: %(default)s]")
+    parser.add_argument('--cold', action='store_true', help='the page cache is dropped before each scenario (needs root)')
+    parser.add_argument('--base', help='the working directory [default: a temporary directory]')
+    parser.add_argument('--output', help='the result file (JSON) [default: standard output]')
+    parser.add_argument('--baseline', help='the result file of a former run: regressions are reported')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='the allowed deterioration against the baseline [default: %(default)s]')
+    args = parser.parse_args(argv)
+    generator = TreeGenerator(args.depth, args.fanOut, args.files,
+        args.medianSize, args.sigma, args.maxSize, args.seed)
+    results = []
+    for durability in args.durability.split(','):
+        if args.base != None:
+            base = os.path.join(args.base, 'syncbench') + os.sep
+            Util.mkDir(base)
+        else:
+            base = Util.getTempDir('syncbench', True)
+        try:
+            bench = SyncBenchmark(base, generator, args.jobs, args.index, 
+                args.cold, durability)
+            results += bench.run(args.changeRatio, args.deleteRatio)
+        finally:
+            shutil.rmtree(base)
+    parameters = vars(args).copy()
+    for key in ('base', 'output', 'baseline', 'tolerance'):
+        del parameters[key]
+    document = {'parameters': parameters, 'python': platform.python_version(),
+        'platform': platform.platform(), 'results': results}
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output == None:
+        say(text)
+    else:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    rc = 0
+    if args.baseline != None:
+        with open(args.baseline, 'r') as fp:
+            regressions = compare(results, json.load(fp)['results'], args.tolerance)
+        for msg in regressions:
+            sayError('regression: ' + msg)
+        rc = 1 if regressions else 0
+    return rc
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
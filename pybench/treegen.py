@@ -0,0 +1,137 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+'''
+Generates repeatable synthetic directory trees for the benchmarks.
+The same parameters (and seed) always produce the same tree.
+'''
+import os, os.path, random, shutil
+
+class TreeGenerator:
+    '''Creates a directory tree with a given shape and file size distribution
+    and modifies it in a reproducible way.
+    '''
+    def __init__(self, depth = 3, fanOut = 4, filesPerDir = 20,
+            medianSize = 4096, sigma = 2.0, maxSize = 16 * 1024 * 1024,
+            seed = 4711):
+        '''Constructor.
+        @param depth: the number of directory levels below the root
+        @param fanOut: the number of subdirectories of each directory
+        @param filesPerDir: the number of files in each directory
+        @param medianSize: the median of the file sizes (log-normal distribution)
+        @param sigma: the spread of the log-normal distribution. 0: all files
+                have the median size
+        @param maxSize: no file is larger than that
+        @param seed: the start value of the random generator
+        '''
+        self._depth = depth
+        self._fanOut = fanOut
+        self._filesPerDir = filesPerDir
+        self._medianSize = medianSize
+        self._sigma = sigma
+        self._maxSize = maxSize
+        self._seed = seed
+        # the content is taken from this block: random data, written fast
+        self._block = random.Random(seed).getrandbits(8 * 1024 * 1024).to_bytes(
+            1024 * 1024, 'little')
+
+    def fileSize(self, rand):
+        '''Returns a file size following the configured distribution.
+        @param rand: the random generator
+        @return: the size in bytes
+        '''
+        if self._sigma <= 0:
+            rc = self._medianSize
+        else:
+            rc = int(rand.lognormvariate(0, self._sigma) * self._medianSize)
+        return min(rc, self._maxSize)
+
+    def writeData(self, filename, size, offset):
+        '''Writes a file with pseudo random content.
+        @param filename: the file to write
+        @param size: the file size
+        @param offset: the start position in the random block: files
+                with different offsets have different content
+        '''
+        blockSize = len(self._block)
+        with open(filename, 'wb') as fp:
+            position = offset % blockSize
+            while size > 0:
+                length = min(size, blockSize - position)
+                fp.write(self._block[position:position + length])
+                size -= length
+                position = 0
+
+    def generate(self, root):
+        '''Creates the tree.
+        @param root: the root directory (with trailing separator). Will be created
+        @return: a tuple (files, bytes): the list of the created files
+                (full names) and the sum of their sizes
+        '''
+        rand = random.Random(self._seed)
+        files = []
+        total = 0
+        todo = [(root, 0)]
+        while todo:
+            path, depth = todo.pop()
+            os.makedirs(path, exist_ok=True)
+            for no in range(self._filesPerDir):
+                full = path + 'file{:04d}.dat'.format(no)
+                size = self.fileSize(rand)
+                self.writeData(full, size, rand.randrange(1 << 20))
+                files.append(full)
+                total += size
+            if depth < self._depth:
+                for no in range(self._fanOut):
+                    todo.append((path + 'dir{:03d}'.format(no) + os.sep, depth + 1))
+        return files, total
+
+    def change(self, files, ratio, seed = None):
+        '''Modifies a part of the files: the size and the content change,
+        the modification time moves into the future.
+        @param files: the list of the files of the tree
+        @param ratio: the part of the files to change, e.g. 0.01
+        @param seed: None or the start value of the random generator
+        @return: a tuple (files, bytes): the changed files and their new total size
+        '''
+        rand = random.Random(self._seed + 1 if seed == None else seed)
+        count = min(len(files), max(1, int(len(files) * ratio + 0.5)))
+        changed = rand.sample(files, count)
+        total = 0
+        for full in changed:
+            info = os.stat(full)
+            size = self.fileSize(rand) + 1
+            if size == info.st_size:
+                size += 1
+            self.writeData(full, size, rand.randrange(1 << 20))
+            os.utime(full, ns=(info.st_atime_ns,
+                info.st_mtime_ns + 60 * 1000 * 1000 * 1000))
+            total += size
+        return changed, total
+
+    def removeFiles(self, files, ratio, seed = None):
+        '''Removes a part of the files (for flat trees without subdirectories).
+        @param files: the list of the files of the tree
+        @param ratio: the part of the files to remove, e.g. 0.5
+        @param seed: None or the start value of the random generator
+        @return: the list of removed files
+        '''
+        rand = random.Random(self._seed + 3 if seed == None else seed)
+        rc = rand.sample(files, min(len(files), int(len(files) * ratio + 0.5)))
+        for full in rc:
+            os.unlink(full)
+        return rc
+
+    def removeTrees(self, root, ratio, seed = None):
+        '''Removes a part of the top level subdirectories.
+        @param root: the root directory (with trailing separator)
+        @param ratio: the part of the subdirectories to remove, e.g. 0.5
+        @param seed: None or the start value of the random generator
+        @return: the list of removed directories
+        '''
+        rand = random.Random(self._seed + 2 if seed == None else seed)
+        dirs = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+        count = min(len(dirs), max(1, int(len(dirs) * ratio + 0.5)))
+        rc = [root + node + os.sep for node in rand.sample(dirs, count)]
+        for path in rc:
+            shutil.rmtree(path)
+        return rc
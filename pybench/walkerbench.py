@@ -0,0 +1,152 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+'''
+Counts the system calls needed to compare a source and a target tree:
+the former listdir/lstat/exists based scan against the DirWalker.
+
+usage: python -m pybench.walkerbench [<dirs> [<files_per_dir>]]
+'''
+import os, os.path, stat, shutil, sys
+
+from dirsync.walker import DirWalker
+from reutil.util import Util, say
+
+class SyscallCounter:
+    '''Counts the calls of the os functions which touch the file system.
+    '''
+    _names = ('listdir', 'lstat', 'stat', 'scandir')
+
+    def __init__(self, names = None):
+        '''Constructor.
+        @param names: None or the names of the os functions to count
+        '''
+        if names != None:
+            self._names = names
+        self._counts = dict.fromkeys(self._names, 0)
+        self._saved = {}
+
+    def wrap(self, name, function):
+        '''Returns a wrapper of an os function counting its calls.
+        @param name: the name of the function in the module os
+        @param function: the original function
+        @return: the wrapper
+        '''
+        def counter(*args, **kwargs):
+            self._counts[name] += 1
+            return function(*args, **kwargs)
+        return counter
+
+    def start(self):
+        '''Installs the counting wrappers.
+        '''
+        for name in self._names:
+            if hasattr(os, name):
+                self._saved[name] = getattr(os, name)
+                setattr(os, name, self.wrap(name, self._saved[name]))
+
+    def stop(self):
+        '''Restores the original functions.
+        '''
+        for name, function in self._saved.items():
+            setattr(os, name, function)
+        self._saved = {}
+
+    def total(self):
+        '''Returns the number of all counted calls.
+        @return: the sum of all counters
+        '''
+        return sum(self._counts.values())
+
+def legacyScan(src, trg):
+    '''Compares two directory trees the way Sync.oneDir did before DirWalker.
+    @param src: the source directory (with trailing separator)
+    @param trg: the target directory (with trailing separator)
+    '''
+    files = os.listdir(src)
+    validFiles = []
+    dirs = []
+    for filename in files:
+        fullSrc = src + filename
+        srcStat = os.lstat(fullSrc)
+        if stat.S_ISDIR(srcStat.st_mode):
+            dirs.append(filename)
+        else:
+            validFiles.append(filename)
+            fullTrg = trg + filename
+            trgStat = os.lstat(fullTrg) if os.path.exists(fullTrg) else None
+    for filename in os.listdir(trg):
+        if filename not in validFiles and filename not in dirs:
+            os.path.isdir(trg + filename)
+    for subdir in dirs:
+        legacyScan(src + subdir + os.sep, trg + subdir + os.sep)
+
+def walkerScan(walker, src, trg):
+    '''Compares two directory trees the way Sync.oneDir does with DirWalker.
+    @param walker: the walker to use
+    @param src: the source directory (with trailing separator)
+    @param trg: the target directory (with trailing separator)
+    '''
+    listing = walker.listing(src, trg)
+    keep = set()
+    dirs = []
+    for node, srcEntry, trgEntry in listing.pairs():
+        keep.add(node)
+        if walker.isDir(srcEntry):
+            dirs.append(node)
+        else:
+            walker.stat(srcEntry)
+            if trgEntry != None:
+                walker.stat(trgEntry)
+    for entry in listing.orphans(keep):
+        walker.isDir(entry)
+    for subdir in dirs:
+        walkerScan(walker, src + subdir + os.sep, trg + subdir + os.sep)
+
+def buildTree(base, countDirs, countFiles):
+    '''Creates a source tree and an identical target tree.
+    @param base: the parent directory of both trees
+    @param countDirs: the number of subdirectories
+    @param countFiles: the number of files in each directory
+    @return: a tuple (source, target)
+    '''
+    src = base + 'src' + os.sep
+    trg = base + 'trg' + os.sep
+    for root in (src, trg):
+        for no in range(countDirs + 1):
+            path = root if no == 0 else root + 'dir%d' % no + os.sep
+            Util.mkDir(path)
+            for fileNo in range(countFiles):
+                Util.writeFile(path + 'file%d.txt' % fileNo, 'x')
+    return src, trg
+
+def main(argv):
+    countDirs = int(argv[0]) if len(argv) > 0 else 20
+    countFiles = int(argv[1]) if len(argv) > 1 else 100
+    base = Util.getTempDir('walkerbench', True)
+    try:
+        src, trg = buildTree(base, countDirs, countFiles)
+        entries = (countDirs + 1) * countFiles + countDirs
+        counter = SyscallCounter()
+        counter.start()
+        try:
+            legacyScan(src, trg)
+        finally:
+            counter.stop()
+        before = counter.total()
+        walker = DirWalker()
+        counter = SyscallCounter()
+        counter.start()
+        try:
+            walkerScan(walker, src, trg)
+        finally:
+            counter.stop()
+        after = counter.total()
+        say('entries: {} before: {} syscalls ({:.2f}/entry) after: {} syscalls ({:.2f}/entry)'
+            .format(entries, before, before / float(entries), after, 
+                after / float(entries)))
+    finally:
+        shutil.rmtree(base)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,195 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil
+from dirsync.copier import Copier, tempName, parseTempName
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('copiertest', True)
+        self._src = self._base + 'src.dat'
+        self._trg = self._base + 'trg.dat'
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testCopyDelta(self):
+        content = ''.join(chr(65 + no) * 100 for no in range(10))
+        Util.writeFile(self._src, content)
+        Util.writeFile(self._trg, content[0:300] + 'x' * 100 + content[400:950])
+        os.utime(self._src, (1000000, 1000000))
+        copier = Copier(500, 100)
+        copier.copy(self._src, self._trg, os.lstat(self._src), 
+            os.lstat(self._trg))
+        self.assertEqual(content, Util.readFileAsString(self._trg))
+        self.assertEqual(1, copier._countDelta)
+        self.assertEqual(200, copier._deltaWritten)
+        self.assertEqual(800, copier._deltaSkipped)
+        self.assertEqual(1000000, os.lstat(self._trg).st_mtime)
+        Util.writeFile(self._trg, content + 'tail')
+        copier.copy(self._src, self._trg, os.lstat(self._src), 
+            os.lstat(self._trg))
+        self.assertEqual(content, Util.readFileAsString(self._trg))
+
+    def testCopySmall(self):
+        Util.writeFile(self._src, 'abc')
+        Util.writeFile(self._trg, 'abd')
+        copier = Copier(500, 100)
+        copier.copy(self._src, self._trg, os.lstat(self._src), 
+            os.lstat(self._trg))
+        self.assertEqual('abc', Util.readFileAsString(self._trg))
+        self.assertEqual(0, copier._countDelta)
+
+    def testCopyMethods(self):
+        content = 'abc' * 100000
+        Util.writeFile(self._src, content)
+        copier = Copier(bufferSize=1000)
+        copier.copy(self._src, self._trg, os.lstat(self._src))
+        self.assertEqual(content, Util.readFileAsString(self._trg))
+        self.assertEqual(1, len(copier._methodStatistics))
+        for name, method in copier._methods:
+            os.unlink(self._trg)
+            with open(self._src, 'rb') as fpSrc, open(self._trg, 'wb') as fpTrg:
+                try:
+                    size = method(fpSrc.fileno(), fpTrg.fileno())
+                except OSError:
+                    continue
+            self.assertEqual(len(content), size, name)
+            self.assertEqual(content, Util.readFileAsString(self._trg), name)
+
+    def writeSparse(self, filename, parts, size):
+        with open(filename, 'wb') as fp:
+            for position, data in parts:
+                fp.seek(position)
+                fp.write(data)
+            fp.truncate(size)
+
+    def allocated(self, filename):
+        return os.stat(filename).st_blocks * 512
+
+    def testCopySparse(self):
+        size = 64 * 1024 * 1024
+        parts = [(0, b'head'), (16 * 1024 * 1024, b'x' * 100000), 
+            (size - 4096, b'tail')]
+        self.writeSparse(self._src, parts, size)
+        info = os.lstat(self._src)
+        copier = Copier()
+        if not copier.isSparse(info):
+            # the filesystem does not support holes
+            return
+        holes = copier.copy(self._src, self._trg, info)
+        self.assertEqual(size, os.path.getsize(self._trg))
+        with open(self._src, 'rb') as fpSrc, open(self._trg, 'rb') as fpTrg:
+            self.assertTrue(fpSrc.read() == fpTrg.read())
+        self.assertTrue(holes > size - 1024 * 1024)
+        self.assertTrue(self.allocated(self._trg) < 2 * 1024 * 1024)
+        if 'sparse' in copier._methodStatistics:
+            self.assertEqual(1, copier._countSparse)
+            self.assertEqual(holes, copier._sparseSkipped)
+        self.assertEqual(0, Copier(sparse='off').copy(self._src, self._trg, info))
+        self.assertEqual(size, os.path.getsize(self._trg))
+
+    def testZeroBlocks(self):
+        size = 4 * 1024 * 1024
+        with open(self._src, 'wb') as fp:
+            fp.write(b'\0' * size)
+            fp.write(b'data')
+        copier = Copier(bufferSize=1000 * 1000, sparse='zeros')
+        copier._methods = [item for item in copier._methods 
+            if item[0] != 'reflink']
+        holes = copier.copy(self._src, self._trg, os.lstat(self._src))
+        self.assertEqual(size, holes)
+        self.assertEqual(size, copier._sparseSkipped)
+        with open(self._trg, 'rb') as fp:
+            self.assertEqual(b'\0' * size + b'data', fp.read())
+
+    def testCopyRangeSparse(self):
+        size = 8 * 1024 * 1024
+        self.writeSparse(self._src, [(0, b'a' * 4096), (size - 4096, b'b' * 4096)], 
+            size)
+        copier = Copier(sparse='zeros')
+        progress = []
+        copier._chunkSize = 1024 * 1024
+        holes = copier.copyRange(self._src, self._trg, 0, progress.append)
+        self.assertEqual(size - 8192, holes)
+        self.assertTrue(len(progress) > 0)
+        with open(self._src, 'rb') as fpSrc, open(self._trg, 'rb') as fpTrg:
+            self.assertTrue(fpSrc.read() == fpTrg.read())
+        self.writeSparse(self._trg, [(0, b'a' * 4096)], 4096)
+        copier.copyRange(self._src, self._trg, 4096)
+        with open(self._src, 'rb') as fpSrc, open(self._trg, 'rb') as fpTrg:
+            self.assertTrue(fpSrc.read() == fpTrg.read())
+
+    def testDropCache(self):
+        content = os.urandom(1024 * 1024) * 5 + b'end'
+        with open(self._src, 'wb') as fp:
+            fp.write(content)
+        copier = Copier(pageCache='drop')
+        if not copier._dropCache:
+            return
+        copier._chunkSize = 1024 * 1024
+        copier.copy(self._src, self._trg, os.lstat(self._src))
+        with open(self._trg, 'rb') as fp:
+            self.assertTrue(content == fp.read())
+        if 'reflink' not in copier._methodStatistics:
+            self.assertEqual(len(content), copier._releasedBytes)
+            self.assertEqual(1, copier._countPreallocated)
+        for name, method in copier._methods:
+            os.unlink(self._trg)
+            with open(self._src, 'rb') as fpSrc, open(self._trg, 'wb') as fpTrg:
+                try:
+                    method(fpSrc.fileno(), fpTrg.fileno())
+                except OSError:
+                    continue
+            with open(self._trg, 'rb') as fp:
+                self.assertTrue(content == fp.read(), name)
+        copier.copyRange(self._src, self._trg, 0)
+        with open(self._trg, 'rb') as fp:
+            self.assertTrue(content == fp.read())
+
+    def testCopyDirect(self):
+        content = os.urandom(3 * 1024 * 1024 + 1000)
+        with open(self._src, 'wb') as fp:
+            fp.write(content)
+        copier = Copier(directMinSize=1024)
+        copier._directBufferSize = 1024 * 1024
+        if not copier._directSupported:
+            return
+        copier.copy(self._src, self._trg, os.lstat(self._src))
+        with open(self._trg, 'rb') as fp:
+            self.assertTrue(content == fp.read())
+        if copier._countDirect > 0:
+            self.assertEqual(len(content), copier._directBytes)
+            self.assertEqual(len(content), copier._methodStatistics['direct'][1])
+        # continues an interrupted copy
+        with open(self._trg, 'r+b') as fp:
+            fp.truncate(2 * 1024 * 1024)
+            fp.seek(1024 * 1024)
+            fp.write(b'x' * 1024 * 1024)
+        copier.copyRange(self._src, self._trg, 1024 * 1024)
+        with open(self._trg, 'rb') as fp:
+            self.assertTrue(content == fp.read())
+        Util.writeFile(self._src, 'small')
+        copier.copy(self._src, self._trg, os.lstat(self._src))
+        self.assertEqual('small', Util.readFileAsString(self._trg))
+
+    def testCopySafe(self):
+        Util.writeFile(self._src, 'abc')
+        Util.writeFile(self._trg, 'abd')
+        Copier().copySafe(self._src, self._trg)
+        self.assertEqual('abc', Util.readFileAsString(self._trg))
+        self.assertEqual(['src.dat', 'trg.dat'], sorted(os.listdir(self._base)))
+
+    def testTempName(self):
+        temp = tempName(self._trg, 'part')
+        self.assertEqual(self._base + '.trg.dat.redirsync.{}.part'.format(
+            os.getpid()), temp)
+        self.assertEqual(('trg.dat', os.getpid(), 'part'), 
+            parseTempName(os.path.basename(temp)))
+        self.assertEqual(('a.redirsync.1.tmp', 2, 'tmp'), 
+            parseTempName('.a.redirsync.1.tmp.redirsync.2.tmp'))
+        self.assertEqual(None, parseTempName('trg.dat.redirsync.tmp'))
+        self.assertEqual(None, parseTempName('.trg.dat.redirsync.x.tmp'))
+
+if __name__ == "__main__":
+    unittest.main()
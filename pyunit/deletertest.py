@@ -0,0 +1,95 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil, stat
+from dirsync.deleter import TreeDeleter
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('deletertest', True)
+        self._tree = self._base + 'tree' + os.sep
+        self._outside = self._base + 'outside' + os.sep
+        Util.mkDir(self._outside)
+        Util.writeFile(self._outside + 'keep.txt', 'keep')
+
+    def tearDown(self):
+        for path, dirs, files in os.walk(self._base):
+            os.chmod(path, 0o755)
+        shutil.rmtree(self._base)
+
+    def build(self, depth, fanOut, files):
+        count = 0
+        todo = [(self._tree, 0)]
+        while todo:
+            path, level = todo.pop()
+            Util.mkDir(path)
+            count += 1
+            for no in range(files):
+                Util.writeFile(path + 'file{}.txt'.format(no), str(no))
+                count += 1
+            if level < depth:
+                for no in range(fanOut):
+                    todo.append((path + 'dir{}'.format(no) + os.sep, level + 1))
+        return count
+
+    def testRemoveTree(self):
+        count = self.build(2, 3, 5)
+        removed = []
+        deleter = TreeDeleter(1, None, removed.append)
+        self.assertTrue(deleter.removeTree(self._tree))
+        deleter.close()
+        self.assertFalse(os.path.exists(self._tree))
+        self.assertEqual(count, deleter._countFiles + deleter._countDirs)
+        self.assertEqual(13, deleter._countDirs)
+        self.assertEqual(count, len(removed))
+        self.assertTrue(self._tree in removed)
+        self.assertTrue(deleter.throughput() > 0)
+
+    def testParallel(self):
+        count = self.build(3, 4, 10)
+        deleter = TreeDeleter(4)
+        for round in range(2):
+            self.assertTrue(deleter.removeTree(self._tree))
+            self.assertFalse(os.path.exists(self._tree))
+            self.build(3, 4, 10)
+        deleter.close()
+        self.assertEqual(2 * count, deleter._countFiles + deleter._countDirs)
+
+    def testSymbolicLinks(self):
+        self.build(1, 2, 1)
+        os.symlink(self._outside, self._tree + 'dir0' + os.sep + 'link')
+        os.symlink(self._outside + 'keep.txt', self._tree + 'file.lnk')
+        link = self._base + 'rootlink'
+        os.symlink(self._outside, link)
+        deleter = TreeDeleter(2)
+        self.assertTrue(deleter.removeTree(self._tree))
+        # only the link is removed, not the directory it points to
+        self.assertTrue(deleter.removeTree(link))
+        deleter.close()
+        self.assertFalse(os.path.lexists(self._tree))
+        self.assertFalse(os.path.lexists(link))
+        self.assertEqual('keep', Util.readFileAsString(self._outside + 'keep.txt'))
+
+    def testReadOnly(self):
+        self.build(1, 1, 2)
+        subdir = self._tree + 'dir0' + os.sep
+        os.chmod(subdir + 'file0.txt', stat.S_IRUSR)
+        os.chmod(subdir, stat.S_IRUSR | stat.S_IXUSR)
+        deleter = TreeDeleter(1)
+        self.assertTrue(deleter.removeTree(self._tree))
+        deleter.close()
+        self.assertFalse(os.path.exists(self._tree))
+
+    def testErrors(self):
+        errors = []
+        deleter = TreeDeleter(1, lambda msg, exc, path: errors.append(path))
+        self.assertFalse(deleter.removeTree(self._base + 'missing'))
+        self.assertEqual([self._base + 'missing' + os.sep], errors)
+        Util.writeFile(self._base + 'file.txt', 'x')
+        self.assertTrue(deleter.removeTree(self._base + 'file.txt'))
+        deleter.close()
+        self.assertFalse(os.path.exists(self._base + 'file.txt'))
+        self.assertEqual(1, deleter._countErrors)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil
+from dirsync.durability import DurabilityTracker
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('durabilitytest', True)
+        self._dir = self._base + 'dir'
+        Util.mkDir(self._dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def write(self, tracker, node, content):
+        temp = self._dir + os.sep + node + '.tmp'
+        Util.writeFile(temp, content)
+        tracker.replace(temp, self._dir + os.sep + node)
+
+    def testDir(self):
+        tracker = DurabilityTracker('dir')
+        self.assertTrue(tracker.isAtomic())
+        self.write(tracker, 'file1.txt', 'abc')
+        self.write(tracker, 'file2.txt', 'def')
+        Util.writeFile(self._dir + os.sep + 'file3.txt', 'ghi')
+        tracker.fileWritten(self._dir + os.sep + 'file3.txt')
+        self.assertEqual(0, tracker._countFiles)
+        # the batch runs at the directory boundary
+        tracker.dirDone(self._dir + os.sep)
+        self.assertEqual(3, tracker._countFiles)
+        self.assertEqual(1, tracker._countDirs)
+        self.assertEqual('abc', Util.readFileAsString(self._dir + os.sep + 'file1.txt'))
+        self.assertEqual(['file1.txt', 'file2.txt', 'file3.txt'], 
+            sorted(os.listdir(self._dir)))
+        tracker.dirDone(self._dir)
+        self.assertEqual(1, tracker._countDirs)
+
+    def testFile(self):
+        tracker = DurabilityTracker('file')
+        self.write(tracker, 'file1.txt', 'abc')
+        self.assertEqual(1, tracker._countFiles)
+        self.assertEqual(0, tracker._countDirs)
+        os.mkdir(self._dir + os.sep + 'sub')
+        tracker.entryChanged(self._dir + os.sep + 'sub' + os.sep)
+        # the rest is synced at the end of the run
+        tracker.flush([self._base])
+        self.assertEqual(1, tracker._countDirs)
+        self.assertEqual(0, len(tracker._dirs))
+
+    def testFilesystem(self):
+        tracker = DurabilityTracker('fs')
+        self.write(tracker, 'file1.txt', 'abc')
+        tracker.dirDone(self._dir)
+        self.assertEqual(0, tracker._countFiles + tracker._countDirs)
+        tracker.flush([self._base, self._dir, self._base + 'missing'])
+        self.assertEqual(1, tracker._countFilesystems)
+
+    def testNone(self):
+        errors = []
+        tracker = DurabilityTracker('none', lambda msg, exc, path: errors.append(path))
+        self.assertFalse(tracker.isAtomic())
+        self.write(tracker, 'file1.txt', 'abc')
+        tracker.entryChanged(self._dir + os.sep + 'file1.txt')
+        tracker.dirDone(self._dir)
+        tracker.flush([self._base + 'missing'])
+        self.assertEqual(0, tracker._countFiles + tracker._countDirs 
+            + tracker._countFilesystems)
+        self.assertEqual([], errors)
+
+if __name__ == "__main__":
+    unittest.main()
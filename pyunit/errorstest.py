@@ -0,0 +1,46 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, json, shutil, errno
+from dirsync.errors import ErrorLog
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('errorstest', True)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testAdd(self):
+        log = ErrorLog(2, 3, 5, self._base + 'error.log', 
+            self._base + 'error.json', None)
+        for no in range(10):
+            exc = PermissionError(errno.EACCES, 'Permission denied', 
+                '/data/dir%d/file%d' % (no % 2, no))
+            log.add('error %d\n' % no, exc, '/data/dir%d/file%d' % (no % 2, no))
+        log.add('no exception\n')
+        log.close()
+        self.assertEqual(11, log._count)
+        self.assertEqual(['error 0\n', 'error 1\n'], log._first)
+        self.assertEqual(['error 8\n', 'error 9\n', 'no exception\n'], list(log._last))
+        self.assertEqual(6, log.omitted())
+        self.assertEqual([('EACCES', 10), ('message', 1)], log.topKinds())
+        self.assertEqual([('/data/dir0/', 5), ('/data/dir1/', 5)], log.topDirs())
+        lines = Util.readFileAsString(self._base + 'error.log').splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertEqual('further errors are only counted', lines[5])
+        with open(self._base + 'error.json', 'r') as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual(6, len(records))
+        self.assertEqual({'time': records[0]['time'], 'kind': 'EACCES',
+            'msg': 'error 0', 'path': '/data/dir0/file0', 'errno': errno.EACCES},
+            records[0])
+
+    def testKindOf(self):
+        self.assertEqual('message', ErrorLog.kindOf(None))
+        self.assertEqual('ENOENT', ErrorLog.kindOf(FileNotFoundError(
+            errno.ENOENT, 'x')))
+        self.assertEqual('ValueError', ErrorLog.kindOf(ValueError('x')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil, time
+from dirsync.hashing import FileHasher
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('hashingtest', True)
+        self._file1 = self._base + 'file1.txt'
+        self._file2 = self._base + 'file2.txt'
+        Util.writeFile(self._file1, 'abc' * 1000)
+        Util.writeFile(self._file2, 'abd' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testDigest(self):
+        hasher = FileHasher(self._base, 100)
+        digest1 = hasher.digest(self._file1, os.lstat(self._file1))
+        digest2 = hasher.digest(self._file2, os.lstat(self._file2))
+        self.assertNotEqual(digest1, digest2)
+        self.assertEqual(2, hasher._countFiles)
+        self.assertEqual(6000, hasher._bytes)
+        hasher.close()
+        hasher = FileHasher(self._base)
+        self.assertEqual(digest1, hasher.digest(self._file1, os.lstat(self._file1)))
+        self.assertEqual(0, hasher._countFiles)
+        self.assertEqual(1, hasher._countCached)
+        Util.writeFile(self._file1, 'abd' * 1000)
+        self.assertEqual(digest2, hasher.digest(self._file1, os.lstat(self._file1)))
+        self.assertEqual(1, hasher._countFiles)
+        self.assertTrue(hasher.throughput() > 0)
+        hasher.close()
+
+    def testRewrittenInPlace(self):
+        hasher = FileHasher(self._base)
+        digest1 = hasher.digest(self._file1, os.lstat(self._file1))
+        before = os.lstat(self._file1)
+        # same size, same inode, the modification time restored
+        time.sleep(0.01)
+        with open(self._file1, 'r+b') as fp:
+            fp.write(b'abd' * 1000)
+        os.utime(self._file1, ns=(before.st_atime_ns, before.st_mtime_ns))
+        info = os.lstat(self._file1)
+        self.assertEqual(before.st_ino, info.st_ino)
+        self.assertEqual(before.st_mtime_ns, info.st_mtime_ns)
+        self.assertNotEqual(digest1, hasher.digest(self._file1, info))
+        self.assertEqual(2, hasher._countFiles)
+        hasher.forget(info)
+        hasher.digest(self._file1, info)
+        self.assertEqual(3, hasher._countFiles)
+        hasher.close()
+
+if __name__ == "__main__":
+    unittest.main()
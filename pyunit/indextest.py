@@ -0,0 +1,95 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil, time
+from dirsync.redirsync import Sync
+from dirsync.index import StateIndex
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('indextest', True)
+        self._home = self._base + 'home'
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        Util.mkDir(self._home)
+        Util.mkDir(self._src + 'dir1')
+        Util.mkDir(self._trg)
+        Util.writeFile(self._src + 'file1.txt', 'abc')
+        Util.writeFile(self._src + 'dir1' + os.sep + 'file2.txt', 'abcd')
+        self._oldHome = os.environ.get('REDIRSYNC_HOME')
+        os.environ['REDIRSYNC_HOME'] = self._home
+
+    def tearDown(self):
+        if self._oldHome == None:
+            del os.environ['REDIRSYNC_HOME']
+        else:
+            os.environ['REDIRSYNC_HOME'] = self._oldHome
+        shutil.rmtree(self._base)
+
+    def ageTarget(self):
+        past = time.time() - 60
+        for path in (self._trg, self._trg + 'dir1'):
+            os.utime(path, (past, past))
+
+    def synchronize(self, chunkSize = None):
+        sync = Sync()
+        if chunkSize != None:
+            sync._settings._scanChunkSize = chunkSize
+        sync._settings._useIndex = True
+        sync._settings._addNonExisting = True
+        sync._settings._copyNewer = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([self._src], self._trg, False)
+        sync.close()
+        return sync
+
+    def testSkipTarget(self):
+        self.synchronize()
+        self.ageTarget()
+        sync = self.synchronize()
+        self.assertEqual(4, sync._walker._countReads)
+        sync = self.synchronize()
+        self.assertEqual(2, sync._walker._countReads)
+        self.assertEqual(0, sync._modified._countFiles)
+        index = StateIndex(self._home, self._src, self._trg)
+        self.assertEqual([], index.verify())
+        Util.writeFile(self._trg + 'file1.txt', 'changed')
+        messages = index.verify()
+        index.close(False)
+        self.assertEqual(1, len(messages))
+        self.assertTrue(messages[0].endswith('file1.txt: modified'))
+
+    def testChunks(self):
+        # more entries than a chunk: recorded in several steps
+        for no in range(7):
+            Util.mkDir(self._src + 'sub%d' % no)
+            Util.writeFile(self._src + 'file%d.dat' % no, str(no))
+        sync = self.synchronize(3)
+        self.ageTarget()
+        for no in range(7):
+            path = self._trg + 'sub%d' % no
+            os.utime(path, (time.time() - 60, time.time() - 60))
+        sync = self.synchronize(3)
+        # 1 + 1 + 7 directories
+        self.assertEqual(9 * 2, sync._walker._countReads)
+        sync = self.synchronize(3)
+        # only the sources are read:
+        self.assertEqual(9, sync._walker._countReads)
+        self.assertEqual(0, sync._modified._countFiles)
+        index = StateIndex(self._home, self._src, self._trg)
+        self.assertEqual([], index.verify())
+        index.close(False)
+
+    def testModifiedTarget(self):
+        self.synchronize()
+        self.ageTarget()
+        self.synchronize()
+        os.unlink(self._trg + 'dir1' + os.sep + 'file2.txt')
+        sync = self.synchronize()
+        self.assertEqual(1, sync._modified._countFiles)
+        self.assertTrue(os.path.exists(self._trg + 'dir1' + os.sep + 'file2.txt'))
+
+if __name__ == "__main__":
+    unittest.main()
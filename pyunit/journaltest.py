@@ -0,0 +1,69 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil
+from dirsync.redirsync import Sync
+from dirsync.journal import Journal
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('journaltest', True)
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        Util.mkDir(self._src + 'dir1')
+        Util.mkDir(self._trg + 'dir1')
+        self._content = ''.join(chr(65 + no % 26) * 100 for no in range(30))
+        Util.writeFile(self._src + 'big.dat', self._content)
+        Util.writeFile(self._src + 'dir1' + os.sep + 'file1.txt', 'abc')
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testLoad(self):
+        name = self._base + 'test.journal'
+        journal = Journal(name, False)
+        srcStat = os.lstat(self._src + 'big.dat')
+        journal.dirDone('/a/')
+        journal.copyProgress('/a/b', '/a/b.part', 100, srcStat)
+        journal.copyProgress('/a/c', '/a/c.part', 100, srcStat)
+        journal.copyDone('/a/c')
+        journal.close(False)
+        with open(name, 'a') as fp:
+            fp.write('["D", "/incomp')
+        journal = Journal(name, True)
+        self.assertTrue(journal.isDone('/a/'))
+        self.assertFalse(journal.isDone('/incomp'))
+        self.assertEqual(100, journal.partialCopy('/a/b')._bytes)
+        self.assertEqual(None, journal.partialCopy('/a/c'))
+        journal.close(True)
+        self.assertFalse(os.path.exists(name))
+
+    def testResume(self):
+        sync = Sync()
+        sync._fnError = self._base + 'error.log'
+        sync._settings._addNonExisting = True
+        sync._settings._verboseLevel = 0
+        sync._settings._resume = True
+        sync._settings._resumableMinSize = 1000
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        name = sync.journalName([self._src], self._trg)
+        trgBig = self._trg + 'big.dat'
+        journal = Journal(name, False)
+        journal.dirDone(self._trg + 'dir1' + os.sep)
+        # written by a former process:
+        temp = self._trg + '.big.dat.redirsync.{}.part'.format(os.getpid() + 1)
+        journal.copyProgress(trgBig, temp, 1000, os.lstat(self._src + 'big.dat'))
+        journal.close(False)
+        Util.writeFile(temp, self._content[0:1200])
+        sync.synchronize([self._src], self._trg, False)
+        sync.close()
+        self.assertEqual(self._content, Util.readFileAsString(trgBig))
+        self.assertEqual(['big.dat', 'dir1'], sorted(os.listdir(self._trg)))
+        self.assertEqual([1, 2000], sync._copier._methodStatistics['resumed'])
+        self.assertFalse(os.path.exists(self._trg + 'dir1' + os.sep + 'file1.txt'))
+        self.assertEqual(1, sync._countResumedDirs)
+        self.assertFalse(os.path.exists(name))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil
+from dirsync.links import LinkTracker
+from dirsync.hashing import FileHasher
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('linkstest', True)
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        Util.mkDir(self._src)
+        Util.mkDir(self._trg)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def copy(self, tracker, node):
+        src = self._src + node
+        srcStat = os.lstat(src)
+        keys = tracker.keys(src, srcStat)
+        linked = tracker.link(keys, self._trg + node, srcStat)
+        if not linked:
+            shutil.copy2(src, self._trg + node)
+            tracker.register(keys, self._trg + node)
+        return linked
+
+    def testHardLinks(self):
+        Util.writeFile(self._src + 'a.txt', 'abc')
+        os.link(self._src + 'a.txt', self._src + 'b.txt')
+        Util.writeFile(self._src + 'c.txt', 'abc')
+        tracker = LinkTracker()
+        self.assertFalse(self.copy(tracker, 'a.txt'))
+        self.assertTrue(self.copy(tracker, 'b.txt'))
+        self.assertFalse(self.copy(tracker, 'c.txt'))
+        self.assertEqual(os.stat(self._trg + 'a.txt').st_ino, 
+            os.stat(self._trg + 'b.txt').st_ino)
+        self.assertEqual(1, tracker._countLinked)
+        self.assertEqual(3, tracker._bytesSaved)
+
+    def testDedup(self):
+        for node in ('a.txt', 'b.txt', 'c.txt'):
+            Util.writeFile(self._src + node, 'x' * 100 if node != 'c.txt' else 'y' * 100)
+            os.utime(self._src + node, (1000, 1000))
+        hasher = FileHasher(None)
+        tracker = LinkTracker(False, hasher, 10)
+        self.assertFalse(self.copy(tracker, 'a.txt'))
+        self.assertTrue(self.copy(tracker, 'b.txt'))
+        self.assertFalse(self.copy(tracker, 'c.txt'))
+        self.assertEqual(1, tracker._countDeduplicated)
+        self.assertEqual(2, os.stat(self._trg + 'a.txt').st_nlink)
+        # a changed registered target is not used:
+        Util.writeFile(self._trg + 'c.txt', 'changed')
+        Util.writeFile(self._src + 'd.txt', 'y' * 100)
+        os.utime(self._src + 'd.txt', (1000, 1000))
+        self.assertFalse(self.copy(tracker, 'd.txt'))
+
+    def testLimit(self):
+        for node in ('a.txt', 'b.txt', 'c.txt', 'd.txt'):
+            Util.writeFile(self._src + node, node[0] * 100)
+        os.link(self._src + 'a.txt', self._src + 'a2.txt')
+        os.link(self._src + 'b.txt', self._src + 'b2.txt')
+        os.link(self._src + 'c.txt', self._src + 'c2.txt')
+        tracker = LinkTracker(maxTargets=2)
+        self.copy(tracker, 'a.txt')
+        self.copy(tracker, 'b.txt')
+        # used: a.txt is the most recent, b.txt the oldest
+        self.assertTrue(self.copy(tracker, 'a2.txt'))
+        self.copy(tracker, 'c.txt')
+        self.assertEqual(2, len(tracker._targets))
+        self.assertEqual(1, tracker._countForgotten)
+        self.assertFalse(self.copy(tracker, 'b2.txt'))
+        self.assertTrue(self.copy(tracker, 'c2.txt'))
+
+if __name__ == "__main__":
+    unittest.main()
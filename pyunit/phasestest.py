@@ -0,0 +1,41 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, threading
+from dirsync.phases import PhaseStatistics
+
+class Test(unittest.TestCase):
+    def testAdd(self):
+        phases = PhaseStatistics()
+        phases.add('stat', 0.5)
+        phases.add('listdir', 0.25, 2)
+        def work():
+            for ix in range(100):
+                phases.add('stat', 0.01)
+        threads = [threading.Thread(target=work) for ix in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        totals = phases.totals()
+        self.assertEqual(401, totals['stat'][0])
+        self.assertAlmostEqual(4.5, totals['stat'][1])
+        self.assertEqual((2, 0.25), totals['listdir'])
+        self.assertEqual((0, 0.0), totals['copy'])
+        self.assertAlmostEqual(4.75, phases.metadataSeconds())
+
+    def testTopItems(self):
+        phases = PhaseStatistics(3)
+        for ix in range(10):
+            phases.dirDone('/dir%d/' % ix, ix / 10.0)
+            phases.copyDone('/file%d' % ix, ix * 1000, 0.1)
+        self.assertEqual([(0.9, '/dir9/'), (0.8, '/dir8/'), (0.7, '/dir7/')],
+            phases.slowestDirs())
+        self.assertEqual(['/file9', '/file8', '/file7'],
+            [item[2] for item in phases.largestCopies()])
+        self.assertEqual(10, phases.totals()['copy'][0])
+        values = phases.toDict()
+        self.assertEqual(9000, values['largestCopies'][0]['bytes'])
+        self.assertEqual('/dir9/', values['slowestDirs'][0]['path'])
+
+if __name__ == "__main__":
+    unittest.main()
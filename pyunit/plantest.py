@@ -0,0 +1,51 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil, json
+from dirsync.redirsync import Sync, main
+from dirsync.plan import Action, readPlan
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('plantest', True)
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        self._plan = self._base + 'plan.jsonl'
+        Util.mkDir(self._src + 'dir1')
+        Util.mkDir(self._trg)
+        Util.writeFile(self._src + 'file1.txt', 'abc')
+        Util.writeFile(self._src + 'dir1' + os.sep + 'file2.txt', 'abcd')
+        Util.writeFile(self._trg + 'orphan.txt', 'x')
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testAction(self):
+        action = Action('copy', '+', '/a', '/b', os.lstat(self._src + 'file1.txt'))
+        values = json.loads(json.dumps(action.toDict()))
+        self.assertEqual('copy', values['op'])
+        self.assertEqual(3, values['size'])
+        copy = Action.fromDict(values)
+        self.assertEqual('/a', copy._src)
+        self.assertEqual(3, copy._size)
+        self.assertFalse(copy._statsKnown)
+
+    def testDryRunAndApply(self):
+        self.assertEqual(0, main(['--add', '--delete', '--dry-run', 
+            '--plan-file', self._plan, self._src, self._trg]))
+        self.assertEqual(['orphan.txt'], os.listdir(self._trg))
+        actions = [(action._op, action._trg[len(self._trg):]) 
+            for action in readPlan(self._plan)]
+        self.assertEqual(sorted([('copy', 'file1.txt'), ('delete', 'orphan.txt'),
+            ('mkdir', 'dir1' + os.sep), ('copy', 'dir1' + os.sep + 'file2.txt')]),
+            sorted(actions))
+        self.assertEqual(0, main(['--apply-plan', self._plan]))
+        self.assertEqual(['dir1', 'file1.txt'], sorted(os.listdir(self._trg)))
+        self.assertEqual('abcd', Util.readFileAsString(self._trg + 'dir1' 
+            + os.sep + 'file2.txt'))
+        # applying the plan again must not fail at the existing directory:
+        self.assertEqual(0, main(['--apply-plan', self._plan]))
+        self.assertEqual(['file2.txt'], os.listdir(self._trg + 'dir1'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, threading
+from dirsync.pool import WorkerPool
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def count(self, pool, depth):
+        with self._lock:
+            self._count += 1
+        if depth > 0:
+            for no in range(3):
+                pool.submit(self.count, pool, depth - 1)
+
+    def testSubtasks(self):
+        pool = WorkerPool(3, 2)
+        pool.submit(self.count, pool, 4)
+        pool.join()
+        pool.close()
+        self.assertEqual(1 + 3 + 9 + 27 + 81, self._count)
+
+    def raiseError(self):
+        raise ValueError('expected')
+
+    def testException(self):
+        pool = WorkerPool(2)
+        pool.submit(self.raiseError)
+        self.assertRaises(ValueError, pool.join)
+        pool.submit(self.count, pool, 0)
+        pool.join()
+        pool.close()
+        self.assertEqual(1, self._count)
+
+    def testBlocking(self):
+        event = threading.Event()
+        started = threading.Event()
+        pool = WorkerPool(1, 1, True)
+        pool.submit(lambda: started.set() or event.wait())
+        started.wait()
+        pool.submit(self.count, None, 0)
+        threading.Timer(0.2, event.set).start()
+        # the queue is full: waits for the worker
+        pool.submit(self.count, None, 0)
+        pool.join()
+        pool.close()
+        self.assertEqual(2, self._count)
+        self.assertEqual(1, pool._countWaits)
+        self.assertTrue(pool._waitSeconds > 0.1)
+
+    def testTrySubmit(self):
+        event = threading.Event()
+        started = threading.Event()
+        pool = WorkerPool(1, 1)
+        self.assertTrue(pool.trySubmit(lambda: started.set() or event.wait()))
+        started.wait()
+        self.assertTrue(pool.trySubmit(self.count, None, 0))
+        # the queue is full: nothing is done
+        self.assertFalse(pool.trySubmit(self.count, None, 0))
+        event.set()
+        pool.join()
+        pool.close()
+        self.assertEqual(1, self._count)
+
+if __name__ == "__main__":
+    unittest.main()
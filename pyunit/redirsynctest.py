@@ -1,9 +1,9 @@
 # Project: https://github.com/republib/republib/wiki
 # Licence: Public domain: http://www.wtfpl.net
 
-import unittest, os.path, re, time
-from dirsync.redirsync import Sync, main, SearchCriteria
-from reutil.util import say
+import unittest, os.path, re, time, shutil, fnmatch, json, stat, threading
+from dirsync.redirsync import Sync, main, SearchCriteria, SyncPair
+from reutil.util import say, Util
 from reutil.config import Config
 
 class Test(unittest.TestCase):
@@ -39,6 +39,10 @@ excluded-files=(~|\.(bak|)$
        
         self._args = DummyArgs(["patterns:", "verbose:1", "update:1", "size:1",
             "add:1"])
+        # the caches of Sync must not touch the real home directory
+        self._home = Util.getTempDir('redirsynctest.home', True)
+        self._oldHome = os.environ.get('REDIRSYNC_HOME')
+        os.environ['REDIRSYNC_HOME'] = self._home
 
     def populateSrc(self):
         self.mkDir(self._src)
@@ -51,7 +55,11 @@ excluded-files=(~|\.(bak|)$
         
 
     def tearDown(self):
-        pass
+        if self._oldHome == None:
+            del os.environ['REDIRSYNC_HOME']
+        else:
+            os.environ['REDIRSYNC_HOME'] = self._oldHome
+        shutil.rmtree(self._home)
     
     def log(self, msg):
         say(msg)
@@ -126,6 +134,25 @@ excluded-files=(~|\.(bak|)$
         self.assertEquals(False, criteria.matches("anytmp"))
         self.assertEquals(False, criteria.matches("anytmp.bak"))
        
+    def testMatchesCompiled(self):
+        patterns = ["*.txt", "*.log", "-*.bak", "*pic*", "-*tmp[1-9].txt", 
+            "-*~", "a?c", "-[!a]*.log", "-*"]
+        names = ["test.txt", "x.tmp3.txt", "mypicture", "pic.bak", "abc",
+            "a.log", "b.log", "file~", "", "tmp1.txt", "a[c"]
+        for count in range(1, len(patterns) + 1):
+            criteria = SearchCriteria()
+            criteria.addPatterns(patterns[0:count])
+            for name in names:
+                expected = "*" in patterns[0:count]
+                for pattern in patterns[0:count]:
+                    if not pattern.startswith("-") and fnmatch.fnmatch(name, pattern):
+                        expected = True
+                for pattern in patterns[0:count]:
+                    if pattern.startswith("-") and fnmatch.fnmatch(name, pattern[1:]):
+                        expected = False
+                self.assertEqual(expected, criteria.matches(name), name)
+                self.assertEqual(expected, criteria.matches(name), name)
+
     def testDeleteFile(self):
         sync = Sync()
         full = self._base + os.sep + 'todelete.dat'
@@ -179,14 +206,17 @@ excluded-files=(~|\.(bak|)$
         sync._settings._browser = '/usr/bin/konqueror'
         count = sync._settings._maxFirstErrors + 3 + sync._settings._maxLastErrors
         self.log('expecting {} errors'.format(count))
-        for no in xrange(count):
+        for no in range(count):
             sync.error('Error No ' + str(no + 1))
         fn = sync.makeReport()
         sync.close()
-        sync.showInBrowser(fn)
+        if os.path.exists(sync._settings._browser):
+            sync.showInBrowser(fn)
         self.assertEqual(count, sync._countErrors)
-        self.assertEquals(sync._settings._maxFirstErrors, len(sync._firstErrors))
-        self.assertEquals(sync._settings._maxLastErrors, len(sync._lastErrors))
+        self.assertEquals(sync._settings._maxFirstErrors, len(sync._errorLog._first))
+        self.assertEquals(sync._settings._maxLastErrors, len(sync._errorLog._last))
+        self.assertEqual('Error No 6\n', sync._errorLog._last[0])
+        self.assertTrue(Util.readFileAsString(fn).find('(3 Fehler ausgelassen)') > 0)
      
     def testReplaceVariables(self):
         sync = Sync()
@@ -239,6 +269,674 @@ excluded-files=(~|\.(bak|)$
               ]
         self.assertEquals(0, main(argv))
 
+    def testCopyJobs(self):
+        base = Util.getTempDir('redirsynctest.copyjobs', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        for dirNo in range(5):
+            path = src + 'dir%d' % dirNo + os.sep
+            Util.mkDir(path)
+            for fileNo in range(20):
+                Util.writeFile(path + 'file%d.txt' % fileNo, 'x' * fileNo)
+        Util.mkDir(trg + 'dir0' + os.sep + 'orphan')
+        Util.writeFile(trg + 'dir0' + os.sep + 'orphan.txt')
+        sync = Sync()
+        sync._settings._jobs = 2
+        sync._settings._copyJobs = 3
+        sync._settings._copyQueueSize = 2
+        sync._settings._addNonExisting = True
+        sync._settings._deleteFilesWithoutSource = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(100, sync._modified._countFiles)
+        self.assertEqual(5 * 190, sync._modified._sizeFiles)
+        self.assertEqual(None, sync._copyPool)
+        self.assertFalse(os.path.exists(trg + 'dir0' + os.sep + 'orphan.txt'))
+        self.assertFalse(os.path.exists(trg + 'dir0' + os.sep + 'orphan'))
+        self.assertEqual('x' * 19, Util.readFileAsString(trg + 'dir4' + os.sep 
+            + 'file19.txt'))
+        shutil.rmtree(base)
+
+    def testHardLinks(self):
+        base = Util.getTempDir('redirsynctest.links', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src + 'dir1')
+        Util.writeFile(src + 'file1.txt', 'x' * 100)
+        os.link(src + 'file1.txt', src + 'dir1' + os.sep + 'file2.txt')
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._copyNewer = True
+        sync._settings._hardLinks = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(1, sync._links._countLinked)
+        self.assertEqual(os.stat(trg + 'file1.txt').st_ino, 
+            os.stat(trg + 'dir1' + os.sep + 'file2.txt').st_ino)
+        # a new link to an unchanged target:
+        os.link(src + 'file1.txt', src + 'file3.txt')
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._copyNewer = True
+        sync._settings._hardLinks = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(1, sync._links._countLinked)
+        self.assertEqual(3, os.stat(trg + 'file1.txt').st_nlink)
+        shutil.rmtree(base)
+
+    def testLinkDest(self):
+        base = Util.getTempDir('redirsynctest.linkdest', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        Util.mkDir(src + 'dir1')
+        Util.writeFile(src + 'file1.txt', 'x' * 100)
+        Util.writeFile(src + 'dir1' + os.sep + 'file2.txt', 'y' * 100)
+        def run(target, linkDest):
+            sync = Sync()
+            sync._settings._addNonExisting = True
+            sync._settings._copyNewer = True
+            sync._settings._verboseLevel = 0
+            sync._settings._linkDest = linkDest
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            sync.synchronize([src], target, False)
+            sync.close()
+            return sync
+        run(base + 'snap.1000', None)
+        time.sleep(0.01)
+        Util.writeFile(src + 'file1.txt', 'changed')
+        sync = run(base + 'snap.{time}', 'auto')
+        self.assertEqual(base + 'snap.1000' + os.sep, sync._linkDestRoot)
+        current = base + 'snap.%d' % sync._startTime + os.sep
+        self.assertEqual(1, sync._linked._countFiles)
+        self.assertEqual(os.stat(base + 'snap.1000/dir1/file2.txt').st_ino,
+            os.stat(current + 'dir1/file2.txt').st_ino)
+        self.assertEqual('changed', Util.readFileAsString(current + 'file1.txt'))
+        self.assertEqual('x' * 100, Util.readFileAsString(base + 'snap.1000/file1.txt'))
+        shutil.rmtree(base)
+
+    def testLinkDestRerun(self):
+        base = Util.getTempDir('redirsynctest.rerun', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        Util.mkDir(src)
+        Util.writeFile(src + 'f', 'v1')
+        os.chmod(src + 'f', 0o444)
+        def run(target, linkDest, deltaMinSize = 0):
+            sync = Sync()
+            sync._settings._addNonExisting = True
+            sync._settings._copyNewer = True
+            sync._settings._copyDifferentSize = True
+            sync._settings._verboseLevel = 0
+            sync._settings._linkDest = linkDest
+            sync._settings._deltaMinSize = deltaMinSize
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            sync.synchronize([src], target, False)
+            sync.close()
+        run(base + 'snap.day1', None)
+        run(base + 'snap.day2', base + 'snap.day1')
+        self.assertEqual(os.stat(base + 'snap.day1/f').st_ino,
+            os.stat(base + 'snap.day2/f').st_ino)
+        os.chmod(src + 'f', 0o644)
+        Util.writeFile(src + 'f', 'v2 changed')
+        os.utime(src + 'f', (time.time() + 10, time.time() + 10))
+        # a second run into the same snapshot, also with delta copy
+        run(base + 'snap.day2', base + 'snap.day1', 1)
+        self.assertEqual('v2 changed', Util.readFileAsString(base + 'snap.day2/f'))
+        self.assertEqual('v1', Util.readFileAsString(base + 'snap.day1/f'))
+        self.assertEqual(0o444, stat.S_IMODE(os.stat(base + 'snap.day1/f').st_mode))
+        self.assertEqual(1, os.stat(base + 'snap.day1/f').st_nlink)
+        shutil.rmtree(base)
+
+    def testParallelSources(self):
+        base = Util.getTempDir('redirsynctest.sources', True)
+        shutil.rmtree(base)
+        sources = []
+        for no in range(4):
+            src = base + 'src%d' % no + os.sep
+            Util.mkDir(src + 'dir1')
+            for fileNo in range(5):
+                Util.writeFile(src + 'dir1' + os.sep + 'file%d.txt' % fileNo, 'x' * no)
+            sources.append(src)
+        trg = base + 'trg' + os.sep
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._parallelSources = 3
+        sync._settings._perDevice = 2
+        sync._settings._useIndex = True
+        sync._home = base
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize(sources, trg, True)
+        sync.close()
+        self.assertTrue(sync.isConcurrent(sync._pairs))
+        self.assertEqual(20, sync._modified._countFiles)
+        self.assertEqual('xxx', Util.readFileAsString(trg + 'src3' + os.sep 
+            + 'dir1' + os.sep + 'file4.txt'))
+        # a target inside another source: sequential
+        self.assertFalse(sync.isConcurrent([SyncPair(sources[0], trg), 
+            SyncPair(trg, sources[0] + 'copy' + os.sep)]))
+        shutil.rmtree(base)
+
+    def testOverlaps(self):
+        base = Util.getTempDir('redirsynctest.overlaps', True)
+        Util.mkDir(base + 'data' + os.sep + 'x')
+        os.symlink(base + 'data', base + 'link')
+        def overlaps(trg1, trg2):
+            return (SyncPair(base + 'src1', trg1).overlaps(SyncPair(base + 'src2', trg2)))
+        self.assertFalse(overlaps(base + 'data/x', base + 'data/xy'))
+        self.assertFalse(overlaps(base + 'data/xy/', base + 'data/x/'))
+        self.assertTrue(overlaps(base + 'data/x', base + 'data/x/sub'))
+        self.assertTrue(overlaps(base + 'data/y/../x', base + 'data/x'))
+        self.assertTrue(overlaps(base + 'link/x/', base + 'data/x/sub'))
+        cwd = os.getcwd()
+        os.chdir(base + 'data')
+        try:
+            self.assertTrue(overlaps('x', base + 'data/x'))
+            self.assertFalse(overlaps('x', base + 'data/xy'))
+        finally:
+            os.chdir(cwd)
+        # a target inside a source:
+        self.assertTrue(SyncPair(base + 'link', base + 'trg').overlaps(
+            SyncPair(base + 'src2', base + 'data/x')))
+        shutil.rmtree(base)
+
+    def testParallelSourcesPerDevice(self):
+        # A and B use device 1, C device 2: C must not wait for A or B
+        pairs = []
+        for name, device in (('A', 1), ('B', 1), ('C', 2)):
+            pair = SyncPair(self._src + name, self._trg + name)
+            pair._name = name
+            pair.devices = lambda device=device: [device]
+            pairs.append(pair)
+        events = []
+        lock = threading.Lock()
+        sync = Sync()
+        sync._settings._parallelSources = 2
+        sync._settings._perDevice = 1
+        def synchronizePair(pair, joinPools):
+            with lock:
+                events.append('+' + pair._name)
+            time.sleep(0.2)
+            with lock:
+                events.append('-' + pair._name)
+        sync.synchronizePair = synchronizePair
+        sync.synchronizeConcurrently(pairs)
+        sync.close()
+        self.assertEqual(6, len(events))
+        # C runs together with the first pair of device 1:
+        self.assertEqual(['+', '+'], [event[0] for event in events[0:2]])
+        self.assertIn('+C', events[0:2])
+        # never two pairs of device 1 at once:
+        for first, second in (('A', 'B'), ('B', 'A')):
+            if events.index('+' + first) < events.index('+' + second):
+                self.assertLess(events.index('-' + first), 
+                    events.index('+' + second))
+
+    def testStatsJson(self):
+        base = Util.getTempDir('redirsynctest.stats', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src + 'dir1')
+        Util.writeFile(src + 'file1.txt', 'x' * 100)
+        Util.writeFile(src + 'dir1' + os.sep + 'file2.txt', 'x' * 10)
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._verboseLevel = 0
+        sync._fnStatsJson = base + 'stats.json'
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        with open(base + 'stats.json', 'r') as fp:
+            values = json.load(fp)
+        self.assertEqual(2, values['modified']['files'])
+        self.assertEqual(2, values['phases']['copy']['count'])
+        self.assertEqual(2, values['phases']['compare']['count'])
+        self.assertEqual(4, values['phases']['listdir']['count'])
+        self.assertEqual(trg + 'file1.txt', values['largestCopies'][0]['path'])
+        self.assertEqual(2, len(values['slowestDirs']))
+        shutil.rmtree(base)
+
+    def testSparse(self):
+        base = Util.getTempDir('redirsynctest.sparse', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src)
+        # the large one is copied resumable (via the journal)
+        for node, size in (('small.img', 8 * 1024 * 1024), 
+                ('large.img', 80 * 1024 * 1024)):
+            with open(src + node, 'wb') as fp:
+                fp.write(b'data')
+                fp.truncate(size)
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._verboseLevel = 0
+        sync._fnStatsJson = base + 'stats.json'
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        with open(base + 'stats.json', 'r') as fp:
+            values = json.load(fp)
+        self.assertEqual(88 * 1024 * 1024, os.path.getsize(trg + 'small.img') 
+            + os.path.getsize(trg + 'large.img'))
+        if sync._copier._countSparse > 0:
+            self.assertEqual(2, sync._copier._countSparse)
+            self.assertTrue(sync._modified._sizeHoles > 87 * 1024 * 1024)
+            self.assertTrue(os.stat(trg + 'large.img').st_blocks * 512 < 1024 * 1024)
+        self.assertEqual(sync._modified._sizeHoles, values['holeBytes'])
+        shutil.rmtree(base)
+
+    def testPageCache(self):
+        base = Util.getTempDir('redirsynctest.cache', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src)
+        Util.writeFile(src + 'large.dat', 'x' * 3000000)
+        Util.writeFile(src + 'small.txt', 'x' * 100)
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._verboseLevel = 0
+        sync._settings._pageCache = 'drop'
+        sync._settings._directMinSize = 2000000
+        sync._fnStatsJson = base + 'stats.json'
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual('x' * 3000000, Util.readFileAsString(trg + 'large.dat'))
+        self.assertTrue('--page-cache=drop' in sync._settings.getSettings())
+        if sync._copier._dropCache:
+            with open(base + 'stats.json', 'r') as fp:
+                values = json.load(fp)['pageCache']
+            self.assertEqual(sync._copier._countDirect, values['directFiles'])
+            self.assertEqual(sync._cacheBefore, values['cachedBefore'])
+            self.assertTrue(os.path.exists(sync.makeReport()))
+        shutil.rmtree(base)
+
+    def testDurability(self):
+        base = Util.getTempDir('redirsynctest.durability', True)
+        src = base + 'src' + os.sep
+        Util.mkDir(src + 'dir1')
+        Util.writeFile(src + 'file1.txt', 'x' * 100)
+        Util.writeFile(src + 'dir1' + os.sep + 'file2.txt', 'x' * 10)
+        for mode in ('none', 'file', 'dir', 'fs'):
+            trg = base + mode + os.sep
+            Util.mkDir(trg)
+            Util.writeFile(trg + 'file1.txt', 'old')
+            sync = Sync()
+            sync._settings._addNonExisting = True
+            sync._settings._copyDifferentSize = True
+            sync._settings._verboseLevel = 0
+            sync._settings._durability = mode
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            sync.synchronize([src], trg, False)
+            sync.close()
+            self.assertEqual('x' * 100, Util.readFileAsString(trg + 'file1.txt'))
+            # no temporary files are left
+            self.assertEqual(['dir1', 'file1.txt'], sorted(os.listdir(trg)))
+            self.assertEqual(['file2.txt'], os.listdir(trg + 'dir1'))
+            tracker = sync._durability
+            if mode == 'file' or mode == 'dir':
+                self.assertEqual(2, tracker._countFiles, mode)
+                self.assertEqual(2, tracker._countDirs, mode)
+            elif mode == 'fs':
+                self.assertEqual(1, tracker._countFilesystems)
+            else:
+                self.assertEqual(0, tracker._countFiles + tracker._countDirs)
+        shutil.rmtree(base)
+
+    def testJobs(self):
+        base = Util.getTempDir('redirsynctest.jobs', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        for dirNo in range(5):
+            path = src + 'dir%d' % dirNo + os.sep + 'sub' + os.sep
+            Util.mkDir(path)
+            for fileNo in range(10):
+                Util.writeFile(path + 'file%d.txt' % fileNo, 'x' * fileNo)
+        Util.mkDir(trg + 'dir0' + os.sep + 'sub')
+        Util.writeFile(trg + 'dir0' + os.sep + 'sub' + os.sep + 'orphan.txt')
+        sync = Sync()
+        sync._settings._jobs = 4
+        sync._settings._minParallelCopySize = 5
+        sync._settings._addNonExisting = True
+        sync._settings._deleteFilesWithoutSource = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(50, sync._total._countFiles)
+        self.assertEqual(50, sync._modified._countFiles)
+        self.assertEqual(5 * 45, sync._modified._sizeFiles)
+        self.assertEqual(11, sync._completed._countDirs)
+        self.assertFalse(os.path.exists(trg + 'dir0' + os.sep + 'sub' 
+            + os.sep + 'orphan.txt'))
+        self.assertEqual('x' * 9, Util.readFileAsString(trg + 'dir4' + os.sep 
+            + 'sub' + os.sep + 'file9.txt'))
+        shutil.rmtree(base)
+
+    def testDeepAndWide(self):
+        base = Util.getTempDir('redirsynctest.deep', True)
+        # shutil.rmtree() would reach the recursion limit
+        sync = Sync()
+        sync.rmTree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        # deeper than the recursion limit of the interpreter
+        deep = src
+        Util.mkDir(src)
+        for no in range(1200):
+            deep += 'd' + os.sep
+            os.mkdir(deep)
+        Util.writeFile(deep + 'deep.txt', 'deep')
+        for no in range(25):
+            Util.writeFile(src + 'file%02d.txt' % no, str(no))
+        Util.mkDir(trg)
+        for no in range(20, 30):
+            Util.writeFile(trg + 'file%02d.txt' % no, 'x')
+        sync._settings._maxDepth = 2000
+        sync._settings._scanChunkSize = 4
+        sync._settings._addNonExisting = True
+        sync._settings._copyDifferentSize = True
+        sync._settings._deleteFilesWithoutSource = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(0, sync._countErrors)
+        self.assertTrue(sync._walker._countSpilled >= 2)
+        self.assertEqual('deep', Util.readFileAsString(
+            trg + os.sep.join(['d'] * 1200) + os.sep + 'deep.txt'))
+        self.assertEqual(['d'] + ['file%02d.txt' % no for no in range(25)],
+            sorted(os.listdir(trg)))
+        self.assertEqual('21', Util.readFileAsString(trg + 'file21.txt'))
+        sync.rmTree(base)
+        sync.close()
+        self.assertFalse(os.path.exists(base))
+
+    def testLocalConfig(self):
+        base = Util.getTempDir('redirsynctest.local', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        for path in ('', 'a/', 'a/deep/', 'b/'):
+            Util.mkDir(src + path)
+            Util.mkDir(trg + path)
+            Util.writeFile(src + path + 'file.txt', path)
+            Util.writeFile(src + path + 'file.tmp', path)
+            Util.writeFile(trg + path + 'orphan.txt', path)
+        # inherited by a/deep, not by b:
+        Util.writeFile(src + 'a/.redirsync.conf', 
+            'patterns.node=-*.tmp\ncopy.mode.removed=delete\n')
+        sync = Sync()
+        settings = sync._settings
+        settings._addNonExisting = True
+        settings._deleteFilesWithoutSource = True
+        settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        for run in range(2):
+            sync.synchronize([src], trg, False)
+        sync.close()
+        self.assertEqual(0, sync._countErrors)
+        self.assertTrue(sync._settings is settings)
+        # one directory per run:
+        self.assertEqual(2, sync._countLocalConfigs)
+        self.assertEqual((1, 1), (sync._configCache._countParsed, 
+            sync._configCache._countHits))
+        for path in ('', 'b/'):
+            self.assertTrue(os.path.exists(trg + path + 'file.tmp'))
+            self.assertFalse(os.path.exists(trg + path + 'orphan.txt'))
+        for path in ('a/', 'a/deep/'):
+            self.assertEqual(path, Util.readFileAsString(trg + path + 'file.txt'))
+            self.assertFalse(os.path.exists(trg + path + 'file.tmp'))
+            self.assertTrue(os.path.exists(trg + path + 'orphan.txt'))
+        self.assertTrue(settings._node.matches('x.tmp'))
+        shutil.rmtree(base)
+
+    def testLocalConfigErrors(self):
+        base = Util.getTempDir('redirsynctest.localerr', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        for path in ('', 'a/', 'b/'):
+            Util.mkDir(src + path)
+            Util.writeFile(src + path + 'file.tmp', path)
+        Util.mkDir(trg)
+        # invalid: the whole file is ignored
+        Util.writeFile(src + 'a/.redirsync.conf', 
+            'maxDepth=abc\npatterns.node=-*.tmp\n')
+        # jobs and durability concern the whole run only
+        Util.writeFile(src + 'b/.redirsync.conf', 
+            'jobs=8\ndurability=fs\npatterns.node=-*.tmp\n')
+        sync = Sync()
+        settings = sync._settings
+        settings._addNonExisting = True
+        settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        for run in range(2):
+            sync.synchronize([src], trg, False)
+        sync.close()
+        # reported once, not per run:
+        self.assertEqual(3, sync._countErrors)
+        self.assertTrue(os.path.exists(trg + 'a/file.tmp'))
+        self.assertFalse(os.path.exists(trg + 'b/file.tmp'))
+        self.assertEqual((1, 'none'), (settings._jobs, settings._durability))
+        derived = settings.derive(sync._configCache.get(src + 'b/.redirsync.conf'))
+        self.assertEqual((1, 'none'), (derived._jobs, derived._durability))
+        self.assertEqual(['durability', 'jobs'], settings.ignoredKeys(
+            sync._configCache.get(src + 'b/.redirsync.conf')))
+        shutil.rmtree(base)
+
+    def testMainMasterConfig(self):
+        base = Util.getTempDir('redirsynctest.mainconf', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src)
+        Util.mkDir(trg)
+        Util.writeFile(src + 'file.txt', 'txt')
+        Util.writeFile(src + 'file.tmp', 'tmp')
+        # the default master configuration in the home directory:
+        Util.writeFile(self._home + '.redirsync.conf', 
+            'copy.mode=add\npatterns.node=-*.tmp\n')
+        self.assertEqual(0, main([src, trg]))
+        self.assertEqual(['file.txt'], os.listdir(trg))
+        self.assertTrue(os.path.exists(self._home + '.redirsync.configs.json'))
+        # an option given on the command line wins:
+        self.assertEqual(0, main(['--node-patterns=*', src, trg]))
+        self.assertEqual(['file.tmp', 'file.txt'], sorted(os.listdir(trg)))
+        # --config replaces the default master configuration:
+        other = base + 'other.conf'
+        Util.writeFile(other, 'copy.mode=add\n')
+        Util.writeFile(src + 'new.tmp', 'new')
+        self.assertEqual(0, main(['--config', other, src, trg]))
+        self.assertTrue(os.path.exists(trg + 'new.tmp'))
+        shutil.rmtree(base)
+
+    def testParsedConfigs(self):
+        base = Util.getTempDir('redirsynctest.master', True)
+        shutil.rmtree(base)
+        home = base + 'home'
+        src = base + 'src' + os.sep
+        Util.mkDir(home)
+        Util.mkDir(src + 'a')
+        Util.mkDir(base + 'trg')
+        Util.writeFile(src + 'a/.redirsync.conf', 'patterns.node=-*.tmp\n')
+        store = home + os.sep + '.redirsync.configs.json'
+        local = os.path.abspath(src + 'a/.redirsync.conf')
+        master = os.path.abspath(home + os.sep + '.redirsync.conf')
+        def run():
+            sync = Sync()
+            # the home directory is taken when the cache is needed:
+            sync._home = home
+            sync._settings._verboseLevel = 0
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            if os.path.exists(master):
+                sync.readMasterConfig(None)
+            sync.synchronize([src], base + 'trg', False)
+            sync.close()
+            with open(store) as fp:
+                entries = json.load(fp)['entries']
+            return sync, sorted(entries.keys())
+        sync, entries = run()
+        self.assertEqual([local], entries)
+        self.assertEqual(1, sync._configCache._countParsed)
+        # the next process does not parse the per directory file again:
+        Util.writeFile(master, 'jobs=3\n')
+        sync, entries = run()
+        self.assertEqual(3, sync._settings._jobs)
+        self.assertEqual(sorted([local, master]), entries)
+        self.assertEqual((1, 1), (sync._configCache._countParsed,
+            sync._parsedConfigs._countHits))
+        # the entry of a removed file is dropped:
+        os.unlink(local)
+        sync, entries = run()
+        self.assertEqual([master], entries)
+        self.assertEqual(0, sync._configCache._countParsed)
+        shutil.rmtree(base)
+
+    def testUpdateGranularity(self):
+        base = Util.getTempDir('redirsynctest.update', True)
+        shutil.rmtree(base)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        Util.mkDir(src)
+        Util.mkDir(trg)
+        past = int(time.time() - 3600) * 10**9
+        # source newer by: 1 sec, 3 sec, 1 nanosecond
+        for node, delta in (('1s', 10**9), ('3s', 3 * 10**9), ('1ns', 1)):
+            Util.writeFile(src + node, 'new')
+            Util.writeFile(trg + node, 'old')
+            os.utime(trg + node, ns=(past, past))
+            os.utime(src + node, ns=(past + delta, past + delta))
+        def run(granularity):
+            sync = Sync()
+            sync._settings._copyNewer = True
+            sync._settings._mtimeGranularity = granularity
+            sync._settings._verboseLevel = 0
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            sync.synchronize([src], trg, False)
+            sync.close()
+            return sorted(node for node in os.listdir(trg)
+                if Util.readFileAsString(trg + node) == 'new')
+        # FAT: within 2 seconds the source is not newer
+        self.assertEqual(['3s'], run(2.0))
+        # the default: exact
+        self.assertEqual(0.0, Sync()._settings._mtimeGranularity)
+        self.assertEqual(['1ns', '1s', '3s'], run(0.0))
+        # the copies got the time of the source: nothing to do
+        self.assertEqual(0, len([node for node in os.listdir(trg)
+            if os.stat(trg + node).st_mtime_ns < os.stat(src + node).st_mtime_ns]))
+        shutil.rmtree(base)
+
+    def testCopyMode(self):
+        filename = self._base + os.sep + 'redirsynctest.mode.conf'
+        Util.writeFile(filename, 'copy.mode=add,delete\n')
+        settings = Sync()._settings
+        settings.readConfig(filename)
+        os.unlink(filename)
+        self.assertEqual((True, False, False, True), (settings._addNonExisting,
+            settings._copyDifferentSize, settings._copyNewer, 
+            settings._deleteFilesWithoutSource))
+
+    def testSpeedSave(self):
+        base = Util.getTempDir('redirsynctest.save', True)
+        Util.mkDir(base + 'src')
+        Util.mkDir(base + 'trg')
+        src = base + 'src' + os.sep + 'file.txt'
+        trg = base + 'trg' + os.sep + 'file.txt'
+        Util.writeFile(src, 'abc')
+        Util.writeFile(trg, 'abd')
+        os.utime(trg, ns=(os.stat(src).st_atime_ns, os.stat(src).st_mtime_ns))
+        sync = Sync()
+        sync._settings._copyNewer = True
+        sync._settings._verboseLevel = 0
+        sync._settings._speed = 'save'
+        sync._home = base
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([base + 'src'], base + 'trg', False)
+        sync.close()
+        self.assertEqual(1, sync._modified._countFiles)
+        self.assertEqual('abc', Util.readFileAsString(trg))
+        self.assertEqual(2, sync._hasher._countFiles)
+        # the target was rewritten in place with the mtime of the source:
+        # the cached digest of the old content must not be used
+        for round in range(2):
+            sync = Sync()
+            sync._settings._copyNewer = True
+            sync._settings._verboseLevel = 0
+            sync._settings._speed = 'save'
+            sync._home = base
+            sync.addNodePatterns(['*'])
+            sync.addDirPatterns(['*'])
+            sync.synchronize([base + 'src'], base + 'trg', False)
+            sync.close()
+            self.assertEqual(0, sync._modified._countFiles)
+        # corrupted content with the same size and mtime is found
+        info = os.stat(trg)
+        with open(trg, 'r+b') as fp:
+            fp.write(b'x')
+        os.utime(trg, ns=(info.st_atime_ns, info.st_mtime_ns))
+        sync = Sync()
+        sync._settings._copyNewer = True
+        sync._settings._verboseLevel = 0
+        sync._settings._speed = 'save'
+        sync._home = base
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([base + 'src'], base + 'trg', False)
+        sync.close()
+        self.assertEqual(1, sync._modified._countFiles)
+        self.assertEqual('abc', Util.readFileAsString(trg))
+        shutil.rmtree(base)
+
+    def testTempFiles(self):
+        base = Util.getTempDir('redirsynctest.temp', True)
+        src = base + 'src' + os.sep
+        trg = base + 'trg' + os.sep
+        stale = '.file.txt.redirsync.{}.tmp'.format(os.getpid() + 1)
+        own = '.file.txt.redirsync.{}.tmp'.format(os.getpid())
+        Util.mkDir(src)
+        Util.mkDir(trg)
+        Util.writeFile(src + 'file.txt', 'abc')
+        Util.writeFile(src + stale, 'x')
+        Util.writeFile(trg + stale, 'x')
+        Util.writeFile(trg + own, 'x')
+        sync = Sync()
+        sync._settings._addNonExisting = True
+        sync._settings._deleteFilesWithoutSource = True
+        sync._settings._verboseLevel = 0
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        sync.synchronize([src], trg, False)
+        sync.close()
+        # the stale file of another process is removed, not copied: 
+        self.assertEqual([own, 'file.txt'], sorted(os.listdir(trg)))
+        shutil.rmtree(base)
+
     def testMainExit(self):
         argv=[ # "testprog", 
               "--add",
@@ -2,7 +2,7 @@
 # Licence: Public domain: http://www.wtfpl.net
 import unittest
 
-from reutil.config import Config
+from reutil.config import Config, ConfigCache, ParsedConfigCache
 from reutil.util import * 
 
 class Test(unittest.TestCase):
@@ -49,6 +49,98 @@ value.conf2=4711
         os.unlink(conf1)
         os.unlink(conf2)
  
+    def testConfigCache(self):
+        conf1 = self._temp + "reutil1.conf"
+        conf2 = self._temp + "reutil2.conf"
+        Util.writeFile(conf1, 'include "%s"\nvalue.conf1=1\n' % conf2)
+        Util.writeFile(conf2, 'value.conf2=2\n')
+        cache = ConfigCache()
+        self.assertEqual(None, cache.get(self._temp + "reutil.missing.conf"))
+        conf = cache.get(conf1)
+        self.assertEqual('2', conf.get('value.conf2'))
+        self.assertTrue(conf is cache.get(conf1))
+        self.assertEqual((1, 1), (cache._countParsed, cache._countHits))
+        # a changed include is detected:
+        Util.writeFile(conf2, 'value.conf2=3\n')
+        info = os.stat(conf2)
+        os.utime(conf2, ns=(info.st_atime_ns, info.st_mtime_ns + 10**9))
+        self.assertEqual('3', cache.get(conf1).get('value.conf2'))
+        self.assertEqual(2, cache._countParsed)
+        os.unlink(conf1)
+        self.assertEqual(None, cache.get(conf1))
+        os.unlink(conf2)
+
+    def testParsedConfigCache(self):
+        conf1 = self._temp + "reutil1.conf"
+        conf2 = self._temp + "reutil2.conf"
+        store = self._temp + "reutil.configs.json"
+        Util.writeFile(conf1, 'include "%s"\nvalue.conf1=1\n' % conf2)
+        Util.writeFile(conf2, 'value.conf2=2\n')
+        if os.path.exists(store):
+            os.unlink(store)
+        cache = ParsedConfigCache(store, 0)
+        self.assertFalse(Config(conf1, cache)._fromCache)
+        cache.save()
+        # another process: validated (maxAge 0), not parsed
+        cache = ParsedConfigCache(store, 0)
+        conf = Config(conf1, cache)
+        self.assertTrue(conf._fromCache)
+        self.assertEqual(('1', '2'), (conf.get('value.conf1'), conf.get('value.conf2')))
+        self.assertEqual(1, cache._countValidated)
+        def change(value, offset):
+            Util.writeFile(conf2, 'value.conf2=%d\n' % value)
+            info = os.stat(conf2)
+            os.utime(conf2, ns=(info.st_atime_ns, info.st_mtime_ns + offset * 10**9))
+        change(3, 1)
+        conf = Config(conf1, cache)
+        self.assertFalse(conf._fromCache)
+        self.assertEqual('3', conf.get('value.conf2'))
+        cache.save()
+        # the default: validated on each lookup
+        change(6, 3)
+        cache = ParsedConfigCache(store)
+        self.assertEqual('6', Config(conf1, cache).get('value.conf2'))
+        cache.save()
+        self.assertEqual('6', Config(conf1, ParsedConfigCache(store)).get('value.conf2'))
+        # trusted without validation (opt-in):
+        cache = ParsedConfigCache(store, 3600)
+        change(4, 2)
+        self.assertEqual('6', Config(conf1, cache).get('value.conf2'))
+        self.assertEqual(0, cache._countValidated)
+        # ConfigCache knows the main file is unchanged, the include not:
+        self.assertEqual('6', ConfigCache(cache).get(conf1).get('value.conf2'))
+        Util.writeFile(conf1, 'include "%s"\nvalue.conf1=5\n' % conf2)
+        os.utime(conf1, ns=(0, 10**9))
+        self.assertEqual(('5', '4'), (ConfigCache(cache).get(conf1).get('value.conf1'),
+            Config(conf1, cache).get('value.conf2')))
+        cache.save()
+        # the entry of a removed file is dropped:
+        os.unlink(conf1)
+        cache = ParsedConfigCache(store, 3600)
+        self.assertEqual(1, len(cache.entries()))
+        cache.save()
+        self.assertEqual(0, len(ParsedConfigCache(store).entries()))
+        for name in (conf2, store):
+            os.unlink(name)
+
+    def testParsedConfigCacheLimit(self):
+        store = self._temp + "reutil.limit.json"
+        names = [self._temp + "reutil.limit%d.conf" % no for no in range(3)]
+        for name in names:
+            Util.writeFile(name, 'value=1\n')
+        cache = ParsedConfigCache(store, 0, 2)
+        Config(names[0], cache)
+        Config(names[1], cache)
+        # used again: names[1] is the least recently used now
+        self.assertTrue(Config(names[0], cache)._fromCache)
+        Config(names[2], cache)
+        cache.save()
+        cache = ParsedConfigCache(store, 0, 2)
+        self.assertEqual(sorted(os.path.abspath(name) for name in names[0:3:2]),
+            sorted(cache.entries().keys()))
+        for name in names + [store]:
+            os.unlink(name)
+
     def testExceptionString(self):
         name = Util.getTempDir(None, True) + 'reutiltest.exceptiontest.txt'
         try:
@@ -0,0 +1,43 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil
+from pybench.treegen import TreeGenerator
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('treegentest', True)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testGenerate(self):
+        generator = TreeGenerator(2, 3, 5, 1000, 1.0, 100000)
+        files, size = generator.generate(self._base + 'a' + os.sep)
+        self.assertEqual((1 + 3 + 9) * 5, len(files))
+        self.assertEqual(size, sum(os.path.getsize(name) for name in files))
+        # repeatable:
+        files2, size2 = TreeGenerator(2, 3, 5, 1000, 1.0, 100000).generate(
+            self._base + 'b' + os.sep)
+        self.assertEqual(size, size2)
+        name = files[7][len(self._base) + 2:]
+        with open(self._base + 'a' + os.sep + name, 'rb') as fp1, open(
+                self._base + 'b' + os.sep + name, 'rb') as fp2:
+            self.assertEqual(fp1.read(), fp2.read())
+
+    def testChange(self):
+        generator = TreeGenerator(1, 2, 50, 100, 0)
+        files, size = generator.generate(self._base)
+        before = dict((name, os.stat(name)) for name in files)
+        changed, size = generator.change(files, 0.01)
+        self.assertEqual(2, len(changed))
+        for name in changed:
+            info = os.stat(name)
+            self.assertNotEqual(before[name].st_size, info.st_size)
+            self.assertTrue(info.st_mtime_ns > before[name].st_mtime_ns)
+        removed = generator.removeTrees(self._base, 0.5)
+        self.assertEqual(1, len(removed))
+        self.assertFalse(os.path.exists(removed[0]))
+
+if __name__ == "__main__":
+    unittest.main()
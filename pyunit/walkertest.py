@@ -0,0 +1,93 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os.path, shutil
+from dirsync.walker import DirWalker, SpilledList
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('walkertest', True)
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        Util.mkDir(self._src + 'dir1')
+        Util.mkDir(self._trg)
+        Util.writeFile(self._src + 'file1.txt', 'abc')
+        Util.writeFile(self._src + 'file2.txt', 'abcd')
+        Util.writeFile(self._trg + 'file1.txt', 'ab')
+        Util.writeFile(self._trg + 'orphan.txt', 'x')
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testListing(self):
+        walker = DirWalker()
+        listing = walker.listing(self._src, self._trg)
+        self.assertTrue(listing.targetExists())
+        self.assertTrue(listing.hasSource('dir1'))
+        pairs = {}
+        for node, srcEntry, trgEntry in listing.pairs():
+            pairs[node] = (srcEntry, trgEntry)
+        self.assertEqual(['dir1', 'file1.txt', 'file2.txt'], sorted(pairs))
+        self.assertTrue(walker.isDir(pairs['dir1'][0]))
+        self.assertEqual(None, pairs['file2.txt'][1])
+        self.assertEqual(3, walker.stat(pairs['file1.txt'][0]).st_size)
+        self.assertEqual(2, walker.stat(pairs['file1.txt'][1]).st_size)
+        orphans = [entry for entry in listing.orphans(set(pairs))]
+        self.assertEqual(['orphan.txt'], [entry.name for entry in orphans])
+        self.assertEqual(self._trg + 'orphan.txt', orphans[0].path)
+        self.assertEqual(4, walker.countSyscalls())
+        # cached:
+        info = walker.stat(pairs['file1.txt'][0])
+        self.assertTrue(info is walker.stat(pairs['file1.txt'][0]))
+        self.assertEqual(os.lstat(self._src + 'file1.txt').st_mtime_ns, 
+            info.st_mtime_ns)
+        self.assertFalse(hasattr(info, '__dict__'))
+
+    def testMissingTarget(self):
+        walker = DirWalker()
+        listing = walker.listing(self._src, self._trg + 'missing' + os.sep)
+        self.assertFalse(listing.targetExists())
+        self.assertEqual([], list(listing.orphans(set())))
+
+    def testSpilledList(self):
+        items = SpilledList(3)
+        for no in range(7):
+            items.append(('dir%d' % no, no % 2 == 0))
+        self.assertTrue(items.isSpilled())
+        self.assertEqual(7, len(items))
+        self.assertEqual([('dir%d' % no, no % 2 == 0) for no in range(7)], 
+            list(items))
+        # iterable again:
+        self.assertEqual(7, len(list(items)))
+        items.close()
+        small = SpilledList(3)
+        small.append(('a', None))
+        self.assertFalse(small.isSpilled())
+        self.assertEqual([('a', None)], list(small))
+
+    def testStreamed(self):
+        walker = DirWalker(2)
+        Util.writeFile(self._trg + 'file0.txt', 'x')
+        listing = walker.listing(self._src, self._trg)
+        self.assertEqual(2, walker._countSpilled)
+        self.assertTrue(listing.targetExists())
+        self.assertTrue(listing.hasSource('file2.txt'))
+        self.assertFalse(listing.hasSource('orphan.txt'))
+        merged = [(node, srcEntry != None, trgEntry != None) 
+            for node, srcEntry, trgEntry in listing.merged()]
+        self.assertEqual([('dir1', True, False), ('file0.txt', False, True),
+            ('file1.txt', True, True), ('file2.txt', True, False), 
+            ('orphan.txt', False, True)], merged)
+        pairs = dict((node, (srcEntry, trgEntry)) 
+            for node, srcEntry, trgEntry in listing.pairs())
+        self.assertTrue(walker.isDir(pairs['dir1'][0]))
+        self.assertEqual(2, walker.stat(pairs['file1.txt'][1]).st_size)
+        self.assertEqual(['file0.txt'], 
+            [entry.name for entry in listing.orphans(set(pairs) | {'orphan.txt'})])
+        self.assertEqual(self._trg + 'orphan.txt', 
+            list(listing.orphans(set()))[-1].path)
+        listing.close()
+        self.assertEqual([], listing._sources._runs)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import unittest, os, os.path, shutil, threading, time
+from dirsync.redirsync import Sync
+from dirsync.watcher import Watcher
+from reutil.util import Util
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._base = Util.getTempDir('watchertest', True)
+        self._src = self._base + 'src' + os.sep
+        self._trg = self._base + 'trg' + os.sep
+        Util.mkDir(self._src + 'dir1')
+        Util.mkDir(self._trg)
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def testCollect(self):
+        watcher = Watcher()
+        watcher.addTree(self._src, self._trg)
+        Util.writeFile(self._src + 'dir1' + os.sep + 'file1.txt', 'abc')
+        Util.mkDir(self._src + 'dir2')
+        batch = watcher.collect(0.1, 1)
+        self.assertEqual((self._trg + 'dir1' + os.sep, 1, False), 
+            batch._dirs[self._src + 'dir1' + os.sep])
+        self.assertEqual((self._trg + 'dir2' + os.sep, 1, True), 
+            batch._dirs[self._src + 'dir2' + os.sep])
+        self.assertTrue(self._src + 'dir2' + os.sep in watcher._descriptors)
+        batch = watcher.changedSince(time.time() - 60)
+        self.assertTrue(self._src + 'dir1' + os.sep in batch._dirs)
+        watcher.close()
+
+    def testChangedSinceNewDirs(self):
+        watcher = Watcher()
+        watcher.addTree(self._src, self._trg)
+        # the events are lost (overflow): the new tree must be found anyway
+        Util.mkDir(self._src + 'dir3' + os.sep + 'sub')
+        Util.writeFile(self._src + 'dir3' + os.sep + 'sub' + os.sep + 'x.txt', 'x')
+        batch = watcher.changedSince(time.time() + 60)
+        self.assertEqual((self._trg, 0, False), batch._dirs[self._src])
+        self.assertEqual((self._trg + 'dir3' + os.sep, 1, True), 
+            batch._dirs[self._src + 'dir3' + os.sep])
+        self.assertTrue(self._src + 'dir3' + os.sep + 'sub' + os.sep 
+            in watcher._descriptors)
+        self.assertFalse(self._src + 'dir1' + os.sep in batch._dirs)
+        batch = watcher.changedSince(time.time() + 60)
+        self.assertTrue(batch.isEmpty())
+        watcher.close()
+
+    def testWatch(self):
+        sync = Sync()
+        sync._fnError = self._base + 'error.log'
+        sync._settings._addNonExisting = True
+        sync._settings._deleteFilesWithoutSource = True
+        sync._settings._verboseLevel = 0
+        sync._settings._watchDelay = 0.1
+        sync._settings._durability = 'fs'
+        sync.addNodePatterns(['*'])
+        sync.addDirPatterns(['*'])
+        thread = threading.Thread(target=sync.watch, 
+            args=([self._src], self._trg, False, 1, 5))
+        thread.start()
+        time.sleep(0.5)
+        Util.writeFile(self._src + 'dir1' + os.sep + 'file1.txt', 'abc')
+        thread.join(10)
+        sync.close()
+        self.assertEqual('abc', Util.readFileAsString(self._trg + 'dir1' 
+            + os.sep + 'file1.txt'))
+        # one sync after the first run, one after the batch:
+        self.assertEqual(2, sync._durability._countFilesystems)
+
+if __name__ == "__main__":
+    unittest.main()
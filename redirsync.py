@@ -92,7 +92,7 @@ class Util:
         '''
         rc = Util.getTempDir(subdir, True) + node
         return rc
-import logging, os.path
+import json, logging, os, os.path, threading, time
 
 class Config:
     '''Maintenances a dictionary read from file(s).'
@@ -108,46 +108,3323 @@ class Config:
     include "/etc/global_var.conf"
     global.basedir=/etc
     '''
+    def __init__(self, filename, cache = None):
+        '''Constructor.
+        @param filename: the configuration file
+        @param cache: None or a ParsedConfigCache: if it contains a valid
+                entry the files are not read
+        '''
+        self._dict = {}
+        self._files = []
+        # the include closure: a list of (file, mtimeNs). mtimeNs is None
+        # for a missing include
+        self._stamps = []
+        item = None if cache == None else cache.lookup(filename)
+        # True: taken from the ParsedConfigCache, not parsed
+        self._fromCache = item != None
+        if item != None:
+            self._dict = dict(item['dict'])
+            self._files = list(item['files'])
+            self._stamps = [tuple(stamp) for stamp in item['stamps']]
+        else:
+            self.read(filename)
+            if cache != None:
+                cache.store(filename, self)
+
+    def read(self, filename):
+        '''Reads a configuration file.
+        @param filename: the configuration file
+        '''
+        fp = open(filename, "r")
+        self._stamps.append((filename, os.fstat(fp.fileno()).st_mtime_ns))
+        lineNo = 0
+        for line in fp:
+            line = line.rstrip()
+            lineNo += 1
+            if not line.startswith('include'):
+                ix = line.find('=')
+                if ix > 0 and line[0].isalpha():
+                    self._dict[line[0:ix]] = line[ix+1:]
+            else:
+                name = line[7:].strip(" \t\"'")
+                if name not in self._files:
+                    self._files.append(name) 
+                    if os.path.exists(name):
+                        self.read(name)
+                    else:
+                        self._stamps.append((name, None))
+                        logging.error(filename + '-' + str(lineNo) 
+                            + ': can not include: ' + name)
+        fp.close()
+        
+    def get(self, key):
+        '''Returns a configuration value.
+        @param key: the key of the value
+        @return None: invalid key<br>
+                otherwise: the value belonging to the key
+        '''
+        return self._dict[key] if key in self._dict else None
+
+    def keys(self):
+        '''Returns the defined keys.
+        @return: the list of the keys (sorted)
+        '''
+        return sorted(self._dict.keys())
+
+class ParsedConfigCache:
+    '''Stores parsed configuration files in a file (JSON): later processes
+    neither read nor parse them again.
+    An entry is valid as long as the modification times of the file and of
+    all its includes are the same: by default they are compared on each
+    lookup (one stat per file instead of reading and parsing).
+    Lazy validation is opt-in (maxAge > 0): the times are only compared if
+    the last comparison is older than maxAge seconds, otherwise the entry
+    is used without any file system access, even if an include has been
+    changed meanwhile.
+    The number of entries is limited: the least recently used are dropped,
+    the entries of removed files when the cache is saved.
+    '''
+    def __init__(self, filename, maxAge = 0.0, maxEntries = 10000):
+        '''Constructor.
+        @param filename: the cache file
+        @param maxAge: 0: each lookup validates the entry<br>
+                otherwise: an entry checked within this many seconds is trusted
+        @param maxEntries: the maximal number of stored files
+        '''
+        self._filename = filename
+        self._maxAge = maxAge
+        self._maxEntries = maxEntries
+        self._lock = threading.Lock()
+        # None: not loaded yet. Otherwise: filename -> entry
+        self._entries = None
+        self._changed = False
+        self._countHits = 0
+        self._countValidated = 0
+        self._countStored = 0
+
+    def entries(self):
+        '''Returns the entries, loads the cache file on the first call.
+        The caller must hold the lock.
+        @return: a dictionary filename -> entry, the least recently used first
+        '''
+        if self._entries == None:
+            self._entries = {}
+            try:
+                with open(self._filename, 'r') as fp:
+                    document = json.load(fp)
+                if document.get('version') == 1:
+                    self._entries = document['entries']
+            except (OSError, ValueError, KeyError, AttributeError):
+                # missing or damaged: will be rebuilt
+                pass
+        return self._entries
+
+    def lookup(self, filename):
+        '''Returns the parsed content of a configuration file.
+        @param filename: the configuration file
+        @return: None: no valid entry<br>
+                otherwise: a dictionary with the keys dict, files and stamps
+        '''
+        key = os.path.abspath(filename)
+        with self._lock:
+            entries = self.entries()
+            item = entries.pop(key, None)
+            if item != None:
+                # the most recently used: the last. The order alone does not
+                # need a save: it is written with the next change
+                entries[key] = item
+        if item == None:
+            return None
+        now = time.time()
+        if self._maxAge <= 0 or now - item['checked'] >= self._maxAge:
+            for name, stamp in item['stamps']:
+                if ConfigCache.stamp(name) != stamp:
+                    return None
+            with self._lock:
+                if self._maxAge > 0:
+                    item['checked'] = now
+                    self._changed = True
+                self._countValidated += 1
+        with self._lock:
+            self._countHits += 1
+        return item
+
+    def store(self, filename, config):
+        '''Stores a parsed configuration file.
+        @param filename: the configuration file
+        @param config: the Config instance
+        '''
+        key = os.path.abspath(filename)
+        with self._lock:
+            entries = self.entries()
+            entries.pop(key, None)
+            entries[key] = {'dict': config._dict,
+                'files': config._files, 'stamps': config._stamps, 
+                'checked': time.time()}
+            while len(entries) > self._maxEntries:
+                del entries[next(iter(entries))]
+            self._changed = True
+            self._countStored += 1
+
+    def prune(self):
+        '''Removes the entries of configuration files which do not exist
+        any more. The caller must hold the lock.
+        '''
+        for filename in list(self._entries.keys()):
+            if ConfigCache.stamp(filename) == None:
+                del self._entries[filename]
+                self._changed = True
+
+    def save(self):
+        '''Writes the cache file if something has changed.
+        '''
+        with self._lock:
+            if self._entries == None:
+                return
+            self.prune()
+            if not self._changed:
+                return
+            temp = '{}.{}.{}'.format(self._filename, os.getpid(), 
+                threading.get_ident())
+            try:
+                with open(temp, 'w') as fp:
+                    json.dump({'version': 1, 'entries': self._entries}, fp)
+                os.replace(temp, self._filename)
+                self._changed = False
+            except OSError as exc:
+                logging.error('cannot write ' + self._filename + ': ' + str(exc))
+
+class ConfigCache:
+    '''Holds parsed configuration files: an unchanged file is not parsed again.
+    A Config is valid as long as the modification times of the file and of
+    all its includes are the same.
+    '''
+    def __init__(self, parsed = None):
+        '''Constructor.
+        @param parsed: None or the ParsedConfigCache used for files
+                not parsed by this process yet
+        '''
+        self._parsed = parsed
+        self._lock = threading.Lock()
+        # filename -> (stamps, config): stamps: a list of (file, mtimeNs)
+        self._configs = {}
+        self._countParsed = 0
+        self._countHits = 0
+
+    @staticmethod
+    def stamp(filename):
+        '''Returns the modification time of a file.
+        @param filename: the file to inspect
+        @return: None: the file does not exist<br>
+                otherwise: the modification time in nanoseconds
+        '''
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, filename):
+        '''Returns the parsed configuration file.
+        @param filename: the configuration file
+        @return: None: the file does not exist<br>
+                otherwise: the Config instance (maybe from the cache)
+        '''
+        mtime = self.stamp(filename)
+        if mtime == None:
+            return None
+        with self._lock:
+            item = self._configs.get(filename)
+        if (item != None and item[0][0][1] == mtime 
+                and all(self.stamp(name) == stamp for name, stamp in item[0][1:])):
+            with self._lock:
+                self._countHits += 1
+            return item[1]
+        config = Config(filename, self._parsed)
+        if config._fromCache and config._stamps[0][1] != mtime:
+            # a trusted (not validated) entry, but the file is known to differ
+            config = Config(filename)
+            self._parsed.store(filename, config)
+        if not config._fromCache:
+            with self._lock:
+                self._countParsed += 1
+        with self._lock:
+            self._configs[filename] = (config._stamps, config)
+        return config
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import heapq, marshal, os, tempfile, time
+
+class EntryStat:
+    '''The part of a file status used by the synchronization.
+    Much smaller than os.stat_result: huge directories stay affordable.
+    '''
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns', 'st_ctime_ns', 'st_ino',
+        'st_dev', 'st_nlink', 'st_blocks')
+
+    def __init__(self, info):
+        '''Constructor.
+        @param info: the status info (os.stat_result)
+        '''
+        self.st_mode = info.st_mode
+        self.st_size = info.st_size
+        self.st_mtime_ns = info.st_mtime_ns
+        # validates the digest cache (see FileHasher)
+        self.st_ctime_ns = info.st_ctime_ns
+        self.st_ino = info.st_ino
+        self.st_dev = info.st_dev
+        self.st_nlink = info.st_nlink
+        # None on Windows: sparse files are not recognized
+        self.st_blocks = getattr(info, 'st_blocks', None)
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1E9
+
+class FileEntry:
+    '''A compact directory entry: the name, the file type from the directory
+    read and the status fetched on demand (without following links).
+    Offers the part of the os.DirEntry interface used by the walker.
+    '''
+    __slots__ = ('name', '_parent', '_isDir', '_stat')
+
+    def __init__(self, name, parent, isDir):
+        '''Constructor.
+        @param name: the node (name without path)
+        @param parent: the directory (with trailing separator)
+        @param isDir: True: the entry is a directory (not a link to it)
+        '''
+        self.name = name
+        self._parent = parent
+        self._isDir = isDir
+        self._stat = None
+
+    @property
+    def path(self):
+        return self._parent + self.name
+
+    def is_dir(self, follow_symlinks = True):
+        return self._isDir
+
+    def stat(self, follow_symlinks = True):
+        if self._stat == None:
+            self._stat = EntryStat(os.lstat(self._parent + self.name))
+        return self._stat
+
+class DirListing:
+    '''The entries of a source directory and of its target counterpart.
+    Both sides are read exactly once. The status of an entry is fetched
+    lazily and only once (FileEntry caches it).
+    '''
+    def __init__(self, walker, sources, targets):
+        '''Constructor.
+        @param walker: the walker which has read the directories
+        @param sources: a dictionary node -> FileEntry of the source
+        @param targets: None: the target does not exist<br>
+                otherwise: a dictionary node -> FileEntry of the target
+        '''
+        self._walker = walker
+        self._sources = sources
+        self._targetExists = targets != None
+        self._targets = targets if targets != None else {}
+
+    def targetExists(self):
+        '''Tests whether the target directory existed while reading.
+        @return: True: the target directory exists
+        '''
+        return self._targetExists
+
+    def hasSource(self, node):
+        '''Tests whether the source directory contains a given node.
+        @param node: the name of the entry (without path)
+        @return: True: the node exists in the source
+        '''
+        return node in self._sources
+
+    def pairs(self):
+        '''Returns the source entries with their target counterparts.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                trgEntry is None if the target does not exist
+        '''
+        targets = self._targets
+        for node, entry in self._sources.items():
+            yield node, entry, targets.get(node)
+
+    def orphans(self, keep):
+        '''Returns the target entries which should not be kept.
+        @param keep: a container of nodes which must not be returned
+        @return: an iterator of target entries (FileEntry)
+        '''
+        for node, entry in self._targets.items():
+            if node not in keep:
+                yield entry
+
+    def merged(self):
+        '''Returns all entries of both sides in one pass.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                srcEntry or trgEntry is None if the node exists on one side only
+        '''
+        for node, entry, trgEntry in self.pairs():
+            yield node, entry, trgEntry
+        sources = self._sources
+        for node, entry in self._targets.items():
+            if node not in sources:
+                yield node, None, entry
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        pass
+
+class SortedRuns:
+    '''The names of a huge directory as sorted runs in temporary files.
+    The directory is read in chunks: each chunk is sorted and written as one
+    run. Iterating merges the runs: the memory depends on the chunk size and
+    the number of runs, not on the number of entries.
+    '''
+    def __init__(self, first, iterator, chunkSize):
+        '''Constructor.
+        @param first: the list of (name, isDir) already read
+        @param iterator: the os.scandir() iterator delivering the rest
+        @param chunkSize: the number of entries of a run
+        '''
+        self._runs = []
+        self._count = 0
+        self.spill(first)
+        chunk = []
+        for entry in iterator:
+            chunk.append((entry.name, entry.is_dir(follow_symlinks=False)))
+            if len(chunk) >= chunkSize:
+                self.spill(chunk)
+                chunk = []
+        if chunk:
+            self.spill(chunk)
+
+    def spill(self, chunk):
+        '''Writes a chunk as sorted run into a temporary file.
+        @param chunk: a list of (name, isDir). Will be sorted
+        '''
+        chunk.sort()
+        fp = tempfile.TemporaryFile(prefix='redirsync.')
+        for item in chunk:
+            marshal.dump(item, fp)
+        self._runs.append((fp, len(chunk)))
+        self._count += len(chunk)
+
+    def readRun(self, fp, count):
+        '''Returns the entries of one run.
+        @param fp: the file containing the run
+        @param count: the number of entries of the run
+        @return: an iterator of (name, isDir)
+        '''
+        fp.seek(0)
+        for no in range(count):
+            yield marshal.load(fp)
+
+    def __iter__(self):
+        return heapq.merge(*[self.readRun(fp, count) for fp, count in self._runs])
+
+    def close(self):
+        '''Removes the temporary files.
+        '''
+        for fp, count in self._runs:
+            fp.close()
+        self._runs = []
+
+class SpilledList:
+    '''A list keeping at most chunkSize items in memory: full chunks are
+    appended to a temporary file. The items must be marshallable.
+    Iterating returns the items in the order of append().
+    '''
+    def __init__(self, chunkSize):
+        '''Constructor.
+        @param chunkSize: the maximal number of items kept in memory
+        '''
+        self._chunkSize = chunkSize
+        self._items = []
+        self._fp = None
+        self._countSpilled = 0
+
+    def append(self, item):
+        '''Adds an item at the end.
+        @param item: the item to add
+        '''
+        self._items.append(item)
+        if len(self._items) >= self._chunkSize:
+            if self._fp == None:
+                self._fp = tempfile.TemporaryFile(prefix='redirsync.')
+            for entry in self._items:
+                marshal.dump(entry, self._fp)
+            self._countSpilled += len(self._items)
+            self._items = []
+
+    def isSpilled(self):
+        '''Tests whether items have been written to the temporary file.
+        @return: True: the list is larger than one chunk
+        '''
+        return self._fp != None
+
+    def __len__(self):
+        return self._countSpilled + len(self._items)
+
+    def __iter__(self):
+        if self._fp != None:
+            self._fp.seek(0)
+            for no in range(self._countSpilled):
+                yield marshal.load(self._fp)
+        for item in self._items:
+            yield item
+
+    def close(self):
+        '''Removes the temporary file.
+        '''
+        if self._fp != None:
+            self._fp.close()
+            self._fp = None
+
+class StreamedListing:
+    '''The entries of a source directory and of its target counterpart
+    when one of them is too large to be kept in memory: both sides are
+    merged as sorted streams of names.
+    '''
+    def __init__(self, walker, src, trg, sources, targets):
+        '''Constructor.
+        @param walker: the walker which has read the directories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param sources: a SortedRuns instance or a dictionary node -> FileEntry
+        @param targets: None: the target does not exist<br>
+                otherwise: a SortedRuns instance or a dictionary node -> FileEntry
+        '''
+        self._walker = walker
+        self._src = src
+        self._trg = trg
+        self._sources = sources
+        self._targets = targets
+
+    def targetExists(self):
+        '''Tests whether the target directory existed while reading.
+        @return: True: the target directory exists
+        '''
+        return self._targets != None
+
+    def hasSource(self, node):
+        '''Tests whether the source directory contains a given node.
+        @param node: the name of the entry (without path)
+        @return: True: the node exists in the source
+        '''
+        if isinstance(self._sources, dict):
+            return node in self._sources
+        return os.path.lexists(self._src + node)
+
+    def sortedNames(self, entries):
+        '''Returns the names of one side in sorted order.
+        @param entries: None, a SortedRuns instance or a dictionary 
+                node -> FileEntry (or IndexedEntry)
+        @return: an iterator of (name, isDir)
+        '''
+        if entries == None:
+            rc = iter(())
+        elif isinstance(entries, dict):
+            rc = iter(sorted((node, entry.is_dir(follow_symlinks=False)) 
+                for node, entry in entries.items()))
+        else:
+            rc = iter(entries)
+        return rc
+
+    def entry(self, entries, path, item):
+        '''Returns the entry of a name delivered by sortedNames().
+        @param entries: a SortedRuns instance or a dictionary node -> entry
+        @param path: the directory of the entries (with trailing separator)
+        @param item: the tuple (name, isDir)
+        @return: the entry of the dictionary (e.g. with the status taken 
+                from the index) or a new FileEntry
+        '''
+        if isinstance(entries, dict):
+            return entries[item[0]]
+        return FileEntry(item[0], path, item[1])
+
+    def merged(self):
+        '''Returns all entries of both sides in one pass, sorted by name.
+        @return: an iterator of tuples (node, srcEntry, trgEntry).
+                srcEntry or trgEntry is None if the node exists on one side only
+        '''
+        sources = self.sortedNames(self._sources)
+        targets = self.sortedNames(self._targets)
+        src = next(sources, None)
+        trg = next(targets, None)
+        while src != None or trg != None:
+            if trg == None or src != None and src[0] < trg[0]:
+                yield src[0], self.entry(self._sources, self._src, src), None
+                src = next(sources, None)
+            elif src == None or trg[0] < src[0]:
+                yield trg[0], None, self.entry(self._targets, self._trg, trg)
+                trg = next(targets, None)
+            else:
+                yield (src[0], self.entry(self._sources, self._src, src),
+                    self.entry(self._targets, self._trg, trg))
+                src = next(sources, None)
+                trg = next(targets, None)
+
+    def pairs(self):
+        '''Returns the source entries with their target counterparts.
+        @return: an iterator of tuples (node, srcEntry, trgEntry)
+        '''
+        for node, srcEntry, trgEntry in self.merged():
+            if srcEntry != None:
+                yield node, srcEntry, trgEntry
+
+    def orphans(self, keep):
+        '''Returns the target entries which should not be kept.
+        @param keep: a container of nodes which must not be returned
+        @return: an iterator of target entries (FileEntry)
+        '''
+        for node, srcEntry, trgEntry in self.merged():
+            if trgEntry != None and node not in keep:
+                yield trgEntry
+
+    def close(self):
+        '''Removes the temporary files.
+        '''
+        for entries in (self._sources, self._targets):
+            if isinstance(entries, SortedRuns):
+                entries.close()
+
+class DirWalker:
+    '''Reads directories with os.scandir() and pairs source and target entries.
+    Each side costs one directory read plus at most one stat() per entry.
+    The file type comes from the directory read itself (d_type) if the
+    file system delivers it.
+    Directories with more than chunkSize entries are not kept in memory:
+    they are spilled as sorted runs and both sides are merged.
+    '''
+    def __init__(self, chunkSize = 100000):
+        '''Constructor.
+        @param chunkSize: the maximal number of entries of one directory
+                kept in memory
+        '''
+        self._chunkSize = chunkSize
+        self._countSpilled = 0
+        self._countReads = 0
+        self._countStats = 0
+        # None or the PhaseStatistics receiving the timings
+        self._phases = None
+
+    def scan(self, path):
+        '''Reads a directory.
+        @param path: the directory to read
+        @return: None: the directory does not exist<br>
+                otherwise: a dictionary node -> FileEntry
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return None
+        if not path.endswith(os.sep):
+            path += os.sep
+        rc = {}
+        with iterator:
+            for entry in iterator:
+                # the os.DirEntry (with a full os.stat_result) is not kept
+                rc[entry.name] = FileEntry(entry.name, path,
+                    entry.is_dir(follow_symlinks=False))
+        return rc
+
+    def entries(self, path):
+        '''Reads a directory without keeping the entries.
+        @param path: the directory to read
+        @return: an iterator of FileEntry. Empty if the directory does not exist
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return
+        if not path.endswith(os.sep):
+            path += os.sep
+        with iterator:
+            for entry in iterator:
+                yield FileEntry(entry.name, path, entry.is_dir(follow_symlinks=False))
+
+    def read(self, path):
+        '''Reads a directory: small ones into memory, huge ones into sorted runs.
+        @param path: the directory to read (with trailing separator)
+        @return: None: the directory does not exist<br>
+                a dictionary node -> FileEntry: at most chunkSize entries<br>
+                otherwise: a SortedRuns instance
+        '''
+        self._countReads += 1
+        try:
+            iterator = os.scandir(path)
+        except FileNotFoundError:
+            return None
+        rc = {}
+        with iterator:
+            for entry in iterator:
+                if len(rc) >= self._chunkSize:
+                    first = [(node, item._isDir) for node, item in rc.items()]
+                    first.append((entry.name, entry.is_dir(follow_symlinks=False)))
+                    rc = SortedRuns(first, iterator, self._chunkSize)
+                    self._countSpilled += 1
+                    break
+                rc[entry.name] = FileEntry(entry.name, path,
+                    entry.is_dir(follow_symlinks=False))
+        return rc
+
+    def listing(self, src, trg, targets = None):
+        '''Reads a source directory and its target counterpart.
+        @param src: the source directory
+        @param trg: the target directory
+        @param targets: None or the already known target entries
+                (e.g. from the state index): the target is not read
+        @return: a DirListing or (huge directories) a StreamedListing instance
+        '''
+        phases = self._phases
+        if phases != None:
+            start = time.perf_counter()
+        if not src.endswith(os.sep):
+            src += os.sep
+        if not trg.endswith(os.sep):
+            trg += os.sep
+        sources = self.read(src)
+        if sources == None:
+            sources = {}
+        count = 1
+        if targets == None:
+            targets = self.read(trg)
+            count = 2
+        if phases != None:
+            phases.add('listdir', time.perf_counter() - start, count)
+        if isinstance(sources, SortedRuns) or isinstance(targets, SortedRuns):
+            return StreamedListing(self, src, trg, sources, targets)
+        return DirListing(self, sources, targets)
+
+    def isDir(self, entry):
+        '''Tests whether an entry is a directory (symbolic links are not).
+        @param entry: the entry to test (FileEntry)
+        @return: True: the entry is a directory
+        '''
+        return entry.is_dir(follow_symlinks=False)
+
+    def stat(self, entry):
+        '''Returns the status of an entry without following symbolic links.
+        @param entry: the entry to inspect (FileEntry)
+        @return: the status info like os.lstat()
+        '''
+        self._countStats += 1
+        if self._phases == None:
+            return entry.stat(follow_symlinks=False)
+        start = time.perf_counter()
+        rc = entry.stat(follow_symlinks=False)
+        self._phases.add('stat', time.perf_counter() - start)
+        return rc
+
+    def countSyscalls(self):
+        '''Returns the number of directory reads and stat() calls.
+        @return: the sum of the calls done by the walker
+        '''
+        return self._countReads + self._countStats
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import threading, queue, sys, time
+
+class WorkerPool:
+    '''Executes tasks in a fixed number of threads.
+    The tasks are stored in a bounded queue. If the queue is full the
+    submitting thread executes the task itself: this slows down the producer
+    and avoids a deadlock when tasks submit further tasks.
+    A blocking pool lets the submitting thread wait instead (backpressure):
+    its tasks must not submit further tasks to the same pool.
+    '''
+    def __init__(self, countWorkers, maxQueued = None, blocking = False,
+            name = 'worker'):
+        '''Constructor.
+        @param countWorkers: the number of worker threads
+        @param maxQueued: None or the maximal number of waiting tasks.<br>
+                None: 4 tasks per worker
+        @param blocking: True: submit() waits while the queue is full<br>
+                False: submit() executes the task itself if the queue is full
+        @param name: the name of the threads (without number)
+        '''
+        if maxQueued == None:
+            maxQueued = 4 * countWorkers
+        self._queue = queue.Queue(maxQueued)
+        self._blocking = blocking
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._excInfo = None
+        self._countWaits = 0
+        self._waitSeconds = 0.0
+        self._threads = []
+        for no in range(countWorkers):
+            thread = threading.Thread(target=self.work,
+                name='redirsync-%s-%d' % (name, no))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, *args):
+        '''Executes a function asynchronously.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            if not self._blocking:
+                self.execute(function, args)
+            else:
+                start = time.time()
+                self._queue.put((function, args))
+                with self._condition:
+                    self._countWaits += 1
+                    self._waitSeconds += time.time() - start
+
+    def trySubmit(self, function, *args):
+        '''Queues a function if the queue has room.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        @return: True: the function will be executed by a worker<br>
+                False: the queue is full, nothing is done
+        '''
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            with self._condition:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._condition.notify_all()
+            return False
+        return True
+
+    def execute(self, function, args):
+        '''Executes a task and marks it as done.
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        try:
+            function(*args)
+        except Exception:
+            with self._condition:
+                if self._excInfo == None:
+                    self._excInfo = sys.exc_info()
+        finally:
+            with self._condition:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._condition.notify_all()
+
+    def work(self):
+        '''The main loop of a worker thread.
+        '''
+        while True:
+            task = self._queue.get()
+            if task == None:
+                break
+            self.execute(task[0], task[1])
+
+    def join(self):
+        '''Waits until all submitted tasks (and their subtasks) are done.
+        The first exception raised by a task is raised again.
+        '''
+        with self._condition:
+            while self._pending > 0:
+                self._condition.wait()
+            excInfo = self._excInfo
+            self._excInfo = None
+        if excInfo != None:
+            raise excInfo[1].with_traceback(excInfo[2])
+
+    def close(self):
+        '''Stops the worker threads.
+        '''
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, stat, sqlite3, hashlib, threading, time
+
+class IndexedStat:
+    '''The part of a file status stored in the index.
+    '''
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns', 'st_ino')
+
+    def __init__(self, mode, size, mtimeNs, inode):
+        '''Constructor.
+        @param mode: the file mode (type and permissions)
+        @param size: the file size in bytes
+        @param mtimeNs: the modification time in nanoseconds
+        @param inode: the inode number
+        '''
+        self.st_mode = mode
+        self.st_size = size
+        self.st_mtime_ns = mtimeNs
+        self.st_ino = inode
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1E9
+
+    @property
+    def st_dev(self):
+        '''The device is not stored: None.'''
+        return None
+
+class IndexedEntry:
+    '''A directory entry taken from the index instead of from the file system.
+    Offers the part of the os.DirEntry interface used by the walker.
+    '''
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, name, path, statInfo):
+        '''Constructor.
+        @param name: the node (name without path)
+        @param path: the full name
+        @param statInfo: the stored status (IndexedStat)
+        '''
+        self.name = name
+        self.path = path
+        self._stat = statInfo
+
+    def is_dir(self, follow_symlinks = True):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def stat(self, follow_symlinks = True):
+        return self._stat
+
+class StateIndex:
+    '''Stores the state of a target tree after a successful run in a SQLite
+    database, one database per (source, target) pair.
+    If the modification time of a target directory has not moved since
+    the last run its entries are taken from the index: the directory is
+    neither read nor its entries stat'ed.
+    '''
+    # a directory modified this recently may change again within the
+    # time stamp granularity of the file system: it will not be trusted
+    _racyNs = 2 * 1000 * 1000 * 1000
+
+    def __init__(self, home, source, target):
+        '''Constructor.
+        @param home: the directory containing the index files
+        @param source: the source directory
+        @param target: the target directory
+        '''
+        self._target = target
+        key = os.path.abspath(source) + '\0' + os.path.abspath(target)
+        path = home + os.sep + '.redirsync.index'
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._filename = (path + os.sep
+            + hashlib.sha1(key.encode('utf-8')).hexdigest()[0:16] + '.db')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._filename, check_same_thread=False)
+        self._db.executescript('''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS files (dir TEXT, node TEXT, mode INTEGER,
+    size INTEGER, mtime_ns INTEGER, inode INTEGER, PRIMARY KEY (dir, node));
+''')
+        self._db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+            (('source', source), ('target', target)))
+        self._db.commit()
+        self._countHits = 0
+        self._countMisses = 0
+
+    def close(self, success):
+        '''Frees the resources.
+        @param success: True: the changes are stored.<br>
+                False: the changes are discarded
+        '''
+        with self._lock:
+            if success:
+                self._db.commit()
+            else:
+                self._db.rollback()
+            self._db.close()
+
+    def relative(self, trg):
+        '''Returns the path relative to the target root.
+        @param trg: a target directory inside the target root
+        @return: the relative path (with trailing separator)
+        '''
+        return trg[len(self._target):]
+
+    def targets(self, trg):
+        '''Returns the indexed entries of a target directory if they are
+        still valid.
+        @param trg: the target directory (with trailing separator)
+        @return: None: the directory is unknown or has been modified<br>
+                otherwise: a dictionary node -> IndexedEntry
+        '''
+        rc = None
+        relPath = self.relative(trg)
+        with self._lock:
+            row = self._db.execute('SELECT mtime_ns FROM dirs WHERE path=?',
+                (relPath,)).fetchone()
+        if row != None:
+            try:
+                mtimeNs = os.stat(trg).st_mtime_ns
+            except OSError:
+                mtimeNs = None
+            if mtimeNs == row[0]:
+                rc = {}
+                with self._lock:
+                    rows = self._db.execute('SELECT node, mode, size, mtime_ns, '
+                        + 'inode FROM files WHERE dir=?', (relPath,)).fetchall()
+                for node, mode, size, nodeMtime, inode in rows:
+                    rc[node] = IndexedEntry(node, trg + node,
+                        IndexedStat(mode, size, nodeMtime, inode))
+        if rc == None:
+            self._countMisses += 1
+        else:
+            self._countHits += 1
+        return rc
+
+    def record(self, trg, entries):
+        '''Stores the state of a target directory.
+        @param trg: the target directory (with trailing separator)
+        @param entries: a dictionary node -> status info of all entries
+        '''
+        self.begin(trg)
+        self.add(trg, entries)
+        self.finish(trg)
+
+    def begin(self, trg):
+        '''Starts recording a target directory in chunks (see add()):
+        the directory is unknown until finish().
+        @param trg: the target directory (with trailing separator)
+        '''
+        relPath = self.relative(trg)
+        with self._lock:
+            self._db.execute('DELETE FROM dirs WHERE path=?', (relPath,))
+            self._db.execute('DELETE FROM files WHERE dir=?', (relPath,))
+
+    def add(self, trg, entries):
+        '''Stores a chunk of the entries of a target directory.
+        @param trg: the target directory (with trailing separator)
+        @param entries: a dictionary node -> status info
+        '''
+        relPath = self.relative(trg)
+        with self._lock:
+            self._db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                [(relPath, node, info.st_mode, info.st_size,
+                    info.st_mtime_ns, info.st_ino)
+                 for node, info in entries.items()])
+
+    def finish(self, trg):
+        '''Marks a target directory as known: all its entries are stored.
+        @param trg: the target directory (with trailing separator)
+        '''
+        relPath = self.relative(trg)
+        mtimeNs = os.stat(trg).st_mtime_ns
+        with self._lock:
+            if time.time() * 1E9 - mtimeNs < self._racyNs:
+                self._db.execute('DELETE FROM files WHERE dir=?', (relPath,))
+            else:
+                self._db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)',
+                    (relPath, mtimeNs))
+
+    def forget(self, trg):
+        '''Marks a target directory as unknown: it will be read the next time.
+        @param trg: the target directory (with trailing separator)
+        '''
+        with self._lock:
+            self._db.execute('DELETE FROM dirs WHERE path=?',
+                (self.relative(trg),))
+
+    def verify(self):
+        '''Compares the index with the real target tree.
+        @return: a list of messages describing the differences.
+                Empty: the index matches the tree
+        '''
+        rc = []
+        with self._lock:
+            dirs = self._db.execute('SELECT path, mtime_ns FROM dirs').fetchall()
+        for relPath, mtimeNs in dirs:
+            trg = self._target + relPath
+            try:
+                if os.stat(trg).st_mtime_ns != mtimeNs:
+                    # will be read again by the next run: no problem
+                    continue
+                real = {}
+                with os.scandir(trg) as iterator:
+                    for entry in iterator:
+                        real[entry.name] = entry.stat(follow_symlinks=False)
+            except OSError as exc:
+                rc.append(trg + ': ' + str(exc))
+                continue
+            with self._lock:
+                rows = self._db.execute('SELECT node, mode, size, mtime_ns, '
+                    + 'inode FROM files WHERE dir=?', (relPath,)).fetchall()
+            for node, mode, size, nodeMtime, inode in rows:
+                info = real.pop(node, None)
+                if info == None:
+                    rc.append(trg + node + ': missing')
+                elif stat.S_IFMT(info.st_mode) != stat.S_IFMT(mode):
+                    rc.append(trg + node + ': file type differs')
+                elif not stat.S_ISDIR(mode) and (info.st_size != size
+                        or info.st_mtime_ns != nodeMtime or info.st_ino != inode):
+                    rc.append(trg + node + ': modified')
+            for node in real:
+                rc.append(trg + node + ': not indexed')
+        return rc
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, hashlib, sqlite3, threading, time
+
+class FileHasher:
+    '''Calculates content digests (BLAKE2b) of files with streaming reads.
+    The digests are stored in a SQLite database in the home directory,
+    keyed by device and inode and validated by size, modification time and
+    change time: a repeated run does not read unchanged files again. The
+    change time detects content rewritten in place with a restored mtime.
+    '''
+    def __init__(self, home, blockSize = 1024 * 1024):
+        '''Constructor.
+        @param home: None or the directory containing the digest cache.<br>
+                None: the digests are not cached
+        @param blockSize: the size of one read
+        '''
+        self._blockSize = blockSize
+        self._lock = threading.Lock()
+        self._db = None
+        if home != None:
+            self._db = sqlite3.connect(home + os.sep + '.redirsync.digests.db',
+                check_same_thread=False)
+            columns = [row[1] for row in 
+                self._db.execute('PRAGMA table_info(digests)')]
+            if columns and 'ctime_ns' not in columns:
+                # a cache of a former version: cannot be validated
+                self._db.execute('DROP TABLE digests')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, 
+    ctime_ns INTEGER, digest BLOB, PRIMARY KEY (dev, inode))''')
+        self._countFiles = 0
+        self._countCached = 0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def close(self):
+        '''Stores the cache and frees the resources.
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def hashFile(self, path):
+        '''Calculates the digest of a file without using the cache.
+        @param path: the filename
+        @return: a tuple (digest, status): the digest (bytes) and the status
+                of the file after reading
+        '''
+        start = time.time()
+        size = 0
+        digest = hashlib.blake2b(digest_size=32)
+        buffer = bytearray(self._blockSize)
+        view = memoryview(buffer)
+        with open(path, 'rb', buffering=0) as fp:
+            while True:
+                length = fp.readinto(buffer)
+                if not length:
+                    break
+                digest.update(view[0:length])
+                size += length
+            statInfo = os.fstat(fp.fileno())
+        with self._lock:
+            self._countFiles += 1
+            self._bytes += size
+            self._seconds += time.time() - start
+        return digest.digest(), statInfo
+
+    def digest(self, path, statInfo):
+        '''Returns the digest of a file, from the cache if possible.
+        @param path: the filename
+        @param statInfo: the status of the file (without following links)
+        @return: the digest (bytes)
+        '''
+        if (statInfo.st_dev == None 
+                or getattr(statInfo, 'st_ctime_ns', None) == None):
+            # e.g. taken from the index
+            statInfo = os.lstat(path)
+        key = (statInfo.st_dev, statInfo.st_ino)
+        row = None
+        if self._db != None:
+            with self._lock:
+                row = self._db.execute('SELECT size, mtime_ns, ctime_ns, digest'
+                    + ' FROM digests WHERE dev=? AND inode=?', key).fetchone()
+        if (row != None and row[0] == statInfo.st_size
+                and row[1] == statInfo.st_mtime_ns 
+                and row[2] == statInfo.st_ctime_ns):
+            rc = row[3]
+            with self._lock:
+                self._countCached += 1
+        else:
+            rc, after = self.hashFile(path)
+            if (after.st_size == statInfo.st_size
+                    and after.st_mtime_ns == statInfo.st_mtime_ns
+                    and after.st_ctime_ns == statInfo.st_ctime_ns):
+                self.store(after, rc)
+        return rc
+
+    def store(self, statInfo, digest):
+        '''Stores the digest of a file in the cache.
+        @param statInfo: the status of the file
+        @param digest: the digest of the content
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO digests '
+                    + 'VALUES (?, ?, ?, ?, ?, ?)', (statInfo.st_dev, 
+                        statInfo.st_ino, statInfo.st_size, 
+                        statInfo.st_mtime_ns, statInfo.st_ctime_ns, digest))
+
+    def forget(self, statInfo):
+        '''Removes the digest of a file from the cache.
+        @param statInfo: the status of the file
+        '''
+        if self._db != None:
+            with self._lock:
+                self._db.execute('DELETE FROM digests WHERE dev=? AND inode=?',
+                    (statInfo.st_dev, statInfo.st_ino))
+
+    def throughput(self):
+        '''Returns the hashing speed.
+        @return: the hashed bytes per second
+        '''
+        return self._bytes / max(self._seconds, 1E-6)
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, stat, shutil, threading, errno, io, mmap, re
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl of Linux: the target shares the data blocks of the source (btrfs, xfs)
+FICLONE = 0x40049409
+# the temporary files: .<node>.redirsync.<pid>.<suffix>
+_tempPattern = re.compile(r'^\.(.+)\.redirsync\.(\d+)\.(tmp|part)$', re.DOTALL)
+
+def tempName(path, suffix = 'tmp'):
+    '''Returns the name of a temporary file receiving the data of a target.
+    The file is hidden and contains the process id: concurrent processes do
+    not share it and leftovers of aborted runs can be recognized.
+    @param path: the full path of the target file
+    @param suffix: 'tmp' or 'part' (resumable copies)
+    @return: the full path of the temporary file (same directory)
+    '''
+    head, node = os.path.split(path)
+    return os.path.join(head, '.{}.redirsync.{}.{}'.format(node, os.getpid(),
+        suffix))
+
+def parseTempName(node):
+    '''Tests whether a node is the name of a temporary file (see tempName()).
+    @param node: the filename without path
+    @return: None: no temporary file<br>
+            otherwise: a tuple (target node, process id, suffix)
+    '''
+    matcher = _tempPattern.match(node)
+    return (None if matcher == None else (matcher.group(1), 
+        int(matcher.group(2)), matcher.group(3)))
+
+def pageCacheSize():
+    '''Returns the size of the page cache of the system.
+    @return: the size in bytes. None: unknown (not Linux)
+    '''
+    rc = None
+    try:
+        with open('/proc/meminfo', 'r') as fp:
+            for line in fp:
+                if line.startswith('Cached:'):
+                    rc = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    return rc
+
+class Copier:
+    '''Copies the content and the metadata of files.
+    The content is copied by the cheapest method the kernel offers:
+    reflink (FICLONE), copy_file_range(), sendfile() and at last
+    read()/write() with a large buffer. A method which is not supported
+    for a pair of devices is not tried again for that pair.
+    Large files which already exist on the target can be updated in place:
+    only the blocks which differ are written (delta copy).
+    Sparse files are copied extent by extent: the holes found by
+    SEEK_DATA/SEEK_HOLE are not written but recreated on the target.
+    Without hole information (or in mode 'zeros') blocks of zeros are skipped.
+    Targets are preallocated (posix_fallocate()) against fragmentation.
+    In page cache mode 'drop' the copied parts are released from the cache
+    window by window (posix_fadvise()): a large run does not evict the cache
+    of other programs. Very large files can bypass the cache (O_DIRECT).
+    In atomic mode new content is written to a temporary file which is
+    renamed into place: the target is never seen half written.
+    '''
+    _unsupported = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+        errno.ENOTTY, errno.EBADF, errno.ETXTBSY)
+    # the bytes handed to the kernel with one call
+    _chunkSize = 64 * 1024 * 1024
+    # the unit of the zero block detection
+    _zeroBlockSize = 64 * 1024
+    # positional I/O is needed for writing around holes (not on Windows)
+    _sparseSupported = hasattr(os, 'pread') and hasattr(os, 'pwrite')
+    # in page cache mode 'drop': the bytes copied between two releases
+    _cacheWindow = 16 * 1024 * 1024
+    _adviceSupported = hasattr(os, 'posix_fadvise')
+    _directSupported = (hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv')
+        and hasattr(os, 'pwritev'))
+    # O_DIRECT needs aligned buffers, positions and lengths
+    _directAlignment = 4096
+    _directBufferSize = 8 * 1024 * 1024
+
+    def __init__(self, deltaMinSize = 0, blockSize = 1024 * 1024, 
+            bufferSize = 1024 * 1024, sparse = 'auto', pageCache = 'keep',
+            directMinSize = 0, preallocateMinSize = 1024 * 1024,
+            atomic = False, replace = None):
+        '''Constructor.
+        @param deltaMinSize: files with at least this size are copied with
+                delta copy if the target exists. 0: no delta copy
+        @param blockSize: the unit of comparison for delta copy
+        @param bufferSize: the buffer size of the read()/write() copy
+        @param sparse: 'auto': files with fewer allocated blocks than their
+                size are copied without their holes<br>
+                'zeros': additionally blocks of zeros are not written<br>
+                'off': all files are copied completely
+        @param pageCache: 'keep': the page cache is used as usual<br>
+                'drop': the copied data is released from the page cache
+        @param directMinSize: files with at least this size are copied with
+                O_DIRECT (bypassing the page cache). 0: never
+        @param preallocateMinSize: targets with at least this size are
+                allocated before copying. 0: never
+        @param atomic: True: regular files are copied into a temporary file
+                which replaces the target (see copySafe())
+        @param replace: None or a function(temp, target) moving the
+                temporary file into place. None: os.replace()
+        '''
+        self._deltaMinSize = deltaMinSize
+        self._blockSize = blockSize
+        self._bufferSize = bufferSize
+        self._sparse = sparse if self._sparseSupported else 'off'
+        self._dropCache = pageCache == 'drop' and self._adviceSupported
+        if self._dropCache:
+            # the kernel copies window by window
+            self._chunkSize = self._cacheWindow
+        self._directMinSize = directMinSize if self._directSupported else 0
+        self._preallocateMinSize = (preallocateMinSize 
+            if hasattr(os, 'posix_fallocate') else 0)
+        self._atomic = atomic
+        self._replace = os.replace if replace == None else replace
+        self._lock = threading.Lock()
+        self._countDelta = 0
+        self._deltaWritten = 0
+        self._deltaSkipped = 0
+        self._countFallbacks = 0
+        self._countSparse = 0
+        self._sparseSkipped = 0
+        self._countPreallocated = 0
+        self._countDirect = 0
+        self._directBytes = 0
+        # the bytes of the copied files released from the page cache
+        self._releasedBytes = 0
+        self._zeros = None
+        self._methods = []
+        if fcntl != None and hasattr(fcntl, 'ioctl') and os.sep == '/':
+            self._methods.append(('reflink', self.copyByReflink))
+        if self._sparse != 'off':
+            # after reflink: sharing the extents keeps the holes too
+            self._methods.append(('sparse', self.copySparse))
+        if hasattr(os, 'copy_file_range'):
+            self._methods.append(('copy_file_range', self.copyByCopyFileRange))
+        if hasattr(os, 'sendfile'):
+            self._methods.append(('sendfile', self.copyBySendfile))
+        self._methods.append(('read/write', self.copyByBuffer))
+        # (srcDevice, trgDevice, method) of failed methods
+        self._failed = set()
+        # method -> [files, bytes]
+        self._methodStatistics = {}
+
+    def copy(self, src, trg, srcStat, trgStat = None):
+        '''Copies a file like shutil.copy2().
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source (without following links)
+        @param trgStat: None or the status of the existing target
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        if self.isDeltaCopy(srcStat, trgStat):
+            try:
+                self.copyDelta(src, trg)
+            except OSError:
+                # the target may be partially updated: replace it completely
+                with self._lock:
+                    self._countFallbacks += 1
+                rc = self.copySafe(src, trg)
+        elif not stat.S_ISREG(srcStat.st_mode):
+            shutil.copy2(src, trg)
+            self.count('copy2', srcStat.st_size)
+        elif self._atomic:
+            rc = self.copySafe(src, trg, srcStat)
+        else:
+            rc = self.copyRegular(src, trg, srcStat)
+        return rc
+
+    def copyRegular(self, src, trg, srcStat):
+        '''Copies the content and the metadata of a regular file.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        if not self.isDirect(srcStat) or not self.copyDirect(src, trg):
+            rc = self.copyContent(src, trg, srcStat)
+        shutil.copystat(src, trg)
+        return rc
+
+    def isDeltaCopy(self, srcStat, trgStat):
+        '''Tests whether a file will be copied by delta copy.
+        @param srcStat: the status of the source (without following links)
+        @param trgStat: None or the status of the existing target
+        @return: True: only the changed blocks will be written
+        '''
+        return (self._deltaMinSize > 0 and trgStat != None
+                and srcStat.st_size >= self._deltaMinSize
+                and stat.S_ISREG(srcStat.st_mode)
+                and stat.S_ISREG(trgStat.st_mode))
+
+    def isSparse(self, srcStat):
+        '''Tests whether a file will be copied without its holes.
+        @param srcStat: the status of the source
+        @return: True: only the data extents will be written
+        '''
+        rc = False
+        if (self._sparse != 'off' and stat.S_ISREG(srcStat.st_mode) 
+                and srcStat.st_size > 0):
+            if self._sparse == 'zeros':
+                rc = True
+            else:
+                blocks = getattr(srcStat, 'st_blocks', None)
+                rc = blocks != None and blocks * 512 < srcStat.st_size
+        return rc
+
+    def count(self, method, size):
+        '''Counts a copy in the statistics of the copy methods.
+        @param method: the name of the method
+        @param size: the number of copied bytes
+        '''
+        with self._lock:
+            if method not in self._methodStatistics:
+                self._methodStatistics[method] = [0, 0]
+            item = self._methodStatistics[method]
+            item[0] += 1
+            item[1] += size
+
+    def isDirect(self, srcStat):
+        '''Tests whether a file should be copied with O_DIRECT.
+        @param srcStat: the status of the source
+        @return: True: the page cache should be bypassed
+        '''
+        return (self._directMinSize > 0 and stat.S_ISREG(srcStat.st_mode)
+            and srcStat.st_size >= self._directMinSize
+            and not self.isSparse(srcStat))
+
+    def adviseSequential(self, fdSrc):
+        '''Announces that the source will be read once from start to end.
+        @param fdSrc: the file descriptor of the source
+        '''
+        if self._dropCache:
+            os.posix_fadvise(fdSrc, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def releaseCache(self, fdSrc, fdTrg, start, end):
+        '''Releases a copied part of the files from the page cache.
+        The target pages are dirty at first: the advice starts their write
+        back, they are released by the advice for the next part.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param start: the first position of the copied part
+        @param end: the position behind the copied part
+        '''
+        if self._dropCache:
+            if end > start:
+                os.posix_fadvise(fdSrc, start, end - start, os.POSIX_FADV_DONTNEED)
+                os.posix_fadvise(fdTrg, start, end - start, os.POSIX_FADV_DONTNEED)
+            if start > 0:
+                previous = max(0, start - self._chunkSize)
+                os.posix_fadvise(fdTrg, previous, start - previous, 
+                    os.POSIX_FADV_DONTNEED)
+
+    def releaseFile(self, fdSrc, fdTrg, size):
+        '''Releases a copied file from the page cache and counts it.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param size: the number of copied bytes
+        '''
+        if self._dropCache:
+            self.releaseCache(fdSrc, fdTrg, 0, size)
+            with self._lock:
+                self._releasedBytes += size
+
+    def preallocate(self, fdTrg, offset, size):
+        '''Allocates the blocks of a target before copying: less fragmentation.
+        @param fdTrg: the file descriptor of the target
+        @param offset: the first position to allocate
+        @param size: the final size of the target
+        @return: True: the target has been extended to size
+        '''
+        rc = False
+        if self._preallocateMinSize > 0 and size >= self._preallocateMinSize:
+            try:
+                os.posix_fallocate(fdTrg, offset, size - offset)
+                rc = True
+            except OSError as exc:
+                if exc.errno not in self._unsupported:
+                    raise
+            if rc:
+                with self._lock:
+                    self._countPreallocated += 1
+        return rc
+
+    def countSparse(self, skipped):
+        '''Counts a file copied without its holes.
+        @param skipped: the number of bytes not written
+        '''
+        with self._lock:
+            self._countSparse += 1
+            self._sparseSkipped += skipped
+
+    def copyContent(self, src, trg, srcStat):
+        '''Copies the content of a regular file with the cheapest method.
+        If a method fails before copying anything the next one is used.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        rc = 0
+        sparse = self.isSparse(srcStat)
+        preallocated = False
+        with open(src, 'rb') as fpSrc, open(trg, 'wb') as fpTrg:
+            fdSrc = fpSrc.fileno()
+            fdTrg = fpTrg.fileno()
+            devices = (srcStat.st_dev, os.fstat(fdTrg).st_dev)
+            self.adviseSequential(fdSrc)
+            for name, method in self._methods:
+                if (devices + (name,) in self._failed 
+                        or name == 'sparse' and not sparse):
+                    continue
+                if name not in ('reflink', 'sparse') and not preallocated:
+                    # the size only: the content is written sequentially
+                    preallocated = self.preallocate(fdTrg, 0, srcStat.st_size)
+                start = os.lseek(fdTrg, 0, os.SEEK_CUR)
+                try:
+                    size = method(fdSrc, fdTrg)
+                except OSError as exc:
+                    if (exc.errno not in self._unsupported 
+                            or os.lseek(fdTrg, 0, os.SEEK_CUR) != start):
+                        raise
+                    with self._lock:
+                        self._failed.add(devices + (name,))
+                    continue
+                self.count(name, size)
+                if name == 'sparse':
+                    rc = srcStat.st_size - size
+                    self.countSparse(rc)
+                elif preallocated and size != srcStat.st_size:
+                    # the source has changed in the meantime
+                    os.ftruncate(fdTrg, size)
+                if name != 'reflink':
+                    self.releaseFile(fdSrc, fdTrg, size)
+                break
+        return rc
+
+    def copyByReflink(self, fdSrc, fdTrg):
+        '''Lets the target share the data blocks of the source.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        fcntl.ioctl(fdTrg, FICLONE, fdSrc)
+        size = os.fstat(fdSrc).st_size
+        os.lseek(fdTrg, size, os.SEEK_SET)
+        return size
+
+    def copyByCopyFileRange(self, fdSrc, fdTrg):
+        '''Copies inside the kernel with copy_file_range().
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        while True:
+            length = os.copy_file_range(fdSrc, fdTrg, self._chunkSize)
+            if length == 0:
+                break
+            rc += length
+            self.releaseCache(fdSrc, fdTrg, rc - length, rc)
+        return rc
+
+    def copyBySendfile(self, fdSrc, fdTrg):
+        '''Copies inside the kernel with sendfile().
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        while True:
+            length = os.sendfile(fdTrg, fdSrc, None, self._chunkSize)
+            if length == 0:
+                break
+            rc += length
+            self.releaseCache(fdSrc, fdTrg, rc - length, rc)
+        return rc
+
+    def copyByBuffer(self, fdSrc, fdTrg):
+        '''Copies with read() and write() through a buffer.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of copied bytes
+        '''
+        rc = 0
+        released = 0
+        buffer = bytearray(self._bufferSize)
+        view = memoryview(buffer)
+        reader = io.FileIO(fdSrc, 'rb', closefd=False)
+        while True:
+            length = reader.readinto(buffer)
+            if not length:
+                break
+            written = 0
+            while written < length:
+                written += os.write(fdTrg, view[written:length])
+            rc += length
+            if rc - released >= self._chunkSize:
+                self.releaseCache(fdSrc, fdTrg, released, rc)
+                released = rc
+        return rc
+
+    def copySparse(self, fdSrc, fdTrg):
+        '''Copies the data extents of a file: the holes are not written.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @return: the number of written bytes
+        '''
+        size, rc = self.copyExtents(fdSrc, fdTrg, 0)
+        os.lseek(fdTrg, size, os.SEEK_SET)
+        return rc
+
+    def dataExtents(self, fd, offset, size):
+        '''Returns the parts of a file which contain data.
+        @param fd: the file descriptor
+        @param offset: the first position to inspect
+        @param size: the file size
+        @return: an iterator of tuples (start, end, exact). exact is False if
+                the filesystem does not know the holes: the part may contain some
+        '''
+        position = offset
+        while position < size:
+            if not hasattr(os, 'SEEK_DATA'):
+                yield (position, size, False)
+                break
+            try:
+                start = os.lseek(fd, position, os.SEEK_DATA)
+                end = min(size, os.lseek(fd, start, os.SEEK_HOLE))
+            except OSError as exc:
+                if exc.errno == errno.ENXIO:
+                    # only a hole up to the end of the file
+                    break
+                if exc.errno not in self._unsupported:
+                    raise
+                yield (position, size, False)
+                break
+            if start >= end:
+                break
+            yield (start, end, True)
+            position = end
+
+    def copyExtents(self, fdSrc, fdTrg, offset, progress = None):
+        '''Copies the data extents of a file starting at a given position.
+        The holes are recreated by setting the file size.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target (empty behind offset)
+        @param offset: the first position to copy
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk (64 MByte)
+        @return: a tuple (size, written): the file size and the number of
+                written bytes
+        '''
+        size = os.fstat(fdSrc).st_size
+        written = 0
+        reported = offset
+        for start, end, exact in self.dataExtents(fdSrc, offset, size):
+            detectZeros = self._sparse == 'zeros' or not exact
+            position = start
+            while position < end:
+                last = min(end, position + self._chunkSize)
+                written += self.copyExtent(fdSrc, fdTrg, position, last, 
+                    detectZeros)
+                self.releaseCache(fdSrc, fdTrg, position, last)
+                position = last
+                if progress != None and position - reported >= self._chunkSize:
+                    os.ftruncate(fdTrg, position)
+                    progress(position)
+                    reported = position
+        os.ftruncate(fdTrg, size)
+        return size, written
+
+    def copyExtent(self, fdSrc, fdTrg, start, end, detectZeros):
+        '''Copies a part of a file to the same position of the target.
+        @param fdSrc: the file descriptor of the source
+        @param fdTrg: the file descriptor of the target
+        @param start: the first position to copy
+        @param end: the position behind the last byte to copy
+        @param detectZeros: True: blocks containing only zeros are not written
+        @return: the number of written bytes
+        '''
+        position = start
+        if not detectZeros and hasattr(os, 'copy_file_range'):
+            try:
+                while position < end:
+                    length = os.copy_file_range(fdSrc, fdTrg, 
+                        min(self._chunkSize, end - position), position, position)
+                    if length == 0:
+                        break
+                    position += length
+                return position - start
+            except OSError as exc:
+                if exc.errno not in self._unsupported:
+                    raise
+        # the part copied by the kernel before it failed
+        rc = position - start
+        unit = self._zeroBlockSize
+        bufferSize = self._bufferSize
+        if detectZeros:
+            if self._zeros == None:
+                self._zeros = bytes(unit)
+            # whole blocks: the zero blocks are found at the same positions
+            bufferSize = max(unit, bufferSize - bufferSize % unit)
+        while position < end:
+            data = os.pread(fdSrc, min(bufferSize, end - position), position)
+            if not data:
+                break
+            length = len(data)
+            view = memoryview(data)
+            first = 0
+            if detectZeros:
+                # writes the runs of blocks which are not zero
+                for ix in range(0, length, unit):
+                    if data[ix:ix + unit] == self._zeros[0:min(unit, length - ix)]:
+                        if first < ix:
+                            rc += self.writeAt(fdTrg, view[first:ix], position + first)
+                        first = ix + unit
+            if first < length:
+                rc += self.writeAt(fdTrg, view[first:length], position + first)
+            position += length
+        return rc
+
+    def writeAt(self, fd, view, position):
+        '''Writes a buffer completely at a given position.
+        @param fd: the file descriptor
+        @param view: the data to write (a memoryview)
+        @param position: the file position of the first byte
+        @return: the number of written bytes
+        '''
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], position + written)
+        return written
+
+    def copyDirect(self, src, trg, offset = 0, progress = None):
+        '''Copies a file with O_DIRECT: the data does not pass the page cache.
+        @param src: the source file
+        @param trg: the target file. Data behind offset is discarded
+        @param offset: the first position to copy (aligned)
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk
+        @return: True: the file has been copied<br>
+                False: the filesystems do not support O_DIRECT
+        '''
+        align = self._directAlignment
+        size = self._directBufferSize
+        # mmap: the buffer is aligned to a page
+        buffer = mmap.mmap(-1, size)
+        view = memoryview(buffer)
+        fdSrc = fdTrg = None
+        position = offset
+        try:
+            fdSrc = os.open(src, os.O_RDONLY | os.O_DIRECT)
+            fdTrg = os.open(trg, os.O_WRONLY | os.O_CREAT | os.O_DIRECT
+                | (os.O_TRUNC if offset == 0 else 0), 0o666)
+            os.ftruncate(fdTrg, offset)
+            total = os.fstat(fdSrc).st_size
+            self.preallocate(fdTrg, offset, total)
+            reported = offset
+            while True:
+                length = os.preadv(fdSrc, [buffer], position)
+                if length == 0:
+                    break
+                # the last block is filled up and cut off by the truncation
+                todo = (length + align - 1) // align * align
+                written = 0
+                while written < todo:
+                    written += os.pwritev(fdTrg, [view[written:todo]], 
+                        position + written)
+                position += length
+                if progress != None and position - reported >= self._chunkSize:
+                    progress(position)
+                    reported = position
+                if length % align != 0:
+                    # the end of the file
+                    break
+            os.ftruncate(fdTrg, position)
+        except OSError as exc:
+            if exc.errno != errno.EINVAL or position != offset:
+                raise
+            return False
+        finally:
+            view.release()
+            buffer.close()
+            if fdSrc != None:
+                os.close(fdSrc)
+            if fdTrg != None:
+                os.close(fdTrg)
+        self.count('direct', position - offset)
+        with self._lock:
+            self._countDirect += 1
+            self._directBytes += position - offset
+        return True
+
+    def copyRange(self, src, trg, offset, progress = None):
+        '''Copies the content of a file starting at a given position.
+        Used to continue an interrupted copy.
+        @param src: the source file
+        @param trg: the target file. Data behind offset is discarded
+        @param offset: the first position to copy
+        @param progress: None or a function called with the number of bytes
+                stored in the target after each chunk (64 MByte)
+        @return: the number of bytes not written because they are holes
+        '''
+        info = os.stat(src)
+        if (self.isDirect(info) and offset % self._directAlignment == 0
+                and self.copyDirect(src, trg, offset, progress)):
+            return 0
+        useKernel = hasattr(os, 'copy_file_range')
+        buffer = None
+        rc = 0
+        with open(src, 'rb') as fpSrc, open(trg, 
+                'r+b' if offset > 0 else 'wb') as fpTrg:
+            fpTrg.truncate(offset)
+            fpSrc.seek(offset)
+            fpTrg.seek(offset)
+            fdSrc = fpSrc.fileno()
+            fdTrg = fpTrg.fileno()
+            position = offset
+            reported = offset
+            self.adviseSequential(fdSrc)
+            preallocated = False
+            if self.isSparse(os.fstat(fdSrc)):
+                position, written = self.copyExtents(fdSrc, fdTrg, offset, 
+                    progress)
+                rc = max(0, position - offset - written)
+                self.countSparse(rc)
+            else:
+                preallocated = self.preallocate(fdTrg, offset, info.st_size)
+                while True:
+                    length = None
+                    if useKernel:
+                        try:
+                            length = os.copy_file_range(fdSrc, fdTrg, 
+                                self._chunkSize, position, position)
+                        except OSError as exc:
+                            if exc.errno not in self._unsupported:
+                                raise
+                            useKernel = False
+                    if length == None:
+                        if buffer == None:
+                            buffer = bytearray(self._bufferSize)
+                        os.lseek(fdSrc, position, os.SEEK_SET)
+                        os.lseek(fdTrg, position, os.SEEK_SET)
+                        length = fpSrc.raw.readinto(buffer)
+                        view = memoryview(buffer)
+                        written = 0
+                        while written < length:
+                            written += os.write(fdTrg, view[written:length])
+                    if not length:
+                        break
+                    position += length
+                    self.releaseCache(fdSrc, fdTrg, position - length, position)
+                    if progress != None and position - reported >= self._chunkSize:
+                        progress(position)
+                        reported = position
+                if preallocated and position != info.st_size:
+                    os.ftruncate(fdTrg, position)
+            self.releaseFile(fdSrc, fdTrg, position)
+        self.count('resumed' if offset > 0 else 'resumable', position - offset - rc)
+        return rc
+
+    def copyDelta(self, src, trg):
+        '''Updates an existing target file: only differing blocks are written.
+        @param src: the source file
+        @param trg: the target file
+        '''
+        written = 0
+        skipped = 0
+        blockSize = self._blockSize
+        with open(src, 'rb') as fpSrc, open(trg, 'r+b') as fpTrg:
+            self.adviseSequential(fpSrc.fileno())
+            position = 0
+            released = 0
+            while True:
+                block = fpSrc.read(blockSize)
+                if not block:
+                    break
+                if fpTrg.read(len(block)) == block:
+                    skipped += len(block)
+                else:
+                    fpTrg.seek(position)
+                    fpTrg.write(block)
+                    written += len(block)
+                position += len(block)
+                if self._dropCache and position - released >= self._chunkSize:
+                    fpTrg.flush()
+                    self.releaseCache(fpSrc.fileno(), fpTrg.fileno(), released, 
+                        position)
+                    released = position
+            fpTrg.truncate(position)
+            fpTrg.flush()
+            self.releaseFile(fpSrc.fileno(), fpTrg.fileno(), position)
+        shutil.copystat(src, trg)
+        self.count('delta', written)
+        with self._lock:
+            self._countDelta += 1
+            self._deltaWritten += written
+            self._deltaSkipped += skipped
+
+    def copySafe(self, src, trg, srcStat = None):
+        '''Copies a file into a temporary file which replaces the target.
+        @param src: the source file
+        @param trg: the target file
+        @param srcStat: None or the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        temp = tempName(trg)
+        try:
+            rc = self.copyRegular(src, temp, 
+                os.stat(src) if srcStat == None else srcStat)
+            self._replace(temp, trg)
+        except OSError:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+        return rc
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import json, sys, threading
+
+class Action:
+    '''One step of a change plan: copy, link, delete, mkdir or rmtree.
+    '''
+    __slots__ = ('_op', '_reason', '_src', '_trg', '_size', '_mtime',
+        '_srcStat', '_trgStat', '_statsKnown')
+
+    def __init__(self, op, reason, src, trg, srcStat = None, trgStat = None):
+        '''Constructor.
+        @param op: 'copy', 'link', 'delete', 'mkdir' or 'rmtree'.<br>
+                'link': the target becomes a hardlink to src
+        @param reason: the reason of the action, e.g. '+' for a new file
+        @param src: None or the source file
+        @param trg: the target file or directory
+        @param srcStat: None or the status of the source
+        @param trgStat: None or the status of the target.<br>
+                For 'copy': None means the target does not exist
+        '''
+        self._op = op
+        self._reason = reason
+        self._src = src
+        self._trg = trg
+        info = srcStat if srcStat != None else trgStat
+        self._size = None if info == None else info.st_size
+        self._mtime = None if info == None else info.st_mtime
+        self._srcStat = srcStat
+        self._trgStat = trgStat
+        self._statsKnown = True
+
+    def toDict(self):
+        '''Returns the action as dictionary (for the JSON representation).
+        @return: a dictionary with the keys op, reason, trg and (if known)
+                src, size and mtime
+        '''
+        rc = {'op': self._op, 'reason': self._reason, 'trg': self._trg}
+        if self._src != None:
+            rc['src'] = self._src
+        if self._size != None:
+            rc['size'] = self._size
+            rc['mtime'] = self._mtime
+        return rc
+
+    @staticmethod
+    def fromDict(values):
+        '''Builds an action from its JSON representation.
+        The status infos are unknown: they must be fetched while executing.
+        @param values: a dictionary created by toDict()
+        @return: the action
+        '''
+        rc = Action(values['op'], values.get('reason'), values.get('src'),
+            values['trg'])
+        rc._size = values.get('size')
+        rc._mtime = values.get('mtime')
+        rc._statsKnown = False
+        return rc
+
+class PlanWriter:
+    '''Writes a change plan as JSON lines: one action per line.
+    '''
     def __init__(self, filename):
         '''Constructor.
-        @param filename: the configuration file
+        @param filename: the file to write. '-': standard output
+        '''
+        self._lock = threading.Lock()
+        if filename == '-':
+            self._fp = sys.stdout
+            self._ownFile = False
+        else:
+            self._fp = open(filename, 'w', buffering=1024 * 1024)
+            self._ownFile = True
+        self._countActions = 0
+
+    def write(self, action):
+        '''Writes one action.
+        @param action: the action to write
+        '''
+        line = json.dumps(action.toDict(), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._fp.write(line)
+            self._countActions += 1
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        if self._ownFile:
+            self._fp.close()
+        else:
+            self._fp.flush()
+
+def readPlan(filename):
+    '''Reads a change plan written by PlanWriter.
+    @param filename: the file to read. '-': standard input
+    @return: an iterator of the actions
+    '''
+    fp = sys.stdin if filename == '-' else open(filename, 'r')
+    try:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield Action.fromDict(json.loads(line))
+    finally:
+        if fp != sys.stdin:
+            fp.close()
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import json, os, os.path, threading, time
+
+class PartialCopy:
+    '''The state of an interrupted copy found in the journal.
+    '''
+    __slots__ = ('_temp', '_bytes', '_size', '_mtimeNs')
+
+    def __init__(self, temp, bytesWritten, size, mtimeNs):
+        '''Constructor.
+        @param temp: the temporary file receiving the data
+        @param bytesWritten: the number of bytes stored in the temporary file
+        @param size: the size of the source file
+        @param mtimeNs: the modification time of the source file
+        '''
+        self._temp = temp
+        self._bytes = bytesWritten
+        self._size = size
+        self._mtimeNs = mtimeNs
+
+class Journal:
+    '''An append-only checkpoint journal of a synchronization run.
+    It records the completed target directories and the progress of large
+    copies. The records are JSON arrays, one per line, and are written in
+    batches. After a successful run the journal is removed.
+    Records:<br>
+    ["D", dir]: all entries of the directory (not its subdirectories) are done<br>
+    ["C", target, temp, bytes, size, mtimeNs]: progress of a copy<br>
+    ["F", target]: a copy is finished
+    '''
+    def __init__(self, filename, resume, batchSize = 1000, interval = 2.0):
+        '''Constructor.
+        @param filename: the journal file
+        @param resume: True: the records of the journal are read and kept.<br>
+                False: the journal is started from scratch
+        @param batchSize: the records are written after this number of records
+        @param interval: ... or after this number of seconds
+        '''
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._done = set()
+        self._copies = {}
+        if resume and os.path.exists(filename):
+            self.load()
+        self._fp = open(filename, 'a' if resume else 'w')
+        self._batchSize = batchSize
+        self._interval = interval
+        self._waiting = []
+        self._lastFlush = time.time()
+
+    def load(self):
+        '''Reads the records of a former run.
+        '''
+        with open(self._filename, 'r') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete
+                    continue
+                kind = record[0]
+                if kind == 'D':
+                    self._done.add(record[1])
+                elif kind == 'C':
+                    self._copies[record[1]] = PartialCopy(record[2], record[3],
+                        record[4], record[5])
+                elif kind == 'F':
+                    self._copies.pop(record[1], None)
+
+    def isDone(self, trg):
+        '''Tests whether a target directory has been completed by a former run.
+        @param trg: the target directory
+        @return: True: the entries of the directory are synchronized
+        '''
+        return trg in self._done
+
+    def partialCopy(self, trg):
+        '''Returns the state of an interrupted copy.
+        @param trg: the target file
+        @return: None: no interrupted copy<br>
+                otherwise: the PartialCopy instance
+        '''
+        return self._copies.get(trg)
+
+    def add(self, record):
+        '''Appends a record. The records are written in batches.
+        @param record: the record (a list)
+        '''
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._waiting.append(line)
+            if (len(self._waiting) >= self._batchSize
+                    or time.time() - self._lastFlush >= self._interval):
+                self.flush()
+
+    def flush(self):
+        '''Writes the waiting records. The caller must hold the lock.
+        '''
+        self._fp.write(''.join(self._waiting))
+        self._fp.flush()
+        self._waiting = []
+        self._lastFlush = time.time()
+
+    def dirDone(self, trg):
+        '''Records that the entries of a target directory are synchronized.
+        @param trg: the target directory
+        '''
+        self.add(['D', trg])
+
+    def copyProgress(self, trg, temp, bytesWritten, srcStat):
+        '''Records the progress of a copy.
+        @param trg: the target file
+        @param temp: the temporary file receiving the data
+        @param bytesWritten: the number of bytes stored in temp
+        @param srcStat: the status of the source
+        '''
+        self.add(['C', trg, temp, bytesWritten, srcStat.st_size,
+            srcStat.st_mtime_ns])
+
+    def copyDone(self, trg):
+        '''Records that a copy is finished.
+        @param trg: the target file
+        '''
+        self.add(['F', trg])
+
+    def close(self, success):
+        '''Frees the resources.
+        @param success: True: the run is complete: the journal is removed
+        '''
+        with self._lock:
+            self.flush()
+            self._fp.close()
+        if success:
+            os.unlink(self._filename)
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, ctypes, ctypes.util, struct, select, time, errno
+
+# constants of <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+class Batch:
+    '''The directories to synchronize after a burst of events.
+    '''
+    def __init__(self):
+        '''Constructor.
         '''
-        self._dict = {}
-        self._files = []
-        self.read(filename)
+        # source directory -> (target directory, depth, recursive)
+        self._dirs = {}
+        self._overflow = False
+        self._countEvents = 0
 
-    def read(self, filename):
-        '''Reads a configuration file.
-        @param filename: the configuration file
+    def add(self, src, trg, depth, recursive):
+        '''Marks a directory as dirty.
+        @param src: the source directory
+        @param trg: the target directory
+        @param depth: the depth of the directory in the source tree
+        @param recursive: True: the subdirectories must be synchronized too
         '''
-        fp = open(filename, "r")
-        lineNo = 0
-        for line in fp:
-            line = line.rstrip()
-            lineNo += 1
-            if not line.startswith('include'):
-                ix = line.find('=')
-                if ix > 0 and line[0].isalpha():
-                    self._dict[line[0:ix]] = line[ix+1:]
+        item = self._dirs.get(src)
+        if item == None or (recursive and not item[2]):
+            self._dirs[src] = (trg, depth, recursive)
+
+    def isEmpty(self):
+        '''Tests whether there is nothing to do.
+        @return: True: no dirty directory and no overflow
+        '''
+        return len(self._dirs) == 0 and not self._overflow
+
+class Watcher:
+    '''Watches source trees with inotify (via ctypes, Linux only) and
+    collects the directories touched by events.
+    '''
+    _mask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+    _eventHeader = struct.Struct('iIII')
+
+    def __init__(self, dirFilter = None, maxDepth = 99):
+        '''Constructor.
+        @param dirFilter: None or a function testing whether a subdirectory
+                (node) is synchronized
+        @param maxDepth: subdirectories deeper than that are not watched
+        '''
+        name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(name if name != None else 'libc.so.6',
+            use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirFilter = dirFilter
+        self._maxDepth = maxDepth
+        # watch descriptor -> (source, target, depth)
+        self._watches = {}
+        self._descriptors = {}
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        os.close(self._fd)
+
+    def addDir(self, src, trg, depth):
+        '''Watches one directory.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory in the source tree
+        '''
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(src), self._mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'cannot watch ' + src)
+        self._watches[wd] = (src, trg, depth)
+        self._descriptors[src] = wd
+
+    def addTree(self, src, trg, depth = 0):
+        '''Watches a directory and its (matching) subdirectories.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory in the source tree
+        '''
+        self.addDir(src, trg, depth)
+        if depth <= self._maxDepth:
+            with os.scandir(src) as iterator:
+                for entry in iterator:
+                    if (entry.is_dir(follow_symlinks=False) and (self._dirFilter == None
+                            or self._dirFilter(entry.name))):
+                        self.addTree(src + entry.name + os.sep,
+                            trg + entry.name + os.sep, depth + 1)
+
+    def removeTree(self, src):
+        '''Stops watching a directory and its subdirectories.
+        @param src: the source directory (with trailing separator)
+        '''
+        for path in [path for path in self._descriptors if path.startswith(src)]:
+            wd = self._descriptors.pop(path)
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self, timeout):
+        '''Reads the waiting events.
+        @param timeout: the maximal waiting time in seconds. None: forever
+        @return: a list of tuples (wd, mask, name). Empty: timeout
+        '''
+        rc = []
+        ready = select.select([self._fd], [], [], timeout)[0]
+        if ready:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as exc:
+                if exc.errno != errno.EAGAIN:
+                    raise
+                data = b''
+            offset = 0
+            header = self._eventHeader
+            while offset < len(data):
+                wd, mask, cookie, length = header.unpack_from(data, offset)
+                offset += header.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                rc.append((wd, mask, name))
+        return rc
+
+    def handle(self, batch, wd, mask, name):
+        '''Stores the consequences of one event in a batch.
+        @param batch: the batch to fill
+        @param wd: the watch descriptor
+        @param mask: the kind of the event
+        @param name: the node concerned (inside the watched directory)
+        '''
+        if mask & IN_Q_OVERFLOW:
+            batch._overflow = True
+            return
+        info = self._watches.get(wd)
+        if info == None:
+            return
+        src, trg, depth = info
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            self._descriptors.pop(src, None)
+            return
+        if mask & IN_DELETE_SELF:
+            return
+        batch.add(src, trg, depth, False)
+        if (mask & IN_ISDIR and depth < self._maxDepth
+                and (self._dirFilter == None or self._dirFilter(name))):
+            subSrc = src + name + os.sep
+            subTrg = trg + name + os.sep
+            if mask & IN_MOVED_FROM:
+                self.removeTree(subSrc)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.addTree(subSrc, subTrg, depth + 1)
+                except OSError:
+                    # already removed again: the parent will be synchronized
+                    return
+                batch.add(subSrc, subTrg, depth + 1, True)
+
+    def collect(self, delay, timeout = None):
+        '''Waits for events and collects them until nothing happens for a while.
+        @param delay: the batch is complete after this many quiet seconds
+        @param timeout: None or the maximal waiting time for the first event
+        @return: a Batch instance (empty if the timeout has been reached)
+        '''
+        batch = Batch()
+        events = self.read(timeout)
+        start = time.time()
+        while events:
+            for wd, mask, name in events:
+                batch._countEvents += 1
+                self.handle(batch, wd, mask, name)
+            # a steady stream of events must not delay the batch forever:
+            if time.time() - start > 10 * delay:
+                break
+            events = self.read(delay)
+        return batch
+
+    def changedSince(self, timepoint):
+        '''Finds the watched directories with entries changed after a time.
+        Used after an overflow of the event queue: only the source side is
+        inspected. The events of created subdirectories may be lost too:
+        unwatched subdirectories are watched now and synchronized recursively.
+        @param timepoint: the time of the last synchronization
+        @return: a Batch containing the changed directories
+        '''
+        batch = Batch()
+        for wd, (src, trg, depth) in list(self._watches.items()):
+            newDirs = []
+            try:
+                info = os.stat(src)
+                changed = max(info.st_mtime, info.st_ctime) >= timepoint
+                with os.scandir(src) as iterator:
+                    for entry in iterator:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (depth < self._maxDepth
+                                    and src + entry.name + os.sep not in self._descriptors
+                                    and (self._dirFilter == None
+                                        or self._dirFilter(entry.name))):
+                                newDirs.append(entry.name)
+                        elif not changed:
+                            info = entry.stat(follow_symlinks=False)
+                            changed = max(info.st_mtime, info.st_ctime) >= timepoint
+            except OSError:
+                changed = False
+            if changed or newDirs:
+                batch.add(src, trg, depth, False)
+            for name in newDirs:
+                subSrc = src + name + os.sep
+                subTrg = trg + name + os.sep
+                try:
+                    self.addTree(subSrc, subTrg, depth + 1)
+                except OSError:
+                    # already removed again: the parent will be synchronized
+                    continue
+                batch.add(subSrc, subTrg, depth + 1, True)
+        return batch
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import heapq, threading
+
+class PhaseStatistics:
+    '''Counters and timers of the phases of a run: listdir, stat, match,
+    compare, copy, delete and rmtree. Each thread accumulates into its own
+    counters (no lock in the hot path), they are summed on demand.
+    The slowest directories and the largest copies are tracked too.
+    '''
+    PHASES = ('listdir', 'stat', 'match', 'compare', 'copy', 'delete', 'rmtree')
+    # the phases not transferring file content
+    METADATA = ('listdir', 'stat', 'match', 'compare', 'delete', 'rmtree')
+
+    def __init__(self, maxItems = 10):
+        '''Constructor.
+        @param maxItems: the number of the slowest directories and the
+                largest copies to keep
+        '''
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # the counters of all threads: phase -> [count, seconds]
+        self._counters = []
+        self._maxItems = maxItems
+        # heaps of (seconds, dir) and (bytes, seconds, file)
+        self._slowestDirs = []
+        self._largestCopies = []
+
+    def counters(self):
+        '''Returns the counters of the current thread.
+        @return: a dictionary phase -> [count, seconds]
+        '''
+        rc = getattr(self._local, 'counters', None)
+        if rc == None:
+            rc = dict((phase, [0, 0.0]) for phase in self.PHASES)
+            self._local.counters = rc
+            with self._lock:
+                self._counters.append(rc)
+        return rc
+
+    def add(self, phase, seconds, count = 1):
+        '''Counts the execution of a phase.
+        @param phase: the name of the phase, e.g. 'stat'
+        @param seconds: the duration of the execution
+        @param count: the number of executed operations
+        '''
+        item = self.counters()[phase]
+        item[0] += count
+        item[1] += seconds
+
+    def keep(self, heap, item):
+        '''Stores an item in a heap holding the largest items only.
+        @param heap: the heap
+        @param item: the item to store
+        '''
+        with self._lock:
+            if len(heap) < self._maxItems:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def dirDone(self, path, seconds):
+        '''Tracks the processing time of a directory (without subdirectories).
+        @param path: the directory
+        @param seconds: the processing time
+        '''
+        if len(self._slowestDirs) < self._maxItems or seconds > self._slowestDirs[0][0]:
+            self.keep(self._slowestDirs, (seconds, path))
+
+    def copyDone(self, path, size, seconds):
+        '''Tracks a copy.
+        @param path: the target file
+        @param size: the number of copied bytes
+        @param seconds: the duration of the copy
+        '''
+        self.add('copy', seconds)
+        if len(self._largestCopies) < self._maxItems or size > self._largestCopies[0][0]:
+            self.keep(self._largestCopies, (size, seconds, path))
+
+    def totals(self):
+        '''Returns the sum of the counters of all threads.
+        @return: a dictionary phase -> (count, seconds)
+        '''
+        rc = dict((phase, [0, 0.0]) for phase in self.PHASES)
+        with self._lock:
+            for counters in self._counters:
+                for phase, (count, seconds) in counters.items():
+                    item = rc[phase]
+                    item[0] += count
+                    item[1] += seconds
+        return dict((phase, tuple(item)) for phase, item in rc.items())
+
+    def metadataSeconds(self):
+        '''Returns the time spent with metadata operations.
+        @return: the sum of the durations of all phases except copy
+        '''
+        totals = self.totals()
+        return sum(totals[phase][1] for phase in self.METADATA)
+
+    def slowestDirs(self):
+        '''Returns the slowest directories.
+        @return: a list of (seconds, dir), the slowest first
+        '''
+        with self._lock:
+            return sorted(self._slowestDirs, reverse=True)
+
+    def largestCopies(self):
+        '''Returns the largest copies.
+        @return: a list of (bytes, seconds, file), the largest first
+        '''
+        with self._lock:
+            return sorted(self._largestCopies, reverse=True)
+
+    def toDict(self):
+        '''Returns the statistics as dictionary (for the JSON representation).
+        @return: a dictionary with the keys phases, slowestDirs and largestCopies
+        '''
+        return {
+            'phases': dict((phase, {'count': count, 'seconds': round(seconds, 6)})
+                for phase, (count, seconds) in self.totals().items()),
+            'slowestDirs': [{'path': path, 'seconds': round(seconds, 6)}
+                for seconds, path in self.slowestDirs()],
+            'largestCopies': [{'path': path, 'bytes': size,
+                'seconds': round(seconds, 6),
+                'mbPerSec': round(size / max(seconds, 1E-9) / 1E6, 3)}
+                for size, seconds, path in self.largestCopies()]
+        }
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import collections, errno, json, os.path, sys, time
+
+class ErrorLog:
+    '''Collects the errors of a run with bounded memory and cost.
+    The first and the last errors are kept for the report (the last ones in
+    a ring buffer). All errors are counted by kind and by directory.
+    Up to a limit the messages are written (buffered) to the error file,
+    a JSON lines file and stderr; beyond it the errors are only counted.
+    '''
+    # the number of distinct directories counted separately
+    _maxDirs = 10000
+
+    def __init__(self, maxFirst = 20, maxLast = 20, maxLogged = 10000,
+            filename = None, jsonFilename = None, echo = sys.stderr,
+            interval = 2.0):
+        '''Constructor.
+        @param maxFirst: the number of first errors kept for the report
+        @param maxLast: the number of last errors kept for the report
+        @param maxLogged: the number of errors written to the log media
+        @param filename: None or the error file (text)
+        @param jsonFilename: None or the error file (JSON lines)
+        @param echo: None or the stream showing the errors
+        @param interval: the log files are flushed after this many seconds
+        '''
+        self._maxFirst = maxFirst
+        self._maxLogged = maxLogged
+        self._filename = filename
+        self._jsonFilename = jsonFilename
+        self._echo = echo
+        self._interval = interval
+        self._fp = None
+        self._fpJson = None
+        self._lastFlush = time.time()
+        self._count = 0
+        self._first = []
+        self._last = collections.deque(maxlen=maxLast)
+        self._kinds = {}
+        self._dirs = {}
+        self._countOtherDirs = 0
+
+    @staticmethod
+    def kindOf(exception):
+        '''Returns the kind of an error.
+        @param exception: None or the exception describing the error
+        @return: e.g. 'EACCES', 'ValueError' or 'message'
+        '''
+        if exception == None:
+            rc = 'message'
+        elif isinstance(exception, OSError) and exception.errno in errno.errorcode:
+            rc = errno.errorcode[exception.errno]
+        else:
+            rc = type(exception).__name__
+        return rc
+
+    def add(self, msg, exception = None, path = None):
+        '''Handles one error. The caller must serialize the calls.
+        @param msg: the complete message (with newline)
+        @param exception: None or the exception describing the error
+        @param path: None or the file concerned
+        '''
+        self._count += 1
+        kind = self.kindOf(exception)
+        self._kinds[kind] = self._kinds.get(kind, 0) + 1
+        if path != None:
+            path = getattr(exception, 'filename', None) or path
+            directory = os.path.dirname(path.rstrip(os.sep)) + os.sep
+            if directory in self._dirs or len(self._dirs) < self._maxDirs:
+                self._dirs[directory] = self._dirs.get(directory, 0) + 1
             else:
-                name = line[7:].strip(" \t\"'")
-                if name not in self._files:
-                    self._files.append(name) 
-                    if os.path.exists(name):
-                        self.read(name)
+                self._countOtherDirs += 1
+        if self._count <= self._maxFirst:
+            self._first.append(msg)
+        else:
+            self._last.append(msg)
+        if self._count <= self._maxLogged:
+            self.write(msg, kind, exception, path)
+            if self._count == self._maxLogged:
+                self.write('further errors are only counted\n', 'limit', None, None)
+
+    def write(self, msg, kind, exception, path):
+        '''Writes an error to the log media.
+        @param msg: the complete message (with newline)
+        @param kind: the kind of the error
+        @param exception: None or the exception describing the error
+        @param path: None or the file concerned
+        '''
+        if self._echo != None:
+            self._echo.write(msg)
+        if self._fp == None and self._filename != None:
+            self._fp = open(self._filename, 'w', buffering=64 * 1024)
+        if self._fp != None:
+            self._fp.write(msg)
+        if self._fpJson == None and self._jsonFilename != None:
+            self._fpJson = open(self._jsonFilename, 'w', buffering=64 * 1024)
+        if self._fpJson != None:
+            record = {'time': round(time.time(), 3), 'kind': kind,
+                'msg': msg.rstrip()}
+            if path != None:
+                record['path'] = path
+            if isinstance(exception, OSError) and exception.errno != None:
+                record['errno'] = exception.errno
+            self._fpJson.write(json.dumps(record, ensure_ascii=False) + '\n')
+        now = time.time()
+        if now - self._lastFlush >= self._interval:
+            self.flush()
+            self._lastFlush = now
+
+    def flush(self):
+        '''Writes the buffered messages.
+        '''
+        for fp in (self._fp, self._fpJson):
+            if fp != None:
+                fp.flush()
+
+    def topKinds(self, count = 10):
+        '''Returns the most frequent kinds of errors.
+        @param count: the maximal number of items
+        @return: a list of (kind, number), the most frequent first
+        '''
+        return sorted(self._kinds.items(), key=lambda item: (-item[1], item[0]))[0:count]
+
+    def topDirs(self, count = 10):
+        '''Returns the directories with the most errors.
+        @param count: the maximal number of items
+        @return: a list of (directory, number), the most errors first
+        '''
+        return sorted(self._dirs.items(), key=lambda item: (-item[1], item[0]))[0:count]
+
+    def omitted(self):
+        '''Returns the number of errors not kept for the report.
+        @return: the number of errors neither in the first nor in the last ones
+        '''
+        return self._count - len(self._first) - len(self._last)
+
+    def close(self):
+        '''Frees the resources.
+        '''
+        for fp in (self._fp, self._fpJson):
+            if fp != None:
+                fp.close()
+        self._fp = self._fpJson = None
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, stat, threading
+
+class LinkTracker:
+    '''Recreates hardlinks on the target instead of copying the data again.
+    Source files with more than one link are identified by (device, inode).
+    Optionally files with identical content (and metadata: the links share
+    one inode) are linked too (deduplication).
+    A target is registered after its copy: a later source path with the same
+    key becomes a hardlink to it.
+    The memory is bounded: at most maxTargets targets are registered, the
+    least recently used are forgotten. A forgotten target is not linked
+    again: a later source with its key is copied.
+    '''
+    def __init__(self, hardLinks = True, hasher = None, dedupMinSize = 4096,
+            maxTargets = 100000):
+        '''Constructor.
+        @param hardLinks: True: hardlinks of the source are recreated
+        @param hasher: None or the FileHasher used for deduplication.<br>
+                None: no deduplication
+        @param dedupMinSize: smaller files are not deduplicated
+        @param maxTargets: the maximal number of registered targets
+        '''
+        self._hardLinks = hardLinks
+        self._hasher = hasher
+        self._dedupMinSize = dedupMinSize
+        self._maxTargets = maxTargets
+        self._lock = threading.Lock()
+        # key -> (target, size, mtimeNs) of the registered target.
+        # Ordered by the last use: the oldest first
+        self._targets = {}
+        self._countForgotten = 0
+        self._countLinked = 0
+        self._countDeduplicated = 0
+        self._bytesSaved = 0
+
+    def keys(self, src, srcStat):
+        '''Returns the keys identifying a source file.
+        @param src: the source file
+        @param srcStat: the status of the source
+        @return: a list of keys (may be empty)
+        '''
+        rc = []
+        if stat.S_ISREG(srcStat.st_mode):
+            if self._hardLinks and srcStat.st_nlink > 1:
+                rc.append(('inode', srcStat.st_dev, srcStat.st_ino))
+            if self._hasher != None and srcStat.st_size >= self._dedupMinSize:
+                rc.append(('content', srcStat.st_size, srcStat.st_mtime_ns,
+                    stat.S_IMODE(srcStat.st_mode), self._hasher.digest(src, srcStat)))
+        return rc
+
+    def link(self, keys, trg, srcStat):
+        '''Creates the target as hardlink to an already registered target.
+        @param keys: the keys of the source (see keys())
+        @param trg: the target file. If it exists it will be replaced
+        @param srcStat: the status of the source
+        @return: True: the link has been created<br>
+                False: the file must be copied
+        '''
+        for key in keys:
+            with self._lock:
+                item = self._targets.pop(key, None)
+                if item != None:
+                    # the most recently used: the last
+                    self._targets[key] = item
+            if item == None:
+                continue
+            other, size, mtimeNs = item
+            try:
+                info = os.lstat(other)
+                if info.st_size != size or info.st_mtime_ns != mtimeNs:
+                    # changed since the registration
+                    continue
+                if os.path.lexists(trg):
+                    os.unlink(trg)
+                os.link(other, trg)
+            except OSError:
+                # e.g. EXDEV or EMLINK: the caller copies
+                continue
+            with self._lock:
+                if key[0] == 'inode':
+                    self._countLinked += 1
+                else:
+                    self._countDeduplicated += 1
+                self._bytesSaved += srcStat.st_size
+            return True
+        return False
+
+    def register(self, keys, trg):
+        '''Stores a copied (or unchanged) target as link destination.
+        @param keys: the keys of the source
+        @param trg: the target file
+        '''
+        if keys:
+            info = os.lstat(trg)
+            with self._lock:
+                for key in keys:
+                    if key not in self._targets:
+                        self.add(key, (trg, info.st_size, info.st_mtime_ns))
+
+    def registerUnchanged(self, srcStat, trg, trgStat):
+        '''Stores an unchanged target of a source file with several links.
+        No content digest is calculated: only the inode key is registered.
+        @param srcStat: the status of the source
+        @param trg: the target file
+        @param trgStat: the status of the target
+        '''
+        if (self._hardLinks and srcStat.st_nlink > 1 
+                and stat.S_ISREG(srcStat.st_mode) and stat.S_ISREG(trgStat.st_mode)):
+            key = ('inode', srcStat.st_dev, srcStat.st_ino)
+            with self._lock:
+                if key not in self._targets:
+                    self.add(key, (trg, trgStat.st_size, trgStat.st_mtime_ns))
+
+    def add(self, key, item):
+        '''Registers a target. If the limit is reached the least recently
+        used target is forgotten. The caller must hold the lock.
+        @param key: the key of the source
+        @param item: the tuple (target, size, mtimeNs)
+        '''
+        self._targets[key] = item
+        while len(self._targets) > self._maxTargets:
+            del self._targets[next(iter(self._targets))]
+            self._countForgotten += 1
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import errno, os, os.path, stat, threading, time
+
+class DirNode:
+    '''A directory being removed. It is deleted itself when its listing and
+    the removal of all its subdirectories are done.
+    '''
+    __slots__ = ('_parent', '_name', '_path', '_fd', '_pending', '_done')
+
+    def __init__(self, parent, name, path, fd):
+        '''Constructor.
+        @param parent: None (the root of the tree) or the parent DirNode
+        @param name: the node of the directory (without path)
+        @param path: the full name of the directory (with trailing separator)
+        @param fd: None or the open descriptor of the directory
+        '''
+        self._parent = parent
+        self._name = name
+        self._path = path
+        self._fd = fd
+        # the listing and the subdirectories still to remove
+        self._pending = 1
+        self._done = threading.Event() if parent == None else None
+
+class TreeDeleter:
+    '''Removes directory trees fast.
+    The directories are read with os.scandir() and the entries are removed
+    relative to the descriptor of the open directory (unlinkat(), no path
+    lookups). Subdirectories are opened with O_NOFOLLOW: an entry replaced by
+    a symbolic link in the meantime is never followed, only the link is removed.
+    The permissions are changed only if a removal fails (read-only directories).
+    With more than one worker the subtrees are removed in parallel.
+    No recursion: the subdirectories not taken by a worker are stored in an
+    explicit stack, only the directories of the current path are open.
+    '''
+    # the descriptor based functions are available (not on Windows)
+    _useFd = (os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd
+        and os.open in os.supports_dir_fd and os.scandir in os.supports_fd
+        and os.chmod in os.supports_fd and hasattr(os, 'O_NOFOLLOW')
+        and hasattr(os, 'O_DIRECTORY'))
+
+    def __init__(self, countWorkers = 1, onError = None, onRemove = None):
+        '''Constructor.
+        @param countWorkers: the number of threads removing subtrees
+                (including the calling thread)
+        @param onError: None or a function(msg, exception, path) handling errors
+        @param onRemove: None or a function(path) called for each removed entry
+        '''
+        self._pool = None
+        if countWorkers > 1:
+            self._pool = WorkerPool(countWorkers - 1, name='deleter')
+        self._onError = onError
+        self._onRemove = onRemove
+        self._lock = threading.Lock()
+        # per thread: the explicit stack of the directories to process
+        self._local = threading.local()
+        self._countFiles = 0
+        self._countDirs = 0
+        self._countErrors = 0
+        self._seconds = 0.0
+
+    def close(self):
+        '''Stops the worker threads.
+        '''
+        if self._pool != None:
+            self._pool.close()
+            self._pool = None
+
+    def throughput(self):
+        '''Returns the removal speed.
+        @return: the removed entries (files and directories) per second
+        '''
+        return (self._countFiles + self._countDirs) / max(self._seconds, 1E-6)
+
+    def error(self, msg, exception, path):
+        '''Handles an error.
+        @param msg: the error message
+        @param exception: the exception describing the error
+        @param path: the file concerned
+        '''
+        with self._lock:
+            self._countErrors += 1
+        if self._onError != None:
+            self._onError(msg, exception, path)
+
+    def removeTree(self, path):
+        '''Removes a directory with all files and subdirectories.
+        Errors are reported (see onError), the rest of the tree is removed.
+        @param path: the full name of the directory. If it is a symbolic link
+                only the link is removed
+        @return: True: the tree has been removed completely
+        '''
+        start = time.time()
+        errors = self._countErrors
+        root = path.rstrip(os.sep)
+        fd = None
+        try:
+            if self._useFd:
+                fd = self.openDir(None, root)
+            elif os.path.islink(root):
+                raise OSError(errno.ELOOP, 'symbolic link', root)
+        except OSError as exc:
+            if exc.errno in (errno.ELOOP, errno.ENOTDIR):
+                self.removeEntry(None, root, False)
+            else:
+                self.error('cannot remove: ', exc, root + os.sep)
+        else:
+            node = DirNode(None, None, root + os.sep, fd)
+            # the calling thread works too: the subtrees go to the workers
+            self.drain(node)
+            node._done.wait()
+        with self._lock:
+            self._seconds += time.time() - start
+        return self._countErrors == errors
+
+    def schedule(self, node):
+        '''Removes a directory: by a worker if the queue has room, otherwise
+        by the current thread.
+        @param node: the DirNode of the directory
+        '''
+        if self._pool != None and self._pool.trySubmit(self.removeContent, node):
+            return
+        todo = getattr(self._local, 'todo', None)
+        if todo != None:
+            todo.append(node)
+        else:
+            self.drain(node)
+
+    def drain(self, node):
+        '''Removes a directory and the subdirectories not taken by a worker.
+        @param node: the DirNode of the directory
+        '''
+        todo = self._local.todo = [node]
+        try:
+            while todo:
+                self.removeContent(todo.pop())
+        finally:
+            self._local.todo = None
+
+    def removeContent(self, node):
+        '''Removes the files of a directory and schedules its subdirectories.
+        @param node: the DirNode of the directory
+        '''
+        parent = node._parent
+        if parent != None and parent._fd != None:
+            try:
+                node._fd = self.openDir(parent, node._name)
+            except OSError as exc:
+                if exc.errno in (errno.ELOOP, errno.ENOTDIR):
+                    # replaced by a symbolic link or a file in the meantime
+                    self.removeEntry(parent, node._name, False)
+                    self.release(parent)
+                    return
+                if exc.errno not in (errno.EMFILE, errno.ENFILE):
+                    self.error('cannot remove: ', exc, node._path)
+                    self.release(parent)
+                    return
+                # too many open directories: this subtree uses path names
+        try:
+            with os.scandir(node._path if node._fd == None else node._fd) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.removeSubdir(node, entry.name)
                     else:
-                        logging.error(filename + '-' + str(lineNo) 
-                            + ': can not include: ' + name)
-        fp.close()
-        
-    def get(self, key):
-        '''Returns a configuration value.
-        @param key: the key of the value
-        @return None: invalid key<br>
-                otherwise: the value belonging to the key
+                        self.removeEntry(node, entry.name, False)
+        except OSError as exc:
+            self.error('cannot list: ', exc, node._path)
+        finally:
+            self.release(node)
+
+    def removeSubdir(self, node, name):
+        '''Schedules the removal of a subdirectory.
+        @param node: the DirNode of the parent
+        @param name: the node of the subdirectory
+        '''
+        with self._lock:
+            node._pending += 1
+        # opened when processed: waiting directories need no descriptor
+        self.schedule(DirNode(node, name, node._path + name + os.sep, None))
+
+    def openDir(self, node, name):
+        '''Opens a directory without following symbolic links.
+        A directory without access rights is made accessible.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the directory
+        @return: the descriptor of the directory
+        '''
+        flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+        if hasattr(os, 'O_CLOEXEC'):
+            flags |= os.O_CLOEXEC
+        dirFd = None if node == None else node._fd
+        try:
+            rc = os.open(name, flags, dir_fd=dirFd)
+        except PermissionError:
+            if not hasattr(os, 'O_PATH'):
+                raise
+            # O_PATH needs no rights and does not follow a link either
+            fd = os.open(name, os.O_PATH | os.O_DIRECTORY | os.O_NOFOLLOW,
+                dir_fd=dirFd)
+            try:
+                info = os.fstat(fd)
+                os.chmod('/proc/self/fd/%d' % fd,
+                    stat.S_IMODE(info.st_mode) | stat.S_IRWXU)
+            finally:
+                os.close(fd)
+            rc = os.open(name, flags, dir_fd=dirFd)
+        return rc
+
+    def remove(self, node, name, isDir):
+        '''Removes a file or an empty directory.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the entry
+        @param isDir: True: the entry is a directory
+        '''
+        function = os.rmdir if isDir else os.unlink
+        if node == None:
+            function(name)
+        elif node._fd != None:
+            function(name, dir_fd=node._fd)
+        else:
+            function(node._path + name)
+
+    def removeEntry(self, node, name, isDir):
+        '''Removes a file or an empty directory and counts it.
+        If the removal is not permitted the parent directory (and on
+        systems without descriptor functions the entry) is made writable.
+        @param node: None (name is a full path) or the DirNode of the parent
+        @param name: the node of the entry
+        @param isDir: True: the entry is a directory
+        '''
+        path = name if node == None else node._path + name
+        try:
+            try:
+                self.remove(node, name, isDir)
+            except PermissionError:
+                self.makeWritable(node, path)
+                self.remove(node, name, isDir)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error('cannot remove: ', exc, path)
+            return
+        with self._lock:
+            if isDir:
+                self._countDirs += 1
+            else:
+                self._countFiles += 1
+        if self._onRemove != None:
+            self._onRemove(path + os.sep if isDir else path)
+
+    def makeWritable(self, node, path):
+        '''Allows the removal of the entries of a directory.
+        @param node: None or the DirNode of the parent
+        @param path: the full name of the entry to remove
+        '''
+        if node != None and node._fd != None:
+            info = os.fstat(node._fd)
+            os.chmod(node._fd, stat.S_IMODE(info.st_mode) | stat.S_IRWXU)
+        else:
+            # e.g. Windows: the read-only attribute of the entry itself
+            parent = os.path.dirname(path.rstrip(os.sep))
+            os.chmod(parent, stat.S_IMODE(os.lstat(parent).st_mode) | stat.S_IRWXU)
+            if not os.path.islink(path):
+                os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IWUSR)
+
+    def release(self, node):
+        '''Marks a part of the work of a directory as done.
+        If nothing remains the directory itself is removed (and maybe its
+        parents: iteratively).
+        @param node: the DirNode of the directory
+        '''
+        while node != None:
+            with self._lock:
+                node._pending -= 1
+                done = node._pending == 0
+            if not done:
+                break
+            if node._fd != None:
+                os.close(node._fd)
+            parent = node._parent
+            if parent == None:
+                self.removeEntry(None, node._path[0:-1], True)
+                node._done.set()
+            else:
+                self.removeEntry(parent, node._name, True)
+            node = parent
+# Project: https://github.com/republib/republib/wiki
+# Licence: Public domain: http://www.wtfpl.net
+import os, os.path, threading, time
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+class DurabilityTracker:
+    '''Makes the written targets durable. Except for 'none' the files are
+    written under a temporary name and renamed into place (atomically): an
+    aborted process never leaves a half written target. The policies differ
+    in what survives a crash of the system (power loss):<br>
+    'none': nothing is synced, the targets are written in place<br>
+    'file': each file is synced before its rename, its directory when the
+    directory is done: a renamed target is never empty or incomplete<br>
+    'dir': the written files and the entries of a directory are synced as one
+    batch when the directory is done. The files are renamed before: a crash
+    before the batch may leave targets of that directory empty or incomplete,
+    after the batch the directory is durable<br>
+    'fs': one syncfs() per target filesystem at the end of the run: a crash
+    during the run may leave any renamed target empty or incomplete, after
+    the run everything is durable<br>
+    Files written after their directory is done (by worker threads) are
+    synced at the end of the run.
+    '''
+    MODES = ('none', 'file', 'dir', 'fs')
+    # directories can be opened and synced (not on Windows)
+    _dirSyncSupported = os.name == 'posix'
+    # the files of a batch open at the same time
+    _batchSize = 256
+
+    def __init__(self, mode = 'none', onError = None):
+        '''Constructor.
+        @param mode: the policy: 'none', 'file', 'dir' or 'fs'
+        @param onError: None or a function(msg, exception, path) handling errors
+        '''
+        self._mode = mode
+        self._onError = onError
+        self._lock = threading.Lock()
+        # directory -> list of the written files not synced yet ('dir')
+        self._files = {}
+        # the directories with changed entries not synced yet
+        self._dirs = set()
+        self._countFiles = 0
+        self._countDirs = 0
+        self._countFilesystems = 0
+        self._seconds = 0.0
+
+    def isAtomic(self):
+        '''Tests whether the files are written under a temporary name.
+        @return: True: the targets are renamed into place by replace()
+        '''
+        return self._mode != 'none'
+
+    def error(self, msg, exception, path):
+        '''Handles an error.
+        @param msg: the error message
+        @param exception: the exception describing the error
+        @param path: the file concerned
+        '''
+        if self._onError != None:
+            self._onError(msg, exception, path)
+
+    def replace(self, temp, trg):
+        '''Moves a completely written temporary file to its final name.
+        Only in mode 'file' the content is synced before the rename.
+        @param temp: the temporary file
+        @param trg: the target file
+        '''
+        if self._mode == 'file':
+            self.syncFile(temp)
+        os.replace(temp, trg)
+        if self._mode == 'dir':
+            self.fileWritten(trg)
+        self.entryChanged(trg)
+
+    def fileWritten(self, full):
+        '''Registers a file written in place.
+        @param full: the full name of the file
+        '''
+        if self._mode == 'file':
+            self.syncFile(full)
+        elif self._mode == 'dir':
+            parent = os.path.dirname(full)
+            with self._lock:
+                files = self._files.get(parent)
+                if files == None:
+                    files = self._files[parent] = []
+                files.append(full)
+
+    def entryChanged(self, full):
+        '''Registers a created, replaced or removed directory entry.
+        @param full: the full name of the entry
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            parent = os.path.dirname(full.rstrip(os.sep))
+            with self._lock:
+                self._dirs.add(parent)
+
+    def dirDone(self, path):
+        '''Syncs the registered files and the entries of a directory.
+        @param path: the directory (with or without trailing separator)
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            path = path.rstrip(os.sep) or os.sep
+            with self._lock:
+                files = self._files.pop(path, None)
+                changed = path in self._dirs
+                if changed:
+                    self._dirs.remove(path)
+            if files != None or changed:
+                start = time.time()
+                for ix in range(0, len(files or ()), self._batchSize):
+                    self.syncFiles(files[ix:ix + self._batchSize])
+                if changed:
+                    self.syncDir(path)
+                with self._lock:
+                    self._seconds += time.time() - start
+
+    def flush(self, roots):
+        '''Syncs everything not synced yet: called at the end of the run.
+        @param roots: the target directories of the run
+        '''
+        if self._mode == 'file' or self._mode == 'dir':
+            with self._lock:
+                dirs = set(self._files.keys()) | self._dirs
+            for path in sorted(dirs):
+                self.dirDone(path)
+        elif self._mode == 'fs':
+            start = time.time()
+            devices = set()
+            for root in roots:
+                try:
+                    device = os.stat(root).st_dev
+                    if device not in devices:
+                        devices.add(device)
+                        self.syncFilesystem(root)
+                except OSError as exc:
+                    self.error('cannot sync: ', exc, root)
+            with self._lock:
+                self._seconds += time.time() - start
+
+    def syncFile(self, full):
+        '''Writes the content of a file to the storage.
+        @param full: the full name of the file
+        '''
+        try:
+            fd = os.open(full, os.O_RDONLY)
+            try:
+                if hasattr(os, 'fdatasync'):
+                    os.fdatasync(fd)
+                else:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error('cannot sync: ', exc, full)
+            return
+        with self._lock:
+            self._countFiles += 1
+
+    def syncFiles(self, files):
+        '''Writes the content of some files to the storage.
+        The write back of all files is started before the first is waited
+        for: the storage works on the whole batch at once.
+        @param files: the full names of the files
+        '''
+        if len(files) == 1 or not hasattr(os, 'posix_fadvise'):
+            for full in files:
+                self.syncFile(full)
+        else:
+            fds = []
+            try:
+                for full in files:
+                    try:
+                        fd = os.open(full, os.O_RDONLY)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as exc:
+                        self.error('cannot sync: ', exc, full)
+                        continue
+                    fds.append((fd, full))
+                    # Linux: starts the write back without waiting
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                for fd, full in fds:
+                    try:
+                        os.fdatasync(fd)
+                    except OSError as exc:
+                        self.error('cannot sync: ', exc, full)
+                        continue
+                    with self._lock:
+                        self._countFiles += 1
+            finally:
+                for fd, full in fds:
+                    os.close(fd)
+
+    def syncDir(self, path):
+        '''Writes the entries of a directory to the storage.
+        @param path: the directory
+        '''
+        if self._dirSyncSupported:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                return
+            except OSError as exc:
+                self.error('cannot sync: ', exc, path)
+                return
+            with self._lock:
+                self._countDirs += 1
+
+    def syncFilesystem(self, path):
+        '''Writes all changes of a filesystem to the storage.
+        Without syncfs() (not Linux) all filesystems are synced.
+        @param path: a directory of the filesystem
         '''
-        return self._dict[key] if key in self._dict else None 
-        #!/usr/local/bin/python
+        libc = None
+        if ctypes != None and os.name == 'posix':
+            try:
+                libc = ctypes.CDLL(None, use_errno=True)
+                if not hasattr(libc, 'syncfs'):
+                    libc = None
+            except OSError:
+                libc = None
+        if libc == None:
+            if hasattr(os, 'sync'):
+                os.sync()
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if libc.syncfs(fd) != 0:
+                    error = ctypes.get_errno()
+                    raise OSError(error, os.strerror(error), path)
+            finally:
+                os.close(fd)
+        with self._lock:
+            self._countFilesystems += 1
+#!/usr/local/bin/python
 # encoding: utf-8
 # Project: https://github.com/republib/republib/wiki
 # Licence: Public domain: http://www.wtfpl.net
@@ -170,10 +3447,12 @@ will be copied from the source to the destination.
 '''
 
 import os.path, shutil, stat, re, fnmatch, logging, time, math, subprocess
+import threading, hashlib, json, glob, copy
 
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 from argparse import ArgumentTypeError
+from argparse import Namespace
 
 
 __all__ = []
@@ -187,7 +3466,11 @@ PROFILE = 0
 
 class SearchCriteria:
     '''Administrates the search criteria for a filename pattern matching.
+    The patterns are compiled into a suffix tuple and one regular expression
+    for the includes and for the excludes. The results are cached per name.
     '''
+    _maxCached = 8192
+
     def __init__(self):
         '''Constructor.
         '''
@@ -197,6 +3480,28 @@ class SearchCriteria:
         self._excludeEndsWith = []
         self._excludePatterns = []
         self._wildcardMatcher = re.compile(r'[*?\[\]]')
+        self.compile()
+
+    def compile(self):
+        '''Builds the matchers from the pattern lists and resets the cache.
+        '''
+        self._includeSuffixes = tuple(self._includeEndsWith)
+        self._includeMatcher = self.combine(self._includePatterns)
+        self._excludeSuffixes = tuple(self._excludeEndsWith)
+        self._excludeMatcher = self.combine(self._excludePatterns)
+        self._cache = {}
+
+    def combine(self, patterns):
+        '''Compiles a list of shell patterns into one regular expression.
+        @param patterns: the list of patterns (syntax of fnmatch)
+        @return: None: the list is empty<br>
+                otherwise: the compiled regular expression
+        '''
+        rc = None
+        if len(patterns) > 0:
+            rc = re.compile('|'.join(fnmatch.translate(os.path.normcase(item)) 
+                for item in patterns))
+        return rc
    
     def getSettings(self):
         '''Returns a string containing the current search criteria.
@@ -241,6 +3546,7 @@ class SearchCriteria:
                     self._includeEndsWith.append(entry[1:])
                 else:
                     self._includePatterns.append(entry)
+        self.compile()
 
     def matches(self, name):
         '''Tests whether a name matches the search criteria.
@@ -248,32 +3554,27 @@ class SearchCriteria:
         @return: True: the name matches the criteria.<br>
                False: otherwise
         '''
-        rc = self._includeAll
-        if not rc:
-            for pattern in self._includeEndsWith:
-                if name.endswith(pattern):
-                    rc = True
-                    break
-            if not rc:
-                for pattern in self._includePatterns:
-                    if fnmatch.fnmatch(name, pattern):
-                        rc = True
-                        break
-        if rc:
-            for pattern in self._excludeEndsWith:
-                if name.endswith(pattern):
-                    rc = False
-                    break
+        rc = self._cache.get(name)
+        if rc == None:
+            rc = (self._includeAll or name.endswith(self._includeSuffixes)
+                or (self._includeMatcher != None 
+                    and self._includeMatcher.match(os.path.normcase(name)) != None))
             if rc:
-                for pattern in self._excludePatterns:
-                    if fnmatch.fnmatch(name, pattern):
-                        rc = False
-                        break
+                rc = not (name.endswith(self._excludeSuffixes)
+                    or (self._excludeMatcher != None 
+                        and self._excludeMatcher.match(os.path.normcase(name)) != None))
+            if len(self._cache) >= self._maxCached:
+                self._cache.clear()
+            self._cache[name] = rc
         return rc
 
 class Settings:
     '''Stores the search criteria for files and subdirs.
     '''
+    # the keys a per directory configuration file may change (see derive())
+    _localKeys = ('copy.mode', 'copy.mode.removed', 'maxDepth', 'verboseLevel')
+    _localPrefixes = ('patterns.',)
+
     def __init__(self):
         self._node = SearchCriteria()
         self._dir = SearchCriteria()
@@ -281,60 +3582,256 @@ class Settings:
         self._maxDepth = 99
         self._addNonExisting = False
         self._copyNewer = False
+        # --update: a source is newer only if its mtime is later by more
+        # than this. 0: exact. FAT targets need 2 (SMB and NFS may round too)
+        self._mtimeGranularity = 0.0
         self._copyDifferentSize = False
         self._speed = 'quick'
         self._verboseLevel = 1
         self._showHtml = False
         self._maxFirstErrors = 20
         self._maxLastErrors = 20
+        self._maxLoggedErrors = 10000
+        self._browser = None
+        self._jobs = 1
+        self._minParallelCopySize = 16 * 1024 * 1024
+        self._copyJobs = 0
+        self._copyQueueSize = 256
+        self._deleteJobs = 4
+        self._scanChunkSize = 100000
+        self._useIndex = False
+        self._deltaMinSize = 0
+        self._bufferSize = 1024 * 1024
+        self._sparse = 'auto'
+        self._pageCache = 'keep'
+        self._directMinSize = 0
+        self._preallocateMinSize = 1024 * 1024
+        self._durability = 'none'
+        self._resume = False
+        self._resumableMinSize = 64 * 1024 * 1024
+        self._watchDelay = 2.0
+        self._hardLinks = False
+        self._dedup = False
+        self._dedupMinSize = 4096
+        self._linkDest = None
+        self._parallelSources = 1
+        self._perDevice = 1
              
     def readConfig(self, filename):
         '''Reads the configuration file.
         @param filename: the name of the configuration file
         '''
-        config = Config(filename)
+        self.applyConfig(Config(filename))
+
+    def derive(self, config):
+        '''Returns a copy changed by a per directory configuration file.
+        Only the keys of applyLocalConfig() are taken: the others concern
+        the whole run (jobs, durability, link.dest ...), see ignoredKeys().
+        The settings itself are not changed.
+        @param config: the Config instance to apply
+        @return: the new Settings instance
+        @raise ValueError: an invalid value
+        '''
+        rc = copy.copy(self)
+        rc.applyLocalConfig(config)
+        return rc
+
+    def ignoredKeys(self, config):
+        '''Returns the keys of a configuration not taken by derive().
+        @param config: the Config instance to inspect
+        @return: the list of the keys which concern the whole run only
+        '''
+        return [key for key in config.keys() if key not in self._localKeys
+            and not key.startswith(self._localPrefixes)]
+
+    def applyConfig(self, config):
+        '''Takes the values defined in a configuration.
+        @param config: the Config instance
+        '''
+        self.applyLocalConfig(config)
+        jobs = config.get('jobs')
+        if jobs != None:
+            self._jobs = max(1, int(jobs))
+        count = config.get('log.error.max')
+        if count != None:
+            self._maxLoggedErrors = int(count)
+        jobs = config.get('jobs.copy')
+        if jobs != None:
+            self._copyJobs = max(0, int(jobs))
+        jobs = config.get('jobs.delete')
+        if jobs != None:
+            self._deleteJobs = max(1, int(jobs))
+        size = config.get('scan.chunk.size')
+        if size != None:
+            self._scanChunkSize = max(1, int(size))
+        size = config.get('jobs.copy.queue')
+        if size != None:
+            self._copyQueueSize = max(1, int(size))
+        size = config.get('jobs.copy.min.size')
+        if size != None:
+            self._minParallelCopySize = int(size)
+        size = config.get('copy.delta.min.size')
+        if size != None:
+            self._deltaMinSize = int(size)
+        size = config.get('copy.buffer.size')
+        if size != None:
+            self._bufferSize = int(size)
+        value = config.get('copy.sparse')
+        if value != None:
+            if value not in ('auto', 'zeros', 'off'):
+                raise ValueError('unknown copy.sparse: {} (auto, zeros or off expected)'.format(value))
+            self._sparse = value
+        value = config.get('copy.page.cache')
+        if value != None:
+            if value not in ('keep', 'drop'):
+                raise ValueError('unknown copy.page.cache: {} (keep or drop expected)'.format(value))
+            self._pageCache = value
+        size = config.get('copy.direct.min.size')
+        if size != None:
+            self._directMinSize = int(size)
+        size = config.get('copy.preallocate.min.size')
+        if size != None:
+            self._preallocateMinSize = int(size)
+        value = config.get('durability')
+        if value != None:
+            if value not in DurabilityTracker.MODES:
+                raise ValueError('unknown durability: {} (none, file, dir or fs expected)'.format(value))
+            self._durability = value
+        size = config.get('journal.copy.min.size')
+        if size != None:
+            self._resumableMinSize = int(size)
+        delay = config.get('watch.delay')
+        if delay != None:
+            self._watchDelay = float(delay)
+        granularity = config.get('copy.mtime.granularity')
+        if granularity != None:
+            self._mtimeGranularity = max(0.0, float(granularity))
+        value = config.get('hardlinks')
+        if value != None:
+            self._hardLinks = value == 'true'
+        value = config.get('dedup')
+        if value != None:
+            self._dedup = value == 'true'
+        size = config.get('dedup.min.size')
+        if size != None:
+            self._dedupMinSize = int(size)
+        count = config.get('sources.parallel')
+        if count != None:
+            self._parallelSources = max(1, int(count))
+        count = config.get('sources.per.device')
+        if count != None:
+            self._perDevice = max(1, int(count))
+        value = config.get('link.dest')
+        if value != None:
+            self._linkDest = value
+        useIndex = config.get('index')
+        if useIndex != None:
+            self._useIndex = useIndex == 'true'
+        
+    def applyLocalConfig(self, config):
+        '''Takes the values which may be defined per directory.
+        @param config: the Config instance
+        '''
         mode = config.get('copy.mode')
         if mode:
-            if mode.find('add'):
+            if 'add' in mode:
                 self._addNonExisting = True
-            if mode.find('size'):
+            if 'size' in mode:
                 self._copyDifferentSize = True
-            if mode.find('update'):
+            if 'update' in mode:
                 self._copyNewer = True
-            if mode.find('delete'):
+            if 'delete' in mode:
                 self._deleteFilesWithoutSource = True
         mode = config.get('copy.mode.removed')
         if mode:
-            if mode.find('add'):
+            if 'add' in mode:
                 self._addNonExisting = False
-            if mode.find('size'):
+            if 'size' in mode:
                 self._copyDifferentSize = False
-            if mode.find('update'):
+            if 'update' in mode:
                 self._copyNewer = False
-            if mode.find('delete'):
+            if 'delete' in mode:
                 self._deleteFilesWithoutSource = False
+        patterns = config.get('patterns.node')
+        if patterns:
+            # copy on write: the criteria may be shared with other settings
+            self._node = copy.deepcopy(self._node)
+            self._node.addPatterns(re.split(r',', patterns))
+        patterns = config.get('patterns.dir')
+        if patterns:
+            self._dir = copy.deepcopy(self._dir)
+            self._dir.addPatterns(re.split(r',', patterns))
         maxDepth = config.get('maxDepth')
         if maxDepth != None:
             self._maxDepth = int(maxDepth)
         verbose = config.get('verboseLevel')
         if verbose != None:
             self._verboseLevel = int(verbose)
-        
-        
+
     def getFromOpts(self, opts):
         '''Get the settings from the command line options.
-        @param opts: the command line options
-        '''
-        self._addNonExisting = opts.add
-        self._copyNewer = opts.update
-        self._copyDifferentSize = opts.size
-        self._maxDepth = opts.maxDepth
-        self._deleteFilesWithoutSource = opts.delete
-        self._node.addPatterns(re.split(r',', opts.nodePatterns))
-        self._dir.addPatterns(re.split(r',', opts.dirPatterns))
-        self._speed = opts.speed
-        self._verboseLevel = opts.verbose
-        self._showHtml = opts.report
+        @param opts: the command line options. A missing option (not given
+                on the command line, see main()) does not change the setting
+        '''
+        if 'add' in opts:
+            self._addNonExisting = opts.add
+        if 'update' in opts:
+            self._copyNewer = opts.update
+        if 'mtimeGranularity' in opts:
+            self._mtimeGranularity = max(0.0, opts.mtimeGranularity)
+        if 'size' in opts:
+            self._copyDifferentSize = opts.size
+        if 'maxDepth' in opts:
+            self._maxDepth = opts.maxDepth
+        if 'delete' in opts:
+            self._deleteFilesWithoutSource = opts.delete
+        if 'nodePatterns' in opts:
+            self._node = SearchCriteria()
+            self._node.addPatterns(re.split(r',', opts.nodePatterns))
+        if 'dirPatterns' in opts:
+            self._dir = SearchCriteria()
+            self._dir.addPatterns(re.split(r',', opts.dirPatterns))
+        if 'speed' in opts:
+            self._speed = opts.speed
+        if 'verbose' in opts:
+            self._verboseLevel = opts.verbose
+        if 'report' in opts:
+            self._showHtml = opts.report
+        if 'jobs' in opts:
+            self._jobs = max(1, opts.jobs)
+        if 'copyJobs' in opts:
+            self._copyJobs = max(0, opts.copyJobs)
+        if 'deleteJobs' in opts:
+            self._deleteJobs = max(1, opts.deleteJobs)
+        if 'index' in opts or 'verifyIndex' in opts:
+            self._useIndex = (getattr(opts, 'index', False) 
+                or getattr(opts, 'verifyIndex', False))
+        if 'deltaMinSize' in opts:
+            self._deltaMinSize = opts.deltaMinSize
+        if 'bufferSize' in opts:
+            self._bufferSize = opts.bufferSize
+        if 'sparse' in opts:
+            self._sparse = opts.sparse
+        if 'pageCache' in opts:
+            self._pageCache = opts.pageCache
+        if 'directMinSize' in opts:
+            self._directMinSize = opts.directMinSize
+        if 'durability' in opts:
+            self._durability = opts.durability
+        if 'resume' in opts:
+            self._resume = opts.resume
+        if 'watchDelay' in opts:
+            self._watchDelay = opts.watchDelay
+        if 'hardLinks' in opts:
+            self._hardLinks = opts.hardLinks
+        if 'dedup' in opts:
+            self._dedup = opts.dedup
+        if getattr(opts, 'linkDest', None) != None:
+            self._linkDest = opts.linkDest
+        if 'parallelSources' in opts:
+            self._parallelSources = max(1, opts.parallelSources)
+        if 'perDevice' in opts:
+            self._perDevice = max(1, opts.perDevice)
         
     def getSettings(self):
         opts = ''
@@ -344,7 +3841,36 @@ class Settings:
             opts += "--delete"
         if self._copyNewer:
             opts += " --update"
+            if self._mtimeGranularity > 0:
+                opts += " --mtime-granularity=" + str(self._mtimeGranularity)
         opts += "--max-depth=" + str(self._maxDepth)
+        if self._jobs > 1:
+            opts += " --jobs=" + str(self._jobs)
+        if self._copyJobs > 0:
+            opts += " --copy-jobs=" + str(self._copyJobs)
+        if self._deleteJobs != 4:
+            opts += " --delete-jobs=" + str(self._deleteJobs)
+        if self._useIndex:
+            opts += " --index"
+        if self._hardLinks:
+            opts += " --hard-links"
+        if self._dedup:
+            opts += " --dedup"
+        if self._linkDest != None:
+            opts += " --link-dest=" + self._linkDest
+        if self._parallelSources > 1:
+            opts += " --parallel-sources={} --per-device={}".format(
+                self._parallelSources, self._perDevice)
+        if self._deltaMinSize > 0:
+            opts += " --delta-min-size=" + str(self._deltaMinSize)
+        if self._sparse != 'auto':
+            opts += " --sparse=" + self._sparse
+        if self._pageCache != 'keep':
+            opts += " --page-cache=" + self._pageCache
+        if self._directMinSize > 0:
+            opts += " --direct-min-size=" + str(self._directMinSize)
+        if self._durability != 'none':
+            opts += " --durability=" + self._durability
         opts += " --node-patterns=" + self._node.getSettings()
         opts += " --dir-patterns=" + self._dir.getSettings()
         return opts
@@ -358,6 +3884,58 @@ class Statistics:
         self._countDirs = 0
         self._countFiles = 0
         self._sizeFiles = 0
+        # the bytes of the files not written because they are holes
+        self._sizeHoles = 0
+
+class SyncPair:
+    '''A source directory with its target directory and the state belonging
+    to the pair: the pairs of a run may be synchronized concurrently.
+    '''
+    def __init__(self, src, trg, linkDest = None):
+        '''Constructor.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param linkDest: None or the counterpart of trg in the previous snapshot
+        '''
+        self._src = src
+        self._trg = trg
+        self._linkDest = linkDest
+        self._index = None
+        self._devices = []
+
+    def overlaps(self, other):
+        '''Tests whether two pairs may touch the same files.
+        @param other: the other pair
+        @return: True: a target lies inside the other target or source
+        '''
+        src, trg = SyncPair.realPath(self._src), SyncPair.realPath(self._trg)
+        otherSrc = SyncPair.realPath(other._src)
+        otherTrg = SyncPair.realPath(other._trg)
+        return (trg.startswith(otherTrg) or otherTrg.startswith(trg)
+            or trg.startswith(otherSrc) or otherTrg.startswith(src))
+
+    @staticmethod
+    def realPath(path):
+        '''Returns the canonical form of a directory for prefix comparisons.
+        @param path: the directory (relative or absolute, may not exist)
+        @return: the absolute path without symbolic links, with a trailing
+                separator: /data/x/ is no prefix of /data/xy/
+        '''
+        rc = os.path.realpath(path)
+        return rc if rc.endswith(os.sep) else rc + os.sep
+
+    def devices(self):
+        '''Returns the devices used by the pair.
+        @return: a sorted list of the st_dev of source and target
+        '''
+        rc = set()
+        for path in (self._src, self._trg):
+            path = os.path.abspath(path)
+            # the target may not exist yet: its nearest existing parent counts
+            while not os.path.exists(path):
+                path = os.path.dirname(path)
+            rc.add(os.stat(path).st_dev)
+        return sorted(rc)
         
 class Sync:
     '''Synchronizes two directory trees in an efficient way.
@@ -368,22 +3946,48 @@ class Sync:
         @param opts: options and arguments from the command line
         '''
         self._startTime = time.time()
+        # per thread: the explicit stack of schedule() and the settings of
+        # the current directory
+        self._local = threading.local()
         self._settings = Settings()
-        self._settingStack = []
         self._countTotals = True
         self._localConfig = '.redirsync.conf'
+        self._countLocalConfigs = 0
+        # filename -> the state of a local configuration already reported
+        self._reportedConfigs = {}
         self._total = Statistics()
         self._completed = Statistics()
         self._modified = Statistics()
-        self._writableFile = None
-        self._fpError = None
+        self._linked = Statistics()
+        self._phases = PhaseStatistics()
+        self._walker = DirWalker()
+        self._walker._phases = self._phases
+        self._fnStatsJson = None
+        self._pool = None
+        self._copyPool = None
+        self._lock = threading.Lock()
+        self._hasher = None
+        self._links = None
+        # the previous snapshot of the whole target
+        self._linkDestRoot = None
+        self._pairs = []
+        self._copier = Copier()
+        self._durability = DurabilityTracker()
+        # the size of the page cache at the start and at the end of the run
+        self._cacheBefore = None
+        self._cacheAfter = None
+        self._planWriter = None
+        self._dryRun = False
+        self._journal = None
+        self._countResumedDirs = 0
+        self._dirStat = IndexedStat(stat.S_IFDIR, 0, 0, 0)
+        self._deleter = None
+        self._errorLog = None
         self._fnError = None
+        self._fnErrorJson = None
         self._countErrors = 0
-        self._firstErrors = []
-        self._lastErrors = []
         self._home = None
         self._waitingErrors = []
-        self._browser = None
         if 'REDIRSYNC_HOME' in os.environ:
             self._home = os.environ.get('REDIRSYNC_HOME')
         elif 'HOME' in os.environ:
@@ -396,6 +4000,88 @@ class Sync:
         if not os.path.exists(self._home) or not os.path.isdir(self._home):
             self._waitingErrors.append('home directory does not exist: ' 
                 + self._home)
+        # the parsed configuration files, see configCache()
+        self._configCache = ConfigCache()
+        # None or the parsed configuration files surviving the process:
+        # created on demand from the final home directory (parsedConfigs())
+        self._parsedConfigs = None
+
+    @property
+    def _settings(self):
+        '''The settings of the directory processed by the current thread:
+        those of the run or, below a local configuration file, a changed copy.
+        '''
+        rc = getattr(self._local, 'settings', None)
+        return self._runSettings if rc == None else rc
+
+    @_settings.setter
+    def _settings(self, settings):
+        self._runSettings = settings
+
+    def localSettings(self, src, inherited):
+        '''Returns the settings of a directory: the inherited ones, changed
+        by the local configuration file of the directory if it exists.
+        The settings are copied only if such a file exists (copy on write).
+        A file which cannot be read or contains invalid values is reported
+        and ignored.
+        @param src: the source directory (with trailing separator)
+        @param inherited: None (the settings of the run) or the settings of
+                the parent directory
+        @return: None (the settings of the run) or the settings to use
+        '''
+        filename = src + self._localConfig
+        try:
+            config = self.configCache().get(filename)
+        except (OSError, ValueError) as exc:
+            if self.firstReport(filename, str(exc)):
+                self.error('local configuration ignored: ', exc, filename)
+            return inherited
+        if config == None:
+            return inherited
+        settings = self._runSettings if inherited == None else inherited
+        try:
+            rc = settings.derive(config)
+        except ValueError as exc:
+            if self.firstReport(filename, config):
+                self.error('local configuration ignored: ', exc, filename)
+            return inherited
+        if self.firstReport(filename, config):
+            for key in settings.ignoredKeys(config):
+                self.error('{}: {} is valid only in the master configuration'
+                    .format(filename, key))
+        with self._lock:
+            self._countLocalConfigs += 1
+        return rc
+
+    def firstReport(self, filename, reason):
+        '''Tests whether a problem of a local configuration file has not
+        been reported yet: each directory visit would repeat the message.
+        @param filename: the configuration file
+        @param reason: identifies the state of the file, e.g. the Config
+                instance (a changed file gets a new one)
+        @return: True: the problem should be reported
+        '''
+        with self._lock:
+            rc = self._reportedConfigs.get(filename) != reason
+            self._reportedConfigs[filename] = reason
+        return rc
+
+    def inheritedSettings(self, src, trg):
+        '''Returns the settings a directory inherits from the local
+        configuration files of its parents.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @return: None (the settings of the run) or the inherited settings
+        '''
+        rc = None
+        pair = self.pairOf(trg)
+        if pair != None and src.startswith(pair._src) and src != pair._src:
+            path = pair._src
+            rc = self.localSettings(path, rc)
+            for node in src[len(path):].split(os.sep)[0:-2]:
+                path += node + os.sep
+                rc = self.localSettings(path, rc)
+        return rc
 
     def replaceVariables(self, phrase, timepoint = None):
         '''Replaces variables in a string with its values.
@@ -422,6 +4108,28 @@ class Sync:
             rc = rc.replace('{time}', "%d" % (timepoint))
         return rc
 
+    def parsedConfigs(self):
+        '''Returns the cache of the parsed configuration files which survives
+        the process. It is created on the first call: the home directory
+        may be changed before.
+        @return: None: the home directory does not exist<br>
+                otherwise: the ParsedConfigCache
+        '''
+        with self._lock:
+            if self._parsedConfigs == None and os.path.isdir(self._home):
+                self._parsedConfigs = ParsedConfigCache(self._home + os.sep 
+                    + '.redirsync.configs.json')
+            return self._parsedConfigs
+
+    def configCache(self):
+        '''Returns the cache of the parsed configuration files (master and
+        per directory), backed by parsedConfigs().
+        @return: the ConfigCache
+        '''
+        if self._configCache._parsed == None:
+            self._configCache._parsed = self.parsedConfigs()
+        return self._configCache
+
     def readMasterConfig(self, config):
         '''Reads the master configuration file.
         @param config: None or the name of the configuration file (with path)
@@ -431,10 +4139,15 @@ class Sync:
         if not os.path.exists(config):
             self._waitingErrors.append('Configuration file not found: ' + config)
         else:
-            self._settings.readConfig(config)
-            self._browser = config.get('browser')
-            self._fnError = self.replaceVariables(config.get('log.file.error'))
-            self._fnLog = self.replaceVariables(config.get('log.file'))
+            values = self.configCache().get(config)
+            self._settings.applyConfig(values)
+            self._settings._browser = values.get('browser')
+            self._fnError = values.get('log.file.error')
+            if self._fnError != None:
+                self._fnError = self.replaceVariables(self._fnError)
+            if values.get('log.file.error.json') != None:
+                self._fnErrorJson = self.replaceVariables(
+                    values.get('log.file.error.json'))
 
             if self._fnError == None:
                 self._fnError = Util.getTempFile('redirsync.error.log')
@@ -444,10 +4157,15 @@ class Sync:
     def close(self):
         '''Frees the resources.
         '''
-        if self._writableFile != None:
-            os.remove(self._writableFile)
-        if self._fpError != None:
-            self._fpError.close()
+        if self._planWriter != None:
+            self._planWriter.close()
+            self._planWriter = None
+        if self._deleter != None:
+            self._deleter.close()
+        if self._parsedConfigs != None:
+            self._parsedConfigs.save()
+        if self._errorLog != None:
+            self._errorLog.close()
     
     def log(self, msg):
         '''Prints a message to the log media.
@@ -462,25 +4180,22 @@ class Sync:
         @param additional:    if the exception message does not contain this
                                 string, it will be issued
         '''
-        msg += "\n"
-        self._countErrors += 1
-        if self._countErrors <= self._settings._maxFirstErrors:
-            self._firstErrors.append(msg)
-        self._lastErrors.append(msg)
-        if len(self._lastErrors) > self._settings._maxLastErrors:
-            self._lastErrors = self._lastErrors [1:]
         if exception != None:
-            if not  msg.endswith(" "):
+            if not msg.endswith(" "):
                 msg += " "
             error = repr(exception)
             msg += error
             if additional != None and error.find(additional) < 0:
                 msg += " [" + additional + ']'
-        sys.stderr.write(msg )
-        if self._fpError == None and self._fnError != None:
-            self._fpError = open(self._fnError, "w")
-        if self._fpError != None:
-            self._fpError.write(msg)
+        msg += "\n"
+        with self._lock:
+            self._countErrors += 1
+            if self._errorLog == None:
+                settings = self._settings
+                self._errorLog = ErrorLog(settings._maxFirstErrors, 
+                    settings._maxLastErrors, settings._maxLoggedErrors, 
+                    self._fnError, self._fnErrorJson)
+            self._errorLog.add(msg, exception, additional)
         
     def addNodePatterns(self, patterns):
         '''Adds a each entry of a list to the include/exclude criteria of the node
@@ -514,41 +4229,24 @@ class Sync:
         '''
         self.error('cannot remove: ' + exceptionString(exceptionInfo, path))
     
-    def getWritableFile(self):
-        '''Returns a file which is writable.
-        This file can be used as source for a file attribute copy.
-        @return: the name of a file which is writable
-        '''
-        if self._writableFile == None:
-            self._writableFile = os.tempnam()
-            fp = open(self._writableFile, "w")
-            fp.close()
-        return self._writableFile
-            
+    def deleter(self):
+        '''Returns the engine removing directory trees (created on demand).
+        @return: the TreeDeleter
+        '''
+        with self._lock:
+            if self._deleter == None:
+                onRemove = None
+                if self._settings._verboseLevel > 1:
+                    onRemove = lambda path: self.log('-' + path)
+                self._deleter = TreeDeleter(self._settings._deleteJobs,
+                    self.error, onRemove)
+        return self._deleter
+
     def rmTree(self, path):
         '''Removes a directory with all files and subdirectories.
         @param path: the full name of the directory to delete
         '''
-        if not path.endswith(os.sep):
-            path += os.sep
-        try:  
-            fullName = path      
-            for node in os.listdir(path):
-                fullName = path + node
-                statInfo = os.lstat(fullName)
-                try:
-                    self.makeWritable(fullName, statInfo)
-                    if self._settings._verboseLevel > 1:
-                        self.log('-' + fullName)
-                    if stat.S_ISDIR(statInfo.st_mode):
-                        self.rmTree(fullName + os.sep)
-                    else:
-                        os.unlink(fullName)
-                except Exception as exc:
-                    self.error('cannot remove: ', exc, fullName)
-            os.rmdir(path)
-        except Exception as exc:
-            self.error('cannot remove: ', exc, fullName)
+        self.deleter().removeTree(path)
        
     def makeWritable(self, path, statInfo = None):
         '''Ensures that a file (or subdirectory) is writable.
@@ -559,9 +4257,9 @@ class Sync:
         if statInfo == None:
             statInfo = os.lstat(path)
         mode = statInfo.st_mode & (stat.S_IWUSR + stat.S_IWGRP + stat.S_IWOTH)
-        if mode == 0:
+        if mode == 0 and not stat.S_ISLNK(statInfo.st_mode):
             try:
-                shutil.copymode(self.getWritableFile(), path)
+                os.chmod(path, stat.S_IMODE(statInfo.st_mode) | stat.S_IWUSR)
             except Exception as exc:
                 self.error('cannot make writable: ', exc, path)    
     
@@ -578,101 +4276,687 @@ class Sync:
         @param fullTrg: the full path of the target file
         @param srcStat: None or the status of the source
         @param srcStat: None or the status of the target
+        @return: True: the file will be copied
         '''
-        copyReason = None
         if srcStat == None:
             srcStat = os.lstat(fullSrc)
             if os.path.exists(fullTrg):
                 trgStat = os.lstat(fullTrg)
+        action = self.fileAction(fullSrc, fullTrg, srcStat, trgStat)
+        if action != None:
+            self.execute(action)
+        return action != None
+
+    def fileAction(self, fullSrc, fullTrg, srcStat, trgStat):
+        '''Decides whether a file must be copied.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @param trgStat: None or the status of the target
+        @return: None: nothing to do<br>
+                otherwise: the copy action
+        '''
+        copyReason = None
         if self._countTotals:
-            self._total._sizeFiles += srcStat.st_size
-            self._total._countFiles += 1
+            with self._lock:
+                self._total._sizeFiles += srcStat.st_size
+                self._total._countFiles += 1
             
         if trgStat == None:
             if self._settings._addNonExisting:
                 copyReason = "+"
+        elif stat.S_ISDIR(trgStat.st_mode):
+            copyReason = '~'
         else:
-            if stat.S_ISDIR(trgStat.st_mode):
-                self.makeWritable(fullTrg, trgStat)
-                self.rmTree(fullTrg)
-                copyReason = '~'
             if not self._settings._copyNewer:
                 copyReason = '*'
-            elif self._settings._copyNewer and srcStat.st_mtime > trgStat.st_mtime:
-                aType = type(srcStat.st_mtime)
-                if (aType == type(float) 
-                      and srcStat.st_mtime - trgStat.st_mtime < 1/(24*3600)):
-                    copyReason = '>'
-            elif self._settings._copyDifferentSize and srcStat.st_size != trgStat.st_size:
+            elif self.isNewer(srcStat, trgStat):
+                copyReason = '>'
+            if (copyReason == None and self._settings._copyDifferentSize 
+                    and srcStat.st_size != trgStat.st_size):
                 copyReason = '!'
-            if copyReason != None:
-                self.makeWritable(fullTrg, trgStat)
-        if copyReason != None:
+            if (copyReason == None and self._settings._speed == 'save'
+                    and srcStat.st_size == trgStat.st_size
+                    and stat.S_ISREG(srcStat.st_mode) 
+                    and stat.S_ISREG(trgStat.st_mode)
+                    and self._hasher.digest(fullSrc, srcStat) 
+                        != self._hasher.digest(fullTrg, trgStat)):
+                copyReason = '#'
+        rc = None
+        if copyReason == '+' and self._linkDestRoot != None:
+            rc = self.linkDestAction(fullSrc, fullTrg, srcStat)
+        if rc == None and copyReason != None:
+            rc = Action('copy', copyReason, fullSrc, fullTrg, srcStat, trgStat)
+        return rc
+
+    def isNewer(self, srcStat, trgStat):
+        '''Tests whether the source is newer than the target (--update).
+        Differences within the time granularity of the target filesystem
+        (--mtime-granularity) do not count: otherwise a target with rounded
+        times would be copied again in each run.
+        @param srcStat: the status of the source
+        @param trgStat: the status of the target
+        @return: True: the source is newer
+        '''
+        granularity = int(self._settings._mtimeGranularity * 1E9)
+        return srcStat.st_mtime_ns - trgStat.st_mtime_ns > granularity
+
+    def linkDestAction(self, fullSrc, fullTrg, srcStat):
+        '''Tests whether a new target can be a hardlink into the previous
+        snapshot (--link-dest): the file must be unchanged there.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the (not existing) target file
+        @param srcStat: the status of the source
+        @return: None: the file must be copied<br>
+                otherwise: the link action
+        '''
+        rc = None
+        pair = self.pairOf(fullTrg)
+        if (stat.S_ISREG(srcStat.st_mode) and pair != None 
+                and pair._linkDest != None):
+            previous = pair._linkDest + fullTrg[len(pair._trg):]
+            try:
+                prevStat = os.lstat(previous)
+            except OSError:
+                prevStat = None
+            if (prevStat != None and stat.S_ISREG(prevStat.st_mode)
+                    and prevStat.st_size == srcStat.st_size
+                    and prevStat.st_mtime_ns == srcStat.st_mtime_ns
+                    and stat.S_IMODE(prevStat.st_mode) == stat.S_IMODE(srcStat.st_mode)
+                    and (self._settings._speed != 'save' 
+                        or self._hasher.digest(fullSrc, srcStat) 
+                            == self._hasher.digest(previous, prevStat))):
+                rc = Action('link', '=', previous, fullTrg, prevStat)
+        return rc
+
+    def execute(self, action):
+        '''Executes an action of the change plan.
+        In dry run mode the action is only written to the plan.
+        @param action: the action to execute
+        '''
+        if self._planWriter != None:
+            self._planWriter.write(action)
+        if self._dryRun:
+            return
+        op = action._op
+        if op == 'copy':
+            self.executeCopy(action)
+        elif op == 'delete' or op == 'rmtree':
+            if self.isParallelDelete(action):
+                self._copyPool.submit(self.executeDelete, action)
+            else:
+                self.executeDelete(action)
+        elif op == 'mkdir':
+            if self._settings._verboseLevel > 1:
+                self.log('&' + action._trg)
+            # the parents are missing only for the root of a target.
+            # The directory exists if the plan is applied again:
+            created = not os.path.isdir(action._trg)
+            os.makedirs(action._trg, exist_ok=True)
+            if created:
+                self._durability.entryChanged(action._trg)
+        elif op == 'link':
+            self.executeLink(action)
+        else:
+            self.error('unknown action: ' + op)
+
+    def executeLink(self, action):
+        '''Executes a link action: the target becomes a hardlink to the file
+        of the previous snapshot. If that fails the file is copied.
+        @param action: the action to execute
+        '''
+        if self._settings._verboseLevel > 1:
+            self.log('=' + action._trg)
+        prevStat = action._srcStat
+        if not action._statsKnown:
+            prevStat = os.lstat(action._src)
+        try:
+            os.link(action._src, action._trg)
+        except OSError:
+            # e.g. another file system or too many links: copy
+            self.copyFile('+', action._src, action._trg, prevStat)
+        else:
+            self._durability.entryChanged(action._trg)
+            with self._lock:
+                self._linked._countFiles += 1
+                self._linked._sizeFiles += prevStat.st_size
+
+    def executeDelete(self, action):
+        '''Executes a delete or rmtree action.
+        @param action: the action to execute
+        '''
+        start = time.perf_counter()
+        if action._op == 'delete':
+            self.deleteFile(action._trg)
+        else:
+            self.rmTree(action._trg)
+        self._durability.entryChanged(action._trg)
+        self._phases.add(action._op, time.perf_counter() - start)
+
+    def isParallelDelete(self, action):
+        '''Tests whether a delete action is done by a copy worker.
+        Only orphans are deleted asynchronously: a target blocking a new
+        subdirectory must be removed before the subdirectory is created.
+        @param action: the delete or rmtree action
+        @return: True: the action is done asynchronously
+        '''
+        return self._copyPool != None and action._reason == '-'
+
+    def executeCopy(self, action):
+        '''Executes a copy action: prepares the target and copies the file.
+        @param action: the action to execute
+        '''
+        fullSrc = action._src
+        fullTrg = action._trg
+        srcStat = action._srcStat
+        trgStat = action._trgStat
+        if not action._statsKnown:
+            srcStat = os.lstat(fullSrc)
+            trgStat = os.lstat(fullTrg) if os.path.lexists(fullTrg) else None
+        if self.isShared(fullTrg, trgStat):
+            # writing in place (or chmod) would change the other links too,
+            # e.g. the previous snapshot of --link-dest
+            os.unlink(fullTrg)
+            self._durability.entryChanged(fullTrg)
+            trgStat = None
+        if trgStat != None:
+            self.makeWritable(fullTrg, trgStat)
+            if stat.S_ISDIR(trgStat.st_mode):
+                self.rmTree(fullTrg)
+        if self._copyPool != None:
+            self._copyPool.submit(self.copyFile, action._reason, fullSrc, 
+                fullTrg, srcStat, trgStat)
+        elif self.isParallelCopy(srcStat):
+            self._pool.submit(self.copyFile, action._reason, fullSrc, fullTrg, 
+                srcStat, trgStat)
+        else:
+            self.copyFile(action._reason, fullSrc, fullTrg, srcStat, trgStat)
+        
+    def isShared(self, fullTrg, trgStat):
+        '''Tests whether a target file shares its inode with other links.
+        @param fullTrg: the full path of the target file
+        @param trgStat: None or the status of the target
+        @return: True: the target must not be changed in place
+        '''
+        rc = False
+        if trgStat != None and stat.S_ISREG(trgStat.st_mode):
+            # the index does not store the link count
+            links = getattr(trgStat, 'st_nlink', None)
+            if links == None:
+                links = os.lstat(fullTrg).st_nlink
+            rc = links > 1
+        return rc
+
+    def isParallelCopy(self, srcStat):
+        '''Tests whether a file is copied by a worker thread.
+        @param srcStat: the status of the source
+        @return: True: the copy is done asynchronously
+        '''
+        return self._copyPool != None or (self._pool != None 
+            and srcStat.st_size >= self._settings._minParallelCopySize)
+
+    def copyFile(self, copyReason, fullSrc, fullTrg, srcStat, trgStat = None):
+        '''Copies a file and counts it as modified.
+        @param copyReason: the reason of the copy: '+', '*', '>', '!', '#' or '~'
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @param trgStat: None or the status of the target before copying
+        '''
+        if self._settings._verboseLevel > 1:
+            self.log(copyReason + fullTrg)
+        start = time.perf_counter()
+        links = self._links
+        keys = None
+        if links != None and stat.S_ISREG(srcStat.st_mode):
+            keys = links.keys(fullSrc, srcStat)
+        holes = 0
+        if keys and links.link(keys, fullTrg, srcStat):
             if self._settings._verboseLevel > 1:
-                self.log(copyReason + fullTrg)
-            shutil.copy2(fullSrc, fullTrg)
+                self.log('=' + fullTrg)
+            self._durability.entryChanged(fullTrg)
+        else:
+            if (self._journal != None and stat.S_ISREG(srcStat.st_mode)
+                    and srcStat.st_size >= self._settings._resumableMinSize
+                    and not self._copier.isDeltaCopy(srcStat, trgStat)):
+                holes = self.copyResumable(fullSrc, fullTrg, srcStat)
+            else:
+                holes = self._copier.copy(fullSrc, fullTrg, srcStat, trgStat)
+                if not stat.S_ISREG(srcStat.st_mode):
+                    self._durability.entryChanged(fullTrg)
+                elif self._copier.isDeltaCopy(srcStat, trgStat):
+                    # written in place
+                    self._durability.fileWritten(fullTrg)
+            self._phases.copyDone(fullTrg, srcStat.st_size, 
+                time.perf_counter() - start)
+            if self._hasher != None and stat.S_ISREG(srcStat.st_mode):
+                self.updateDigest(copyReason, fullSrc, fullTrg, srcStat)
+            if keys:
+                links.register(keys, fullTrg)
+        with self._lock:
             self._modified._sizeFiles += srcStat.st_size
+            self._modified._sizeHoles += holes
             self._modified._countFiles += 1
         
-    def oneDir(self, src, trg, depth):
+    def updateDigest(self, copyReason, fullSrc, fullTrg, srcStat):
+        '''Updates the cached digest of a copied target.
+        After a copy because of different content ('#') the target gets
+        the known digest of the source: the next run does not hash it again.
+        @param copyReason: the reason of the copy
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source before copying
+        '''
+        trgStat = os.lstat(fullTrg)
+        after = os.lstat(fullSrc)
+        if (copyReason == '#' and after.st_size == srcStat.st_size
+                and after.st_mtime_ns == srcStat.st_mtime_ns):
+            self._hasher.store(trgStat, self._hasher.digest(fullSrc, srcStat))
+        else:
+            self._hasher.forget(trgStat)
+
+    def copyResumable(self, fullSrc, fullTrg, srcStat):
+        '''Copies a large file via a temporary file, recording the progress
+        in the journal. An interrupted copy of a former run is continued.
+        @param fullSrc: the full path of the source file
+        @param fullTrg: the full path of the target file
+        @param srcStat: the status of the source
+        @return: the number of bytes not written because they are holes
+        '''
+        journal = self._journal
+        temp = tempName(fullTrg, 'part')
+        offset = 0
+        partial = journal.partialCopy(fullTrg)
+        if partial != None and self.isPartOf(partial._temp, fullTrg):
+            # the former run had another process id
+            if (partial._size == srcStat.st_size
+                    and partial._mtimeNs == srcStat.st_mtime_ns
+                    and os.path.exists(partial._temp) 
+                    and os.path.getsize(partial._temp) >= partial._bytes):
+                temp = partial._temp
+                offset = partial._bytes
+                if self._settings._verboseLevel > 1:
+                    self.log('resuming at {}: {}'.format(offset, fullTrg))
+            elif os.path.exists(partial._temp):
+                os.unlink(partial._temp)
+        rc = self._copier.copyRange(fullSrc, temp, offset, 
+            lambda position: journal.copyProgress(fullTrg, temp, position, srcStat))
+        shutil.copystat(fullSrc, temp)
+        self._durability.replace(temp, fullTrg)
+        journal.copyDone(fullTrg)
+        return rc
+
+    def isPartOf(self, temp, fullTrg):
+        '''Tests whether a file is the temporary file of a resumable copy.
+        @param temp: the full path of the file to test
+        @param fullTrg: the full path of the target file
+        @return: True: temp belongs to a (former) resumable copy of fullTrg
+        '''
+        head, node = os.path.split(temp)
+        info = parseTempName(node)
+        return (info != None and info[2] == 'part' 
+            and os.path.join(head, info[0]) == fullTrg)
+
+    def isStaleTemp(self, trg, node):
+        '''Tests whether a target entry is a temporary file left over by an
+        aborted run. The file of an interrupted resumable copy is kept.
+        @param trg: the target directory (with trailing separator)
+        @param node: the name of a temporary file (see tempName())
+        @return: True: the file can be removed
+        '''
+        target, pid, suffix = parseTempName(node)
+        rc = pid != os.getpid()
+        if rc and suffix == 'part' and self._journal != None:
+            partial = self._journal.partialCopy(trg + target)
+            rc = partial == None or partial._temp != trg + node
+        return rc
+
+    def schedule(self, function, *args):
+        '''Executes a function: in a worker thread if --jobs is active and
+        the queue has room, otherwise by the current thread.
+        The current thread uses an explicit stack instead of recursion:
+        deep trees do not reach the recursion limit. The order is the same
+        as with recursion (depth first, the subtasks in scheduling order).
+        @param function: the function to execute
+        @param args: the arguments of the function
+        '''
+        if self._pool != None and self._pool.trySubmit(function, *args):
+            return
+        todo = getattr(self._local, 'todo', None)
+        if todo != None:
+            todo.append((function, args))
+            return
+        todo = self._local.todo = [(function, args)]
+        try:
+            while todo:
+                function, args = todo.pop()
+                mark = len(todo)
+                function(*args)
+                todo[mark:] = reversed(todo[mark:])
+        finally:
+            self._local.todo = None
+
+    def oneDir(self, src, trg, depth, recursive = True, settings = None):
         '''Syncronizes one directory.
         @param src: the source directory, e.g. /home/
         @param trg: the target directory e.g. /opt/backup/
         @param depth: the current depth of the source tree
+        @param recursive: False: the subdirectories are not synchronized
+        @param settings: None: the settings of the run<br>
+                otherwise: the settings inherited from the parent directory
         '''
-        if not os.path.exists(trg):
-            if self._settings._verboseLevel > 1:
-                self.log('&' + trg)
-            os.mkdir(trg)
-            
-        files = os.listdir(src)
-        if self._localConfig in files:
-            self.readConfig(src + self._localConfig) 
-        validFiles = []
-        dirs = []
-        if self._countTotals:
-            self._total._countDirs += 1
-        self._modified._countDirs += 1
-        modified = self._modified._countFiles
-        for filename in files:
-            fullSrc = src + filename
-            srcStat = os.lstat(fullSrc)
-            if stat.S_ISDIR(srcStat.st_mode):
-                if self._settings._dir.matches(filename):
-                    dirs.append(filename)
+        pair = self.pairOf(trg)
+        index = None if pair == None else pair._index
+        journal = self._journal
+        if journal != None and journal.isDone(trg):
+            self.resumeDir(src, trg, depth, settings)
+            return
+        countErrors = self._countErrors
+        start = time.perf_counter()
+        listing = self._walker.listing(src, trg, 
+            None if index == None else index.targets(trg))
+        if listing.hasSource(self._localConfig):
+            settings = self.localSettings(src, settings)
+        self._local.settings = settings
+        chunkSize = self._settings._scanChunkSize
+        dirs = SpilledList(chunkSize)
+        try:
+            if index != None and self._dryRun:
+                index = None
+            # target states for the index: node -> status info. Stored in
+            # chunks: the memory does not depend on the size of the directory
+            known = None if index == None else {}
+            copied = []
+            pending = False
+            if index != None:
+                index.begin(trg)
+            try:
+                for action in self.planDir(listing, src, trg, depth, dirs, known):
+                    self.execute(action)
+                    if action._op == 'copy':
+                        if self.isParallelCopy(action._srcStat):
+                            pending = True
+                        else:
+                            copied.append(action._trg)
+                    elif action._op == 'link':
+                        copied.append(action._trg)
+                    elif action._op != 'mkdir' and self.isParallelDelete(action):
+                        pending = True
+                    if (index != None and not pending 
+                            and len(known) + len(copied) >= chunkSize):
+                        self.recordChunk(index, trg, known, copied)
+            finally:
+                listing.close()
+            self._durability.dirDone(trg)
+            if index != None:
+                if pending or countErrors != self._countErrors:
+                    index.forget(trg)
+                else:
+                    self.recordChunk(index, trg, known, copied)
+                    index.finish(trg)
+            if (journal != None and not pending and not self._dryRun
+                    and countErrors == self._countErrors):
+                journal.dirDone(trg)
+            self._phases.dirDone(src, time.perf_counter() - start)
+        finally:
+            self._local.settings = None
+        if recursive:
+            self.scheduleDirs(dirs, src, trg, depth, settings)
+        else:
+            dirs.close()
+
+    def scheduleDirs(self, dirs, src, trg, depth, settings):
+        '''Schedules the synchronization of the subdirectories of a directory.
+        @param dirs: the SpilledList of (node, isDir) of the subdirectories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory (not the subdirectories)
+        @param settings: None or the settings of the directory. The
+                subdirectories share them (no copy)
+        '''
+        if dirs.isSpilled():
+            # one by one: millions of subdirectories do not fill the stack
+            self.schedule(self.scheduleSubdirs, iter(dirs), dirs, src, trg, 
+                depth, settings)
+        else:
+            for subdir, isDir in dirs:
+                self.schedule(self.oneDir, src + subdir + os.sep, 
+                    trg + subdir + os.sep, depth + 1, True, settings)
+
+    def scheduleSubdirs(self, subdirs, dirs, src, trg, depth, settings):
+        '''Schedules the next subdirectory of a huge directory and then
+        itself for the rest: the pending subdirectories stay in the
+        temporary file of the SpilledList instead of the stack or the queue.
+        @param subdirs: the iterator over dirs
+        @param dirs: the SpilledList of (node, isDir) of the subdirectories
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the depth of the directory (not the subdirectories)
+        @param settings: None or the settings of the directory
+        '''
+        item = next(subdirs, None)
+        if item == None:
+            dirs.close()
+        else:
+            self.schedule(self.oneDir, src + item[0] + os.sep, 
+                trg + item[0] + os.sep, depth + 1, True, settings)
+            self.schedule(self.scheduleSubdirs, subdirs, dirs, src, trg, 
+                depth, settings)
+
+    def recordChunk(self, index, trg, known, copied):
+        '''Stores the collected target states of a directory in the index.
+        The containers are emptied.
+        @param index: the StateIndex of the target tree
+        @param trg: the target directory (with trailing separator)
+        @param known: IN/OUT: node -> status of the unchanged entries
+        @param copied: IN/OUT: the list of the copied targets (full path)
+        '''
+        for fullTrg in copied:
+            known[fullTrg[len(trg):]] = os.lstat(fullTrg)
+        index.add(trg, known)
+        known.clear()
+        del copied[:]
+
+    def resumeDir(self, src, trg, depth, settings = None):
+        '''Handles a directory completed by an interrupted former run:
+        only the subdirectories are processed.
+        @param src: the source directory
+        @param trg: the target directory
+        @param depth: the current depth of the source tree
+        @param settings: None or the settings inherited from the parent directory
+        '''
+        with self._lock:
+            self._countResumedDirs += 1
+        settings = self.localSettings(src, settings)
+        current = self._runSettings if settings == None else settings
+        if depth <= current._maxDepth:
+            walker = self._walker
+            dirs = SpilledList(current._scanChunkSize)
+            for entry in walker.entries(src):
+                if walker.isDir(entry) and current._dir.matches(entry.name):
+                    dirs.append((entry.name, True))
+            self.scheduleDirs(dirs, src, trg, depth, settings)
+
+    def planDir(self, listing, src, trg, depth, dirs, known = None):
+        '''Decides what has to be done to synchronize one directory.
+        Subdirectories are not processed but returned in dirs.
+        Both sides are processed in one pass: huge directories are merged
+        as sorted streams (see StreamedListing).
+        The memory does not grow with the size of the directory, except for
+        the delayed copies of changed files with several links (--hard-links)
+        and for known: the caller must empty it (see recordChunk()).
+        @param listing: the entries of the source and the target directory
+        @param src: the source directory, e.g. /home/
+        @param trg: the target directory e.g. /opt/backup/
+        @param depth: the current depth of the source tree
+        @param dirs: OUT: the subdirectories to process, a SpilledList of
+                (node, isDir): isDir is None if the target does not exist
+        @param known: None or OUT: node -> status of the target entries
+                which are not changed by the actions
+        @return: an iterator of the actions
+        '''
+        walker = self._walker
+        phases = self._phases
+        settings = self._settings
+        clock = time.perf_counter
+        # the targets of subdirectories are created by their parents
+        if not listing.targetExists() and depth == 0:
+            yield Action('mkdir', '&', None, trg)
+        countFiles = 0
+        sizeFiles = 0
+        modified = False
+        # copies of files with several links: done after the unchanged
+        # links of the directory are registered
+        delayed = []
+        for filename, srcEntry, trgEntry in listing.merged():
+            if parseTempName(filename) != None:
+                # temporary files are never copied or deleted as orphans.
+                # Leftovers of aborted runs are removed:
+                if (trgEntry != None and not walker.isDir(trgEntry)
+                        and self.isStaleTemp(trg, filename)):
+                    yield Action('delete', '-', None, trgEntry.path)
+                continue
+            # True: a target without a (matching) source
+            orphan = False
+            if srcEntry == None:
+                orphan = True
+            elif walker.isDir(srcEntry):
+                start = clock()
+                matches = settings._dir.matches(filename)
+                phases.add('match', clock() - start)
+                if not matches:
+                    orphan = True
+                elif depth <= settings._maxDepth:
+                    dirs.append((filename, 
+                        None if trgEntry == None else walker.isDir(trgEntry)))
+                elif trgEntry != None and known != None:
+                    # too deep: the target stays as it is
+                    known[filename] = (self._dirStat if walker.isDir(trgEntry)
+                        else walker.stat(trgEntry))
             else:
-                self._completed._countFiles += 1
-                self._completed._sizeFiles += srcStat.st_size
-                fullTrg = trg + filename
-                if self._settings._node.matches(filename):
-                    if self._settings._deleteFilesWithoutSource:
-                        validFiles.append(filename) 
-                    trgStat = os.lstat(fullTrg) if os.path.exists(fullTrg) else None
-                    if not stat.S_ISDIR(srcStat.st_mode):
-                        self.oneFile(fullSrc, fullTrg, srcStat, trgStat)
-        self._completed._countDirs += 1               
-        if modified != self._modified._countFiles:
+                srcStat = walker.stat(srcEntry)
+                countFiles += 1
+                sizeFiles += srcStat.st_size
+                start = clock()
+                matches = settings._node.matches(filename)
+                phases.add('match', clock() - start)
+                if not matches:
+                    orphan = True
+                else:
+                    trgStat = None if trgEntry == None else walker.stat(trgEntry)
+                    start = clock()
+                    action = self.fileAction(src + filename, trg + filename, 
+                        srcStat, trgStat)
+                    phases.add('compare', clock() - start)
+                    if action != None:
+                        modified = True
+                        if self._links != None and srcStat.st_nlink > 1:
+                            delayed.append(action)
+                        else:
+                            yield action
+                    elif trgStat != None:
+                        if known != None:
+                            known[filename] = trgStat
+                        if self._links != None:
+                            self._links.registerUnchanged(srcStat, 
+                                trg + filename, trgStat)
+            if orphan and trgEntry != None:
+                if not settings._deleteFilesWithoutSource:
+                    if known != None:
+                        known[filename] = walker.stat(trgEntry)
+                elif walker.isDir(trgEntry):
+                    yield Action('rmtree', '-', None, trgEntry.path)
+                else:
+                    yield Action('delete', '-', None, trgEntry.path)
+        for action in delayed:
+            yield action
+        with self._lock:
+            if self._countTotals:
+                self._total._countDirs += 1
             self._modified._countDirs += 1
-            
-        if self._settings._deleteFilesWithoutSource:
-            trgFiles = os.listdir(trg)
-            for filename in trgFiles:
-                if filename not in validFiles and filename not in dirs:
-                    full = trg + filename
-                    if os.path.isdir(full):
-                        self.rmTree(full)
-                    else:
-                        self.deleteFile(full) 
+            self._completed._countFiles += countFiles
+            self._completed._sizeFiles += sizeFiles
+            self._completed._countDirs += 1               
+            if modified:
+                self._modified._countDirs += 1
                         
-        if depth <= self._settings._maxDepth:
-            for subdir in dirs:
-                fullTrg = fullTrg + subdir
-                if os.path.exists(fullTrg) and not os.path.isdir(fullTrg):
-                    self.deleteFile(fullTrg)
-                self.oneDir(src + subdir + os.sep, trg + subdir + os.sep, 
-                    depth + 1)
-         
+        for subdir, isDir in dirs:
+            if not isDir:
+                if isDir != None:
+                    yield Action('delete', '~', None, trg + subdir)
+                yield Action('mkdir', '&', None, trg + subdir + os.sep)
+            if known != None:
+                known[subdir] = self._dirStat
+
+    def planTree(self, src, trg, depth = 0):
+        '''Decides what has to be done to synchronize a directory tree.
+        Nothing is executed: the target tree is only read.
+        @param src: the source directory (with trailing separator)
+        @param trg: the target directory (with trailing separator)
+        @param depth: the current depth of the source tree
+        @return: an iterator of the actions
+        '''
+        # an explicit stack instead of recursion: per directory (src, trg,
+        # depth, settings, dirs, iterator over the subdirectories not done)
+        todo = []
+        current = (src, trg, depth, None)
+        while current != None:
+            src, trg, depth, settings = current
+            dirs = SpilledList(self._settings._scanChunkSize)
+            listing = self._walker.listing(src, trg)
+            if listing.hasSource(self._localConfig):
+                settings = self.localSettings(src, settings)
+            self._local.settings = settings
+            try:
+                for action in self.planDir(listing, src, trg, depth, dirs):
+                    yield action
+            finally:
+                listing.close()
+                self._local.settings = None
+            todo.append((src, trg, depth, settings, dirs, iter(dirs)))
+            current = None
+            while todo and current == None:
+                src, trg, depth, settings, dirs, subdirs = todo[-1]
+                item = next(subdirs, None)
+                if item == None:
+                    todo.pop()
+                    dirs.close()
+                else:
+                    current = (src + item[0] + os.sep, trg + item[0] + os.sep,
+                        depth + 1, settings)
             
+    def startPools(self):
+        '''Starts the worker threads configured by --jobs and --copy-jobs.
+        With copy workers the run is a pipeline: the scanner feeds the copy
+        and delete jobs into a bounded queue and waits if it is full.
+        '''
+        if self._settings._jobs > 1:
+            self._pool = WorkerPool(self._settings._jobs)
+        if self._settings._copyJobs > 0:
+            self._copyPool = WorkerPool(self._settings._copyJobs, 
+                self._settings._copyQueueSize, True, 'copier')
+
+    def joinPools(self):
+        '''Waits until the scanner and then the copy workers are done.
+        '''
+        if self._pool != None:
+            self._pool.join()
+        if self._copyPool != None:
+            self._copyPool.join()
+
+    def stopPools(self):
+        '''Stops the worker threads.
+        '''
+        if self._pool != None:
+            self._pool.close()
+            self._pool = None
+        if self._copyPool != None:
+            self._copyPool.close()
+            if self._settings._verboseLevel > 0:
+                self.log("pipeline: the scanner waited {} times ({:.1f} sec) for the copy workers"
+                    .format(self._copyPool._countWaits, self._copyPool._waitSeconds))
+            self._copyPool = None
+
     def synchronize(self, sources, target, useLastNode):
         '''Synchronizes the directory trees given by the command line opts.
         @param sources: a list of source directories
@@ -680,7 +4964,173 @@ class Sync:
         @param useLastNode: True: the last node of the source will be appended
                         to the target. source=/x/y target=/z copy target: /z/y
         '''
+        pattern = target
         target = self.replaceVariables(target, self._startTime)
+        self._linkDestRoot = self._settings._linkDest
+        if self._linkDestRoot == 'auto':
+            self._linkDestRoot = self.findPreviousSnapshot(pattern, target)
+            if self._settings._verboseLevel > 0:
+                self.log("link-dest: {}".format(self._linkDestRoot or 
+                    'no previous snapshot found'))
+        if self._linkDestRoot != None and not self._linkDestRoot.endswith(os.sep):
+            self._linkDestRoot += os.sep
+        self._cacheBefore = pageCacheSize()
+        self.startPools()
+        if self._settings._speed == 'save' or self._settings._dedup:
+            self._hasher = FileHasher(self._home)
+        if self._settings._hardLinks or self._settings._dedup:
+            self._links = LinkTracker(self._settings._hardLinks, 
+                self._hasher if self._settings._dedup else None, 
+                self._settings._dedupMinSize)
+        self._durability = DurabilityTracker(self._settings._durability, 
+            self.error)
+        self._copier = self.createCopier()
+        self._walker._chunkSize = self._settings._scanChunkSize
+        if not self._dryRun:
+            self._journal = Journal(self.journalName(sources, target), 
+                self._settings._resume)
+        success = False
+        try:
+            self.synchronizeSources(sources, target, useLastNode)
+            # before the journal is closed: the run is complete only if durable
+            self._durability.flush([pair._trg for pair in self._pairs])
+            success = True
+        finally:
+            self.stopPools()
+            self._cacheAfter = pageCacheSize()
+            if self._journal != None:
+                self._journal.close(success)
+                self._journal = None
+                if self._countResumedDirs > 0 and self._settings._verboseLevel > 0:
+                    self.log("resumed: {} directories completed by the former run"
+                        .format(self._countResumedDirs))
+            if self._hasher != None:
+                self._hasher.close()
+                if self._settings._verboseLevel > 0:
+                    self.log("hashed: {} files {} in {:.1f} sec: {:.1f} MB/s ({} from cache)"
+                        .format(self._hasher._countFiles, 
+                            self.formatSize(self._hasher._bytes), 
+                            self._hasher._seconds, 
+                            self._hasher.throughput() / 1E6, 
+                            self._hasher._countCached))
+            if self._settings._verboseLevel > 0:
+                if self._countLocalConfigs > 0:
+                    self.log("local configurations: {} directories ({} files parsed, {} from the cache)"
+                        .format(self._countLocalConfigs, 
+                            self._configCache._countParsed,
+                            self._configCache._countHits))
+                if self._links != None:
+                    self.log("hardlinks: {} recreated, {} deduplicated, {} saved, {} forgotten"
+                        .format(self._links._countLinked, 
+                            self._links._countDeduplicated,
+                            self.formatSize(self._links._bytesSaved),
+                            self._links._countForgotten))
+                if self._linkDestRoot != None:
+                    self.log("link-dest: {} files {} linked to the previous snapshot"
+                        .format(self._linked._countFiles, 
+                            self.formatSize(self._linked._sizeFiles)))
+                if self._deleter != None:
+                    self.log("removed trees: {} files, {} dirs in {:.1f} sec: {:.0f} entries/s"
+                        .format(self._deleter._countFiles, self._deleter._countDirs,
+                            self._deleter._seconds, self._deleter.throughput()))
+                if self._copier._countDelta > 0:
+                    self.log("delta copy: {} files, {} written, {} unchanged"
+                        .format(self._copier._countDelta, 
+                            self.formatSize(self._copier._deltaWritten),
+                            self.formatSize(self._copier._deltaSkipped)))
+                if self._copier._countSparse > 0:
+                    self.log("sparse copy: {} files, {} holes not written"
+                        .format(self._copier._countSparse, 
+                            self.formatSize(self._modified._sizeHoles)))
+                for method, (count, size) in sorted(
+                        self._copier._methodStatistics.items()):
+                    self.log("copied by {}: {} files {}".format(method, count,
+                        self.formatSize(size)))
+                if self._durability._mode != 'none':
+                    self.log("durability {}: {} files, {} directories, {} filesystems synced in {:.1f} sec"
+                        .format(self._durability._mode, 
+                            self._durability._countFiles,
+                            self._durability._countDirs, 
+                            self._durability._countFilesystems,
+                            self._durability._seconds))
+                if self._copier._dropCache or self._copier._countDirect > 0:
+                    self.log("page cache: {} released, {} bypassed (O_DIRECT), {} preallocated files, cached {} -> {}"
+                        .format(self.formatSize(self._copier._releasedBytes),
+                            self.formatSize(self._copier._directBytes),
+                            self._copier._countPreallocated,
+                            self.formatCacheSize(self._cacheBefore),
+                            self.formatCacheSize(self._cacheAfter)))
+                self.log("phases: " + ", ".join("{} {}x {:.3f} sec".format(
+                    phase, count, seconds) for phase, (count, seconds) 
+                    in sorted(self._phases.totals().items()) if count > 0))
+            if self._fnStatsJson != None:
+                self.writeStatsJson(self._fnStatsJson)
+        if self._settings._showHtml:
+            report = self.makeReport()
+            self.showInBrowser(report)
+
+    def createCopier(self):
+        '''Returns the copy engine configured by the settings.
+        @return: the Copier instance
+        '''
+        settings = self._settings
+        return Copier(settings._deltaMinSize, bufferSize=settings._bufferSize, 
+            sparse=settings._sparse, pageCache=settings._pageCache,
+            directMinSize=settings._directMinSize,
+            preallocateMinSize=settings._preallocateMinSize,
+            atomic=self._durability.isAtomic(), 
+            replace=self._durability.replace)
+
+    def journalName(self, sources, target):
+        '''Returns the name of the checkpoint journal of a run.
+        The journal lies next to the error log.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @return: the filename of the journal
+        '''
+        key = '\0'.join([os.path.abspath(target)] 
+            + [os.path.abspath(src) for src in sources])
+        node = 'redirsync.{}.journal'.format(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[0:12])
+        if self._fnError != None:
+            rc = os.path.join(os.path.dirname(os.path.abspath(self._fnError)), node)
+        else:
+            rc = Util.getTempFile(node)
+        return rc
+
+    def findPreviousSnapshot(self, pattern, current):
+        '''Finds the newest snapshot matching a target containing time
+        variables, e.g. /backup/{year}.{month}.{dayOfMonth}.
+        @param pattern: the target with variables
+        @param current: the target of this run (variables replaced)
+        @return: None: no snapshot found<br>
+                otherwise: the most recently modified snapshot except current
+        '''
+        rc = None
+        pattern = pattern.replace('{home}', self._home).rstrip(os.sep)
+        wildcards = re.sub(r'\{(year|month|dayOfMonth|hour|minute|second|dayOfWeek|week|time)\}',
+            '*', glob.escape(pattern))
+        if wildcards != glob.escape(pattern):
+            current = os.path.normpath(os.path.abspath(current))
+            newest = None
+            for candidate in glob.glob(wildcards):
+                if (os.path.normpath(os.path.abspath(candidate)) != current 
+                        and os.path.isdir(candidate)):
+                    mtime = os.stat(candidate).st_mtime
+                    if newest == None or mtime > newest:
+                        newest = mtime
+                        rc = candidate
+        return rc
+
+    def targetPairs(self, sources, target, useLastNode):
+        '''Returns the source directories with their target directories.
+        @param sources: a list of source directories
+        @param target: the name of the target directory (variables replaced)
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @return: a list of tuples (source, target), both with trailing separator
+        '''
+        rc = []
         for src in sources:
             if not src.endswith(os.sep):
                 src += os.sep
@@ -692,12 +5142,280 @@ class Sync:
                 if len(lastNode) == 0:
                     self.error("--use-last-node needs at least one node in source " + src)
                 trg += os.path.basename(lastNode) + os.sep
-            if self._settings._verboseLevel > 0:
-                self.log("=== " + src + " -> " + trg)
-            self.oneDir(src, trg, 0)
-        if self._settings._showHtml:
-            report = self.makeReport()
-            self.showInBrowser(report)
+            rc.append((src, trg))
+        return rc
+
+    def pairOf(self, trg):
+        '''Returns the source/target pair a target belongs to.
+        @param trg: a target file or directory
+        @return: None: not inside a target of the run<br>
+                otherwise: the SyncPair
+        '''
+        for pair in self._pairs:
+            if trg.startswith(pair._trg):
+                return pair
+        return None
+
+    def synchronizeSources(self, sources, target, useLastNode):
+        '''Synchronizes the source directories: one after another or, with
+        --parallel-sources, concurrently if the pairs do not overlap.
+        @param sources: a list of source directories
+        @param target: the name of the target directory (variables replaced)
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        '''
+        root = target if target.endswith(os.sep) else target + os.sep
+        pairs = []
+        for src, trg in self.targetPairs(sources, target, useLastNode):
+            pairs.append(SyncPair(src, trg, None if self._linkDestRoot == None
+                else self._linkDestRoot + trg[len(root):]))
+        # the most specific target first: see pairOf()
+        self._pairs = sorted(pairs, key=lambda pair: -len(pair._trg))
+        if self.isConcurrent(pairs):
+            self.synchronizeConcurrently(pairs)
+        else:
+            for pair in pairs:
+                self.synchronizePair(pair, True)
+
+    def isConcurrent(self, pairs):
+        '''Tests whether the pairs can be synchronized concurrently.
+        @param pairs: the list of SyncPair instances
+        @return: True: concurrency is wanted and the pairs do not overlap
+        '''
+        rc = self._settings._parallelSources > 1 and len(pairs) > 1
+        for ix, pair in enumerate(pairs):
+            for other in pairs[ix + 1:]:
+                if rc and pair.overlaps(other):
+                    rc = False
+                    if self._settings._verboseLevel > 0:
+                        self.log("overlapping targets: {} {}: sequential run"
+                            .format(pair._trg, other._trg))
+        return rc
+
+    def synchronizePair(self, pair, join):
+        '''Synchronizes one source directory with its target.
+        @param pair: the SyncPair to process
+        @param join: True: waits until the worker threads are done
+        '''
+        if self._settings._verboseLevel > 0:
+            self.log("=== " + pair._src + " -> " + pair._trg)
+        if self._dryRun:
+            for action in self.planTree(pair._src, pair._trg):
+                self.execute(action)
+            return
+        if self._settings._useIndex:
+            pair._index = StateIndex(self._home, pair._src, pair._trg)
+        success = False
+        try:
+            self.oneDir(pair._src, pair._trg, 0)
+            if join:
+                self.joinPools()
+            success = True
+        finally:
+            index = pair._index
+            if index != None:
+                if self._settings._verboseLevel > 0:
+                    self.log("index: {} directories from the index, {} read"
+                        .format(index._countHits, index._countMisses))
+                pair._index = None
+                index.close(success)
+
+    def synchronizeConcurrently(self, pairs):
+        '''Synchronizes the pairs in parallel threads. At most 
+        --parallel-sources pairs run at once and at most --per-device pairs
+        use the same device (source or target).
+        Each pair is scanned by its own thread: the --jobs pool is not used
+        for scanning, but the copy workers (--copy-jobs) are shared.
+        A pair takes all its slots at once: a waiting pair holds none, so it
+        cannot block a pair of another device.
+        @param pairs: the list of SyncPair instances (not overlapping)
+        '''
+        for pair in pairs:
+            pair._devices = pair.devices()
+        condition = threading.Condition()
+        # device -> the number of running pairs using it
+        busy = {}
+        running = 0
+        errors = []
+        def startable(pair):
+            return (running < self._settings._parallelSources 
+                and all(busy.get(device, 0) < self._settings._perDevice
+                    for device in pair._devices))
+        def run(pair):
+            nonlocal running
+            with condition:
+                condition.wait_for(lambda: startable(pair))
+                running += 1
+                for device in pair._devices:
+                    busy[device] = busy.get(device, 0) + 1
+            try:
+                self.synchronizePair(pair, False)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                with condition:
+                    running -= 1
+                    for device in pair._devices:
+                        busy[device] -= 1
+                    condition.notify_all()
+        pool = self._pool
+        self._pool = None
+        try:
+            threads = []
+            for pair in pairs:
+                thread = threading.Thread(target=run, args=(pair,),
+                    name='redirsync-source-%d' % len(threads))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            self._pool = pool
+        self.joinPools()
+        if errors:
+            raise errors[0][1].with_traceback(errors[0][2])
+
+    def watch(self, sources, target, useLastNode, rounds = None, timeout = None):
+        '''Synchronizes the trees and then waits for changes of the sources
+        (inotify): only the directories touched by events are synchronized.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @param rounds: None or the number of batches to process (for tests)
+        @param timeout: None or the maximal waiting time for the next event
+        '''
+        watcher = Watcher(self._settings._dir.matches, self._settings._maxDepth)
+        try:
+            # watching starts before the first run: no change gets lost
+            for src, trg in self.targetPairs(sources, 
+                    self.replaceVariables(target, self._startTime), useLastNode):
+                watcher.addTree(src, trg)
+            lastSync = time.time()
+            self.synchronize(sources, target, useLastNode)
+            count = 0
+            while rounds == None or count < rounds:
+                batch = watcher.collect(self._settings._watchDelay, timeout)
+                if batch.isEmpty():
+                    if timeout != None:
+                        break
+                    continue
+                start = time.time()
+                if batch._overflow:
+                    self.error('inotify queue overflow: rescanning changed directories')
+                    for src, item in watcher.changedSince(lastSync)._dirs.items():
+                        batch.add(src, item[0], item[1], item[2])
+                if self._settings._verboseLevel > 0:
+                    self.log("watch: {} events, {} directories".format(
+                        batch._countEvents, len(batch._dirs)))
+                self.syncBatch(batch)
+                lastSync = start
+                count += 1
+        finally:
+            watcher.close()
+
+    def syncBatch(self, batch):
+        '''Synchronizes the directories collected by the watcher.
+        The changes of the batch are durable when the method returns.
+        @param batch: the Batch instance to process
+        '''
+        # parents first: they create the targets of new subdirectories
+        roots = set()
+        for src in sorted(batch._dirs):
+            trg, depth, recursive = batch._dirs[src]
+            if os.path.isdir(src):
+                try:
+                    self.oneDir(src, trg, depth, recursive, 
+                        self.inheritedSettings(src, trg))
+                except OSError as exc:
+                    self.error('synchronization failed: ', exc, src)
+            roots.update(pair._trg for pair in self._pairs 
+                if trg.startswith(pair._trg))
+        self._durability.flush(sorted(roots))
+
+    def applyPlan(self, filename):
+        '''Executes the actions of a change plan written by --dry-run.
+        @param filename: the file containing the plan. '-': standard input
+        '''
+        self._durability = DurabilityTracker(self._settings._durability, 
+            self.error)
+        self.startPools()
+        self._copier = self.createCopier()
+        roots = set()
+        try:
+            for action in readPlan(filename):
+                self.execute(action)
+                roots.add(os.path.dirname(action._trg.rstrip(os.sep)))
+            self.joinPools()
+            self._durability.flush(sorted(roots))
+        finally:
+            self.stopPools()
+
+    def verifyIndexes(self, sources, target, useLastNode):
+        '''Compares the state indexes with the real target trees.
+        Each difference is reported as error.
+        @param sources: a list of source directories
+        @param target: the name of the target directory
+        @param useLastNode: True: the last node of the source will be appended
+                        to the target
+        @return: the number of differences
+        '''
+        rc = 0
+        target = self.replaceVariables(target, self._startTime)
+        for src, trg in self.targetPairs(sources, target, useLastNode):
+            index = StateIndex(self._home, src, trg)
+            for msg in index.verify():
+                self.error('index differs: ' + msg)
+                rc += 1
+            index.close(True)
+        return rc
+
+    def writeStatsJson(self, filename):
+        '''Writes the statistics of the run as JSON.
+        @param filename: the file to write
+        '''
+        def counts(statistics):
+            return {'dirs': statistics._countDirs, 'files': statistics._countFiles,
+                'bytes': statistics._sizeFiles}
+        document = self._phases.toDict()
+        document.update({
+            'start': self._startTime,
+            'seconds': round(time.time() - self._startTime, 3),
+            'total': counts(self._total),
+            'modified': counts(self._modified),
+            'holeBytes': self._modified._sizeHoles,
+            'metadataSeconds': round(self._phases.metadataSeconds(), 6),
+            'copyMethods': dict((method, {'files': count, 'bytes': size})
+                for method, (count, size) in self._copier._methodStatistics.items()),
+            'errors': self._countErrors
+        })
+        if self._linkDestRoot != None:
+            document['linkDest'] = {'previous': self._linkDestRoot,
+                'files': self._linked._countFiles, 'bytes': self._linked._sizeFiles}
+        if self._deleter != None:
+            document['removedTrees'] = {'files': self._deleter._countFiles,
+                'dirs': self._deleter._countDirs, 
+                'seconds': round(self._deleter._seconds, 6),
+                'entriesPerSec': round(self._deleter.throughput(), 1)}
+        if self._copier._dropCache or self._copier._countDirect > 0:
+            document['pageCache'] = {'releasedBytes': self._copier._releasedBytes,
+                'directFiles': self._copier._countDirect,
+                'directBytes': self._copier._directBytes,
+                'preallocatedFiles': self._copier._countPreallocated,
+                'cachedBefore': self._cacheBefore, 'cachedAfter': self._cacheAfter}
+        if self._durability._mode != 'none':
+            document['durability'] = {'mode': self._durability._mode,
+                'files': self._durability._countFiles,
+                'dirs': self._durability._countDirs,
+                'filesystems': self._durability._countFilesystems,
+                'seconds': round(self._durability._seconds, 6)}
+        if self._links != None:
+            document['links'] = {'linked': self._links._countLinked,
+                'deduplicated': self._links._countDeduplicated,
+                'bytesSaved': self._links._bytesSaved}
+        with open(filename, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+            fp.write('\n')
 
     def formatSize(self, bytes):
         '''Formats a size value in a human readable form.
@@ -713,6 +5431,13 @@ class Sync:
         else:
             rc = "%.3f GByte" % (bytes / 1000.0 / 1000.0 / 1000.0)
         return rc
+
+    def formatCacheSize(self, bytes):
+        '''Formats a size of the page cache.
+        @param bytes: None (unknown) or the size in bytes
+        @return: the formated string
+        '''
+        return '?' if bytes == None else self.formatSize(bytes)
     
     def makeReport(self):
         '''Builds a report in HTML and write it to a file.
@@ -731,19 +5456,102 @@ class Sync:
                 int (durationInt / 3600), int(durationInt / 3600) % 60, durationInt % 60)
             
         errors = ''
-        if self._countErrors > 0:
+        errorLog = self._errorLog
+        if errorLog != None:
+            errorLog.flush()
             errors = """
 <h2>Es sind leider Fehler aufgetreten</h2>
 <p>Anzahl Fehler: {}
 <p><a href="file://{}">Vollst&auml;ndiges Fehlerprotokoll</a></p>
-<pre>
-""".format(self._countErrors, self._fnError) + "".join(self._firstErrors)
-                
-            omitted = self._countErrors - (self._settings._maxFirstErrors 
-                + self._settings._maxLastErrors)
+<table border="0">
+<tr><td>Fehlerart</td><td>Anzahl</td></tr>
+""".format(self._countErrors, self._fnError)
+            for kind, count in errorLog.topKinds():
+                errors += '<tr><td>{}</td><td>{}</td></tr>\n'.format(kind, count)
+            errors += '</table>\n'
+            if len(errorLog._dirs) > 0:
+                errors += '<table border="0">\n<tr><td>Verzeichnis</td><td>Fehler</td></tr>\n'
+                for path, count in errorLog.topDirs():
+                    errors += '<tr><td>{}</td><td>{}</td></tr>\n'.format(path, count)
+                errors += '</table>\n'
+            errors += '<pre>\n' + "".join(errorLog._first)
+            omitted = errorLog.omitted()
             if omitted > 0:
                 errors += "... ({} Fehler ausgelassen)\n".format(omitted)
-            errors += "".join(self._lastErrors) + "</pre>\n"
+            errors += "".join(errorLog._last) + "</pre>\n"
+        details = ''
+        if self._copier._countDelta > 0:
+            details = '''<p>Delta-Kopie: {} Dateien, {} geschrieben, {} unver&auml;ndert</p>
+'''.format(self._copier._countDelta, self.formatSize(self._copier._deltaWritten),
+                self.formatSize(self._copier._deltaSkipped))
+        if self._copier._countSparse > 0:
+            details += '''<p>Sparse-Dateien: {} Dateien, {} L&ouml;cher nicht geschrieben</p>
+'''.format(self._copier._countSparse, self.formatSize(self._modified._sizeHoles))
+        if len(self._copier._methodStatistics) > 0:
+            details += '<table border="0">\n<tr><td>Kopiermethode</td><td>Dateien</td><td>MByte</td></tr>\n'
+            for method, (count, size) in sorted(
+                    self._copier._methodStatistics.items()):
+                details += '<tr><td>{}</td><td>{}</td><td>{}</td></tr>\n'.format(
+                    method, count, self.formatSize(size))
+            details += '</table>\n'
+        if self._durability._mode != 'none':
+            details += '''<p>Dauerhaftigkeit ({}): {} Dateien, {} Verzeichnisse,
+{} Dateisysteme synchronisiert in {:.1f} sec</p>
+'''.format(self._durability._mode, self._durability._countFiles,
+                self._durability._countDirs, self._durability._countFilesystems,
+                self._durability._seconds)
+        if self._copier._dropCache or self._copier._countDirect > 0:
+            details += '''<p>Page-Cache: {} freigegeben, {} direkt geschrieben (O_DIRECT),
+{} Dateien vorab belegt<br/>
+Cache vorher: {}, nachher: {}</p>
+'''.format(self.formatSize(self._copier._releasedBytes), 
+                self.formatSize(self._copier._directBytes),
+                self._copier._countPreallocated,
+                self.formatCacheSize(self._cacheBefore),
+                self.formatCacheSize(self._cacheAfter))
+        if self._linkDestRoot != None:
+            details += '''<p>Vorheriger Snapshot: {}<br/>
+Verlinkt: {} Dateien, {}</p>
+'''.format(self._linkDestRoot, self._linked._countFiles, 
+                self.formatSize(self._linked._sizeFiles))
+        if self._links != None:
+            details += '''<p>Hardlinks: {} wiederhergestellt, {} dedupliziert, {} gespart</p>
+'''.format(self._links._countLinked, self._links._countDeduplicated,
+                self.formatSize(self._links._bytesSaved))
+        if self._deleter != None:
+            details += '''<p>Gel&ouml;schte Verzeichnisb&auml;ume: {} Dateien, {} Verzeichnisse
+in {:.1f} sec: {:.0f} Eintr&auml;ge/s</p>
+'''.format(self._deleter._countFiles, self._deleter._countDirs,
+                self._deleter._seconds, self._deleter.throughput())
+        if self._hasher != None:
+            details += '''<p>Pr&uuml;fsummen: {} Dateien, {} in {:.1f} sec: {:.1f} MByte/s
+({} aus dem Cache)</p>
+'''.format(self._hasher._countFiles, self.formatSize(self._hasher._bytes),
+                self._hasher._seconds, self._hasher.throughput() / 1E6,
+                self._hasher._countCached)
+        totals = self._phases.totals()
+        details += '''<p>Metadaten: {:.3f} sec, Kopieren: {:.3f} sec</p>
+<table border="0">
+<tr><td>Phase</td><td>Anzahl</td><td>Sekunden</td></tr>
+'''.format(self._phases.metadataSeconds(), totals['copy'][1])
+        for phase in PhaseStatistics.PHASES:
+            details += '<tr><td>{}</td><td>{}</td><td>{:.3f}</td></tr>\n'.format(
+                phase, totals[phase][0], totals[phase][1])
+        details += '</table>\n'
+        slowest = self._phases.slowestDirs()
+        if len(slowest) > 0:
+            details += '<h2>Langsamste Verzeichnisse</h2>\n<table border="0">\n'
+            for seconds, path in slowest:
+                details += '<tr><td>{:.3f} sec</td><td>{}</td></tr>\n'.format(
+                    seconds, path)
+            details += '</table>\n'
+        largest = self._phases.largestCopies()
+        if len(largest) > 0:
+            details += '<h2>Gr&ouml;&szlig;te Kopien</h2>\n<table border="0">\n'
+            for size, seconds, path in largest:
+                details += '<tr><td>{}</td><td>{:.3f} sec</td><td>{}</td></tr>\n'.format(
+                    self.formatSize(size), seconds, path)
+            details += '</table>\n'
         msg = '''<html>
 <head>
 <title>Datensicherung Report</title>
@@ -773,7 +5581,7 @@ Dauer: {duration}</p>
     <td>{r_size}:1</td>
 </tr>
 </table>
-{errors}
+{details}{errors}
 </body>
 </html>
         '''.format(
@@ -789,6 +5597,7 @@ Dauer: {duration}</p>
             r_files=self._total._countFiles / max(1, self._modified._countFiles),
             r_size=self._total._sizeFiles / max(1, self._modified._sizeFiles),
             rate=self._modified._sizeFiles / max(1,durationInt),
+            details=details,
             errors=errors)
         fp.write(msg)
         fp.close()
@@ -858,30 +5667,82 @@ USAGE
         parser.add_argument("-a", "--add", dest="add", action="store_true", help="add new files (only exist on the source")
         parser.add_argument("-c", "--config", dest="config", type=isFile, help="configuration file. [default: {}]".format(defaultConfig) )
         parser.add_argument("--delete", dest="delete", action="store_true", help="files on the target which are not exist on the source will be deleted")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, help="number of worker threads for subdirectories and large files. [default: %(default)s]")
+        parser.add_argument("--buffer-size", dest="bufferSize", type=int, default=1024*1024, help="buffer size (in bytes) if the kernel cannot copy itself. [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--apply-plan", dest="applyPlan", help="executes the change plan written by --dry-run. '-': standard input. Source and target are not needed", metavar="FILE")
+        parser.add_argument("--sparse", dest="sparse", default="auto", choices=['auto', 'zeros', 'off'], help="'auto': the holes of sparse files are not copied but recreated. 'zeros': blocks of zeros are not written either (filesystems without hole information). 'off': all bytes are copied [default: %(default)s]")
+        parser.add_argument("--page-cache", dest="pageCache", default="keep", choices=['keep', 'drop'], help="'drop': the copied data is released from the page cache while copying: the cache of other programs survives the run [default: %(default)s]")
+        parser.add_argument("--direct-min-size", dest="directMinSize", type=int, default=0, help="files with at least this size (in bytes) are copied with O_DIRECT, bypassing the page cache. 0: never [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--durability", dest="durability", default="none", choices=['none', 'file', 'dir', 'fs'], help="'none': nothing is synced. Otherwise the files are copied via temporary files renamed into place (an aborted run leaves no half written target) and synced: 'file': each file before its rename (a renamed target survives a power loss). 'dir': the files and entries of a directory as one batch when the directory is done (a power loss before may leave files of that directory incomplete). 'fs': one syncfs() per target filesystem at the end (durable only after the run) [default: %(default)s]")
+        parser.add_argument("--delta-min-size", dest="deltaMinSize", type=int, default=0, help="existing target files with at least this size (in bytes) are updated in place: only changed blocks are written. 0: never [default: %(default)s]", metavar="BYTES")
+        parser.add_argument("--error-json", dest="errorJson", help="the errors are written to this file as JSON lines", metavar="FILE")
+        parser.add_argument("--stats-json", dest="statsJson", help="the statistics of the run (phase timings, slowest directories, largest copies) are written to this file as JSON", metavar="FILE")
+        parser.add_argument("-n", "--dry-run", dest="dryRun", action="store_true", help="writes the change plan (JSON lines) but changes nothing")
+        parser.add_argument("--copy-jobs", dest="copyJobs", type=int, default=0, help="copies and deletions are done by this many threads fed by the scanner through a bounded queue. 0: the scanner copies itself [default: %(default)s]", metavar="N")
+        parser.add_argument("--delete-jobs", dest="deleteJobs", type=int, default=4, help="directory trees are removed by this many threads (subtrees in parallel) [default: %(default)s]", metavar="N")
+        parser.add_argument("-H", "--hard-links", dest="hardLinks", action="store_true", help="files with several links in the source are linked in the target too instead of being copied again")
+        parser.add_argument("--dedup", dest="dedup", action="store_true", help="new files with the same content and metadata as an already copied file become hardlinks to it. The last 100000 copied files are remembered")
+        parser.add_argument("--link-dest", dest="linkDest", help="snapshot mode: new files unchanged in this previous snapshot are hardlinked to it. 'auto': the newest existing directory matching the target pattern (e.g. /backup/{year}.{month}.{dayOfMonth})", metavar="PREVIOUS")
+        parser.add_argument("--parallel-sources", dest="parallelSources", type=int, default=1, help="at most N sources (with their own targets) are synchronized concurrently if the targets do not overlap [default: %(default)s]", metavar="N")
+        parser.add_argument("--per-device", dest="perDevice", type=int, default=1, help="at most N concurrent sources use the same device (source or target) [default: %(default)s]", metavar="N")
+        parser.add_argument("--index", dest="index", action="store_true", help="stores the state of the target in REDIRSYNC_HOME: unchanged target directories will not be read again")
+        parser.add_argument("--verify-index", dest="verifyIndex", action="store_true", help="compares the state index with the target tree instead of synchronizing")
         parser.add_argument("-l", "--log-file", dest="logfile", default=defaultLog, help="log file. [default: %(default)s]")
         parser.add_argument("-m", "--max-depth", dest="maxDepth", type=int, default=100, help="maximal depth of the directory tree.  [default: %(default)s]" )
+        parser.add_argument("--plan-file", dest="planFile", help="the change plan is written to this file. '-': standard output. [default: standard output with --dry-run]", metavar="FILE")
         parser.add_argument("-p", "--node-patterns", dest="nodePatterns", default="*,-*.bak,-*~", help="only files matching this patterns will be copied. Separator: ',' [default: %(default)s]", metavar="RE")
         parser.add_argument("-P", "--dir-patterns", dest="dirPatterns", default="*,cache,-temp,-tmp", help="only files matching this patterns will be copied. Separator: ',' [default: %(default)s]", metavar="RE")
         parser.add_argument("-r", "--report", dest="report", action="store_true", help="displays a report in a browser. [default: %(default)s]")
+        parser.add_argument("--resume", dest="resume", action="store_true", help="continues an interrupted run: completed directories and partial copies of large files are taken from the checkpoint journal")
         parser.add_argument("-s", "--size", dest="size", action="store_true", help="copy if the size of source and target is different. [default: %(default)s]")
-        parser.add_argument("-S", "--speed", dest="speed", default="quick", help="'quick' or 'save'. [default: %(default)s]")
-        parser.add_argument("-u", "--update", dest="update", action="store_true", help="if a file exists on the destination and it is newer it will be copied")
+        parser.add_argument("-S", "--speed", dest="speed", default="quick", choices=['quick', 'save'], help="'quick': compare size and time. 'save': compare the content of equal sized files by a hash. [default: %(default)s]")
+        parser.add_argument("-u", "--update", dest="update", action="store_true", help="if a file exists on the destination and the source is newer it will be copied (see --mtime-granularity)")
+        parser.add_argument("--mtime-granularity", dest="mtimeGranularity", type=float, default=0.0, help="--update: the source is newer only if its modification time is later by more than this. 0: exact (nanoseconds). 2: targets on FAT, whose times are rounded [default: %(default)s]", metavar="SECONDS")
         parser.add_argument("--use-last-node", dest="useLastNode", action="store_true", help="the last node of the source will added to the target.  [default: %(default)s]")
-        parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="set verbosity level [default: %(default)s]")
+        parser.add_argument("-w", "--watch", dest="watch", action="store_true", help="after the synchronization the sources are watched (inotify): changes are synchronized within seconds")
+        parser.add_argument("--watch-delay", dest="watchDelay", type=float, default=2.0, help="the changes are synchronized when the sources are quiet for this many seconds. [default: %(default)s]", metavar="SECONDS")
+        parser.add_argument("-v", "--verbose", dest="verbose", action="count", default=0, help="set verbosity level [default: %(default)s]")
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
-        parser.add_argument(dest="source", type=isDirectory, help="source directory", metavar="source", nargs='+')
-        parser.add_argument(dest="target", type=isDirectory, help="target directory", metavar="target")
+        parser.add_argument(dest="source", type=isDirectory, help="source directory", metavar="source", nargs='*')
+        parser.add_argument(dest="target", type=isDirectory, help="target directory", metavar="target", nargs='?')
         
         # Process arguments
         args = parser.parse_args(argv)
-        
-        if ("config" not in args and os.path.isfile(defaultConfig) ):
-            args.append["config"] = defaultConfig
+        if args.target == None and len(args.source) > 1:
+            args.target = args.source.pop()
+        if args.applyPlan == None and (len(args.source) == 0 or args.target == None):
+            parser.error("source and target are required")
         
         sync = Sync()
         sync._settings.getFromOpts(args)
-        if sync._settings._showHtml and (not hasattr(sync._browser, '_browser')
-                or sync._browser == None):
+        config = args.config
+        if config == None:
+            for name in (sync._home + os.sep + '.redirsync.conf', 
+                    os.path.expanduser(defaultConfig)):
+                if os.path.isfile(name):
+                    config = name
+                    break
+        if config != None:
+            # the configuration replaces the defaults of the options...
+            sync.readMasterConfig(config)
+            # ...but not the options given on the command line (an option
+            # with its default value counts as not given)
+            sync._settings.getFromOpts(Namespace(**dict((dest, value) 
+                for dest, value in vars(args).items() 
+                if value != parser.get_default(dest))))
+        sync._dryRun = args.dryRun
+        sync._fnStatsJson = args.statsJson
+        if args.errorJson != None:
+            sync._fnErrorJson = args.errorJson
+        if args.planFile == None and args.dryRun:
+            args.planFile = '-'
+        if args.planFile == '-':
+            # the standard output belongs to the plan
+            sync._settings._verboseLevel = 0
+            args.verbose = 0
+        if args.planFile != None:
+            sync._planWriter = PlanWriter(args.planFile)
+        if sync._settings._showHtml and sync._settings._browser == None:
             sync.error('No browser defined. I cannot execute --report')
             exit(2)
         
@@ -898,7 +5759,18 @@ USAGE
                 opts += " --use-last-node"
             say("opts: " + opts + ' ' + sync._settings.getSettings())
         
-        sync.synchronize(args.source, args.target, args.useLastNode)
+        if args.applyPlan != None:
+            sync.applyPlan(args.applyPlan)
+            sync.close()
+            return 0
+        if args.verifyIndex:
+            rc = sync.verifyIndexes(args.source, args.target, args.useLastNode)
+            sync.close()
+            return 0 if rc == 0 else 1
+        if args.watch:
+            sync.watch(args.source, args.target, args.useLastNode)
+        else:
+            sync.synchronize(args.source, args.target, args.useLastNode)
         sync.close()
 
            
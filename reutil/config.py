@@ -1,4 +1,4 @@
-import logging, os.path
+import json, logging, os, os.path, threading, time
 
 class Config:
     '''Maintenances a dictionary read from file(s).'
@@ -14,19 +14,35 @@ class Config:
     include "/etc/global_var.conf"
     global.basedir=/etc
     '''
-    def __init__(self, filename):
+    def __init__(self, filename, cache = None):
         '''Constructor.
         @param filename: the configuration file
+        @param cache: None or a ParsedConfigCache: if it contains a valid
+                entry the files are not read
         '''
         self._dict = {}
         self._files = []
-        self.read(filename)
+        # the include closure: a list of (file, mtimeNs). mtimeNs is None
+        # for a missing include
+        self._stamps = []
+        item = None if cache == None else cache.lookup(filename)
+        # True: taken from the ParsedConfigCache, not parsed
+        self._fromCache = item != None
+        if item != None:
+            self._dict = dict(item['dict'])
+            self._files = list(item['files'])
+            self._stamps = [tuple(stamp) for stamp in item['stamps']]
+        else:
+            self.read(filename)
+            if cache != None:
+                cache.store(filename, self)
 
     def read(self, filename):
         '''Reads a configuration file.
         @param filename: the configuration file
         '''
         fp = open(filename, "r")
+        self._stamps.append((filename, os.fstat(fp.fileno()).st_mtime_ns))
         lineNo = 0
         for line in fp:
             line = line.rstrip()
@@ -42,6 +58,7 @@ class Config:
                     if os.path.exists(name):
                         self.read(name)
                     else:
+                        self._stamps.append((name, None))
                         logging.error(filename + '-' + str(lineNo) 
                             + ': can not include: ' + name)
         fp.close()
@@ -52,5 +69,190 @@ class Config:
         @return None: invalid key<br>
                 otherwise: the value belonging to the key
         '''
-        return self._dict[key] if key in self._dict else None 
-        
\ No newline at end of file
+        return self._dict[key] if key in self._dict else None
+
+    def keys(self):
+        '''Returns the defined keys.
+        @return: the list of the keys (sorted)
+        '''
+        return sorted(self._dict.keys())
+
+class ParsedConfigCache:
+    '''Stores parsed configuration files in a file (JSON): later processes
+    neither read nor parse them again.
+    An entry is valid as long as the modification times of the file and of
+    all its includes are the same: by default they are compared on each
+    lookup (one stat per file instead of reading and parsing).
+    Lazy validation is opt-in (maxAge > 0): the times are only compared if
+    the last comparison is older than maxAge seconds, otherwise the entry
+    is used without any file system access, even if an include has been
+    changed meanwhile.
+    The number of entries is limited: the least recently used are dropped,
+    the entries of removed files when the cache is saved.
+    '''
+    def __init__(self, filename, maxAge = 0.0, maxEntries = 10000):
+        '''Constructor.
+        @param filename: the cache file
+        @param maxAge: 0: each lookup validates the entry<br>
+                otherwise: an entry checked within this many seconds is trusted
+        @param maxEntries: the maximal number of stored files
+        '''
+        self._filename = filename
+        self._maxAge = maxAge
+        self._maxEntries = maxEntries
+        self._lock = threading.Lock()
+        # None: not loaded yet. Otherwise: filename -> entry
+        self._entries = None
+        self._changed = False
+        self._countHits = 0
+        self._countValidated = 0
+        self._countStored = 0
+
+    def entries(self):
+        '''Returns the entries, loads the cache file on the first call.
+        The caller must hold the lock.
+        @return: a dictionary filename -> entry, the least recently used first
+        '''
+        if self._entries == None:
+            self._entries = {}
+            try:
+                with open(self._filename, 'r') as fp:
+                    document = json.load(fp)
+                if document.get('version') == 1:
+                    self._entries = document['entries']
+            except (OSError, ValueError, KeyError, AttributeError):
+                # missing or damaged: will be rebuilt
+                pass
+        return self._entries
+
+    def lookup(self, filename):
+        '''Returns the parsed content of a configuration file.
+        @param filename: the configuration file
+        @return: None: no valid entry<br>
+                otherwise: a dictionary with the keys dict, files and stamps
+        '''
+        key = os.path.abspath(filename)
+        with self._lock:
+            entries = self.entries()
+            item = entries.pop(key, None)
+            if item != None:
+                # the most recently used: the last. The order alone does not
+                # need a save: it is written with the next change
+                entries[key] = item
+        if item == None:
+            return None
+        now = time.time()
+        if self._maxAge <= 0 or now - item['checked'] >= self._maxAge:
+            for name, stamp in item['stamps']:
+                if ConfigCache.stamp(name) != stamp:
+                    return None
+            with self._lock:
+                if self._maxAge > 0:
+                    item['checked'] = now
+                    self._changed = True
+                self._countValidated += 1
+        with self._lock:
+            self._countHits += 1
+        return item
+
+    def store(self, filename, config):
+        '''Stores a parsed configuration file.
+        @param filename: the configuration file
+        @param config: the Config instance
+        '''
+        key = os.path.abspath(filename)
+        with self._lock:
+            entries = self.entries()
+            entries.pop(key, None)
+            entries[key] = {'dict': config._dict,
+                'files': config._files, 'stamps': config._stamps, 
+                'checked': time.time()}
+            while len(entries) > self._maxEntries:
+                del entries[next(iter(entries))]
+            self._changed = True
+            self._countStored += 1
+
+    def prune(self):
+        '''Removes the entries of configuration files which do not exist
+        any more. The caller must hold the lock.
+        '''
+        for filename in list(self._entries.keys()):
+            if ConfigCache.stamp(filename) == None:
+                del self._entries[filename]
+                self._changed = True
+
+    def save(self):
+        '''Writes the cache file if something has changed.
+        '''
+        with self._lock:
+            if self._entries == None:
+                return
+            self.prune()
+            if not self._changed:
+                return
+            temp = '{}.{}.{}'.format(self._filename, os.getpid(), 
+                threading.get_ident())
+            try:
+                with open(temp, 'w') as fp:
+                    json.dump({'version': 1, 'entries': self._entries}, fp)
+                os.replace(temp, self._filename)
+                self._changed = False
+            except OSError as exc:
+                logging.error('cannot write ' + self._filename + ': ' + str(exc))
+
+class ConfigCache:
+    '''Holds parsed configuration files: an unchanged file is not parsed again.
+    A Config is valid as long as the modification times of the file and of
+    all its includes are the same.
+    '''
+    def __init__(self, parsed = None):
+        '''Constructor.
+        @param parsed: None or the ParsedConfigCache used for files
+                not parsed by this process yet
+        '''
+        self._parsed = parsed
+        self._lock = threading.Lock()
+        # filename -> (stamps, config): stamps: a list of (file, mtimeNs)
+        self._configs = {}
+        self._countParsed = 0
+        self._countHits = 0
+
+    @staticmethod
+    def stamp(filename):
+        '''Returns the modification time of a file.
+        @param filename: the file to inspect
+        @return: None: the file does not exist<br>
+                otherwise: the modification time in nanoseconds
+        '''
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, filename):
+        '''Returns the parsed configuration file.
+        @param filename: the configuration file
+        @return: None: the file does not exist<br>
+                otherwise: the Config instance (maybe from the cache)
+        '''
+        mtime = self.stamp(filename)
+        if mtime == None:
+            return None
+        with self._lock:
+            item = self._configs.get(filename)
+        if (item != None and item[0][0][1] == mtime 
+                and all(self.stamp(name) == stamp for name, stamp in item[0][1:])):
+            with self._lock:
+                self._countHits += 1
+            return item[1]
+        config = Config(filename, self._parsed)
+        if config._fromCache and config._stamps[0][1] != mtime:
+            # a trusted (not validated) entry, but the file is known to differ
+            config = Config(filename)
+            self._parsed.store(filename, config)
+        if not config._fromCache:
+            with self._lock:
+                self._countParsed += 1
+        with self._lock:
+            self._configs[filename] = (config._stamps, config)
+        return config